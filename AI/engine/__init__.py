@@ -14,62 +14,13 @@ Architecture:
 
 Refactored: 2025-11-01
 Version: Professional 5.0
-"""
-
-# ═══════════════════════════════════════════════════════════════════════════
-# CORE SERVICES - الخدمات الأساسية
-# ═══════════════════════════════════════════════════════════════════════════
-
-from .ai_service import (
-    ai_chat_with_search,
-    gather_system_context,
-    build_system_message,
-    get_system_setting
-)
-
-# ═══════════════════════════════════════════════════════════════════════════
-# DATABASE SEARCH - البحث في قاعدة البيانات
-# ═══════════════════════════════════════════════════════════════════════════
-
-from .ai_database_search import (
-    search_database_for_query,
-    analyze_query_intent,
-    get_time_range
-)
-
-# ═══════════════════════════════════════════════════════════════════════════
-# CONVERSATION & MEMORY - المحادثة والذاكرة
-# ═══════════════════════════════════════════════════════════════════════════
-
-from .ai_conversation import (
-    get_or_create_session_memory,
-    add_to_memory,
-    clear_session_memory,
-    get_conversation_context,
-    get_local_faq_responses,
-    match_local_response,
-    get_conversation_stats
-)
-
-# ═══════════════════════════════════════════════════════════════════════════
-# HYBRID ENGINE - المحرك الهجين (Groq + Local)
-# ═══════════════════════════════════════════════════════════════════════════
 
-from .ai_hybrid_engine import (
-    HybridAIEngine,
-    get_hybrid_engine,
-    GROQ_API_KEY,
-    GROQ_ENABLED
-)
+الوحدات الفرعية لا تُستورد عند استيراد الحزمة، بل عند أول وصول لاسم منها
+(PEP 562) حتى لا يتحمل إقلاع التطبيق كلفة تحميل كل محركات الذكاء.
+"""
 
-# ═══════════════════════════════════════════════════════════════════════════
-# ACTION EXECUTOR - محرك تنفيذ العمليات
-# ═══════════════════════════════════════════════════════════════════════════
+import importlib
 
-from .ai_action_executor import (
-    ActionExecutor,
-    parse_user_request
-)
 
 # ═══════════════════════════════════════════════════════════════════════════
 # REAL-TIME MONITOR - المراقب الفوري
@@ -80,195 +31,276 @@ ProactiveAssistant = None
 get_realtime_monitor = lambda: None
 get_system_health_status = lambda: {}
 
-from .ai_event_listeners import register_ai_listeners
-
-# ═══════════════════════════════════════════════════════════════════════════
-# AUTO-LEARNING - التعلم التلقائي
-# ═══════════════════════════════════════════════════════════════════════════
-
-from .ai_auto_learning import (
-    AutoLearningEngine,
-    get_auto_learning_engine,
-    schedule_daily_scan
-)
-
-# ═══════════════════════════════════════════════════════════════════════════
-# KNOWLEDGE BASES - قواعد المعرفة
-# ═══════════════════════════════════════════════════════════════════════════
-
-from .ai_knowledge import (
-    get_knowledge_base,
-    analyze_error,
-    format_error_response
-)
-
-from .ai_knowledge_finance import (
-    get_finance_knowledge,
-    calculate_palestine_income_tax,
-    calculate_vat,
-    get_customs_info,
-    get_tax_knowledge_detailed
-)
-
-from .ai_gl_knowledge import (
-    get_gl_knowledge_for_ai,
-    explain_gl_entry,
-    analyze_gl_batch,
-    detect_gl_error,
-    suggest_gl_correction,
-    explain_any_number,
-    trace_transaction_flow
-)
-
-from .ai_accounting_professional import (
-    get_professional_accounting_knowledge,
-    ACCOUNTING_EQUATION,
-    DOUBLE_ENTRY_SYSTEM,
-    CHART_OF_ACCOUNTS,
-    BALANCE_FORMULAS,
-    FINANCIAL_STATEMENTS
-)
-
-# ═══════════════════════════════════════════════════════════════════════════
-# ADVANCED FEATURES - الميزات المتقدمة
-# ═══════════════════════════════════════════════════════════════════════════
+_LAZY_EXPORTS = {
+    # ═══════════════════════════════════════════════════════════════════════════
+    # CORE SERVICES - الخدمات الأساسية
+    # ═══════════════════════════════════════════════════════════════════════════
+
+    'ai_service': (
+        'ai_chat_with_search',
+        'gather_system_context',
+        'build_system_message',
+        'get_system_setting',
+    ),
+
+    # ═══════════════════════════════════════════════════════════════════════════
+    # DATABASE SEARCH - البحث في قاعدة البيانات
+    # ═══════════════════════════════════════════════════════════════════════════
+
+    'ai_database_search': (
+        'search_database_for_query',
+        'analyze_query_intent',
+        'get_time_range',
+    ),
+
+    # ═══════════════════════════════════════════════════════════════════════════
+    # CONVERSATION & MEMORY - المحادثة والذاكرة
+    # ═══════════════════════════════════════════════════════════════════════════
+
+    'ai_conversation': (
+        'get_or_create_session_memory',
+        'add_to_memory',
+        'clear_session_memory',
+        'get_conversation_context',
+        'get_local_faq_responses',
+        'match_local_response',
+        'get_conversation_stats',
+    ),
+
+    # ═══════════════════════════════════════════════════════════════════════════
+    # HYBRID ENGINE - المحرك الهجين (Groq + Local)
+    # ═══════════════════════════════════════════════════════════════════════════
+
+    'ai_hybrid_engine': (
+        'HybridAIEngine',
+        'get_hybrid_engine',
+        'GROQ_API_KEY',
+        'GROQ_ENABLED',
+    ),
+
+    # ═══════════════════════════════════════════════════════════════════════════
+    # ACTION EXECUTOR - محرك تنفيذ العمليات
+    # ═══════════════════════════════════════════════════════════════════════════
+
+    'ai_action_executor': (
+        'ActionExecutor',
+        'parse_user_request',
+    ),
+
+    # ═══════════════════════════════════════════════════════════════════════════
+    # REAL-TIME MONITOR - المراقب الفوري
+    # ═══════════════════════════════════════════════════════════════════════════
+
+    'ai_event_listeners': (
+        'register_ai_listeners',
+    ),
+
+    # ═══════════════════════════════════════════════════════════════════════════
+    # AUTO-LEARNING - التعلم التلقائي
+    # ═══════════════════════════════════════════════════════════════════════════
+
+    'ai_auto_learning': (
+        'AutoLearningEngine',
+        'get_auto_learning_engine',
+        'schedule_daily_scan',
+    ),
+
+    # ═══════════════════════════════════════════════════════════════════════════
+    # KNOWLEDGE BASES - قواعد المعرفة
+    # ═══════════════════════════════════════════════════════════════════════════
+
+    'ai_knowledge': (
+        'get_knowledge_base',
+        'analyze_error',
+        'format_error_response',
+    ),
+
+    'ai_knowledge_finance': (
+        'get_finance_knowledge',
+        'calculate_palestine_income_tax',
+        'calculate_vat',
+        'get_customs_info',
+        'get_tax_knowledge_detailed',
+    ),
+
+    'ai_gl_knowledge': (
+        'get_gl_knowledge_for_ai',
+        'explain_gl_entry',
+        'analyze_gl_batch',
+        'detect_gl_error',
+        'suggest_gl_correction',
+        'explain_any_number',
+        'trace_transaction_flow',
+    ),
+
+    'ai_accounting_professional': (
+        'get_professional_accounting_knowledge',
+        'ACCOUNTING_EQUATION',
+        'DOUBLE_ENTRY_SYSTEM',
+        'CHART_OF_ACCOUNTS',
+        'BALANCE_FORMULAS',
+        'FINANCIAL_STATEMENTS',
+    ),
+
+    # ═══════════════════════════════════════════════════════════════════════════
+    # ADVANCED FEATURES - الميزات المتقدمة
+    # ═══════════════════════════════════════════════════════════════════════════
+
+    'ai_management': (
+        'save_api_key_encrypted',
+        'test_api_key',
+        'list_configured_apis',
+        'start_training_job',
+        'get_training_job_status',
+        'get_live_ai_stats',
+    ),
+
+    'ai_self_review': (
+        'log_interaction',
+        'check_policy_compliance',
+        'generate_self_audit_report',
+        'get_system_status',
+    ),
+
+    'ai_auto_discovery': (
+        'auto_discover_if_needed',
+        'find_route_by_keyword',
+        'get_route_suggestions',
+        'load_system_map',
+        'build_system_map',
+    ),
+
+    'ai_data_awareness': (
+        'auto_build_if_needed',
+        'find_model_by_keyword',
+        'load_data_schema',
+    ),
+
+    'ai_integrated_intelligence': (
+        'IntegratedIntelligence',
+        'get_integrated_intelligence',
+    ),
+
+    'ai_learning_system': (
+        'LearningSystem',
+        'get_learning_system',
+    ),
+
+    'ai_performance_tracker': (
+        'PerformanceTracker',
+        'get_performance_tracker',
+    ),
+
+    'ai_python_expert': (
+        'PythonExpert',
+        'get_python_expert',
+    ),
+
+    'ai_database_expert': (
+        'DatabaseExpert',
+        'get_database_expert',
+    ),
+
+    'ai_web_expert': (
+        'WebExpert',
+        'get_web_expert',
+    ),
+
+    'ai_user_guide_master': (
+        'UserGuideMaster',
+        'get_user_guide_master',
+    ),
+
+    'ai_training_engine': (
+        'AITrainingEngine',
+        'get_training_engine',
+    ),
+
+    'ai_code_quality_monitor': (
+        'CodeQualityMonitor',
+        'get_code_monitor',
+    ),
+
+    'ai_permissions': (
+        'is_ai_enabled',
+        'is_ai_visible_to_role',
+        'can_ai_execute_action',
+        'get_ai_access_level',
+    ),
+
+    'ai_self_evolution': (
+        'SelfEvolutionEngine',
+        'get_evolution_engine',
+    ),
+
+    'ai_unified_mind': (
+        'UnifiedMind',
+        'get_unified_mind',
+    ),
+
+    'ai_accounting_auditor': (
+        'AccountingAuditor',
+        'get_accounting_auditor',
+    ),
+
+    'ai_reasoning_engine': (
+        'ReasoningEngine',
+        'get_reasoning_engine',
+    ),
+
+    'ai_master_controller': (
+        'MasterController',
+        'get_master_controller',
+    ),
+
+    'ai_continuous_learner': (
+        'ContinuousLearner',
+        'get_continuous_learner',
+    ),
+
+    'ai_book_reader': (
+        'BookReader',
+        'get_book_reader',
+    ),
+
+    'ai_deep_memory': (
+        'DeepMemory',
+        'get_deep_memory',
+    ),
+
+    'ai_comprehension_engine': (
+        'ComprehensionEngine',
+        'get_comprehension_engine',
+    ),
+
+    'ai_intensive_trainer': (
+        'IntensiveTrainer',
+        'get_intensive_trainer',
+    ),
+
+    'ai_specialized_training': (
+        'SpecializedTraining',
+        'get_specialized_training',
+    ),
+}
+
+_EXPORT_MODULE = {name: module for module, names in _LAZY_EXPORTS.items() for name in names}
+
+
+def __getattr__(name):
+    module = _EXPORT_MODULE.get(name)
+    if module is None:
+        if name.startswith('ai_'):
+            return importlib.import_module(f'.{name}', __name__)
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(f'.{module}', __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_EXPORT_MODULE))
 
-from .ai_management import (
-    save_api_key_encrypted,
-    test_api_key,
-    list_configured_apis,
-    start_training_job,
-    get_training_job_status,
-    get_live_ai_stats
-)
-
-from .ai_self_review import (
-    log_interaction,
-    check_policy_compliance,
-    generate_self_audit_report,
-    get_system_status
-)
-
-from .ai_auto_discovery import (
-    auto_discover_if_needed,
-    find_route_by_keyword,
-    get_route_suggestions,
-    load_system_map,
-    build_system_map
-)
-
-from .ai_data_awareness import (
-    auto_build_if_needed,
-    find_model_by_keyword,
-    load_data_schema
-)
-
-from .ai_integrated_intelligence import (
-    IntegratedIntelligence,
-    get_integrated_intelligence
-)
-
-from .ai_learning_system import (
-    LearningSystem,
-    get_learning_system
-)
-
-from .ai_performance_tracker import (
-    PerformanceTracker,
-    get_performance_tracker
-)
-
-from .ai_python_expert import (
-    PythonExpert,
-    get_python_expert
-)
-
-from .ai_database_expert import (
-    DatabaseExpert,
-    get_database_expert
-)
-
-from .ai_web_expert import (
-    WebExpert,
-    get_web_expert
-)
-
-from .ai_user_guide_master import (
-    UserGuideMaster,
-    get_user_guide_master
-)
-
-from .ai_training_engine import (
-    AITrainingEngine,
-    get_training_engine
-)
-
-from .ai_code_quality_monitor import (
-    CodeQualityMonitor,
-    get_code_monitor
-)
-
-from .ai_permissions import (
-    is_ai_enabled,
-    is_ai_visible_to_role,
-    can_ai_execute_action,
-    get_ai_access_level
-)
-
-from .ai_self_evolution import (
-    SelfEvolutionEngine,
-    get_evolution_engine
-)
-
-from .ai_unified_mind import (
-    UnifiedMind,
-    get_unified_mind
-)
-
-from .ai_accounting_auditor import (
-    AccountingAuditor,
-    get_accounting_auditor
-)
-
-from .ai_reasoning_engine import (
-    ReasoningEngine,
-    get_reasoning_engine
-)
-
-from .ai_master_controller import (
-    MasterController,
-    get_master_controller
-)
-
-from .ai_continuous_learner import (
-    ContinuousLearner,
-    get_continuous_learner
-)
-
-from .ai_book_reader import (
-    BookReader,
-    get_book_reader
-)
-
-from .ai_deep_memory import (
-    DeepMemory,
-    get_deep_memory
-)
-
-from .ai_comprehension_engine import (
-    ComprehensionEngine,
-    get_comprehension_engine
-)
-
-from .ai_intensive_trainer import (
-    IntensiveTrainer,
-    get_intensive_trainer
-)
-
-from .ai_specialized_training import (
-    SpecializedTraining,
-    get_specialized_training
-)
 
 # ═══════════════════════════════════════════════════════════════════════════
 # EXPORTS - التصدير الشامل
@@ -21,6 +21,7 @@ from datetime import datetime, timedelta
 from typing import Dict, List, Any, Set
 from sqlalchemy import inspect, MetaData
 from extensions import db
+from AI.engine.ai_event_store import atomic_write_json, get_event_store
 
 
 # ═══════════════════════════════════════════════════════════════════════════
@@ -30,6 +31,8 @@ from extensions import db
 AUTO_LEARNING_LOG = 'AI/data/auto_learning_log.json'
 LAST_SCAN_FILE = 'AI/data/last_scan.json'
 DISCOVERED_CHANGES = 'AI/data/discovered_changes.json'
+SCAN_LOG_STREAM = 'auto_learning'
+SCAN_LOG_KEEP = 100
 
 
 # ═══════════════════════════════════════════════════════════════════════════
@@ -94,15 +97,10 @@ class AutoLearningEngine:
     def save_scan(self, snapshot: Dict):
         """حفظ معلومات الـ Scan الحالي"""
         try:
-            os.makedirs('AI/data', exist_ok=True)
-            
-            data = {
+            atomic_write_json(LAST_SCAN_FILE, {
                 'timestamp': datetime.now().isoformat(),
                 'snapshot': snapshot
-            }
-            
-            with open(LAST_SCAN_FILE, 'w', encoding='utf-8') as f:
-                json.dump(data, f, ensure_ascii=False, indent=2)
+            })
         except Exception as e:
             print(f"Error saving scan: {e}")
     
@@ -428,29 +426,24 @@ class AutoLearningEngine:
     def save_changes(self, changes: Dict):
         """حفظ التغييرات المكتشفة"""
         try:
-            os.makedirs('AI/data', exist_ok=True)
-            
-            with open(DISCOVERED_CHANGES, 'w', encoding='utf-8') as f:
-                json.dump({
-                    'timestamp': datetime.now().isoformat(),
-                    'changes': changes
-                }, f, ensure_ascii=False, indent=2)
+            atomic_write_json(DISCOVERED_CHANGES, {
+                'timestamp': datetime.now().isoformat(),
+                'changes': changes
+            })
         
         except Exception as e:
             print(f"Error saving changes: {e}")
     
+    def _scan_log(self):
+        """سجل الـ Scans في مخزن الأحداث؛ auto_learning_log.json نسخة لآخر 100 للقرّاء القدامى"""
+        store = get_event_store()
+        store.register_export(SCAN_LOG_STREAM, AUTO_LEARNING_LOG, SCAN_LOG_KEEP)
+        return store
+
     def log_scan(self, changes: Dict):
-        """تسجيل الـ Scan في الـ Log"""
+        """تسجيل الـ Scan في الـ Log (إضافة حدث بدل إعادة كتابة الملف)"""
         try:
-            # تحميل الـ Log الحالي
-            if os.path.exists(AUTO_LEARNING_LOG):
-                with open(AUTO_LEARNING_LOG, 'r', encoding='utf-8') as f:
-                    log = json.load(f)
-            else:
-                log = []
-            
-            # إضافة سجل جديد
-            log.append({
+            self._scan_log().append(SCAN_LOG_STREAM, {
                 'timestamp': datetime.now().isoformat(),
                 'changes_count': {
                     'tables': len(changes.get('new_tables', [])),
@@ -462,26 +455,13 @@ class AutoLearningEngine:
                 },
                 'changes': changes
             })
-            
-            # الاحتفاظ بآخر 100 سجل
-            log = log[-100:]
-            
-            # حفظ
-            os.makedirs('AI/data', exist_ok=True)
-            with open(AUTO_LEARNING_LOG, 'w', encoding='utf-8') as f:
-                json.dump(log, f, ensure_ascii=False, indent=2)
-        
         except Exception as e:
             print(f"Error logging scan: {e}")
     
     def get_scan_history(self, limit: int = 10) -> List[Dict]:
         """الحصول على تاريخ الـ Scans"""
         try:
-            if os.path.exists(AUTO_LEARNING_LOG):
-                with open(AUTO_LEARNING_LOG, 'r', encoding='utf-8') as f:
-                    log = json.load(f)
-                    return log[-limit:]
-            return []
+            return self._scan_log().recent(SCAN_LOG_STREAM, limit)
         except Exception:
             return []
 
@@ -5,6 +5,10 @@ import os
 from pathlib import Path
 import hashlib
 
+from AI.engine.ai_event_store import atomic_write_json, get_event_store
+
+SESSIONS_STREAM = 'learning_sessions'
+
 
 class ContinuousLearner:
     
@@ -331,24 +335,17 @@ class ContinuousLearner:
         else:
             phase['discoveries'].append('First learning session - building initial knowledge base')
         
-        with open(snapshot_file, 'w', encoding='utf-8') as f:
-            json.dump(self.knowledge_base, f, ensure_ascii=False, indent=2)
+        atomic_write_json(str(snapshot_file), self.knowledge_base)
         
         self.changes_detected = phase['changes_found']
         
         return phase
     
     def _save_session(self, session: Dict):
-        session_file = self.data_dir / f'session_{session["id"]}.json'
-        
-        with open(session_file, 'w', encoding='utf-8') as f:
-            json.dump(session, f, ensure_ascii=False, indent=2)
+        get_event_store().append(SESSIONS_STREAM, dict(session, timestamp=session['end_time']))
     
     def _update_knowledge_base(self):
-        kb_file = self.data_dir / 'knowledge_base.json'
-        
-        with open(kb_file, 'w', encoding='utf-8') as f:
-            json.dump(self.knowledge_base, f, ensure_ascii=False, indent=2)
+        atomic_write_json(str(self.data_dir / 'knowledge_base.json'), self.knowledge_base)
     
     def get_learning_stats(self) -> Dict:
         return {
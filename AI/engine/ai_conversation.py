@@ -21,7 +21,26 @@ import os
 # 🧠 CONVERSATION MEMORY - الذاكرة التحادثية
 # ═══════════════════════════════════════════════════════════════════════════
 
-_conversation_memory = {}
+_conversation_store = None
+
+
+def _new_session_memory(session_id: str) -> Dict[str, Any]:
+    return {
+        'session_id': session_id,
+        'created_at': datetime.now().isoformat(),
+        'messages': [],
+        'context': {},
+        'last_entities': []
+    }
+
+
+def _get_conversation_store():
+    """مخزن الجلسات (LRU + TTL، ومشترك بين العمال عند توفر Redis/Cache)"""
+    global _conversation_store
+    if _conversation_store is None:
+        from AI.engine.ai_conversation_store import ConversationStore
+        _conversation_store = ConversationStore.from_config('conversation', _new_session_memory)
+    return _conversation_store
 
 
 def get_or_create_session_memory(session_id: str) -> Dict[str, Any]:
@@ -34,18 +53,7 @@ def get_or_create_session_memory(session_id: str) -> Dict[str, Any]:
     Returns:
         ذاكرة الجلسة مع تاريخ المحادثات
     """
-    global _conversation_memory
-    
-    if session_id not in _conversation_memory:
-        _conversation_memory[session_id] = {
-            'session_id': session_id,
-            'created_at': datetime.now().isoformat(),
-            'messages': [],
-            'context': {},
-            'last_entities': []
-        }
-    
-    return _conversation_memory[session_id]
+    return _get_conversation_store().get(session_id)
 
 
 def add_to_memory(session_id: str, role: str, content: str):
@@ -57,25 +65,20 @@ def add_to_memory(session_id: str, role: str, content: str):
         role: 'user' أو 'assistant'
         content: محتوى الرسالة
     """
-    memory = get_or_create_session_memory(session_id)
+    store = _get_conversation_store()
     
-    memory['messages'].append({
+    # حفظ آخر 50 رسالة فقط (توفير الذاكرة)
+    store.append_message(session_id, {
         'role': role,
         'content': content,
         'timestamp': datetime.now().isoformat()
     })
-    
-    # حفظ آخر 50 رسالة فقط (توفير الذاكرة)
-    if len(memory['messages']) > 50:
-        memory['messages'] = memory['messages'][-50:]
+    store.save(session_id)
 
 
 def clear_session_memory(session_id: str):
     """مسح ذاكرة جلسة معينة"""
-    global _conversation_memory
-    
-    if session_id in _conversation_memory:
-        del _conversation_memory[session_id]
+    _get_conversation_store().delete(session_id)
 
 
 def get_conversation_context(session_id: str) -> Dict[str, Any]:
@@ -287,12 +290,12 @@ def match_local_response(message: str) -> Optional[str]:
 
 def get_conversation_stats() -> Dict[str, Any]:
     """إحصائيات المحادثات"""
-    global _conversation_memory
+    sessions = _get_conversation_store().values()
     
-    total_sessions = len(_conversation_memory)
+    total_sessions = len(sessions)
     total_messages = sum(
         len(session['messages'])
-        for session in _conversation_memory.values()
+        for session in sessions
     )
     
     return {
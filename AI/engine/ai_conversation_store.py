@@ -0,0 +1,292 @@
+"""
+💬 مخزن ذاكرة المحادثات - LRU + TTL + مشاركة بين العمليات
+ذاكرة الجلسات محدودة الحجم في كل عملية (عدد جلسات ورسائل وأحرف) وتُحذف
+الجلسة الخاملة بعد TTL. عند توفر Redis أو Flask-Caching مشترك تُحفظ نسخة
+JSON مضغوطة من الجلسة هناك، فتستمر المحادثة إذا انتقل الطلب لعامل آخر.
+"""
+
+import json
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Callable, Dict, Optional
+
+DEFAULT_TTL = 3600
+DEFAULT_MAX_SESSIONS = 1000
+DEFAULT_MAX_MESSAGES = 50
+DEFAULT_MAX_CHARS = 4000
+KEY_PREFIX = 'ai_conv:'
+SAVE_ATTEMPTS = 3
+
+
+def _encode(value):
+    if isinstance(value, datetime):
+        return {'$dt': value.isoformat()}
+    return str(value)
+
+
+def _decode(obj):
+    if len(obj) == 1 and '$dt' in obj:
+        return datetime.fromisoformat(obj['$dt'])
+    return obj
+
+
+def dumps(entry: Dict[str, Any]) -> str:
+    return json.dumps(entry, ensure_ascii=False, separators=(',', ':'), default=_encode)
+
+
+def loads(payload: str) -> Dict[str, Any]:
+    return json.loads(payload, object_hook=_decode)
+
+
+def _config(name, default):
+    try:
+        from flask import current_app
+        return current_app.config.get(name, default)
+    except Exception:
+        return default
+
+
+class _RedisBackend:
+
+    def __init__(self, client):
+        self.client = client
+
+    def get(self, key):
+        return self.client.get(key)
+
+    def set(self, key, value, ttl):
+        self.client.set(key, value, ex=int(ttl))
+
+    def compare_and_set(self, key, expected, value, ttl) -> bool:
+        """الكتابة فقط إن بقيت القيمة كما قُرئت (WATCH/MULTI)"""
+        import redis
+        with self.client.pipeline() as pipe:
+            try:
+                pipe.watch(key)
+                current = pipe.get(key)
+                if current != expected:
+                    pipe.unwatch()
+                    return False
+                pipe.multi()
+                pipe.set(key, value, ex=int(ttl))
+                pipe.execute()
+                return True
+            except redis.WatchError:
+                return False
+
+    def delete(self, key):
+        self.client.delete(key)
+
+
+class _CacheBackend:
+    """Flask-Caching المهيأ للتطبيق؛ يتطلب سياق التطبيق"""
+
+    def __init__(self, cache):
+        self.cache = cache
+
+    def get(self, key):
+        return self.cache.get(key)
+
+    def set(self, key, value, ttl):
+        self.cache.set(key, value, timeout=int(ttl))
+
+    def compare_and_set(self, key, expected, value, ttl) -> bool:
+        # Flask-Caching بلا عملية ذرية: الدمج قبل الكتابة يغطي معظم التزامن
+        self.cache.set(key, value, timeout=int(ttl))
+        return True
+
+    def delete(self, key):
+        self.cache.delete(key)
+
+
+def _resolve_backend(kind: str):
+    """auto: Redis إن كان متصلاً، ثم Flask-Caching إن لم يكن محلياً لكل عملية، وإلا بدون مشاركة"""
+    if kind in ('auto', 'redis'):
+        try:
+            from utils import redis_client
+            if redis_client is not None:
+                return _RedisBackend(redis_client)
+        except Exception:
+            pass
+    if kind in ('auto', 'cache'):
+        cache_type = str(_config('CACHE_TYPE', '') or '')
+        if kind == 'cache' or not any(t in cache_type for t in ('SimpleCache', 'NullCache', 'simple', 'null')):
+            try:
+                from extensions import cache
+                return _CacheBackend(cache)
+            except Exception:
+                pass
+    return None
+
+
+class ConversationStore:
+    """ذاكرة جلسات LRU مع انتهاء بعد الخمول
+
+    get() يعيد نفس كائن القاموس داخل العملية حتى تبقى التعديلات المباشرة
+    عليه مرئية، وsave() يرفع رقم المراجعة وينشر النسخة للمخزن المشترك.
+    عند القراءة تُستبدل النسخة المحلية إذا كانت المشتركة أحدث منها، وعند
+    الحفظ تُدمج رسائل النسخة المشتركة (بمعرّف كل رسالة) ثم تُكتب بشرط
+    compare-and-set حتى لا يمحو عاملان رسائل بعضهما بنفس المراجعة.
+    القراءة من المخزن المشترك تتم خارج القفل.
+    """
+
+    def __init__(self, namespace: str, factory: Callable[[str], Dict[str, Any]],
+                 ttl: int = DEFAULT_TTL, max_sessions: int = DEFAULT_MAX_SESSIONS,
+                 max_messages: int = DEFAULT_MAX_MESSAGES, max_chars: int = DEFAULT_MAX_CHARS,
+                 backend: str = 'auto'):
+        self.namespace = namespace
+        self.factory = factory
+        self.ttl = max(int(ttl or DEFAULT_TTL), 60)
+        self.max_sessions = max(int(max_sessions or DEFAULT_MAX_SESSIONS), 1)
+        self.max_messages = max(int(max_messages or DEFAULT_MAX_MESSAGES), 1)
+        self.max_chars = max(int(max_chars or DEFAULT_MAX_CHARS), 100)
+        self.backend_kind = backend or 'auto'
+        self._backend = None
+        self._backend_resolved = False
+        self._sessions: 'OrderedDict[str, list]' = OrderedDict()
+        self._lock = threading.RLock()
+
+    @classmethod
+    def from_config(cls, namespace: str, factory) -> 'ConversationStore':
+        return cls(
+            namespace, factory,
+            ttl=_config('AI_CONVERSATION_TTL', DEFAULT_TTL),
+            max_sessions=_config('AI_CONVERSATION_MAX_SESSIONS', DEFAULT_MAX_SESSIONS),
+            max_messages=_config('AI_CONVERSATION_MAX_MESSAGES', DEFAULT_MAX_MESSAGES),
+            max_chars=_config('AI_CONVERSATION_MAX_CHARS', DEFAULT_MAX_CHARS),
+            backend=_config('AI_CONVERSATION_BACKEND', 'auto'),
+        )
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def values(self):
+        with self._lock:
+            return [item[0] for item in self._sessions.values()]
+
+    # ------------------------------------------------------------ المخزن المشترك
+
+    def _shared(self):
+        if not self._backend_resolved and self.backend_kind != 'local':
+            self._backend = _resolve_backend(self.backend_kind)
+            self._backend_resolved = True
+        return self._backend
+
+    def _key(self, session_id: str) -> str:
+        return f'{KEY_PREFIX}{self.namespace}:{session_id}'
+
+    def _fetch_raw(self, session_id: str):
+        backend = self._shared()
+        if backend is None:
+            return None
+        try:
+            return backend.get(self._key(session_id))
+        except Exception:
+            return None
+
+    def _fetch_shared(self, session_id: str) -> Optional[Dict[str, Any]]:
+        payload = self._fetch_raw(session_id)
+        try:
+            return loads(payload) if payload else None
+        except Exception:
+            return None
+
+    def _merged_messages(self, local: list, theirs: list) -> list:
+        """رسائل النسخة المشتركة بترتيبها ثم الرسائل المحلية التي أُضيفت بعد آخر رسالة مشتركة"""
+        their_ids = {m.get('_id') for m in theirs if isinstance(m, dict)}
+        last_common = max((i for i, m in enumerate(local) if m.get('_id') in their_ids), default=-1)
+        own = [m for m in local[last_common + 1:] if m.get('_id') not in their_ids]
+        return (list(theirs) + own)[-self.max_messages:]
+
+    # ------------------------------------------------------------ الجلسات
+
+    def get(self, session_id: str) -> Dict[str, Any]:
+        shared = self._fetch_shared(session_id)
+        now = time.monotonic()
+        with self._lock:
+            self._evict_idle(now)
+            item = self._sessions.get(session_id)
+            if shared is not None and (item is None or shared.get('_rev', 0) > item[0].get('_rev', 0)):
+                if item is None:
+                    item = [shared, now]
+                else:
+                    # نفس الكائن يبقى مرجعاً صالحاً لمن يحمله؛ رسائله غير المنشورة تُدمج
+                    local = item[0].get('messages') or []
+                    item[0].clear()
+                    item[0].update(shared)
+                    item[0]['messages'] = self._merged_messages(local, shared.get('messages') or [])
+                self._sessions[session_id] = item
+            if item is None:
+                entry = self.factory(session_id)
+                entry['_rev'] = 0
+                item = [entry, now]
+                self._sessions[session_id] = item
+            item[1] = now
+            self._sessions.move_to_end(session_id)
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+            return item[0]
+
+    def append_message(self, session_id: str, message: Dict[str, Any]) -> Dict[str, Any]:
+        """إضافة رسالة مع قص المحتوى الطويل والاحتفاظ بآخر max_messages"""
+        with self._lock:
+            entry = self.get(session_id)
+            content = message.get('content')
+            if isinstance(content, str) and len(content) > self.max_chars:
+                message = dict(message, content=content[:self.max_chars])
+            if '_id' not in message:
+                message = dict(message, _id=uuid.uuid4().hex)
+            messages = entry.setdefault('messages', [])
+            messages.append(message)
+            if len(messages) > self.max_messages:
+                del messages[:-self.max_messages]
+            return entry
+
+    def save(self, session_id: str) -> None:
+        backend = self._shared()
+        for _attempt in range(SAVE_ATTEMPTS if backend is not None else 1):
+            raw = self._fetch_raw(session_id) if backend is not None else None
+            try:
+                shared = loads(raw) if raw else None
+            except Exception:
+                shared = None
+            with self._lock:
+                item = self._sessions.get(session_id)
+                if item is None:
+                    return
+                entry = item[0]
+                if shared is not None:
+                    entry['messages'] = self._merged_messages(entry.get('messages') or [], shared.get('messages') or [])
+                entry['_rev'] = max(entry.get('_rev', 0), (shared or {}).get('_rev', 0)) + 1
+                if backend is None:
+                    return
+                payload = dumps(entry)
+            try:
+                if backend.compare_and_set(self._key(session_id), raw, payload, self.ttl):
+                    return
+            except Exception:
+                return
+
+    def delete(self, session_id: str) -> None:
+        with self._lock:
+            self._sessions.pop(session_id, None)
+            backend = self._shared()
+            if backend is not None:
+                try:
+                    backend.delete(self._key(session_id))
+                except Exception:
+                    pass
+
+    def _evict_idle(self, now: float) -> None:
+        # OrderedDict مرتب حسب آخر استخدام؛ التوقف عند أول جلسة غير منتهية
+        while self._sessions:
+            session_id, item = next(iter(self._sessions.items()))
+            if now - item[1] < self.ttl:
+                break
+            self._sessions.popitem(last=False)
+
+
+__all__ = ['ConversationStore', 'dumps', 'loads']
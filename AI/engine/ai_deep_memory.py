@@ -4,6 +4,11 @@ import json
 from pathlib import Path
 import hashlib
 
+from AI.engine.ai_event_store import atomic_write_json, get_event_store
+from AI.engine.ai_knowledge_index import files_signature, flatten, load_or_build
+
+MEMORY_FILES = ('long_term_memory.json', 'semantic_memory.json', 'procedural_memory.json', 'episodic_memory.json')
+
 
 class DeepMemory:
     
@@ -16,6 +21,8 @@ class DeepMemory:
         self.semantic_memory = {}
         self.procedural_memory = {}
         self.episodic_memory = []
+        self._experiences_by_key = {}
+        self._index = None
         
         self._load_all_memories()
     
@@ -43,6 +50,53 @@ class DeepMemory:
                     self.procedural_memory = json.load(f)
             except Exception:
                 pass
+        
+        ep_file = self.memory_dir / 'episodic_memory.json'
+        if ep_file.exists():
+            try:
+                with open(ep_file, 'r', encoding='utf-8') as f:
+                    self.episodic_memory = json.load(f)[-1000:]
+            except Exception:
+                pass
+        self._experiences_by_key = {self._experience_key(e): e for e in self.episodic_memory}
+    
+    # ------------------------------------------------------------ الفهرس
+    
+    @staticmethod
+    def _experience_key(exp: Dict) -> str:
+        return hashlib.md5(f"{exp.get('timestamp')}_{exp.get('event')}".encode()).hexdigest()
+    
+    def _build_index(self, index):
+        for memory_id, memory in {**self.long_term_memory, **self.short_term_memory}.items():
+            index.add('fact', memory_id, f"{memory.get('key', '')} {flatten(memory.get('value'))}")
+        for concept_id, concept in self.semantic_memory.items():
+            index.add('concept', concept_id, f"{concept['concept']} {concept['definition']} {flatten(concept.get('examples'))}")
+        for proc_id, proc in self.procedural_memory.items():
+            index.add('procedure', proc_id, f"{proc['name']} {flatten(proc.get('steps'))}")
+        for exp in self.episodic_memory:
+            index.add('experience', self._experience_key(exp), f"{exp['event']} {exp['outcome']}")
+    
+    def _get_index(self):
+        """الفهرس المقلوب للذاكرة؛ يُحمّل من القرص إن لم تتغير ملفات الذاكرة منذ بنائه"""
+        if self._index is None:
+            signature = files_signature(self.memory_dir / name for name in MEMORY_FILES)
+            self._index = load_or_build('deep_memory', signature, self._build_index)
+        return self._index
+    
+    def _index_add(self, source: str, key: str, text: str):
+        if self._index is not None:
+            self._index.add(source, key, text)
+    
+    def _resolve(self, source: str, key: str) -> Optional[Dict]:
+        if source == 'fact':
+            return self.short_term_memory.get(key) or self.long_term_memory.get(key)
+        if source == 'concept':
+            return self.semantic_memory.get(key)
+        if source == 'procedure':
+            return self.procedural_memory.get(key)
+        if source == 'experience':
+            return self._experiences_by_key.get(key)
+        return None
     
     def remember_fact(self, category: str, key: str, value: Any, importance: int = 5):
         memory_id = hashlib.md5(f'{category}_{key}'.encode()).hexdigest()
@@ -59,6 +113,7 @@ class DeepMemory:
         }
         
         self.short_term_memory[memory_id] = memory_entry
+        self._index_add('fact', memory_id, f"{key} {flatten(value)}")
         
         if importance >= 7:
             self.long_term_memory[memory_id] = memory_entry
@@ -75,6 +130,7 @@ class DeepMemory:
             'created_at': datetime.now().isoformat(),
             'mastery_level': 0
         }
+        self._index_add('concept', concept_id, f"{concept} {definition} {flatten(examples)}")
         
         self._save_semantic_memory()
     
@@ -89,6 +145,7 @@ class DeepMemory:
             'success_rate': 0.0,
             'created_at': datetime.now().isoformat()
         }
+        self._index_add('procedure', proc_id, f"{name} {flatten(steps)}")
         
         self._save_procedural_memory()
     
@@ -101,8 +158,16 @@ class DeepMemory:
         }
         
         self.episodic_memory.append(experience)
+        key = self._experience_key(experience)
+        self._experiences_by_key[key] = experience
+        self._index_add('experience', key, f"{event} {outcome}")
         
         if len(self.episodic_memory) > 1000:
+            for old in self.episodic_memory[:-1000]:
+                old_key = self._experience_key(old)
+                self._experiences_by_key.pop(old_key, None)
+                if self._index is not None:
+                    self._index.remove('experience', old_key)
             self.episodic_memory = self.episodic_memory[-1000:]
         
         self._save_episodic_memory()
@@ -144,14 +209,12 @@ class DeepMemory:
         return None
     
     def recall_similar_experiences(self, query: str, limit: int = 5) -> List[Dict]:
-        query_lower = query.lower()
-        
         similar = []
-        for exp in self.episodic_memory:
-            if query_lower in exp['event'].lower() or query_lower in exp['outcome'].lower():
+        for _, source, key in self._get_index().search(query, limit, sources=('experience',)):
+            exp = self._resolve(source, key)
+            if exp is not None:
                 similar.append(exp)
-        
-        return similar[-limit:]
+        return similar
     
     def consolidate_memory(self):
         consolidated = 0
@@ -183,55 +246,40 @@ class DeepMemory:
         }
     
     def search_all_memories(self, query: str) -> Dict[str, List]:
-        query_lower = query.lower()
-        
         results = {
             'facts': [],
             'concepts': [],
             'procedures': [],
             'experiences': []
         }
+        buckets = {'fact': 'facts', 'concept': 'concepts', 'procedure': 'procedures', 'experience': 'experiences'}
         
-        for memory in {**self.long_term_memory, **self.short_term_memory}.values():
-            if query_lower in str(memory.get('value', '')).lower() or query_lower in memory.get('key', '').lower():
-                results['facts'].append(memory)
-        
-        for concept in self.semantic_memory.values():
-            if query_lower in concept['concept'].lower() or query_lower in concept['definition'].lower():
-                results['concepts'].append(concept)
-        
-        for proc in self.procedural_memory.values():
-            if query_lower in proc['name'].lower():
-                results['procedures'].append(proc)
-        
-        for exp in self.episodic_memory:
-            if query_lower in exp['event'].lower() or query_lower in exp['outcome'].lower():
-                results['experiences'].append(exp)
-        
-        for key in results:
-            results[key] = results[key][:10]
+        for _, source, key in self._get_index().search(query, limit=None):
+            bucket = results[buckets[source]]
+            if len(bucket) >= 10:
+                continue
+            item = self._resolve(source, key)
+            if item is not None:
+                bucket.append(item)
         
         return results
     
+    def _save(self, filename: str, attr: str):
+        """الحفظ مؤجل للتفريغ الدوري: عدة تحديثات متتالية = كتابة ذرية واحدة للملف"""
+        path = str(self.memory_dir / filename)
+        get_event_store().defer(path, lambda: atomic_write_json(path, getattr(self, attr).copy()))
+    
     def _save_long_term_memory(self):
-        ltm_file = self.memory_dir / 'long_term_memory.json'
-        with open(ltm_file, 'w', encoding='utf-8') as f:
-            json.dump(self.long_term_memory, f, ensure_ascii=False, indent=2)
+        self._save('long_term_memory.json', 'long_term_memory')
     
     def _save_semantic_memory(self):
-        sem_file = self.memory_dir / 'semantic_memory.json'
-        with open(sem_file, 'w', encoding='utf-8') as f:
-            json.dump(self.semantic_memory, f, ensure_ascii=False, indent=2)
+        self._save('semantic_memory.json', 'semantic_memory')
     
     def _save_procedural_memory(self):
-        proc_file = self.memory_dir / 'procedural_memory.json'
-        with open(proc_file, 'w', encoding='utf-8') as f:
-            json.dump(self.procedural_memory, f, ensure_ascii=False, indent=2)
+        self._save('procedural_memory.json', 'procedural_memory')
     
     def _save_episodic_memory(self):
-        ep_file = self.memory_dir / 'episodic_memory.json'
-        with open(ep_file, 'w', encoding='utf-8') as f:
-            json.dump(self.episodic_memory, f, ensure_ascii=False, indent=2)
+        self._save('episodic_memory.json', 'episodic_memory')
 
 
 _deep_memory = None
@@ -0,0 +1,288 @@
+"""
+🗃️ مخزن أحداث ومقاييس المساعد - Append-only + Buffered
+سجلات ومقاييس المساعد تُكتب في قاعدة SQLite جانبية (WAL) بدل إعادة كتابة
+ملفات JSON كاملة مع كل رسالة. الكتابة تُجمع في الذاكرة وتُفرّغ دورياً في
+معاملة واحدة، والعدادات تُجمع كفروقات (value = value + delta) فتبقى صحيحة
+مع أكثر من عملية.
+"""
+
+import atexit
+import json
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional
+
+EVENTS_DB = 'AI/data/ai_events.db'
+FLUSH_INTERVAL = 5.0
+COMPACT_INTERVAL = 3600.0
+DEFAULT_KEEP = 5000
+# حد الأحداث المعلّقة في الذاكرة عند تعذّر الكتابة (تُحذف الأقدم بعده)
+MAX_PENDING = 10000
+
+_SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS events ("
+    " id INTEGER PRIMARY KEY AUTOINCREMENT, stream TEXT NOT NULL, ts TEXT NOT NULL, payload TEXT NOT NULL)",
+    "CREATE INDEX IF NOT EXISTS ix_events_stream_id ON events (stream, id)",
+    "CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value REAL NOT NULL DEFAULT 0)",
+)
+
+
+def atomic_write_json(path: str, data: Any) -> None:
+    """كتابة JSON عبر ملف مؤقت ثم os.replace حتى لا يقرأ أحد ملفاً نصف مكتوب"""
+    directory = os.path.dirname(path) or '.'
+    os.makedirs(directory, exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, separators=(',', ':'))
+    os.replace(tmp, path)
+
+
+class EventStore:
+
+    def __init__(self, path: str = EVENTS_DB, flush_interval: float = FLUSH_INTERVAL, keep: int = DEFAULT_KEEP):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.keep = keep
+        self._events: List[tuple] = []
+        self._deltas: Dict[str, float] = {}
+        self._deferred: Dict[str, Callable[[], None]] = {}
+        self._exports: Dict[str, tuple] = {}
+        self._lock = threading.Lock()
+        self._io_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._last_compact = time.monotonic()
+        self._ready = False
+
+    # ------------------------------------------------------------ الاتصال
+
+    def _connect(self) -> sqlite3.Connection:
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=30)
+        if not self._ready:
+            conn.execute("PRAGMA journal_mode=WAL")
+            for statement in _SCHEMA:
+                conn.execute(statement)
+            conn.commit()
+            self._ready = True
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def _ensure_flusher(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name="ai-event-flush", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception:
+                pass
+
+    # ------------------------------------------------------------ الكتابة
+
+    def append(self, stream: str, payload: Dict[str, Any]) -> None:
+        """إضافة حدث للمخزن (في الذاكرة حتى التفريغ التالي)"""
+        ts = payload.get('timestamp') or datetime.now(timezone.utc).isoformat()
+        with self._lock:
+            self._events.append((stream, ts, json.dumps(payload, ensure_ascii=False, default=str)))
+        self._ensure_flusher()
+
+    def incr(self, name: str, value: float = 1) -> None:
+        with self._lock:
+            self._deltas[name] = self._deltas.get(name, 0) + value
+        self._ensure_flusher()
+
+    def defer(self, key: str, callback: Callable[[], None]) -> None:
+        """تأجيل عملية حفظ لتنفيذها مرة واحدة عند التفريغ التالي مهما تكرر طلبها"""
+        with self._lock:
+            self._deferred[key] = callback
+        self._ensure_flusher()
+
+    def register_export(self, stream: str, path: str, limit: int) -> None:
+        """نسخة JSON لآخر limit حدث تُحدّث بعد كل تفريغ فيه أحداث جديدة (للقرّاء القدامى)
+
+        أول تسجيل يستورد محتوى الملف الحالي كأحداث حتى لا تضيع السجلات السابقة.
+        """
+        if stream in self._exports:
+            return
+        self._exports[stream] = (path, limit)
+        legacy = []
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                legacy = json.load(f)
+        except (OSError, ValueError):
+            pass
+        if isinstance(legacy, list):
+            self.seed_once(f'imported.{stream}', {}, [(stream, item) for item in legacy if isinstance(item, dict)])
+
+    def flush(self) -> None:
+        """تفريغ المعلّق في معاملة واحدة
+
+        عند فشل الكتابة تُعاد الأحداث (بحد MAX_PENDING) والفروقات للذاكرة
+        لتُكتب في التفريغ التالي، وعمليات الحفظ المؤجلة تُنفذ في كل الأحوال.
+        """
+        with self._lock:
+            events, self._events = self._events, []
+            deltas, self._deltas = self._deltas, {}
+            deferred, self._deferred = self._deferred, {}
+        with self._io_lock:
+            try:
+                if events or deltas:
+                    try:
+                        conn = self._connect()
+                        try:
+                            with conn:
+                                if events:
+                                    conn.executemany("INSERT INTO events (stream, ts, payload) VALUES (?, ?, ?)", events)
+                                if deltas:
+                                    conn.executemany(
+                                        "INSERT INTO counters (name, value) VALUES (?, ?) "
+                                        "ON CONFLICT(name) DO UPDATE SET value = value + excluded.value",
+                                        list(deltas.items()),
+                                    )
+                        finally:
+                            conn.close()
+                    except Exception:
+                        self._requeue(events, deltas)
+                        raise
+                    if time.monotonic() - self._last_compact >= COMPACT_INTERVAL:
+                        try:
+                            conn = self._connect()
+                            try:
+                                self._compact(conn)
+                            finally:
+                                conn.close()
+                        except Exception:
+                            pass
+                for stream in {e[0] for e in events} & set(self._exports):
+                    path, limit = self._exports[stream]
+                    try:
+                        atomic_write_json(path, self.recent(stream, limit))
+                    except Exception:
+                        pass
+            finally:
+                for callback in deferred.values():
+                    try:
+                        callback()
+                    except Exception:
+                        pass
+
+    def _reset_after_fork(self) -> None:
+        """في العملية الابنة: المعلّق يخص الأب (سيفرّغه هو) والأقفال والخيط لا تُورث بحالة صالحة"""
+        self._events = []
+        self._deltas = {}
+        self._deferred = {}
+        self._lock = threading.Lock()
+        self._io_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+
+    def _requeue(self, events: List[tuple], deltas: Dict[str, float]) -> None:
+        with self._lock:
+            self._events = (events + self._events)[-MAX_PENDING:]
+            for name, value in deltas.items():
+                self._deltas[name] = self._deltas.get(name, 0) + value
+
+    def _compact(self, conn: sqlite3.Connection) -> None:
+        """حذف ما زاد عن آخر keep حدث لكل stream"""
+        with conn:
+            for (stream,) in conn.execute("SELECT DISTINCT stream FROM events").fetchall():
+                conn.execute(
+                    "DELETE FROM events WHERE stream = ? AND id <= "
+                    "(SELECT id FROM events WHERE stream = ? ORDER BY id DESC LIMIT 1 OFFSET ?)",
+                    (stream, stream, self.keep),
+                )
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        self._last_compact = time.monotonic()
+
+    def seed_once(self, marker: str, counters: Dict[str, float], events: Optional[List[tuple]] = None) -> bool:
+        """تهيئة العدادات والأحداث مرة واحدة فقط عبر كل العمليات (ترحيل البيانات القديمة)"""
+        with self._io_lock:
+            conn = self._connect()
+            try:
+                with conn:
+                    inserted = conn.execute(
+                        "INSERT OR IGNORE INTO counters (name, value) VALUES (?, 1)", (marker,)
+                    ).rowcount
+                    if inserted:
+                        conn.executemany(
+                            "INSERT INTO counters (name, value) VALUES (?, ?) "
+                            "ON CONFLICT(name) DO UPDATE SET value = value + excluded.value",
+                            list(counters.items()),
+                        )
+                        conn.executemany(
+                            "INSERT INTO events (stream, ts, payload) VALUES (?, ?, ?)",
+                            [(stream, payload.get('timestamp') or '', json.dumps(payload, ensure_ascii=False, default=str))
+                             for stream, payload in events or []],
+                        )
+                return bool(inserted)
+            finally:
+                conn.close()
+
+    # ------------------------------------------------------------ القراءة
+
+    def recent(self, stream: str, limit: int = 100) -> List[Dict[str, Any]]:
+        """آخر limit حدث بالترتيب الزمني، بما فيها غير المفرّغة بعد"""
+        with self._lock:
+            pending = [json.loads(p) for s, _, p in self._events if s == stream]
+        rows = []
+        if os.path.exists(self.path):
+            conn = self._connect()
+            try:
+                rows = conn.execute(
+                    "SELECT payload FROM events WHERE stream = ? ORDER BY id DESC LIMIT ?", (stream, limit)
+                ).fetchall()
+            finally:
+                conn.close()
+        items = [json.loads(r[0]) for r in reversed(rows)] + pending
+        return items[-limit:]
+
+    def counters(self, prefix: str = '') -> Dict[str, float]:
+        values: Dict[str, float] = {}
+        if os.path.exists(self.path):
+            conn = self._connect()
+            try:
+                for name, value in conn.execute(
+                    "SELECT name, value FROM counters WHERE name LIKE ?", (prefix + '%',)
+                ):
+                    values[name] = value
+            finally:
+                conn.close()
+        with self._lock:
+            for name, delta in self._deltas.items():
+                if name.startswith(prefix):
+                    values[name] = values.get(name, 0) + delta
+        return values
+
+
+_event_store = None
+_store_lock = threading.Lock()
+
+
+def _after_fork_in_child():
+    if _event_store is not None:
+        _event_store._reset_after_fork()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
+
+
+def get_event_store() -> EventStore:
+    global _event_store
+    if _event_store is None:
+        with _store_lock:
+            if _event_store is None:
+                _event_store = EventStore()
+                atexit.register(_event_store.flush)
+    return _event_store
+
+
+__all__ = ['EventStore', 'get_event_store', 'atomic_write_json']
@@ -6,6 +6,8 @@ import json
 from pathlib import Path
 from datetime import datetime
 
+from AI.engine.ai_knowledge_index import files_signature, flatten, load_or_build, normalize
+
 KNOWLEDGE_CACHE_FILE = 'AI/data/ai_knowledge_cache.json'
 TRAINING_LOG_FILE = 'AI/data/ai_training_log.json'
 
@@ -29,6 +31,7 @@ class SystemKnowledgeBase:
             'last_indexed': None,
             'index_count': 0
         }
+        self._index = None
         self.load_from_cache()
     
     def load_from_cache(self):
@@ -49,7 +52,8 @@ class SystemKnowledgeBase:
             self.knowledge['index_count'] = self.knowledge.get('index_count', 0) + 1
             
             with open(KNOWLEDGE_CACHE_FILE, 'w', encoding='utf-8') as f:
-                json.dump(self.knowledge, f, ensure_ascii=False, indent=2)
+                json.dump(self.knowledge, f, ensure_ascii=False, separators=(',', ':'))
+            self._index = None
 
         except Exception as e:
             pass
@@ -664,6 +668,31 @@ class SystemKnowledgeBase:
                 return {model_name: model_data}
         return None
     
+    INDEXED_SECTIONS = ('models', 'enums', 'routes', 'templates', 'forms', 'functions',
+                        'javascript', 'css', 'relationships')
+
+    def _build_index(self, index):
+        for section in self.INDEXED_SECTIONS:
+            for name, data in (self.knowledge.get(section) or {}).items():
+                index.add(section, name, f"{name} {flatten(data)}")
+        for i, rule in enumerate(self.knowledge.get('business_rules') or []):
+            index.add('business_rules', str(i), flatten(rule))
+
+    def search(self, query, limit=10, sections=None):
+        """بحث BM25 في كل أقسام المعرفة: [(score, section, name, data)]"""
+        if self._index is None:
+            self._index = load_or_build('knowledge', files_signature([KNOWLEDGE_CACHE_FILE]), self._build_index)
+        results = []
+        for score, section, name in self._index.search(query, limit, sections):
+            container = self.knowledge.get(section)
+            if section == 'business_rules':
+                data = container[int(name)] if container and int(name) < len(container) else None
+            else:
+                data = (container or {}).get(name)
+            if data is not None:
+                results.append((score, section, name, data))
+        return results
+    
     def find_related_models(self, model_name):
         """إيجاد الموديلات المرتبطة"""
         related = []
@@ -796,10 +825,10 @@ def get_knowledge_base():
         _knowledge_base.index_all_files()
     return _knowledge_base
 
-def get_local_faq_responses():
-    """قاعدة الأسئلة الشائعة - ردود فورية محلية"""
-    return {
-        'من أنت': """🤖 أنا المساعد الذكي في نظام أزاد لإدارة الكراجات (AI 4.0).
+
+# الأسئلة الشائعة وقواعد الرد السريع تُبنى مرة واحدة عند الاستيراد
+_LOCAL_FAQ_RESPONSES = {
+    'من أنت': """🤖 أنا المساعد الذكي في نظام أزاد لإدارة الكراجات (AI 4.0).
         
 📌 قدراتي:
 • قراءة مباشرة من قاعدة البيانات (87 جدول)
@@ -813,7 +842,7 @@ def get_local_faq_responses():
 • المطور: المهندس أحمد غنام
 • الموقع: رام الله - فلسطين 🇵🇸""",
         
-        'ما قدراتك': """🧠 قدراتي الكاملة:
+    'ما قدراتك': """🧠 قدراتي الكاملة:
 
 1. 📊 تحليل البيانات:
    • قراءة مباشرة من 87 جدول
@@ -840,7 +869,7 @@ def get_local_faq_responses():
    • المستودعات (5 أنواع)
    • حركة القطع""",
         
-        'كيف أضيف عميل': """📝 إضافة عميل جديد:
+    'كيف أضيف عميل': """📝 إضافة عميل جديد:
 
 1. اذهب إلى: `/customers/add`
 2. أدخل البيانات المطلوبة:
@@ -852,7 +881,7 @@ def get_local_faq_responses():
 
 🔗 الرابط المباشر: /customers/add""",
         
-        'كيف أضيف صيانة': """🔧 إضافة طلب صيانة:
+    'كيف أضيف صيانة': """🔧 إضافة طلب صيانة:
 
 1. اذهب إلى: `/service/create`
 2. اختر العميل
@@ -863,7 +892,7 @@ def get_local_faq_responses():
 
 🔗 الرابط: /service/create""",
         
-        'أين النفقات': """💸 صفحة النفقات:
+    'أين النفقات': """💸 صفحة النفقات:
 
 🔗 الرابط: `/expenses`
 
@@ -873,7 +902,7 @@ def get_local_faq_responses():
 • البحث والفلترة
 • تصدير التقارير""",
         
-        'أين المتجر': """🛒 المتجر الإلكتروني:
+    'أين المتجر': """🛒 المتجر الإلكتروني:
 
 🔗 الرابط: `/shop`
 
@@ -882,37 +911,57 @@ def get_local_faq_responses():
 • سلة التسوق
 • الطلبات المسبقة
 • تقييم المنتجات""",
-    }
+}
+
+_LOCAL_FAQ_NORMALIZED = [(normalize(key), response) for key, response in _LOCAL_FAQ_RESPONSES.items()]
+
+
+def get_local_faq_responses():
+    """قاعدة الأسئلة الشائعة - ردود فورية محلية"""
+    return _LOCAL_FAQ_RESPONSES
+
+
+def match_local_faq(message):
+    """أول سؤال شائع يظهر نصه في الرسالة (بعد توحيد الحروف)"""
+    text = normalize(message)
+    for key, response in _LOCAL_FAQ_NORMALIZED:
+        if key in text:
+            return response
+    return None
+
+
+_LOCAL_QUICK_RULES = {
+    'count_customers': {
+        'patterns': ['كم عدد العملاء', 'عدد الزبائن', 'how many customers'],
+        'query': 'Customer.query.count()',
+        'response_template': '✅ عدد العملاء: {count} عميل'
+    },
+    'count_services': {
+        'patterns': ['كم صيانة', 'عدد الصيانات', 'طلبات الصيانة'],
+        'query': 'ServiceRequest.query.count()',
+        'response_template': '🔧 عدد طلبات الصيانة: {count} طلب'
+    },
+    'count_expenses': {
+        'patterns': ['كم نفقة', 'عدد النفقات', 'المصاريف'],
+        'query': 'Expense.query.count()',
+        'response_template': '💸 عدد النفقات: {count} نفقة'
+    },
+    'count_products': {
+        'patterns': ['كم منتج', 'عدد القطع', 'المنتجات'],
+        'query': 'Product.query.count()',
+        'response_template': '📦 عدد المنتجات: {count} منتج'
+    },
+    'count_suppliers': {
+        'patterns': ['كم مورد', 'عدد الموردين'],
+        'query': 'Supplier.query.count()',
+        'response_template': '🏭 عدد الموردين: {count} مورد'
+    },
+}
+
 
 def get_local_quick_rules():
     """قواعد الرد السريع المحلي - بدون Groq"""
-    return {
-        'count_customers': {
-            'patterns': ['كم عدد العملاء', 'عدد الزبائن', 'how many customers'],
-            'query': 'Customer.query.count()',
-            'response_template': '✅ عدد العملاء: {count} عميل'
-        },
-        'count_services': {
-            'patterns': ['كم صيانة', 'عدد الصيانات', 'طلبات الصيانة'],
-            'query': 'ServiceRequest.query.count()',
-            'response_template': '🔧 عدد طلبات الصيانة: {count} طلب'
-        },
-        'count_expenses': {
-            'patterns': ['كم نفقة', 'عدد النفقات', 'المصاريف'],
-            'query': 'Expense.query.count()',
-            'response_template': '💸 عدد النفقات: {count} نفقة'
-        },
-        'count_products': {
-            'patterns': ['كم منتج', 'عدد القطع', 'المنتجات'],
-            'query': 'Product.query.count()',
-            'response_template': '📦 عدد المنتجات: {count} منتج'
-        },
-        'count_suppliers': {
-            'patterns': ['كم مورد', 'عدد الموردين'],
-            'query': 'Supplier.query.count()',
-            'response_template': '🏭 عدد الموردين: {count} مورد'
-        },
-    }
+    return _LOCAL_QUICK_RULES
 
 def analyze_error(traceback_text):
     """تحليل خطأ"""
@@ -0,0 +1,222 @@
+"""
+🔎 فهرس المعرفة - Inverted Index + BM25
+فهرس مقلوب مضغوط مشترك بين قاعدة المعرفة والذاكرة العميقة، مع توحيد
+أشكال الحروف العربية، يُحمّل من القرص عند أول بحث فقط.
+"""
+
+import gzip
+import json
+import math
+import os
+import re
+import threading
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+INDEX_DIR = Path('AI/data/index')
+INDEX_FORMAT = 1
+
+_DIACRITICS = re.compile(r'[\u0610-\u061A\u064B-\u065F\u0670\u0640]')
+_CAMEL = re.compile(r'([a-z0-9])([A-Z])')
+_TOKEN = re.compile(r'[^\W_]+', re.UNICODE)
+_LETTERS = str.maketrans({
+    'أ': 'ا', 'إ': 'ا', 'آ': 'ا', 'ٱ': 'ا',
+    'ة': 'ه', 'ى': 'ي', 'ؤ': 'و', 'ئ': 'ي',
+    '٠': '0', '١': '1', '٢': '2', '٣': '3', '٤': '4',
+    '٥': '5', '٦': '6', '٧': '7', '٨': '8', '٩': '9',
+})
+_PREFIXES = ('وال', 'بال', 'كال', 'فال', 'لل', 'ال')
+
+STOPWORDS = frozenset({
+    'في', 'من', 'علي', 'الي', 'عن', 'مع', 'هو', 'هي', 'هذا', 'هذه', 'ذلك', 'التي', 'الذي',
+    'او', 'ثم', 'كل', 'ما', 'ماذا', 'هل', 'كيف', 'اين', 'متي', 'لا', 'ان', 'كان', 'قد',
+    'the', 'a', 'an', 'of', 'to', 'in', 'and', 'or', 'is', 'for', 'on', 'by', 'with', 'what', 'how',
+})
+
+
+def normalize(text) -> str:
+    """توحيد النص: حذف التشكيل والتطويل وتوحيد الألف والتاء المربوطة والياء"""
+    text = _CAMEL.sub(r'\1 \2', str(text or ''))
+    return _DIACRITICS.sub('', text).translate(_LETTERS).lower()
+
+
+def tokenize(text) -> List[str]:
+    tokens = []
+    for token in _TOKEN.findall(normalize(text)):
+        if len(token) < 2 or token in STOPWORDS:
+            continue
+        for prefix in _PREFIXES:
+            if token.startswith(prefix) and len(token) - len(prefix) >= 2:
+                token = token[len(prefix):]
+                break
+        tokens.append(token)
+    return tokens
+
+
+def flatten(value, limit: int = 4000) -> str:
+    """تحويل قيمة JSON متداخلة لنص قابل للفهرسة"""
+    parts: List[str] = []
+
+    def walk(v):
+        if isinstance(v, dict):
+            for k, item in v.items():
+                parts.append(str(k))
+                walk(item)
+        elif isinstance(v, (list, tuple)):
+            for item in v:
+                walk(item)
+        elif v is not None:
+            parts.append(str(v))
+
+    walk(value)
+    return ' '.join(parts)[:limit]
+
+
+def files_signature(paths: Iterable) -> str:
+    """بصمة ملفات المصدر (الحجم ووقت التعديل) لمعرفة متى يلزم إعادة البناء"""
+    parts = []
+    for path in paths:
+        try:
+            st = os.stat(path)
+            parts.append(f'{path}:{st.st_size}:{st.st_mtime_ns}')
+        except OSError:
+            parts.append(f'{path}:-')
+    return '|'.join(parts)
+
+
+class KnowledgeIndex:
+    """فهرس مقلوب بتقييم BM25
+
+    كل مستند له (source, key) يعود به البحث، والمستدعي يحوّله للكائن الأصلي.
+    الإضافة تزايدية؛ استبدال مستند بنفس المفتاح يعلّم القديم كمحذوف.
+    """
+
+    K1 = 1.5
+    B = 0.75
+
+    def __init__(self):
+        self.docs: List[Optional[Tuple[str, str]]] = []
+        self.lengths: List[int] = []
+        self.postings: Dict[str, List[List[int]]] = {}
+        self.total_length = 0
+        self.live = 0
+        self._ids: Dict[Tuple[str, str], int] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self.live
+
+    def add(self, source: str, key: str, text) -> None:
+        terms: Dict[str, int] = {}
+        for token in tokenize(text):
+            terms[token] = terms.get(token, 0) + 1
+        with self._lock:
+            self._remove_locked(source, key)
+            doc = len(self.docs)
+            self.docs.append((source, key))
+            length = sum(terms.values())
+            self.lengths.append(length)
+            self.total_length += length
+            self.live += 1
+            self._ids[(source, key)] = doc
+            for term, tf in terms.items():
+                self.postings.setdefault(term, []).append([doc, tf])
+
+    def remove(self, source: str, key: str) -> None:
+        with self._lock:
+            self._remove_locked(source, key)
+
+    def _remove_locked(self, source, key):
+        doc = self._ids.pop((source, key), None)
+        if doc is not None:
+            self.docs[doc] = None
+            self.total_length -= self.lengths[doc]
+            self.live -= 1
+
+    def search(self, query: str, limit: Optional[int] = 10,
+               sources: Optional[Iterable[str]] = None) -> List[Tuple[float, str, str]]:
+        """أفضل المستندات لـ query كـ (score, source, key) مرتبة تنازلياً"""
+        terms = set(tokenize(query))
+        if not terms or not self.live:
+            return []
+        sources = set(sources) if sources else None
+        n = self.live
+        avgdl = (self.total_length / n) or 1.0
+        scores: Dict[int, float] = {}
+        for term in terms:
+            posting = self.postings.get(term)
+            if not posting:
+                continue
+            idf = math.log(1 + (n - len(posting) + 0.5) / (len(posting) + 0.5))
+            for doc, tf in posting:
+                meta = self.docs[doc]
+                if meta is None or (sources is not None and meta[0] not in sources):
+                    continue
+                norm = tf + self.K1 * (1 - self.B + self.B * self.lengths[doc] / avgdl)
+                scores[doc] = scores.get(doc, 0.0) + idf * tf * (self.K1 + 1) / norm
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+        if limit:
+            ranked = ranked[:limit]
+        return [(round(score, 4), *self.docs[doc]) for doc, score in ranked]
+
+    # ------------------------------------------------------------ التخزين
+
+    def save(self, path, signature: str) -> None:
+        """حفظ مضغوط (gzip + JSON بدون مسافات) مع إسقاط المستندات المحذوفة"""
+        with self._lock:
+            remap, docs, lengths = {}, [], []
+            for doc, meta in enumerate(self.docs):
+                if meta is not None:
+                    remap[doc] = len(docs)
+                    docs.append(meta)
+                    lengths.append(self.lengths[doc])
+            postings = {}
+            for term, posting in self.postings.items():
+                kept = [[remap[doc], tf] for doc, tf in posting if doc in remap]
+                if kept:
+                    postings[term] = kept
+        payload = {'format': INDEX_FORMAT, 'signature': signature, 'docs': docs,
+                   'lengths': lengths, 'postings': postings}
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(path.name + '.tmp')
+        with gzip.open(tmp, 'wt', encoding='utf-8', compresslevel=6) as f:
+            json.dump(payload, f, ensure_ascii=False, separators=(',', ':'))
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path, signature: str) -> Optional['KnowledgeIndex']:
+        try:
+            with gzip.open(path, 'rt', encoding='utf-8') as f:
+                payload = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if payload.get('format') != INDEX_FORMAT or payload.get('signature') != signature:
+            return None
+        index = cls()
+        index.docs = [tuple(meta) for meta in payload['docs']]
+        index.lengths = payload['lengths']
+        index.postings = payload['postings']
+        index.total_length = sum(index.lengths)
+        index.live = len(index.docs)
+        index._ids = {meta: doc for doc, meta in enumerate(index.docs)}
+        return index
+
+
+def load_or_build(name: str, signature: str,
+                  builder: Callable[['KnowledgeIndex'], None]) -> KnowledgeIndex:
+    """تحميل الفهرس المحفوظ إن طابقت بصمته، وإلا بناؤه وحفظه"""
+    path = INDEX_DIR / f'{name}.json.gz'
+    index = KnowledgeIndex.load(path, signature)
+    if index is not None:
+        return index
+    index = KnowledgeIndex()
+    builder(index)
+    try:
+        index.save(path, signature)
+    except OSError:
+        pass
+    return index
+
+
+__all__ = ['KnowledgeIndex', 'normalize', 'tokenize', 'flatten', 'files_signature', 'load_or_build']
@@ -8,6 +8,10 @@ import os
 from datetime import datetime
 from collections import defaultdict
 
+from AI.engine.ai_event_store import atomic_write_json, get_event_store
+
+LEARNED_FILE = 'AI/data/learned_responses.json'
+
 
 class LearningSystem:
     
@@ -19,10 +23,9 @@ class LearningSystem:
         self._load_learned_data()
     
     def _load_learned_data(self):
-        learned_file = 'AI/data/learned_responses.json'
-        if os.path.exists(learned_file):
+        if os.path.exists(LEARNED_FILE):
             try:
-                with open(learned_file, 'r', encoding='utf-8') as f:
+                with open(LEARNED_FILE, 'r', encoding='utf-8') as f:
                     data = json.load(f)
                     self.learned_responses = data.get('responses', {})
                     self.error_corrections = data.get('corrections', {})
@@ -125,17 +128,17 @@ class LearningSystem:
         return len(intersection) / len(union)
     
     def _save_learned_data(self):
+        """الحفظ مؤجل للتفريغ التالي لمخزن الأحداث: كتابة ذرية واحدة مهما تكررت التفاعلات"""
+        get_event_store().defer(LEARNED_FILE, self._write_learned_data)
+
+    def _write_learned_data(self):
         try:
-            os.makedirs('AI/data', exist_ok=True)
-            learned_file = 'AI/data/learned_responses.json'
-            
-            with open(learned_file, 'w', encoding='utf-8') as f:
-                json.dump({
-                    'responses': self.learned_responses,
-                    'corrections': self.error_corrections,
-                    'patterns': dict(self.pattern_library),
-                    'last_updated': datetime.now().isoformat()
-                }, f, ensure_ascii=False, indent=2)
+            atomic_write_json(LEARNED_FILE, {
+                'responses': dict(self.learned_responses),
+                'corrections': dict(self.error_corrections),
+                'patterns': dict(self.pattern_library),
+                'last_updated': datetime.now().isoformat()
+            })
         except Exception as e:
             print(f"Error saving learned data: {e}")
     
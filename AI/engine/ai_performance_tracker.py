@@ -8,67 +8,86 @@ import os
 from datetime import datetime, timedelta
 from collections import defaultdict
 
+from AI.engine.ai_event_store import get_event_store
+
+LEGACY_METRICS_FILE = 'AI/data/performance_metrics.json'
+PREFIX = 'perf.'
+
 
 class PerformanceTracker:
+    """العدادات تُجمع كفروقات في مخزن الأحداث والسجل أحداث مضافة (append-only)"""
     
     def __init__(self):
-        self.metrics = {
-            'total_queries': 0,
-            'successful_queries': 0,
-            'failed_queries': 0,
-            'avg_confidence': 0.0,
-            'avg_response_time': 0.0,
-            'queries_by_type': defaultdict(int),
+        self.store = get_event_store()
+        self._import_legacy_metrics()
+    
+    def _import_legacy_metrics(self):
+        """ترحيل performance_metrics.json القديم إلى العدادات مرة واحدة"""
+        if not os.path.exists(LEGACY_METRICS_FILE):
+            return
+        try:
+            with open(LEGACY_METRICS_FILE, 'r', encoding='utf-8') as f:
+                metrics = json.load(f).get('metrics') or {}
+            total = int(metrics.get('total_queries') or 0)
+            if not total:
+                return
+            seed = {
+                f'{PREFIX}total': total,
+                f'{PREFIX}success': metrics.get('successful_queries', 0),
+                f'{PREFIX}failed': metrics.get('failed_queries', 0),
+                f'{PREFIX}confidence_sum': float(metrics.get('avg_confidence', 0)) * total,
+                f'{PREFIX}time_sum': float(metrics.get('avg_response_time', 0)) * total,
+            }
+            for name, count in (metrics.get('queries_by_type') or {}).items():
+                seed[f'{PREFIX}type.{name}'] = count
+            for name, count in (metrics.get('expert_usage') or {}).items():
+                seed[f'{PREFIX}expert.{name}'] = count
+            self.store.seed_once('imported.performance', seed)
+        except Exception:
+            pass
+    
+    @property
+    def metrics(self) -> Dict:
+        values = self.store.counters(PREFIX)
+        total = int(values.get(f'{PREFIX}total', 0))
+        queries_by_type, expert_usage = defaultdict(int), defaultdict(int)
+        for name, value in values.items():
+            if name.startswith(f'{PREFIX}type.'):
+                queries_by_type[name[len(f'{PREFIX}type.'):]] = int(value)
+            elif name.startswith(f'{PREFIX}expert.'):
+                expert_usage[name[len(f'{PREFIX}expert.'):]] = int(value)
+        return {
+            'total_queries': total,
+            'successful_queries': int(values.get(f'{PREFIX}success', 0)),
+            'failed_queries': int(values.get(f'{PREFIX}failed', 0)),
+            'avg_confidence': values.get(f'{PREFIX}confidence_sum', 0) / total if total else 0.0,
+            'avg_response_time': values.get(f'{PREFIX}time_sum', 0) / total if total else 0.0,
+            'queries_by_type': queries_by_type,
             'errors_by_type': defaultdict(int),
-            'expert_usage': defaultdict(int)
+            'expert_usage': expert_usage
         }
-        self.performance_log = []
-        self._load_metrics()
-    
-    def _load_metrics(self):
-        metrics_file = 'AI/data/performance_metrics.json'
-        if os.path.exists(metrics_file):
-            try:
-                with open(metrics_file, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-                    self.metrics = data.get('metrics', self.metrics)
-                    self.performance_log = data.get('log', [])[-1000:]
-            except Exception:
-                pass
     
     def record_query(self, query: str, response: Dict, execution_time: float):
-        self.metrics['total_queries'] += 1
-        
-        if response.get('answer'):
-            self.metrics['successful_queries'] += 1
-        else:
-            self.metrics['failed_queries'] += 1
-        
+        success = bool(response.get('answer'))
         confidence = response.get('confidence', 0.0)
-        
-        total = self.metrics['total_queries']
-        old_avg = self.metrics['avg_confidence']
-        self.metrics['avg_confidence'] = ((old_avg * (total - 1)) + confidence) / total
-        
-        old_time = self.metrics['avg_response_time']
-        self.metrics['avg_response_time'] = ((old_time * (total - 1)) + execution_time) / total
-        
         query_type = self._classify_query(query)
-        self.metrics['queries_by_type'][query_type] += 1
         
-        if response.get('sources'):
-            for source in response['sources']:
-                self.metrics['expert_usage'][source] += 1
+        store = self.store
+        store.incr(f'{PREFIX}total')
+        store.incr(f'{PREFIX}success' if success else f'{PREFIX}failed')
+        store.incr(f'{PREFIX}confidence_sum', confidence)
+        store.incr(f'{PREFIX}time_sum', execution_time)
+        store.incr(f'{PREFIX}type.{query_type}')
+        for source in response.get('sources') or []:
+            store.incr(f'{PREFIX}expert.{source}')
         
-        self.performance_log.append({
+        store.append('performance', {
             'timestamp': datetime.now().isoformat(),
             'query_type': query_type,
             'confidence': confidence,
             'execution_time': execution_time,
-            'success': bool(response.get('answer'))
+            'success': success
         })
-        
-        self._save_metrics()
     
     def _classify_query(self, query: str) -> str:
         q = query.lower()
@@ -84,49 +103,38 @@ class PerformanceTracker:
         
         return 'general'
     
-    def _save_metrics(self):
-        try:
-            os.makedirs('AI/data', exist_ok=True)
-            
-            with open('AI/data/performance_metrics.json', 'w', encoding='utf-8') as f:
-                json.dump({
-                    'metrics': dict(self.metrics),
-                    'log': self.performance_log[-1000:],
-                    'last_updated': datetime.now().isoformat()
-                }, f, ensure_ascii=False, indent=2)
-        except Exception:
-            pass
-    
     def get_performance_report(self) -> Dict:
+        metrics = self.metrics
         success_rate = 0
-        if self.metrics['total_queries'] > 0:
-            success_rate = (self.metrics['successful_queries'] / self.metrics['total_queries']) * 100
+        if metrics['total_queries'] > 0:
+            success_rate = (metrics['successful_queries'] / metrics['total_queries']) * 100
         
         return {
-            'total_queries': self.metrics['total_queries'],
+            'total_queries': metrics['total_queries'],
             'success_rate': round(success_rate, 2),
-            'avg_confidence': round(self.metrics['avg_confidence'] * 100, 2),
-            'avg_response_time': round(self.metrics['avg_response_time'], 3),
+            'avg_confidence': round(metrics['avg_confidence'] * 100, 2),
+            'avg_response_time': round(metrics['avg_response_time'], 3),
             'top_query_types': dict(sorted(
-                self.metrics['queries_by_type'].items(),
+                metrics['queries_by_type'].items(),
                 key=lambda x: x[1],
                 reverse=True
             )[:5]),
-            'expert_usage': dict(self.metrics['expert_usage']),
+            'expert_usage': dict(metrics['expert_usage']),
             'recent_trend': self._calculate_trend()
         }
     
     def _calculate_trend(self) -> str:
-        if len(self.performance_log) < 20:
+        log = self.store.recent('performance', 20)
+        if len(log) < 20:
             return 'insufficient_data'
         
         recent_success = sum(
-            1 for p in self.performance_log[-10:]
+            1 for p in log[-10:]
             if p.get('success')
         ) / 10
         
         older_success = sum(
-            1 for p in self.performance_log[-20:-10]
+            1 for p in log[-20:-10]
             if p.get('success')
         ) / 10
         
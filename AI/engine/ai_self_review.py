@@ -10,15 +10,13 @@ SELF_AUDIT_LOG = 'AI/data/ai_self_audit.json'
 TRAINING_POLICY = 'AI/data/ai_training_policy.json'
 
 def log_interaction(question, answer, confidence, search_results):
+    """إضافة التفاعل لمخزن الأحداث؛ ai_interactions.json يُحدّث كنسخة لآخر 100 عند التفريغ"""
     try:
-        os.makedirs('AI/data', exist_ok=True)
+        from AI.engine.ai_event_store import get_event_store
         
-        interactions = []
-        if os.path.exists(INTERACTIONS_LOG):
-            with open(INTERACTIONS_LOG, 'r', encoding='utf-8') as f:
-                interactions = json.load(f)
-        
-        interactions.append({
+        store = get_event_store()
+        store.register_export('interactions', INTERACTIONS_LOG, 100)
+        store.append('interactions', {
             'timestamp': datetime.now(timezone.utc).isoformat(),
             'question': question[:200],
             'answer': answer[:300],
@@ -27,11 +25,6 @@ def log_interaction(question, answer, confidence, search_results):
             'has_data': len(search_results) > 1 if search_results else False
         })
         
-        interactions = interactions[-100:]
-        
-        with open(INTERACTIONS_LOG, 'w', encoding='utf-8') as f:
-            json.dump(interactions, f, ensure_ascii=False, indent=2)
-        
     except Exception as e:
         pass
 
@@ -48,7 +48,7 @@ from AI.engine.ai_auto_training import (
     init_auto_training
 )
 
-_conversation_memory = {}
+_conversation_store = None
 _last_audit_time = None
 _groq_failures = []
 _local_fallback_mode = True  # محلي بشكل افتراضي
@@ -72,24 +72,15 @@ def gather_system_context():
             Role, Permission, ExchangeTransaction
         )
         
-        # CPU & Memory
-        cpu_usage = psutil.cpu_percent(interval=1)
-        memory = psutil.virtual_memory()
-        
-        # Database size
-        db_size = "غير معروف"
-        db_health = "نشط"
-        try:
-            result = db.session.execute(text("SELECT pg_database_size(current_database())")).scalar()
-            db_size = f"{result / (1024**2):.2f} MB"
-        except Exception:
-            try:
-                # SQLite
-                db_path = 'instance/app.db'
-                if os.path.exists(db_path):
-                    db_size = f"{os.path.getsize(db_path) / (1024**2):.2f} MB"
-            except Exception:
-                pass
+        # CPU & Memory & DB size من لقطة خيط المقاييس (بدون انتظار ثانية للمعالج)
+        from flask import current_app
+        from services.system_metrics import current_snapshot
+        metrics = current_snapshot(current_app._get_current_object())
+        cpu_usage = metrics.get('cpu_percent', 0)
+        memory_percent = metrics.get('memory_percent', 0)
+        snapshot_counts = metrics.get('counts') or {}
+        db_size = f"{metrics['db_size_mb']:.2f} MB" if metrics.get('db_size_mb') is not None else "غير معروف"
+        db_health = metrics.get('db_health', 'نشط')
         
         # Counts
         today = datetime.now(timezone.utc).date()
@@ -111,7 +102,21 @@ def gather_system_context():
         cache_key_prefix = 'ai_system_context_'
         cache_ttl = 300
         
+        # أسماء العدادات في لقطة المقاييس
+        snapshot_keys = {
+            'total_users': 'users', 'active_users': 'active_users', 'total_services': 'services',
+            'pending_services': 'pending_services', 'completed_services': 'completed_services',
+            'total_customers': 'customers', 'active_customers': 'active_customers',
+            'total_vendors': 'suppliers', 'total_products': 'products', 'products_in_stock': 'products_in_stock',
+            'total_warehouses': 'warehouses', 'roles_count': 'roles', 'total_payments': 'payments',
+            'total_expenses': 'expenses', 'total_notes': 'notes', 'total_shipments': 'shipments',
+            'total_audit_logs': 'audit_logs', 'total_exchange_transactions': 'exchange_transactions',
+        }
+        
         def get_cached_count(model, key_suffix, query_func=None):
+            snapshot_value = snapshot_counts.get(snapshot_keys.get(key_suffix))
+            if snapshot_value is not None:
+                return snapshot_value
             cache_key = f"{cache_key_prefix}{key_suffix}"
             cached = cache.get(cache_key)
             if cached is not None:
@@ -188,7 +193,7 @@ def gather_system_context():
             
             # Performance
             'cpu_usage': cpu_usage,
-            'memory_usage': memory.percent,
+            'memory_usage': memory_percent,
             'db_size': db_size,
             'db_health': db_health,
             
@@ -197,7 +202,7 @@ def gather_system_context():
 الصيانة: {total_services} طلب
 العملاء: {total_customers} | الموردين: {total_vendors}
 المنتجات: {total_products} | المخازن: {total_warehouses}
-CPU: {cpu_usage}% | RAM: {memory.percent}%
+CPU: {cpu_usage}% | RAM: {memory_percent}%
 """
         }
         
@@ -333,25 +338,35 @@ def analyze_question_intent(question):
     
     return intent
 
+def _new_session_memory(session_id):
+    return {
+        'messages': [],
+        'context': {},
+        'created_at': datetime.now(timezone.utc),
+        'last_updated': datetime.now(timezone.utc),
+        'user_preferences': {},  # تفضيلات المستخدم
+        'topics': [],  # المواضيع المحادثة
+        'entities_mentioned': {},  # الكيانات المذكورة
+        'last_intent': None,  # آخر نية
+    }
+
+def _get_conversation_store():
+    """مخزن الجلسات (LRU + TTL، ومشترك بين العمال عند توفر Redis/Cache)"""
+    global _conversation_store
+    if _conversation_store is None:
+        from AI.engine.ai_conversation_store import ConversationStore
+        _conversation_store = ConversationStore.from_config('service', _new_session_memory)
+    return _conversation_store
+
 def get_or_create_session_memory(session_id):
     """الحصول على أو إنشاء ذاكرة المحادثة - محسّنة"""
-    if session_id not in _conversation_memory:
-        _conversation_memory[session_id] = {
-            'messages': [],
-            'context': {},
-            'created_at': datetime.now(timezone.utc),
-            'last_updated': datetime.now(timezone.utc),
-            'user_preferences': {},  # تفضيلات المستخدم
-            'topics': [],  # المواضيع المحادثة
-            'entities_mentioned': {},  # الكيانات المذكورة
-            'last_intent': None,  # آخر نية
-        }
-    
-    _conversation_memory[session_id]['last_updated'] = datetime.now(timezone.utc)
-    return _conversation_memory[session_id]
+    memory = _get_conversation_store().get(session_id)
+    memory['last_updated'] = datetime.now(timezone.utc)
+    return memory
 
 def add_to_memory(session_id, role, content, context=None):
     """إضافة رسالة للذاكرة - محسّنة مع context"""
+    store = _get_conversation_store()
     memory = get_or_create_session_memory(session_id)
     
     message_entry = {
@@ -378,11 +393,9 @@ def add_to_memory(session_id, role, content, context=None):
         if context.get('intent'):
             memory['last_intent'] = context['intent']
     
-    memory['messages'].append(message_entry)
-    
-    # الاحتفاظ بآخر 50 رسالة (زيادة من 20)
-    if len(memory['messages']) > 50:
-        memory['messages'] = memory['messages'][-50:]
+    # الاحتفاظ بآخر AI_CONVERSATION_MAX_MESSAGES رسالة (50 افتراضياً)
+    store.append_message(session_id, message_entry)
+    store.save(session_id)
 
 def get_conversation_context(session_id):
     """الحصول على سياق المحادثة الكامل"""
@@ -1370,6 +1383,13 @@ def search_database_for_query(query):
                 if explanation:
                     results[f'model_explanation_{entity}'] = explanation
         
+        knowledge_hits = kb.search(query, limit=5)
+        if knowledge_hits:
+            results['knowledge_matches'] = [
+                {'section': section, 'name': name, 'score': score}
+                for score, section, name, _ in knowledge_hits
+            ]
+        
         if intent['type'] == 'report' or intent.get('accounting'):
             results['report_data'] = generate_smart_report(intent)
         
@@ -2310,9 +2330,9 @@ def local_intelligent_response(message):
     """
     # استيراد جميع المكونات الذكية
     try:
-        from AI.engine.ai_knowledge import get_local_faq_responses, get_local_quick_rules
+        from AI.engine.ai_knowledge import match_local_faq, get_local_quick_rules
     except Exception:
-        get_local_faq_responses = lambda: {}
+        match_local_faq = lambda x: None
         get_local_quick_rules = lambda: {}
     
     try:
@@ -2691,10 +2711,9 @@ def local_intelligent_response(message):
             pass
     
     # 1. فحص FAQ أولاً
-    faq = get_local_faq_responses()
-    for key, response in faq.items():
-        if key in message_lower:
-            return f"💡 **رد محلي فوري:**\n\n{response}"
+    faq_response = match_local_faq(message_lower)
+    if faq_response:
+        return f"💡 **رد محلي فوري:**\n\n{faq_response}"
     
     # 🔍 أسئلة تحليلية ذكية - يحلل ويستنتج ويوصي
     if any(word in message_lower for word in ['افحص', 'حلل', 'analyze', 'check', 'أفضل', 'best', 'top']):
@@ -121,11 +121,13 @@ def run_daily_code_scan():
 # 🚀 SCHEDULER INITIALIZATION
 # ═══════════════════════════════════════════════════════════════════════════
 
-def start_scheduler():
+def start_scheduler(jobs=None):
     """
     تشغيل الجدولة
     
     يجب استدعاؤها عند بدء التطبيق
+    jobs: سجل المهام الرئيسي (extensions.JobRegistry) - عند تمريره تُسجَّل
+    المهام في مُجدول التطبيق نفسه فتخضع لانتخاب القائد بدل مُجدول منفصل
     """
     
     global _scheduler_started
@@ -133,8 +135,10 @@ def start_scheduler():
         logger.info("AI Scheduler already running; skipping re-initialization")
         return
 
+    target = jobs if jobs is not None else scheduler
+
     # مهمة 1: Code Quality Scan - يومياً الساعة 2:00 ص
-    scheduler.add_job(
+    target.add_job(
         func=run_daily_code_scan,
         trigger=CronTrigger(hour=2, minute=0),  # 2:00 AM
         id='daily_code_scan',
@@ -143,7 +147,7 @@ def start_scheduler():
     )
     
     # مهمة 2: Auto-Learning Scan - يومياً الساعة 3:00 ص
-    scheduler.add_job(
+    target.add_job(
         func=run_auto_learning_scan,
         trigger=CronTrigger(hour=3, minute=0),  # 3:00 AM
         id='auto_learning_scan',
@@ -152,7 +156,7 @@ def start_scheduler():
     )
     
     # مهمة 3: Cleanup - كل أسبوع
-    scheduler.add_job(
+    target.add_job(
         func=cleanup_old_logs,
         trigger=CronTrigger(day_of_week='sun', hour=1, minute=0),  # كل أحد 1:00 AM
         id='cleanup_logs',
@@ -160,8 +164,9 @@ def start_scheduler():
         replace_existing=True
     )
     
-    # تشغيل الـ Scheduler
-    scheduler.start()
+    # تشغيل الـ Scheduler (المُجدول المشترك يُشغَّل من extensions)
+    if jobs is None:
+        scheduler.start()
     _scheduler_started = True
     
     logger.info("AI Scheduler started - All AI systems enabled")
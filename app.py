@@ -1,4 +1,11 @@
 import os
+
+from services.startup_profile import current_profiler, install_import_profiler, phase as startup_phase, profile_requested
+
+# يجب أن يسبق كل الاستيرادات الأخرى حتى يُقاس زمن استيراد كل وحدة
+if profile_requested():
+    install_import_profiler()
+
 import uuid
 import logging
 import inspect
@@ -167,6 +174,7 @@ def create_app(config_object=Config) -> Flask:
     app.config.setdefault("ADMIN_USER_EMAILS", os.getenv("ADMIN_USER_EMAILS", ""))
     app.config.setdefault("ADMIN_USER_IDS", os.getenv("ADMIN_USER_IDS", ""))
     app.config.setdefault("SKIP_SYSTEM_INTEGRITY", bool(int(os.getenv("SKIP_SYSTEM_INTEGRITY", "0"))))
+    app.config.setdefault("LAZY_STARTUP", bool(int(os.getenv("LAZY_STARTUP", "0"))))
     app.config.setdefault("PERMISSIONS_REQUIRE_ALL", False)
     app.config.setdefault("AI_SYSTEMS_ENABLED", True)
     app.config.setdefault("ENABLE_AUTOMATED_BACKUPS", True)
@@ -192,9 +200,11 @@ def create_app(config_object=Config) -> Flask:
     app.config["SQLALCHEMY_ENGINE_OPTIONS"] = engine_opts
 
     setup_logging(app)
-    setup_sentry(app)
+    with startup_phase("setup_sentry"):
+        setup_sentry(app)
 
-    init_extensions(app)
+    with startup_phase("init_extensions"):
+        init_extensions(app)
     try:
         with app.app_context():
             pass
@@ -346,8 +356,15 @@ def create_app(config_object=Config) -> Flask:
             return f"{filename}&v={version}"
         return f"{filename}?v={version}"
     
+    from services.static_assets import init_static_assets
+    asset_manifest = init_static_assets(app)
+
     def static_url(filename):
+        # url_for('static') يضيف بصمة المحتوى من asset-manifest.json تلقائياً؛
+        # الرقم الساعي يبقى فقط للملفات غير الموجودة في المانيفست
         url = url_for('static', filename=filename)
+        if asset_manifest is not None and not app.debug and asset_manifest.version_of(filename):
+            return url
         return static_version_filter(url)
     
     @app.context_processor
@@ -611,8 +628,9 @@ def create_app(config_object=Config) -> Flask:
     attach_acl(supplier_settlements_bp, read_perm="manage_vendors", write_perm="manage_vendors")
     # API endpoints تحتاج صلاحية access_api
     # استثناء: endpoint أسعار الصرف متاح للجميع (بدون مصادقة)
+    # إشعارات المستخدم تحتاج تسجيل دخول فقط (login_required داخل الـ endpoint)
     attach_acl(api_bp, read_perm="access_api", write_perm="manage_api",
-               exempt_prefixes=["/api/exchange-rates"])
+               exempt_prefixes=["/api/exchange-rates", "/api/notifications/"])
     attach_acl(notes_bp, read_perm="view_notes", write_perm="manage_notes")
     attach_acl(bp_barcode, read_perm="view_parts", write_perm=None)
     attach_acl(ledger_bp, read_perm="manage_ledger", write_perm="manage_ledger")
@@ -632,7 +650,7 @@ def create_app(config_object=Config) -> Flask:
             return
         try:
             from AI.scheduler import start_scheduler
-            start_scheduler()
+            start_scheduler(app.extensions.get("job_registry"))
         except Exception as exc:
             app.logger.warning(f"AI Scheduler start skipped: {exc}")
         try:
@@ -642,7 +660,10 @@ def create_app(config_object=Config) -> Flask:
             app.logger.warning(f"AI event listeners registration skipped: {exc}")
         state["initialized"] = True
     
-    _init_ai_systems()
+    lazy_startup = app.config.get("LAZY_STARTUP", False)
+    if not lazy_startup:
+        with startup_phase("ai_systems"):
+            _init_ai_systems()
     
     BLUEPRINTS = [
         auth_bp,
@@ -701,8 +722,9 @@ def create_app(config_object=Config) -> Flask:
         workflows_bp,
         balances_api_bp,
     ]
-    for bp in BLUEPRINTS:
-        app.register_blueprint(bp)
+    with startup_phase("register_blueprints"):
+        for bp in BLUEPRINTS:
+            app.register_blueprint(bp)
 
     def _collect_model_classes():
         collected = []
@@ -783,10 +805,39 @@ def create_app(config_object=Config) -> Flask:
         app.logger.info("System integrity check passed: %s routes, %s models, %s forms",
                         len(rule_index), len(table_map), len(form_names if 'form_names' in locals() else []))
 
-    if not app.config.get("SKIP_SYSTEM_INTEGRITY"):
-        validate_system_integrity()
+    def _configure_mappers():
+        from sqlalchemy.orm import configure_mappers
+        configure_mappers()
+
+    def _deferred_startup():
+        """وضع LAZY_STARTUP: ما لا يحتاجه أول طلب يُنفذ في خيط خلفي بعد الإقلاع"""
+        state = app.extensions["lazy_startup"]
+        try:
+            _configure_mappers()
+        except Exception as exc:
+            app.logger.warning(f"Deferred mapper configuration failed: {exc}")
+        _seed_reference_data()
+        with app.app_context():
+            _init_ai_systems()
+        if not app.config.get("SKIP_SYSTEM_INTEGRITY"):
+            try:
+                validate_system_integrity()
+            except Exception as exc:
+                state["integrity_error"] = str(exc)
+                app.logger.critical(f"Deferred system integrity check failed: {exc}")
+        state["done"] = True
+        app.logger.info("Deferred startup tasks finished.")
+
+    if lazy_startup:
+        app.extensions["lazy_startup"] = {"done": False, "integrity_error": None}
     else:
-        app.logger.warning("System integrity check skipped by configuration.")
+        with startup_phase("configure_mappers"):
+            _configure_mappers()
+        if not app.config.get("SKIP_SYSTEM_INTEGRITY"):
+            with startup_phase("system_integrity"):
+                validate_system_integrity()
+        else:
+            app.logger.warning("System integrity check skipped by configuration.")
 
     CORS(
         app,
@@ -906,6 +957,9 @@ def create_app(config_object=Config) -> Flask:
             except Exception:
                 db.session.rollback()
 
+    from services import db_restore
+    db_restore.init_app(app, lambda: db.engine)
+
     @app.before_request
     def _attach_request_id():
         g.request_id = request.headers.get("X-Request-Id") or uuid.uuid4().hex
@@ -1102,54 +1156,80 @@ def create_app(config_object=Config) -> Flask:
     from cli import register_cli
     register_cli(app)
 
-    # ========== إضافة العملات الافتراضية تلقائياً ==========
-    with app.app_context():
-        try:
-            from models import Currency, CURRENCY_CHOICES
+    def _seed_reference_data():
+        # ========== إضافة العملات الافتراضية تلقائياً ==========
+        with app.app_context():
+            try:
+                from models import Currency, CURRENCY_CHOICES
             
-            # التحقق من وجود عملات في قاعدة البيانات
-            currency_count = Currency.query.count()
+                # التحقق من وجود عملات في قاعدة البيانات
+                currency_count = Currency.query.count()
             
-            # إذا لم تكن هناك عملات، أضف العملات الافتراضية
-            if currency_count == 0:
-                symbols = {
-                    'ILS': 'ILS', 'USD': 'USD', 'EUR': 'EUR', 'JOD': 'JOD',
-                    'AED': 'AED', 'SAR': 'SAR', 'EGP': 'EGP', 'GBP': 'GBP'
-                }
+                # إذا لم تكن هناك عملات، أضف العملات الافتراضية
+                if currency_count == 0:
+                    symbols = {
+                        'ILS': 'ILS', 'USD': 'USD', 'EUR': 'EUR', 'JOD': 'JOD',
+                        'AED': 'AED', 'SAR': 'SAR', 'EGP': 'EGP', 'GBP': 'GBP'
+                    }
                 
-                for code, name in CURRENCY_CHOICES:
-                    currency = Currency(
-                        code=code,
-                        name=name,
-                        symbol=symbols.get(code, code),
-                        decimals=2,
-                        is_active=True
-                    )
-                    db.session.add(currency)
+                    for code, name in CURRENCY_CHOICES:
+                        currency = Currency(
+                            code=code,
+                            name=name,
+                            symbol=symbols.get(code, code),
+                            decimals=2,
+                            is_active=True
+                        )
+                        db.session.add(currency)
                 
-                db.session.commit()
-        except Exception as e:
-            pass
+                    db.session.commit()
+            except Exception as e:
+                pass
     
-    # ضمان وجود الأدوار الأساسية
-    with app.app_context():
-        try:
-            from models import Role
-            from permissions_config.permissions import PermissionsRegistry
+        # ضمان وجود الأدوار الأساسية
+        with app.app_context():
+            try:
+                from models import Role
+                from permissions_config.permissions import PermissionsRegistry
             
-            for role_name in PermissionsRegistry.ROLES.keys():
-                existing = Role.query.filter_by(name=role_name).first()
-                if not existing:
-                    role_data = PermissionsRegistry.ROLES[role_name]
-                    role = Role(
-                        name=role_name,
-                        description=role_data.get('description', '')
-                    )
-                    db.session.add(role)
+                for role_name in PermissionsRegistry.ROLES.keys():
+                    existing = Role.query.filter_by(name=role_name).first()
+                    if not existing:
+                        role_data = PermissionsRegistry.ROLES[role_name]
+                        role = Role(
+                            name=role_name,
+                            description=role_data.get('description', '')
+                        )
+                        db.session.add(role)
             
-            db.session.commit()
-        except Exception:
-            db.session.rollback()
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+
+    def _fail_stale_imports():
+        # عمليات الاستيراد التي قطعها إيقاف الخادم تبقى RUNNING بلا خيط يكملها
+        with app.app_context():
+            try:
+                from sqlalchemy import inspect as sa_inspect
+                from services.product_import import fail_stale_runs
+                if not sa_inspect(db.engine).has_table("import_runs"):
+                    return
+                fail_stale_runs(db.session, app.config.get("IMPORT_STALE_MINUTES", 30))
+            except Exception as exc:
+                db.session.rollback()
+                app.logger.warning(f"Stale import recovery failed: {exc}")
+
+    if lazy_startup:
+        import threading
+        threading.Thread(target=_deferred_startup, name="deferred-startup", daemon=True).start()
+    else:
+        with startup_phase("seed_reference_data"):
+            _seed_reference_data()
+    _fail_stale_imports()
+
+    profiler = current_profiler()
+    if profiler is not None and not profiler.finished:
+        profiler.finish(app)
 
     return app
 
@@ -1271,5 +1351,6 @@ if __name__ == '__main__':
                 scheduler.shutdown(wait=False)
         except Exception:
             pass
-else:
+elif __name__ != "__mp_main__":
+    # عمّال spawn/forkserver (مثل مولّد PDF) يعيدون استيراد السكربت الرئيسي باسم __mp_main__
     app = create_app()
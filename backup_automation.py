@@ -22,6 +22,13 @@ class AutomatedBackupManager:
             'max_backups': 5  # احتفظ بآخر 5 نسخ فقط
         }
     
+    def _store(self):
+        """مخزن اللقطات التزايدية إذا كان مفعلاً و zstandard متاحاً"""
+        from services.backup_store import BackupStore, available
+        if not self.app.config.get('BACKUP_INCREMENTAL', True) or not available():
+            return None
+        return BackupStore.from_app(self.app)
+    
     def create_backup(self):
         try:
             from extensions import db
@@ -36,6 +43,17 @@ class AutomatedBackupManager:
                 logger.error(f'Database file not found: {db_path}')
                 return None
             
+            store = self._store()
+            if store is not None:
+                # لقطة متسقة عبر backup API تكتب الكتل المتغيرة فقط بدل نسخ الملف الحي كاملاً
+                manifest = store.snapshot(db_path, version=self.app.config.get('APP_VERSION'))
+                store.prune(self.app.config.get('BACKUP_SNAPSHOT_KEEP', 72))
+                logger.info(
+                    f"✅ Snapshot created: {manifest['id']} "
+                    f"({manifest['new_chunks']} new chunks, {manifest['new_bytes'] / (1024 * 1024):.2f} MB)"
+                )
+                return store.manifest_path(manifest['id'])
+            
             shutil.copy2(db_path, backup_path)
             
             file_size = backup_path.stat().st_size / (1024 * 1024)
@@ -85,11 +103,28 @@ class AutomatedBackupManager:
                 'size_mb': latest.stat().st_size / (1024 * 1024)
             }
         
+        snapshots = None
+        try:
+            store = self._store()
+            snapshots = store.stats() if store is not None else None
+        except Exception as e:
+            logger.warning(f'⚠️ Snapshot status failed: {str(e)}')
+        if snapshots and snapshots['latest']:
+            latest = snapshots['latest']
+            snap_date = datetime.fromisoformat(latest['created_at']).astimezone().replace(tzinfo=None)
+            if latest_backup is None or snap_date > latest_backup['date']:
+                latest_backup = {
+                    'filename': Path(latest['path']).name,
+                    'date': snap_date,
+                    'size_mb': latest['db_size'] / (1024 * 1024),
+                }
+        
         return {
-            'total_backups': len(all_backups),
-            'total_size_mb': total_size,
+            'total_backups': len(all_backups) + (snapshots['snapshots'] if snapshots else 0),
+            'total_size_mb': total_size + (snapshots['store_bytes'] / (1024 * 1024) if snapshots else 0),
             'latest_backup': latest_backup,
-            'retention_policy': self.retention_policy
+            'retention_policy': self.retention_policy,
+            'snapshots': snapshots,
         }
 
 def schedule_automated_backups(app, scheduler):
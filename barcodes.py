@@ -51,56 +51,24 @@ def validate_barcode(code: str) -> dict:
     return {"valid": False, "normalized": None, "suggested": None}
 
 def generate_qr_code(data: str, size: int = 200, border: int = 4) -> Optional[str]:
-    """توليد QR Code كصورة base64"""
+    """توليد QR Code كصورة base64 (من كاش الصور حسب البيانات والمقاس)"""
     if not QR_AVAILABLE:
         return None
     
     try:
-        qr = qrcode.QRCode(
-            version=1,
-            error_correction=qrcode.constants.ERROR_CORRECT_L,
-            box_size=10,
-            border=border,
-        )
-        qr.add_data(data)
-        qr.make(fit=True)
-        
-        img = qr.make_image(fill_color="black", back_color="white")
-        
-        img = img.resize((size, size), Image.Resampling.LANCZOS)
-        
-        buffer = io.BytesIO()
-        img.save(buffer, format='PNG')
-        img_str = base64.b64encode(buffer.getvalue()).decode()
-        
-        return f"data:image/png;base64,{img_str}"
+        from services.label_render import data_uri
+        return data_uri(data, kind="qr", width=size, height=size, border=border)
     except Exception:
         return None
 
 def generate_barcode_image(code: str, width: int = 300, height: int = 100) -> Optional[str]:
-    """توليد صورة باركود"""
+    """توليد صورة باركود: EAN-13 خطي للرموز الصالحة وإلا QR (من كاش الصور)"""
     if not QR_AVAILABLE:
         return None
     
     try:
-        qr = qrcode.QRCode(
-            version=1,
-            error_correction=qrcode.constants.ERROR_CORRECT_L,
-            box_size=3,
-            border=1,
-        )
-        qr.add_data(code)
-        qr.make(fit=True)
-        
-        img = qr.make_image(fill_color="black", back_color="white")
-        
-        img = img.resize((width, height), Image.Resampling.LANCZOS)
-        
-        buffer = io.BytesIO()
-        img.save(buffer, format='PNG')
-        img_str = base64.b64encode(buffer.getvalue()).decode()
-        
-        return f"data:image/png;base64,{img_str}"
+        from services.label_render import data_uri
+        return data_uri(code, kind="auto", width=width, height=height, border=1)
     except Exception:
         return None
 
@@ -27,7 +27,7 @@ from models import (
     Partner, PartnerSettlement, Payment, PaymentDirection, PaymentEntityType, PaymentMethod, PaymentStatus, Permission,
     PreOrder, Product, Role, ServicePart, ServiceRequest, ServiceStatus, ServiceTask,
     Shipment, ShipmentItem, StockAdjustment, StockAdjustmentItem, StockLevel, Supplier,
-    SupplierSettlement, Transfer, TransferDirection, Warehouse, _ensure_customer_for_counterparty, _gl_upsert_batch_and_entries,
+    SupplierSettlement, SystemSettings, Transfer, TransferDirection, Warehouse, _ensure_customer_for_counterparty, _gl_upsert_batch_and_entries,
     build_partner_settlement_draft, build_supplier_settlement_draft, convert_amount, User,
 )
 
@@ -2062,6 +2062,299 @@ def optimize_db():
     except Exception as e:
         click.echo(click.style(f"❌ خطأ: {str(e)}", fg="red"))
 
+@click.command("assets-build", help="بناء بصمات ملفات static وتوليد نسخ .br/.gz مسبقة الضغط")
+@click.option("--no-compress", is_flag=True, help="بناء البصمات فقط بدون نسخ مضغوطة.")
+@click.option("--min-size", type=int, default=1024, show_default=True, help="أصغر حجم ملف (بايت) يستحق الضغط.")
+@click.option("--clean", is_flag=True, help="حذف المانيفست والنسخ المضغوطة بدل البناء.")
+@with_appcontext
+def assets_build(no_compress: bool, min_size: int, clean: bool) -> None:
+    from flask import current_app
+    from services.static_assets import build_asset_manifest, clean_asset_build
+
+    static_folder = current_app.static_folder
+    if clean:
+        removed = clean_asset_build(static_folder)
+        click.echo(f"🧹 تم حذف {removed} ملف بناء من {static_folder}")
+        return
+    stats = build_asset_manifest(static_folder, compress=not no_compress, min_size=min_size)
+    click.echo(
+        f"✅ assets: {stats['files']} ملف، {stats['compressed']} نسخة مضغوطة جديدة، "
+        f"{stats['reused']} معاد استخدامها ({stats['bytes'] / 1048576:.1f} MB أصلي)"
+    )
+
+
+@click.command("scheduler-run", help="تشغيل المهام المجدولة في عملية مستقلة (SCHEDULER_MODE=external)")
+@with_appcontext
+def scheduler_run() -> None:
+    import time as _time
+    from flask import current_app
+    from extensions import scheduler, start_job_scheduler
+
+    app = current_app._get_current_object()
+    if not start_job_scheduler(app):
+        raise click.ClickException("تعذر تشغيل المُجدول")
+    jobs = app.extensions.get("job_registry")
+    click.echo(f"⏰ scheduler: {len(jobs.job_ids) if jobs else 0} مهمة، المالك {jobs.lease.owner if jobs else '-'}")
+    try:
+        while True:
+            _time.sleep(1)
+    except (KeyboardInterrupt, SystemExit):
+        pass
+    finally:
+        if scheduler.running:
+            scheduler.shutdown(wait=True)
+        if jobs:
+            jobs.lease.release()
+
+
+@click.command("scheduler-status", help="عرض قائد المُجدول وآخر تشغيل لكل مهمة")
+@click.option("--job", "job_id", default=None, help="عرض سجل مهمة محددة.")
+@click.option("--limit", type=int, default=20, show_default=True)
+@with_appcontext
+def scheduler_status(job_id, limit) -> None:
+    from models import SchedulerJobRun, SchedulerLease
+
+    lease = db.session.get(SchedulerLease, "scheduler")
+    if lease:
+        state = "نشط" if lease.expires_at > datetime.utcnow() else "منتهي"
+        click.echo(f"👑 القائد: {lease.owner} ({state} حتى {lease.expires_at:%Y-%m-%d %H:%M:%S} UTC)")
+    else:
+        click.echo("👑 لا يوجد قائد مسجل")
+
+    q = SchedulerJobRun.query
+    if job_id:
+        q = q.filter(SchedulerJobRun.job_id == job_id)
+        rows = q.order_by(SchedulerJobRun.started_at.desc()).limit(limit).all()
+    else:
+        latest = (
+            db.session.query(SchedulerJobRun.job_id, func.max(SchedulerJobRun.id).label("id"))
+            .group_by(SchedulerJobRun.job_id)
+            .subquery()
+        )
+        rows = (
+            q.join(latest, SchedulerJobRun.id == latest.c.id)
+            .order_by(SchedulerJobRun.job_id)
+            .all()
+        )
+    for r in rows:
+        duration = f"{r.duration_ms}ms" if r.duration_ms is not None else "-"
+        line = f"{r.job_id:<28} {r.status:<8} {r.started_at:%Y-%m-%d %H:%M:%S} {duration:>10} {r.owner}"
+        if r.error:
+            line += f"  ⚠ {r.error[:80]}"
+        click.echo(line)
+
+
+@click.command("cogs-rebuild", help="إعادة بناء طبقات التكلفة وتكلفة البضاعة المباعة المجمدة من التاريخ")
+@click.option("--method", type=click.Choice(["FIFO", "AVERAGE"], case_sensitive=False), default=None,
+              help="طريقة التكلفة (الافتراضي COGS_METHOD).")
+@with_appcontext
+def cogs_rebuild(method) -> None:
+    from services.cost_layers import cost_method, rebuild_all
+
+    method = (method or cost_method()).upper()
+    try:
+        counts = rebuild_all(db.session, method=method)
+        db.session.commit()
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        raise click.ClickException(str(e)) from e
+    click.echo(
+        f"✅ cogs ({method}): {counts.get('layers', 0)} طبقة، {counts.get('entries', 0)} بند تكلفة "
+        f"من {counts.get('sale', 0)} بيع و{counts.get('service', 0)} صيانة "
+        f"و{counts.get('adjustment', 0)} تسوية و{counts.get('shipment', 0)} شحنة و{counts.get('exchange', 0)} حركة تبادل"
+    )
+
+
+@click.command("assets-depreciate", help="تسجيل أقساط استهلاك الأصول الناقصة حتى فترة محددة مع قيد يومية لكل فترة")
+@click.option("--through", "through", default=None, help="آخر فترة YYYY-MM لا تتجاوز الشهر الحالي (الافتراضي: آخر فترة مستحقة).")
+@click.option("--no-gl", is_flag=True, default=False, help="تسجيل الأقساط بدون قيود يومية.")
+@with_appcontext
+def assets_depreciate(through, no_gl) -> None:
+    from services.depreciation import due_through, ensure_not_future, parse_period, run_depreciation
+
+    day_of_month = int(SystemSettings.get_setting("depreciation_day_of_month", 1) or 1)
+    try:
+        period = ensure_not_future(parse_period(through)) if through else due_through(day_of_month=day_of_month)
+    except ValueError as e:
+        raise click.BadParameter(str(e), param_hint="--through")
+    try:
+        counts = run_depreciation(db.session, period, day_of_month=day_of_month, post_gl=not no_gl)
+        db.session.commit()
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        raise click.ClickException(str(e)) from e
+    click.echo(
+        f"✅ استهلاك حتى {period[0]}-{period[1]:02d}: {counts['rows']} قسط في {counts['periods']} فترة، "
+        f"{counts['batches']} قيد يومية ({counts['assets']} أصل نشط)"
+    )
+
+
+@click.command("cost-center-rollup", help="إعادة بناء المجاميع الشهرية لمراكز التكلفة ثم تقييم التنبيهات")
+@click.option("--no-alerts", is_flag=True, default=False, help="إعادة البناء فقط بدون تقييم التنبيهات.")
+@with_appcontext
+def cost_center_rollup(no_alerts) -> None:
+    from services.cost_center_analytics import evaluate_alerts, rebuild_rollup
+
+    try:
+        rows = rebuild_rollup(db.session)
+        counts = {"alerts": 0, "triggered": 0} if no_alerts else evaluate_alerts(db.session)
+        db.session.commit()
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        raise click.ClickException(str(e)) from e
+    click.echo(f"✅ {rows} مجموع شهري؛ {counts['triggered']} تنبيه أُطلق من {counts['alerts']} نشط")
+
+
+@click.command("stock-totals-rebuild", help="إعادة بناء product_stock_totals من stock_levels")
+@with_appcontext
+def stock_totals_rebuild() -> None:
+    from services.stock_totals import rebuild
+
+    try:
+        rows = rebuild(db.session.connection())
+        db.session.commit()
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        raise click.ClickException(str(e)) from e
+    click.echo(f"✅ {rows} منتج في product_stock_totals")
+
+
+def _backup_store():
+    from flask import current_app
+    from services.backup_store import BackupStore, available
+
+    if not available():
+        raise click.ClickException("zstandard غير مثبت")
+    return BackupStore.from_app(current_app)
+
+
+@click.command("backup-snapshot", help="أخذ لقطة تزايدية لقاعدة SQLite (الكتل المتغيرة فقط)")
+@with_appcontext
+def backup_snapshot() -> None:
+    from flask import current_app
+
+    uri = current_app.config.get("SQLALCHEMY_DATABASE_URI", "")
+    if not uri.startswith("sqlite:///"):
+        raise click.ClickException("قاعدة البيانات ليست SQLite")
+    store = _backup_store()
+    try:
+        m = store.snapshot(uri.replace("sqlite:///", ""), version=current_app.config.get("APP_VERSION"))
+    except Exception as e:
+        raise click.ClickException(str(e)) from e
+    click.echo(
+        f"✅ {m['id']}: {len(m['chunks'])} كتلة، {m['new_chunks']} جديدة "
+        f"({m['new_bytes'] / 1048576:.2f} MB مضغوط من {m['db_size'] / 1048576:.1f} MB)"
+    )
+
+
+@click.command("backup-list", help="عرض اللقطات التزايدية وحجم المخزن")
+@with_appcontext
+def backup_list() -> None:
+    store = _backup_store()
+    stats = store.stats()
+    for snap in store.list_snapshots():
+        click.echo(
+            f"{snap['id']:<26} {snap['db_size'] / 1048576:>9.1f} MB  "
+            f"{snap['chunk_count']:>6} كتلة  +{snap.get('new_bytes', 0) / 1048576:.2f} MB"
+        )
+    click.echo(
+        f"📦 {stats['snapshots']} لقطة، المخزن {stats['store_bytes'] / 1048576:.1f} MB "
+        f"مقابل {stats['logical_bytes'] / 1048576:.1f} MB كنسخ كاملة"
+    )
+
+
+@click.command("backup-verify", help="التحقق من كتل لقطة (الأحدث افتراضياً)")
+@click.option("--snapshot", "snapshot_id", default=None)
+@click.option("--all", "verify_all", is_flag=True, help="التحقق من كل اللقطات.")
+@click.option("--quick", is_flag=True, help="التحقق من وجود الكتل فقط بدون فك الضغط.")
+@with_appcontext
+def backup_verify(snapshot_id, verify_all: bool, quick: bool) -> None:
+    store = _backup_store()
+    ids = [s["id"] for s in store.list_snapshots()] if verify_all else [snapshot_id]
+    failed = 0
+    for sid in ids:
+        try:
+            r = store.verify(sid, deep=not quick)
+        except FileNotFoundError as e:
+            raise click.ClickException(str(e)) from e
+        failed += 0 if r["ok"] else 1
+        state = "✅" if r["ok"] else f"❌ مفقودة {len(r['missing'])} تالفة {len(r['corrupt'])}"
+        click.echo(f"{r['id']:<26} {r['chunks']:>6} كتلة  {state}")
+    if failed:
+        raise click.ClickException(f"{failed} لقطة غير سليمة")
+
+
+@click.command("backup-restore", help="استعادة لقطة إلى ملف قاعدة جديد (لا يلمس القاعدة الحية)")
+@click.option("--snapshot", "snapshot_id", default=None, help="معرف اللقطة (الأحدث افتراضياً).")
+@click.option("--target", required=True, type=click.Path(dir_okay=False))
+@with_appcontext
+def backup_restore(snapshot_id, target: str) -> None:
+    if os.path.exists(target):
+        raise click.ClickException(f"الملف موجود: {target}")
+    store = _backup_store()
+    try:
+        r = store.restore(target, snapshot_id)
+    except Exception as e:
+        raise click.ClickException(str(e)) from e
+    click.echo(f"✅ تمت استعادة {r['id']} إلى {r['path']} ({r['size'] / 1048576:.1f} MB)")
+
+
+@click.command("backup-prune", help="حذف اللقطات القديمة والكتل غير المستخدمة")
+@click.option("--keep", type=int, default=None, help="عدد اللقطات المحتفظ بها (الافتراضي BACKUP_SNAPSHOT_KEEP).")
+@with_appcontext
+def backup_prune(keep) -> None:
+    from flask import current_app
+
+    store = _backup_store()
+    r = store.prune(keep or current_app.config.get("BACKUP_SNAPSHOT_KEEP", 72))
+    click.echo(f"🧹 حُذفت {r['snapshots']} لقطة و{r['chunks']} كتلة ({r['bytes'] / 1048576:.1f} MB)")
+
+
+@click.command("db-merge", help="دمج قاعدة SQLite فرعية في القاعدة الحالية على دفعات (ATTACH)")
+@click.argument("source", type=click.Path(exists=True, dir_okay=False))
+@click.option("--mode", type=click.Choice(["smart", "append"]), default="smart", show_default=True)
+@click.option("--ignore", "ignored", multiple=True, help="جدول يُستثنى من الدمج (يمكن تكراره).")
+@click.option("--dry-run", is_flag=True, help="عرض الفروقات فقط بدون كتابة.")
+@click.option("--batch-size", type=int, default=None, help="عدد السجلات في كل دفعة (الافتراضي DB_MERGE_BATCH_SIZE).")
+@with_appcontext
+def db_merge(source: str, mode: str, ignored, dry_run: bool, batch_size) -> None:
+    from flask import current_app
+    from services.db_merge import merge_databases
+
+    uri = current_app.config.get("SQLALCHEMY_DATABASE_URI", "")
+    if not uri.startswith("sqlite:///"):
+        raise click.ClickException("قاعدة البيانات ليست SQLite")
+    target = uri.replace("sqlite:///", "")
+
+    def _progress(table, done, total):
+        click.echo(f"\r  {table:<40} {done:>10}/{total}", nl=False)
+        if done >= total:
+            click.echo("")
+
+    result = merge_databases(
+        target, source, mode=mode, ignored_tables=ignored, dry_run=dry_run,
+        batch_size=batch_size or current_app.config.get("DB_MERGE_BATCH_SIZE", 5000),
+        progress=None if dry_run else _progress,
+    )
+    if dry_run:
+        for row in result:
+            new = "-" if row["new"] is None else row["new"]
+            changed = "-" if row["changed"] is None else row["changed"]
+            drift = f"  ⚠ أعمدة ناقصة: {', '.join(row['missing_in_source'])}" if row["missing_in_source"] else ""
+            click.echo(f"{row['table']:<40} src={row['source_count']:<8} dst={row['target_count']:<8} new={new:<8} changed={changed}{drift}")
+        return
+    for failed in result["errors"]:
+        click.echo(click.style(f"❌ {failed['table']}: {failed['error']}", fg="red"))
+    for table, n in result["fk_violations"].items():
+        click.echo(click.style(f"⚠ {table}: {n} سجل بمرجع مفقود", fg="yellow"))
+    for table, n in result["rebuilt"].items():
+        if n is None:
+            click.echo(click.style(f"❌ تعذر إعادة بناء {table}", fg="red"))
+        else:
+            click.echo(f"↻ أعيد بناء {table}: {n} صف")
+    click.echo(f"✅ أضيف {result['added']} سجل من {len(result['tables'])} جدول في {result['seconds']} ثانية")
+
+
 @click.command("link-missing-counterparties")
 @with_appcontext
 def link_missing_counterparties():
@@ -2698,7 +2991,8 @@ def register_cli(app) -> None:
         note_add, note_list, audit_tail,
         currency_balance, currency_validate, currency_report, currency_health, currency_update, currency_test,
         create_superadmin,
-        optimize_db, link_missing_counterparties,
+        optimize_db, link_missing_counterparties, assets_build, scheduler_run, scheduler_status, cogs_rebuild, assets_depreciate, cost_center_rollup, stock_totals_rebuild,
+        backup_snapshot, backup_list, backup_verify, backup_restore, backup_prune, db_merge,
         seed_employees, seed_salaries, seed_expenses_demo, seed_branches,
         workflow_check_timeouts, gl_recreate_payments, sync_balances, checks_sync_due
     ]
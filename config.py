@@ -228,6 +228,65 @@ class Config:
     BACKUP_KEEP_LAST = _int("BACKUP_KEEP_LAST", 5)
     BACKUP_DB_INTERVAL = timedelta(hours=1)
     BACKUP_SQL_INTERVAL = timedelta(hours=24)
+    # نسخ تزايدي: كتل مضغوطة بـ zstd حسب المحتوى + manifest لكل لقطة
+    BACKUP_INCREMENTAL = _bool(os.environ.get("BACKUP_INCREMENTAL"), True)
+    BACKUP_STORE_DIR = os.path.join(BACKUP_DIR, "store")
+    BACKUP_CHUNK_SIZE = _int("BACKUP_CHUNK_SIZE", 1024 * 1024)
+    BACKUP_ZSTD_LEVEL = _int("BACKUP_ZSTD_LEVEL", 3)
+    BACKUP_SNAPSHOT_KEEP = _int("BACKUP_SNAPSHOT_KEEP", 72)
+    # تفريغ iterdump النصي الكامل اختياري عند تفعيل النسخ التزايدي
+    BACKUP_SQL_DUMP = _bool(os.environ.get("BACKUP_SQL_DUMP"), False)
+    DB_MERGE_BATCH_SIZE = _int("DB_MERGE_BATCH_SIZE", 5000)
+
+    # مقاييس النظام تُجمع في خيط خلفي؛ الطلبات تقرأ آخر لقطة فقط
+    SYSTEM_METRICS_SAMPLER = _bool(os.environ.get("SYSTEM_METRICS_SAMPLER"), True)
+    SYSTEM_METRICS_INTERVAL = _int("SYSTEM_METRICS_INTERVAL", 15)
+    SYSTEM_METRICS_COUNTS_INTERVAL = _int("SYSTEM_METRICS_COUNTS_INTERVAL", 120)
+
+    # أرقام المستندات من جدول document_sequences؛ حجم > 1 يحجز كتلة أرقام لكل عامل (غير مفعّل على SQLite)
+    DOC_NUMBER_BLOCK_SIZE = _int("DOC_NUMBER_BLOCK_SIZE", 1)
+    # باركود EAN-13 المولّد: بادئة الشركة (200-299 للاستخدام الداخلي لدى GS1) وحجم دفعة الإسناد الجماعي
+    BARCODE_COMPANY_PREFIX = os.environ.get("BARCODE_COMPANY_PREFIX", "200")
+    BARCODE_ASSIGN_BATCH = _int("BARCODE_ASSIGN_BATCH", 1000)
+    # صور الباركود/QR المولدة: LRU في الذاكرة + كاش على القرص (instance/label_cache افتراضياً)
+    LABEL_CACHE_DIR = os.environ.get("LABEL_CACHE_DIR") or None
+    LABEL_CACHE_MAX_MB = _int("LABEL_CACHE_MAX_MB", 64)
+    LABEL_MEMORY_ITEMS = _int("LABEL_MEMORY_ITEMS", 1024)
+    LABEL_BULK_LIMIT = _int("LABEL_BULK_LIMIT", 500)
+    LABEL_SHEET_MAX = _int("LABEL_SHEET_MAX", 2000)
+    # لقطة أسعار الصرف المستخدمة داخل flush تُعاد قراءتها من exchange_rates بعد هذه المدة (ثوانٍ)
+    FX_SNAPSHOT_TTL = _int("FX_SNAPSHOT_TTL", 300)
+
+    # توليد PDF في عمليات WeasyPrint منفصلة (0 = داخل عملية الويب) مع كاش على القرص
+    PDF_RENDER_WORKERS = _int("PDF_RENDER_WORKERS", 2)
+    PDF_RENDER_TIMEOUT = _int("PDF_RENDER_TIMEOUT", 120)
+    PDF_CACHE_DIR = os.environ.get("PDF_CACHE_DIR") or None
+    PDF_CACHE_MAX_MB = _int("PDF_CACHE_MAX_MB", 256)
+    PDF_BULK_LIMIT = _int("PDF_BULK_LIMIT", 200)
+
+    # أرقام الميزانيات المجمّعة تبقى في الذاكرة حتى يُسجل مصروف/التزام جديد أو تنتهي المدة (ثوانٍ)
+    BUDGET_ANALYTICS_TTL = _int("BUDGET_ANALYTICS_TTL", 300)
+
+    # ذاكرة محادثات المساعد: auto = Redis إن توفر ثم Flask-Caching المشترك، local = داخل العملية فقط
+    AI_CONVERSATION_BACKEND = os.environ.get("AI_CONVERSATION_BACKEND", "auto")
+    AI_CONVERSATION_TTL = _int("AI_CONVERSATION_TTL", 3600)
+    AI_CONVERSATION_MAX_SESSIONS = _int("AI_CONVERSATION_MAX_SESSIONS", 1000)
+    AI_CONVERSATION_MAX_MESSAGES = _int("AI_CONVERSATION_MAX_MESSAGES", 50)
+    AI_CONVERSATION_MAX_CHARS = _int("AI_CONVERSATION_MAX_CHARS", 4000)
+
+    NOTIFICATION_CLEANUP_CHUNK = _int("NOTIFICATION_CLEANUP_CHUNK", 500)
+    # المنتهي الصلاحية يبقى في العدّاد حتى يحذفه التنظيف، فالفاصل القصير يبقي الشارة دقيقة
+    NOTIFICATION_CLEANUP_MINUTES = _int("NOTIFICATION_CLEANUP_MINUTES", 1)
+
+    # embedded: كل عملية تشغّل APScheduler وتنفذ القائدة فقط | external: عبر flask scheduler-run
+    SCHEDULER_MODE = os.environ.get("SCHEDULER_MODE", "embedded").strip().lower()
+    SCHEDULER_LEASE_TTL = _int("SCHEDULER_LEASE_TTL", 90)
+    SCHEDULER_LEASE_RENEW = _int("SCHEDULER_LEASE_RENEW", 30)
+    SCHEDULER_JOB_STALE_SECONDS = _int("SCHEDULER_JOB_STALE_SECONDS", 6 * 3600)
+    SCHEDULER_HISTORY_DAYS = _int("SCHEDULER_HISTORY_DAYS", 30)
+
+    # طريقة تكلفة البضاعة المباعة: FIFO أو AVERAGE (تُطبق على البنود الجديدة فقط)
+    COGS_METHOD = os.environ.get("COGS_METHOD", "FIFO").strip().upper()
 
     LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
     JSON_LOGS = _bool(os.environ.get("JSON_LOGS"), False)
@@ -242,6 +301,14 @@ class Config:
     IMPORT_REPORT_DIR = os.environ.get("IMPORT_REPORT_DIR") or os.path.join(instance_dir, "imports", "reports")
     os.makedirs(IMPORT_TMP_DIR, exist_ok=True)
     os.makedirs(IMPORT_REPORT_DIR, exist_ok=True)
+    # ملفات المنتجات الأكبر من IMPORT_PREVIEW_MAX_MB تُستورد مباشرة في الخلفية بدون معاينة قابلة للتعديل
+    # (رفع ملفات أكبر من MAX_CONTENT_LENGTH_MB يتطلب رفع ذلك الحد أيضاً)
+    IMPORT_MAX_UPLOAD_MB = _int("IMPORT_MAX_UPLOAD_MB", 50)
+    IMPORT_PREVIEW_MAX_MB = _int("IMPORT_PREVIEW_MAX_MB", 2)
+    IMPORT_BATCH_ROWS = _int("IMPORT_BATCH_ROWS", 5000)
+    IMPORT_BACKGROUND = _bool(os.environ.get("IMPORT_BACKGROUND"), True)
+    # عملية QUEUED/RUNNING لم يتحرك updated_at لها منذ هذه المدة تُعد منقطعة (إعادة تشغيل/انهيار) وتُعلَّم FAILED
+    IMPORT_STALE_MINUTES = _int("IMPORT_STALE_MINUTES", 30)
 
     ONLINE_GATEWAY_DEFAULT = (os.environ.get("ONLINE_GATEWAY_DEFAULT") or "blooprint").lower()
     BLOOPRINT_WEBHOOK_SECRET = os.environ.get("BLOOPRINT_WEBHOOK_SECRET", "")
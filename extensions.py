@@ -19,14 +19,7 @@ from flask_socketio import SocketIO
 from flask_sqlalchemy import SQLAlchemy
 from flask_wtf import CSRFProtect
 from flask_caching import Cache
-try:
-    from flask_compress import Compress
-except ImportError:
-    class Compress:
-        def __init__(self, *args, **kwargs):
-            pass
-        def init_app(self, app):
-            pass
+from middleware.compression import CompressionPolicy
 from sqlalchemy import event, func
 from sqlalchemy.engine import Engine
 
@@ -49,14 +42,6 @@ except Exception:
     def colorama_init(*args, **kwargs):
         return
 
-try:
-    import sentry_sdk
-    from sentry_sdk.integrations.flask import FlaskIntegration
-    from sentry_sdk.integrations.sqlalchemy import SqlalchemyIntegration
-except Exception:
-    sentry_sdk = None
-
-
 class RequestIdFilter(logging.Filter):
     def filter(self, record):
         if has_request_context():
@@ -148,9 +133,17 @@ def setup_logging(app):
 
 def setup_sentry(app):
     dsn = (app.config.get("SENTRY_DSN") or "").strip()
-    if not dsn or not sentry_sdk:
+    if not dsn:
         app.logger.info("Sentry disabled (no DSN configured).")
         return
+    # الاستيراد هنا فقط: sentry_sdk يكلف ~0.25 ثانية عند الإقلاع حتى بدون DSN
+    try:
+        import sentry_sdk
+        from sentry_sdk.integrations.flask import FlaskIntegration
+        from sentry_sdk.integrations.sqlalchemy import SqlalchemyIntegration
+    except Exception:
+        app.logger.info("Sentry disabled (sentry_sdk not installed).")
+        return
     try:
         sentry_sdk.init(
             dsn=dsn,
@@ -205,7 +198,7 @@ migrate = Migrate()
 login_manager = LoginManager()
 mail = Mail()
 csrf = CSRFProtect()
-compress = Compress()
+compress = CompressionPolicy()
 socketio = SocketIO(cors_allowed_origins="*", logger=False, engineio_logger=False)
 
 # نظام الإشعارات الفورية
@@ -382,6 +375,31 @@ def perform_vacuum_optimize(app):
         app.logger.warning(f"⚠️ Database optimization error: {e}")
 
 
+def _incremental_backup_enabled(app) -> bool:
+    if not app.config.get("BACKUP_INCREMENTAL", True):
+        return False
+    from services.backup_store import available
+    if not available():
+        app.logger.warning("⚠️ zstandard غير مثبت: الرجوع للنسخ الاحتياطي الكامل")
+        return False
+    return True
+
+
+def perform_incremental_backup(app, db_path):
+    """لقطة تزايدية (الكتل المتغيرة فقط) ثم تنظيف اللقطات والكتل القديمة"""
+    from services.backup_store import BackupStore
+
+    store = BackupStore.from_app(app)
+    manifest = store.snapshot(db_path, version=app.config.get("APP_VERSION"))
+    pruned = store.prune(app.config.get("BACKUP_SNAPSHOT_KEEP", 72))
+    app.logger.info(
+        f"Incremental backup {manifest['id']}: {len(manifest['chunks'])} chunks, "
+        f"{manifest['new_chunks']} new ({manifest['new_bytes'] / 1048576:.2f} MB), "
+        f"pruned {pruned['snapshots']} snapshots / {pruned['chunks']} chunks"
+    )
+    return manifest
+
+
 def perform_backup_db(app):
     """Database backup utility"""
     try:
@@ -395,6 +413,10 @@ def perform_backup_db(app):
             app.logger.error(f"Database file not found: {db_path}")
             return
         
+        if _incremental_backup_enabled(app):
+            perform_incremental_backup(app, db_path)
+            return
+        
         backup_dir = app.config.get("BACKUP_DB_DIR")
         os.makedirs(backup_dir, exist_ok=True)
         
@@ -471,114 +493,62 @@ def perform_backup_db(app):
 def process_asset_depreciation(app):
     try:
         with app.app_context():
-            from models import SystemSettings, FixedAsset, FixedAssetCategory, AssetDepreciation, db
-            from datetime import date
-            from decimal import Decimal
+            from models import SystemSettings, db
+            from services.depreciation import due_through, run_depreciation
             
             enable_auto = SystemSettings.get_setting('enable_auto_depreciation', False)
             if not enable_auto:
                 return
             
-            today = date.today()
-            current_year = today.year
-            current_month = today.month
-            
+            # يعمل يومياً ويستكمل أي شهر فائت حتى آخر فترة مستحقة (الصفوف الموجودة لا تُعاد)
             day_of_month = int(SystemSettings.get_setting('depreciation_day_of_month', 1))
-            if today.day != day_of_month:
-                return
-            
-            assets = FixedAsset.query.filter_by(status='ACTIVE').all()
-            
-            for asset in assets:
-                existing = AssetDepreciation.query.filter_by(
-                    asset_id=asset.id,
-                    fiscal_year=current_year,
-                    fiscal_month=current_month
-                ).first()
-                
-                if existing:
-                    continue
-                
-                category = asset.category
-                if not category:
-                    continue
-                
-                years_owned = (today - asset.purchase_date).days / 365.25
-                if years_owned >= category.useful_life_years:
-                    continue
-                
-                if category.depreciation_method == 'STRAIGHT_LINE':
-                    annual_depreciation = float(asset.purchase_price) / category.useful_life_years
-                    monthly_depreciation = annual_depreciation / 12
-                else:
-                    rate = float(category.depreciation_rate or 0) / 100
-                    current_value = asset.get_current_book_value(today)
-                    annual_depreciation = current_value * rate
-                    monthly_depreciation = annual_depreciation / 12
-                
-                total_previous = db.session.query(func.sum(AssetDepreciation.depreciation_amount)).filter(
-                    AssetDepreciation.asset_id == asset.id
-                ).scalar() or 0
-                
-                accumulated = float(total_previous) + monthly_depreciation
-                book_value = float(asset.purchase_price) - accumulated
-                
-                if book_value < 0:
-                    book_value = 0
-                    monthly_depreciation = float(asset.purchase_price) - float(total_previous)
-                
-                depreciation = AssetDepreciation(
-                    asset_id=asset.id,
-                    fiscal_year=current_year,
-                    fiscal_month=current_month,
-                    depreciation_date=today,
-                    depreciation_amount=Decimal(str(round(monthly_depreciation, 2))),
-                    accumulated_depreciation=Decimal(str(round(accumulated, 2))),
-                    book_value=Decimal(str(round(book_value, 2)))
+            through = due_through(day_of_month=day_of_month)
+            counts = run_depreciation(db.session, through, day_of_month=day_of_month)
+            db.session.commit()
+            if counts.get('rows'):
+                app.logger.info(
+                    f"[Depreciation] {counts['rows']} rows for {counts['periods']} periods, "
+                    f"{counts['batches']} GL batches ({counts['assets']} assets)"
                 )
-                db.session.add(depreciation)
-                
-                from models import _gl_upsert_batch_and_entries, GL_ACCOUNTS
-                
-                entries = [
-                    (GL_ACCOUNTS.get("DEPRECIATION_EXP", "6800_DEPRECIATION"), monthly_depreciation, 0),
-                    (category.depreciation_account_code, 0, monthly_depreciation),
-                ]
-                
-                try:
-                    batch_id = _gl_upsert_batch_and_entries(
-                        db.session.connection(),
-                        source_type="DEPRECIATION",
-                        source_id=asset.id,
-                        purpose="DEPRECIATION",
-                        currency="ILS",
-                        memo=f"استهلاك {asset.name} - {current_year}/{current_month}",
-                        entries=entries,
-                        ref=f"DEP-{asset.asset_number}-{current_year}{current_month:02d}",
-                        entity_type=None,
-                        entity_id=None
-                    )
-                    depreciation.gl_batch_id = batch_id
-                except Exception as e:
-                    app.logger.warning(f"Failed to create GL for depreciation: {e}")
             
+    except Exception as e:
+        try:
+            db.session.rollback()
+        except Exception:
+            pass
+        app.logger.error(f"[Depreciation] Job failed: {e}")
+
+
+def process_cost_center_alerts(app):
+    try:
+        with app.app_context():
+            from models import db
+            from services.cost_center_analytics import evaluate_alerts
+            
+            counts = evaluate_alerts(db.session)
             db.session.commit()
-            app.logger.info(f"[Depreciation] Processed {len(assets)} assets")
+            if counts.get('triggered'):
+                app.logger.info(f"[Cost Center Alerts] {counts['triggered']} of {counts['alerts']} alerts triggered")
             
     except Exception as e:
-        app.logger.error(f"[Depreciation] Job failed: {e}")
+        try:
+            db.session.rollback()
+        except Exception:
+            pass
+        app.logger.error(f"[Cost Center Alerts] Job failed: {e}")
 
 
 def update_exchange_rates_job(app):
     try:
         with app.app_context():
-            from models import auto_update_missing_rates
+            from services.fx_snapshot import refresh_fx_snapshot
             
-            result = auto_update_missing_rates()
+            # السحب من الإنترنت هنا فقط؛ مستمعو flush يقرؤون من اللقطة
+            result = refresh_fx_snapshot()
             
             if result.get('success'):
                 updated = result.get('updated_rates', 0)
-                app.logger.info(f"[FX Update] Updated {updated} exchange rates")
+                app.logger.info(f"[FX Update] Updated {updated} exchange rates, snapshot {result.get('snapshot_pairs', 0)} pairs")
             else:
                 app.logger.warning(f"[FX Update] Failed: {result.get('message', 'Unknown error')}")
                 
@@ -750,6 +720,21 @@ def process_check_reminders(app):
         app.logger.error(f"[Check Reminders] Job failed: {e}")
 
 
+def process_notification_cleanup(app):
+    try:
+        with app.app_context():
+            from notifications import Notification
+            
+            removed = Notification.cleanup_expired(
+                chunk_size=int(app.config.get("NOTIFICATION_CLEANUP_CHUNK", 500) or 500)
+            )
+            if removed:
+                app.logger.info(f"[Notifications] Removed {removed} expired notifications")
+                
+    except Exception as e:
+        app.logger.error(f"[Notifications] Cleanup job failed: {e}")
+
+
 def perform_backup_sql(app):
     """نسخ احتياطي SQL محسن"""
     try:
@@ -763,6 +748,11 @@ def perform_backup_sql(app):
             app.logger.error(f"Database file not found: {db_path}")
             return
         
+        # اللقطات التزايدية تغطي الاستعادة؛ التفريغ النصي الكامل فقط عند طلبه صراحة
+        if _incremental_backup_enabled(app) and not app.config.get("BACKUP_SQL_DUMP"):
+            app.logger.debug("SQL dump skipped: incremental backups enabled (BACKUP_SQL_DUMP=0)")
+            return
+        
         backup_dir = app.config.get("BACKUP_SQL_DIR")
         os.makedirs(backup_dir, exist_ok=True)
         
@@ -824,14 +814,11 @@ def register_fonts(app=None):
         logging.error("Font registration failed: %s", e)
 
 
-def _safe_start_scheduler(app):
-    skip_cmds = ("db", "seed", "shell", "migrate", "upgrade", "downgrade", "init")
-    if any(cmd in sys.argv for cmd in skip_cmds):
-        app.logger.info("Scheduler skipped: CLI context.")
-        return
-    if os.environ.get("DISABLE_SCHEDULER"):
-        app.logger.info("Scheduler disabled by environment variable.")
-        return
+def start_job_scheduler(app):
+    """تشغيل APScheduler والمشاركة في انتخاب القائد
+
+    كل العمليات تجدد العقد، لكن المهام لا تُنفَّذ إلا في العملية القائدة.
+    """
     try:
         if not scheduler.running:
             scheduler.start()
@@ -840,6 +827,29 @@ def _safe_start_scheduler(app):
             app.logger.info("APScheduler already running; skip start.")
     except Exception as e:
         app.logger.warning(f"Scheduler start skipped: {e}")
+        return False
+    jobs = app.extensions.get("job_registry")
+    if jobs is not None and not jobs.lease.is_leader:
+        jobs.lease.renew()
+        if not app.extensions.get("scheduler_lease_atexit"):
+            import atexit
+            atexit.register(jobs.lease.release)
+            app.extensions["scheduler_lease_atexit"] = True
+    return True
+
+
+def _safe_start_scheduler(app):
+    skip_cmds = ("db", "seed", "shell", "migrate", "upgrade", "downgrade", "init", "scheduler-run", "scheduler-status")
+    if any(cmd in sys.argv for cmd in skip_cmds):
+        app.logger.info("Scheduler skipped: CLI context.")
+        return
+    if os.environ.get("DISABLE_SCHEDULER"):
+        app.logger.info("Scheduler disabled by environment variable.")
+        return
+    if app.config.get("SCHEDULER_MODE", "embedded") == "external":
+        app.logger.info("Scheduler runs in a dedicated process (flask scheduler-run).")
+        return
+    start_job_scheduler(app)
 
 
 def init_extensions(app):
@@ -853,13 +863,13 @@ def init_extensions(app):
     csrf.init_app(app)
     mail.init_app(app)
     
+    # مستويات ضغط خفيفة للاستجابات الديناميكية الكبيرة بدل المستوى 9 على خيط الطلب
+    app.config.setdefault('COMPRESS_ENDPOINT_LEVELS', {
+        'ledger.*': {'br': 4, 'gzip': 5},
+        'api.*': {'br': 4, 'gzip': 5},
+        'balances_api.*': {'br': 4, 'gzip': 5},
+    })
     compress.init_app(app)
-    app.config.setdefault('COMPRESS_MIMETYPES', [
-        'text/html', 'text/css', 'text/xml', 'text/javascript',
-        'application/json', 'application/javascript'
-    ])
-    app.config.setdefault('COMPRESS_LEVEL', 9)
-    app.config.setdefault('COMPRESS_MIN_SIZE', 100)
 
     # تعطيل SocketIO في Development mode لتجنب أخطاء WebSocket
     # يمكن تفعيله في Production مع gunicorn + gevent
@@ -919,15 +929,21 @@ def init_extensions(app):
                 return False
             return False
 
+    from services.scheduler_service import JobRegistry
+    jobs = app.extensions.get("job_registry")
+    if jobs is None:
+        jobs = app.extensions["job_registry"] = JobRegistry(app, scheduler)
+
     try:
-        scheduler.add_job(
+        jobs.add_maintenance_jobs()
+        jobs.add_job(
             lambda: perform_backup_db(app),
             "interval",
             seconds=app.config.get("BACKUP_DB_INTERVAL").total_seconds(),
             id="db_backup",
             replace_existing=True,
         )
-        scheduler.add_job(
+        jobs.add_job(
             lambda: perform_backup_sql(app),
             "interval",
             seconds=app.config.get("BACKUP_SQL_INTERVAL").total_seconds(),
@@ -935,7 +951,7 @@ def init_extensions(app):
             replace_existing=True,
         )
         
-        scheduler.add_job(
+        jobs.add_job(
             lambda: update_exchange_rates_job(app),
             "interval",
             hours=1,
@@ -943,17 +959,24 @@ def init_extensions(app):
             replace_existing=True,
         )
         
-        scheduler.add_job(
+        jobs.add_job(
             lambda: process_asset_depreciation(app),
             "cron",
-            day=1,
             hour=2,
             minute=0,
             id="asset_depreciation",
             replace_existing=True,
         )
         
-        scheduler.add_job(
+        jobs.add_job(
+            lambda: process_cost_center_alerts(app),
+            "interval",
+            hours=1,
+            id="cost_center_alerts",
+            replace_existing=True,
+        )
+        
+        jobs.add_job(
             lambda: process_recurring_invoices(app),
             "cron",
             hour=0,
@@ -962,7 +985,7 @@ def init_extensions(app):
             replace_existing=True,
         )
         
-        scheduler.add_job(
+        jobs.add_job(
             lambda: process_payment_reminders(app),
             "cron",
             hour=9,
@@ -971,7 +994,7 @@ def init_extensions(app):
             replace_existing=True,
         )
         
-        scheduler.add_job(
+        jobs.add_job(
             lambda: process_low_stock_alerts(app),
             "cron",
             hour=8,
@@ -980,7 +1003,7 @@ def init_extensions(app):
             replace_existing=True,
         )
         
-        scheduler.add_job(
+        jobs.add_job(
             lambda: process_check_reminders(app),
             "cron",
             hour=7,
@@ -989,7 +1012,15 @@ def init_extensions(app):
             replace_existing=True,
         )
         
-        scheduler.add_job(
+        jobs.add_job(
+            lambda: process_notification_cleanup(app),
+            "interval",
+            minutes=int(app.config.get("NOTIFICATION_CLEANUP_MINUTES", 1) or 1),
+            id="notification_cleanup",
+            replace_existing=True,
+        )
+        
+        jobs.add_job(
             lambda: perform_wal_checkpoint(app),
             "interval",
             minutes=3,
@@ -997,7 +1028,7 @@ def init_extensions(app):
             replace_existing=True,
         )
         
-        scheduler.add_job(
+        jobs.add_job(
             lambda: perform_vacuum_optimize(app),
             "interval",
             hours=1,
@@ -1010,7 +1041,7 @@ def init_extensions(app):
                 from backup_automation import schedule_automated_backups
                 state = app.extensions.setdefault("auto_backup_scheduler", {})
                 if not state.get("scheduled"):
-                    schedule_automated_backups(app, scheduler)
+                    schedule_automated_backups(app, jobs)
                     state["scheduled"] = True
             except Exception as e:
                 app.logger.warning(f"Automated backup scheduling failed: {e}")
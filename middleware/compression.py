@@ -0,0 +1,254 @@
+import threading
+import time
+import zlib
+from typing import Any, Dict, Iterable, Optional
+
+from flask import request
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+# حجم إطار Ethernet تقريباً: ما دونه يُرسل في حزمة واحدة ولا فائدة من ضغطه
+DEFAULT_MIN_SIZE = 1400
+
+DEFAULT_LEVELS = {
+    "application/json": {"br": 4, "gzip": 5},
+    "text/html": {"br": 5, "gzip": 6},
+    "*": {"br": 5, "gzip": 6},
+}
+
+DEFAULT_MIMETYPES = (
+    "text/html", "text/css", "text/xml", "text/plain", "text/csv", "text/javascript",
+    "application/json", "application/javascript", "application/xml", "image/svg+xml",
+)
+
+# الاستجابات المتدفقة تُفرَّغ للعميل بعد تجمّع هذا القدر من المدخلات، لا بعد كل جزء
+DEFAULT_STREAM_FLUSH_BYTES = 64 * 1024
+
+# بدايات ملفات مضغوطة أصلاً (gzip, zstd, zip, brotli-framed غير قابل للكشف)
+_COMPRESSED_MAGIC = (b"\x1f\x8b", b"\x28\xb5\x2f\xfd", b"PK\x03\x04")
+
+
+class _Stats:
+    __slots__ = ("count", "skipped", "bytes_in", "bytes_out", "seconds", "max_ms", "streamed")
+
+    def __init__(self):
+        self.count = 0
+        self.skipped = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.seconds = 0.0
+        self.max_ms = 0.0
+        self.streamed = 0
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "compressed": self.count,
+            "skipped": self.skipped,
+            "streamed": self.streamed,
+            "bytes_in": self.bytes_in,
+            "bytes_out": self.bytes_out,
+            "ratio": round(self.bytes_out / self.bytes_in, 4) if self.bytes_in else None,
+            "total_ms": round(self.seconds * 1000, 2),
+            "avg_ms": round(self.seconds * 1000 / self.count, 3) if self.count else 0.0,
+            "max_ms": round(self.max_ms, 3),
+        }
+
+
+class CompressionMetrics:
+    """زمن وحجم الضغط لكل endpoint (لكل عملية worker)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats: Dict[str, _Stats] = {}
+
+    def _get(self, endpoint: str) -> _Stats:
+        st = self._stats.get(endpoint)
+        if st is None:
+            st = self._stats.setdefault(endpoint, _Stats())
+        return st
+
+    def record(self, endpoint: str, bytes_in: int, bytes_out: int, seconds: float, streamed: bool = False) -> None:
+        with self._lock:
+            st = self._get(endpoint)
+            st.count += 1
+            st.bytes_in += bytes_in
+            st.bytes_out += bytes_out
+            st.seconds += seconds
+            st.max_ms = max(st.max_ms, seconds * 1000)
+            if streamed:
+                st.streamed += 1
+
+    def record_skip(self, endpoint: str) -> None:
+        with self._lock:
+            self._get(endpoint).skipped += 1
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            return {ep: st.to_dict() for ep, st in sorted(self._stats.items())}
+
+    def reset(self) -> None:
+        with self._lock:
+            self._stats.clear()
+
+
+def _compressor(algorithm: str, level: int):
+    if algorithm == "br":
+        return brotli.Compressor(quality=level)
+    return zlib.compressobj(level, zlib.DEFLATED, 31)
+
+
+def _compress_bytes(algorithm: str, level: int, data: bytes) -> bytes:
+    if algorithm == "br":
+        return brotli.compress(data, quality=level)
+    c = zlib.compressobj(level, zlib.DEFLATED, 31)
+    return c.compress(data) + c.flush()
+
+
+class CompressionPolicy:
+    """سياسة ضغط الاستجابات
+
+    - مستوى ضغط لكل endpoint (COMPRESS_ENDPOINT_LEVELS) أو حسب نوع المحتوى.
+    - ضغط متدفق لاستجابات الـ generator بدل تجميعها في الذاكرة.
+    - تخطي الاستجابات المضغوطة أصلاً أو الأصغر من COMPRESS_MIN_SIZE.
+    """
+
+    def __init__(self, app=None):
+        self.metrics = CompressionMetrics()
+        self.app = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app) -> None:
+        self.app = app
+        app.config.setdefault("COMPRESS_ENABLED", True)
+        app.config.setdefault("COMPRESS_MIMETYPES", list(DEFAULT_MIMETYPES))
+        app.config.setdefault("COMPRESS_MIN_SIZE", DEFAULT_MIN_SIZE)
+        app.config.setdefault("COMPRESS_LEVELS", DEFAULT_LEVELS)
+        app.config.setdefault("COMPRESS_ENDPOINT_LEVELS", {})
+        app.config.setdefault("COMPRESS_STREAMS", True)
+        app.config.setdefault("COMPRESS_STREAM_FLUSH_BYTES", DEFAULT_STREAM_FLUSH_BYTES)
+        app.config.setdefault("COMPRESS_ALGORITHMS", ["br", "gzip"] if brotli else ["gzip"])
+        app.extensions["compression_policy"] = self
+        app.after_request(self.after_request)
+
+    def _choose_algorithm(self) -> Optional[str]:
+        accepted = request.accept_encodings
+        best, best_q = None, 0.0
+        for algorithm in self.app.config["COMPRESS_ALGORITHMS"]:
+            if algorithm == "br" and brotli is None:
+                continue
+            q = accepted[algorithm]
+            if q > best_q:
+                best, best_q = algorithm, q
+        return best
+
+    def levels_for(self, endpoint: str, mimetype: str) -> Optional[Dict[str, int]]:
+        cfg = self.app.config
+        overrides = cfg.get("COMPRESS_ENDPOINT_LEVELS") or {}
+        if endpoint in overrides:
+            return overrides[endpoint] or None
+        blueprint = endpoint.rsplit(".", 1)[0] if "." in endpoint else None
+        if blueprint and f"{blueprint}.*" in overrides:
+            return overrides[f"{blueprint}.*"] or None
+        levels = cfg.get("COMPRESS_LEVELS") or DEFAULT_LEVELS
+        return levels.get(mimetype) or levels.get("*") or DEFAULT_LEVELS["*"]
+
+    def after_request(self, response):
+        cfg = self.app.config
+        if not cfg.get("COMPRESS_ENABLED", True):
+            return response
+        endpoint = request.endpoint or "-"
+        if (
+            response.status_code != 200
+            or request.method == "HEAD"
+            or "Content-Encoding" in response.headers
+            or response.mimetype not in cfg["COMPRESS_MIMETYPES"]
+            or "no-transform" in (response.headers.get("Cache-Control") or "")
+            # send_file/static (ملفات قد تكون مضغوطة مسبقاً، مع Range وETag) تمر كما هي
+            or response.direct_passthrough
+            or "Content-Range" in response.headers
+        ):
+            return response
+        response.vary.add("Accept-Encoding")
+
+        algorithm = self._choose_algorithm()
+        if not algorithm:
+            return response
+        levels = self.levels_for(endpoint, response.mimetype)
+        level = (levels or {}).get(algorithm)
+        if not level:
+            return response
+
+        if response.is_streamed:
+            if not cfg.get("COMPRESS_STREAMS", True):
+                return response
+            length = response.content_length
+            if length is not None and length < cfg["COMPRESS_MIN_SIZE"]:
+                self.metrics.record_skip(endpoint)
+                return response
+            response.response = self._stream(response.response, algorithm, level, endpoint)
+            response.headers.pop("Content-Length", None)
+            self._mark(response, algorithm)
+            return response
+
+        data = response.get_data()
+        if len(data) < cfg["COMPRESS_MIN_SIZE"] or data.startswith(_COMPRESSED_MAGIC):
+            self.metrics.record_skip(endpoint)
+            return response
+        start = time.perf_counter()
+        packed = _compress_bytes(algorithm, level, data)
+        elapsed = time.perf_counter() - start
+        if len(packed) >= len(data):
+            self.metrics.record_skip(endpoint)
+            return response
+        self.metrics.record(endpoint, len(data), len(packed), elapsed)
+        response.set_data(packed)
+        self._mark(response, algorithm)
+        return response
+
+    @staticmethod
+    def _mark(response, algorithm: str) -> None:
+        response.headers["Content-Encoding"] = algorithm
+        etag, weak = response.get_etag()
+        if etag:
+            response.set_etag(f"{etag}:{algorithm}", weak)
+
+    def _stream(self, chunks: Iterable[Any], algorithm: str, level: int, endpoint: str):
+        compressor = _compressor(algorithm, level)
+        is_br = algorithm == "br"
+        flush_every = max(int(self.app.config.get("COMPRESS_STREAM_FLUSH_BYTES") or 0), 0)
+        bytes_in = bytes_out = pending = 0
+        elapsed = 0.0
+        try:
+            for chunk in chunks:
+                if isinstance(chunk, str):
+                    chunk = chunk.encode("utf-8")
+                if not chunk:
+                    continue
+                start = time.perf_counter()
+                out = compressor.process(chunk) if is_br else compressor.compress(chunk)
+                pending += len(chunk)
+                # flush عند حد حجم فقط: كل flush يكسر نافذة الضغط ويضيف علامة مزامنة
+                if flush_every and pending >= flush_every:
+                    out += compressor.flush() if is_br else compressor.flush(zlib.Z_SYNC_FLUSH)
+                    pending = 0
+                elapsed += time.perf_counter() - start
+                bytes_in += len(chunk)
+                bytes_out += len(out)
+                if out:
+                    yield out
+            start = time.perf_counter()
+            tail = compressor.finish() if is_br else compressor.flush()
+            elapsed += time.perf_counter() - start
+            bytes_out += len(tail)
+            if tail:
+                yield tail
+        finally:
+            close = getattr(chunks, "close", None)
+            if close is not None:
+                close()
+            self.metrics.record(endpoint, bytes_in, bytes_out, elapsed, streamed=True)
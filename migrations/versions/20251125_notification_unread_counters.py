@@ -0,0 +1,74 @@
+"""notification unread counters and broadcast read markers
+
+Revision ID: 20251125_notif_counters
+Revises: 84a17762f7c4
+Create Date: 2025-11-25 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy import inspect
+
+
+revision = '20251125_notif_counters'
+down_revision = '84a17762f7c4'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    bind = op.get_bind()
+    inspector = inspect(bind)
+    existing_tables = inspector.get_table_names()
+
+    def existing_indexes(table_name):
+        return {idx['name'] for idx in inspector.get_indexes(table_name)} if table_name in existing_tables else set()
+
+    if 'notification_unread_counters' not in existing_tables:
+        op.create_table(
+            'notification_unread_counters',
+            sa.Column('user_id', sa.Integer(), autoincrement=False, nullable=False),
+            sa.Column('unread_count', sa.Integer(), server_default=sa.text('0'), nullable=False),
+            sa.Column('broadcast_read_count', sa.Integer(), server_default=sa.text('0'), nullable=False),
+            sa.Column('updated_at', sa.DateTime(), server_default=sa.text('(CURRENT_TIMESTAMP)'), nullable=False),
+            sa.PrimaryKeyConstraint('user_id')
+        )
+
+    if 'notifications' in existing_tables:
+        if 'notification_broadcast_reads' not in existing_tables:
+            op.create_table(
+                'notification_broadcast_reads',
+                sa.Column('notification_id', sa.Integer(), nullable=False),
+                sa.Column('user_id', sa.Integer(), nullable=False),
+                sa.Column('read_at', sa.DateTime(), server_default=sa.text('(CURRENT_TIMESTAMP)'), nullable=False),
+                sa.ForeignKeyConstraint(['notification_id'], ['notifications.id'], ondelete='CASCADE'),
+                sa.ForeignKeyConstraint(['user_id'], ['users.id'], ondelete='CASCADE'),
+                sa.PrimaryKeyConstraint('notification_id', 'user_id')
+            )
+            op.create_index('ix_notification_broadcast_reads_user_id', 'notification_broadcast_reads', ['user_id'], unique=False)
+
+        indexes = existing_indexes('notifications')
+        if 'ix_notifications_user_id_id' not in indexes:
+            op.create_index('ix_notifications_user_id_id', 'notifications', ['user_id', 'id'], unique=False)
+        if 'ix_notifications_expires_at' not in indexes:
+            op.create_index('ix_notifications_expires_at', 'notifications', ['expires_at'], unique=False)
+
+
+def downgrade():
+    bind = op.get_bind()
+    inspector = inspect(bind)
+    existing_tables = inspector.get_table_names()
+
+    if 'notifications' in existing_tables:
+        indexes = {idx['name'] for idx in inspector.get_indexes('notifications')}
+        if 'ix_notifications_expires_at' in indexes:
+            op.drop_index('ix_notifications_expires_at', table_name='notifications')
+        if 'ix_notifications_user_id_id' in indexes:
+            op.drop_index('ix_notifications_user_id_id', table_name='notifications')
+
+    if 'notification_broadcast_reads' in existing_tables:
+        op.drop_index('ix_notification_broadcast_reads_user_id', table_name='notification_broadcast_reads')
+        op.drop_table('notification_broadcast_reads')
+
+    if 'notification_unread_counters' in existing_tables:
+        op.drop_table('notification_unread_counters')
@@ -0,0 +1,67 @@
+"""scheduler leader lease and job run history
+
+Revision ID: 20251126_scheduler_leases
+Revises: 20251125_notif_counters
+Create Date: 2025-11-26 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy import inspect
+
+
+revision = '20251126_scheduler_leases'
+down_revision = '20251125_notif_counters'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    bind = op.get_bind()
+    inspector = inspect(bind)
+    existing_tables = inspector.get_table_names()
+
+    if 'scheduler_leases' not in existing_tables:
+        op.create_table(
+            'scheduler_leases',
+            sa.Column('name', sa.String(length=64), nullable=False),
+            sa.Column('owner', sa.String(length=128), nullable=False),
+            sa.Column('acquired_at', sa.DateTime(), nullable=False),
+            sa.Column('renewed_at', sa.DateTime(), nullable=False),
+            sa.Column('expires_at', sa.DateTime(), nullable=False),
+            sa.PrimaryKeyConstraint('name')
+        )
+        op.create_index('ix_scheduler_leases_expires_at', 'scheduler_leases', ['expires_at'], unique=False)
+
+    if 'scheduler_job_runs' not in existing_tables:
+        op.create_table(
+            'scheduler_job_runs',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('job_id', sa.String(length=100), nullable=False),
+            sa.Column('owner', sa.String(length=128), nullable=False),
+            sa.Column('status', sa.String(length=20), nullable=False),
+            sa.Column('started_at', sa.DateTime(), nullable=False),
+            sa.Column('finished_at', sa.DateTime(), nullable=True),
+            sa.Column('duration_ms', sa.Integer(), nullable=True),
+            sa.Column('error', sa.Text(), nullable=True),
+            sa.PrimaryKeyConstraint('id')
+        )
+        op.create_index('ix_scheduler_job_runs_status', 'scheduler_job_runs', ['status'], unique=False)
+        op.create_index('ix_scheduler_job_runs_started_at', 'scheduler_job_runs', ['started_at'], unique=False)
+        op.create_index('ix_scheduler_job_runs_job_started', 'scheduler_job_runs', ['job_id', 'started_at'], unique=False)
+
+
+def downgrade():
+    bind = op.get_bind()
+    inspector = inspect(bind)
+    existing_tables = inspector.get_table_names()
+
+    if 'scheduler_job_runs' in existing_tables:
+        op.drop_index('ix_scheduler_job_runs_job_started', table_name='scheduler_job_runs')
+        op.drop_index('ix_scheduler_job_runs_started_at', table_name='scheduler_job_runs')
+        op.drop_index('ix_scheduler_job_runs_status', table_name='scheduler_job_runs')
+        op.drop_table('scheduler_job_runs')
+
+    if 'scheduler_leases' in existing_tables:
+        op.drop_index('ix_scheduler_leases_expires_at', table_name='scheduler_leases')
+        op.drop_table('scheduler_leases')
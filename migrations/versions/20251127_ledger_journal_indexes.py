@@ -0,0 +1,50 @@
+"""composite indexes for the unified ledger journal
+
+Revision ID: 20251127_ledger_journal_idx
+Revises: 20251126_scheduler_leases
+Create Date: 2025-11-27 00:00:00.000000
+
+"""
+from alembic import op
+from sqlalchemy import inspect
+
+
+revision = '20251127_ledger_journal_idx'
+down_revision = '20251126_scheduler_leases'
+branch_labels = None
+depends_on = None
+
+
+INDEXES = (
+    ('ix_sales_status_date', 'sales', ['status', 'sale_date']),
+    ('ix_pay_status_date', 'payments', ['status', 'payment_date']),
+    ('ix_sale_returns_status_created', 'sale_returns', ['status', 'created_at']),
+    ('ix_gl_source_posted', 'gl_batches', ['source_type', 'posted_at']),
+)
+
+
+def _existing_indexes(inspector, table):
+    try:
+        return {ix['name'] for ix in inspector.get_indexes(table)}
+    except Exception:
+        return set()
+
+
+def upgrade():
+    bind = op.get_bind()
+    inspector = inspect(bind)
+    existing_tables = inspector.get_table_names()
+
+    for name, table, columns in INDEXES:
+        if table in existing_tables and name not in _existing_indexes(inspector, table):
+            op.create_index(name, table, columns, unique=False)
+
+
+def downgrade():
+    bind = op.get_bind()
+    inspector = inspect(bind)
+    existing_tables = inspector.get_table_names()
+
+    for name, table, _columns in reversed(INDEXES):
+        if table in existing_tables and name in _existing_indexes(inspector, table):
+            op.drop_index(name, table_name=table)
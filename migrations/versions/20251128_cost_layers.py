@@ -0,0 +1,76 @@
+"""cost layers and frozen COGS entries
+
+Revision ID: 20251128_cost_layers
+Revises: 20251127_ledger_journal_idx
+Create Date: 2025-11-28 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy import inspect
+
+
+revision = '20251128_cost_layers'
+down_revision = '20251127_ledger_journal_idx'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    bind = op.get_bind()
+    inspector = inspect(bind)
+    existing_tables = inspector.get_table_names()
+
+    if 'cost_layers' not in existing_tables:
+        op.create_table(
+            'cost_layers',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('product_id', sa.Integer(), nullable=False),
+            sa.Column('source_type', sa.String(length=30), nullable=False),
+            sa.Column('source_id', sa.Integer(), nullable=True),
+            sa.Column('received_at', sa.DateTime(), nullable=False),
+            sa.Column('qty_in', sa.Integer(), nullable=False),
+            sa.Column('qty_remaining', sa.Integer(), nullable=False),
+            sa.Column('unit_cost', sa.Numeric(14, 4), nullable=False),
+            sa.Column('created_at', sa.DateTime(), nullable=False),
+            sa.ForeignKeyConstraint(['product_id'], ['products.id'], ondelete='CASCADE'),
+            sa.PrimaryKeyConstraint('id'),
+        )
+        op.create_index('ix_cost_layers_product_id', 'cost_layers', ['product_id'], unique=False)
+        op.create_index('ix_cost_layers_product_open', 'cost_layers', ['product_id', 'qty_remaining', 'received_at'], unique=False)
+        op.create_index('ix_cost_layers_source', 'cost_layers', ['source_type', 'source_id'], unique=False)
+
+    if 'cogs_entries' not in existing_tables:
+        op.create_table(
+            'cogs_entries',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('source_type', sa.String(length=30), nullable=False),
+            sa.Column('source_id', sa.Integer(), nullable=False),
+            sa.Column('document_type', sa.String(length=30), nullable=False),
+            sa.Column('document_id', sa.Integer(), nullable=False),
+            sa.Column('product_id', sa.Integer(), nullable=False),
+            sa.Column('quantity', sa.Integer(), nullable=False),
+            sa.Column('unit_cost', sa.Numeric(14, 4), nullable=False),
+            sa.Column('total_cost', sa.Numeric(14, 2), nullable=False),
+            sa.Column('method', sa.String(length=10), nullable=False),
+            sa.Column('cost_source', sa.String(length=30), nullable=False),
+            sa.Column('posted_at', sa.DateTime(), nullable=False),
+            sa.Column('created_at', sa.DateTime(), nullable=False),
+            sa.ForeignKeyConstraint(['product_id'], ['products.id'], ondelete='CASCADE'),
+            sa.PrimaryKeyConstraint('id'),
+            sa.UniqueConstraint('source_type', 'source_id', name='uq_cogs_entries_source'),
+        )
+        op.create_index('ix_cogs_entries_product_id', 'cogs_entries', ['product_id'], unique=False)
+        op.create_index('ix_cogs_entries_document', 'cogs_entries', ['document_type', 'document_id'], unique=False)
+        op.create_index('ix_cogs_entries_doc_posted', 'cogs_entries', ['document_type', 'posted_at'], unique=False)
+
+
+def downgrade():
+    bind = op.get_bind()
+    inspector = inspect(bind)
+    existing_tables = inspector.get_table_names()
+
+    if 'cogs_entries' in existing_tables:
+        op.drop_table('cogs_entries')
+    if 'cost_layers' in existing_tables:
+        op.drop_table('cost_layers')
@@ -0,0 +1,39 @@
+"""document number sequences
+
+Revision ID: 20251129_document_sequences
+Revises: 20251128_cost_layers
+Create Date: 2025-11-29 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy import inspect
+
+
+revision = '20251129_document_sequences'
+down_revision = '20251128_cost_layers'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    bind = op.get_bind()
+    inspector = inspect(bind)
+
+    if 'document_sequences' not in inspector.get_table_names():
+        op.create_table(
+            'document_sequences',
+            sa.Column('doc_type', sa.String(length=20), nullable=False),
+            sa.Column('period', sa.String(length=10), nullable=False),
+            sa.Column('last_value', sa.Integer(), nullable=False, server_default='0'),
+            sa.Column('updated_at', sa.DateTime(), nullable=False, server_default=sa.func.now()),
+            sa.PrimaryKeyConstraint('doc_type', 'period'),
+        )
+
+
+def downgrade():
+    bind = op.get_bind()
+    inspector = inspect(bind)
+
+    if 'document_sequences' in inspector.get_table_names():
+        op.drop_table('document_sequences')
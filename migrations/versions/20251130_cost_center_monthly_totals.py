@@ -0,0 +1,64 @@
+"""cost center monthly totals rollup
+
+Revision ID: 20251130_cc_monthly_totals
+Revises: 20251129_document_sequences
+Create Date: 2025-11-30 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy import inspect
+
+
+revision = '20251130_cc_monthly_totals'
+down_revision = '20251129_document_sequences'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    bind = op.get_bind()
+    inspector = inspect(bind)
+    tables = inspector.get_table_names()
+
+    if 'cost_center_monthly_totals' not in tables:
+        op.create_table(
+            'cost_center_monthly_totals',
+            sa.Column('cost_center_id', sa.Integer(), nullable=False),
+            sa.Column('period', sa.String(length=7), nullable=False),
+            sa.Column('amount', sa.Numeric(15, 2), nullable=False, server_default='0'),
+            sa.Column('allocations_count', sa.Integer(), nullable=False, server_default='0'),
+            sa.Column('updated_at', sa.DateTime(), nullable=False, server_default=sa.func.now()),
+            sa.ForeignKeyConstraint(['cost_center_id'], ['cost_centers.id'], ondelete='CASCADE'),
+            sa.PrimaryKeyConstraint('cost_center_id', 'period'),
+        )
+        op.create_index('ix_cc_monthly_period', 'cost_center_monthly_totals', ['period'])
+
+    if 'cost_center_allocations' not in tables:
+        return
+
+    # تعبئة أولية من التوزيعات الحالية
+    year = sa.extract('year', sa.column('allocation_date'))
+    month = sa.extract('month', sa.column('allocation_date'))
+    rows = bind.execute(
+        sa.select(sa.column('cost_center_id'), year, month, sa.func.sum(sa.column('amount')), sa.func.count())
+        .select_from(sa.table('cost_center_allocations'))
+        .group_by(sa.column('cost_center_id'), year, month)
+    ).fetchall()
+    if rows:
+        bind.execute(
+            sa.text(
+                "INSERT INTO cost_center_monthly_totals (cost_center_id, period, amount, allocations_count, updated_at) "
+                "VALUES (:c, :p, :a, :n, CURRENT_TIMESTAMP)"
+            ),
+            [{"c": c, "p": f"{int(y):04d}-{int(m):02d}", "a": a or 0, "n": n} for c, y, m, a, n in rows if y and m],
+        )
+
+
+def downgrade():
+    bind = op.get_bind()
+    inspector = inspect(bind)
+
+    if 'cost_center_monthly_totals' in inspector.get_table_names():
+        op.drop_index('ix_cc_monthly_period', table_name='cost_center_monthly_totals')
+        op.drop_table('cost_center_monthly_totals')
@@ -0,0 +1,105 @@
+"""product import staging table and import run progress
+
+Revision ID: 20251201_product_import_staging
+Revises: 20251130_cc_monthly_totals
+Create Date: 2025-12-01 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy import inspect
+
+
+revision = '20251201_product_import_staging'
+down_revision = '20251130_cc_monthly_totals'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    bind = op.get_bind()
+    inspector = inspect(bind)
+    tables = inspector.get_table_names()
+
+    if 'import_runs' in tables:
+        existing_cols = {col['name'] for col in inspector.get_columns('import_runs')}
+        with op.batch_alter_table('import_runs') as batch_op:
+            if 'status' not in existing_cols:
+                batch_op.add_column(sa.Column('status', sa.String(length=20), nullable=False, server_default='DONE'))
+                batch_op.create_index('ix_import_runs_status', ['status'])
+            if 'stage' not in existing_cols:
+                batch_op.add_column(sa.Column('stage', sa.String(length=20), nullable=True))
+            if 'processed' not in existing_cols:
+                batch_op.add_column(sa.Column('processed', sa.Integer(), nullable=False, server_default='0'))
+            if 'finished_at' not in existing_cols:
+                batch_op.add_column(sa.Column('finished_at', sa.DateTime(), nullable=True))
+
+    if 'product_import_staging' not in tables:
+        op.create_table(
+            'product_import_staging',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('run_id', sa.Integer(), nullable=False),
+            sa.Column('rownum', sa.Integer(), nullable=False),
+            sa.Column('action', sa.String(length=10), nullable=True),
+            sa.Column('note', sa.String(length=64), nullable=True),
+            sa.Column('product_id', sa.Integer(), nullable=True),
+            sa.Column('sku_key', sa.String(length=50), nullable=True),
+            sa.Column('part_key', sa.String(length=100), nullable=True),
+            sa.Column('serial_key', sa.String(length=100), nullable=True),
+            sa.Column('name', sa.String(length=255), nullable=True),
+            sa.Column('sku', sa.String(length=50), nullable=True),
+            sa.Column('part_number', sa.String(length=100), nullable=True),
+            sa.Column('brand', sa.String(length=100), nullable=True),
+            sa.Column('commercial_name', sa.String(length=100), nullable=True),
+            sa.Column('chassis_number', sa.String(length=100), nullable=True),
+            sa.Column('serial_no', sa.String(length=100), nullable=True),
+            sa.Column('barcode', sa.String(length=100), nullable=True),
+            sa.Column('unit', sa.String(length=50), nullable=True),
+            sa.Column('category_name', sa.String(length=100), nullable=True),
+            sa.Column('price', sa.Numeric(12, 2), nullable=True),
+            sa.Column('selling_price', sa.Numeric(12, 2), nullable=True),
+            sa.Column('purchase_price', sa.Numeric(12, 2), nullable=True),
+            sa.Column('cost_before_shipping', sa.Numeric(12, 2), nullable=True),
+            sa.Column('cost_after_shipping', sa.Numeric(12, 2), nullable=True),
+            sa.Column('unit_price_before_tax', sa.Numeric(12, 2), nullable=True),
+            sa.Column('min_price', sa.Numeric(12, 2), nullable=True),
+            sa.Column('max_price', sa.Numeric(12, 2), nullable=True),
+            sa.Column('tax_rate', sa.Numeric(5, 2), nullable=True),
+            sa.Column('min_qty', sa.Integer(), nullable=True),
+            sa.Column('reorder_point', sa.Integer(), nullable=True),
+            sa.Column('condition', sa.String(length=20), nullable=True),
+            sa.Column('origin_country', sa.String(length=50), nullable=True),
+            sa.Column('warranty_period', sa.Integer(), nullable=True),
+            sa.Column('weight', sa.Numeric(10, 2), nullable=True),
+            sa.Column('dimensions', sa.String(length=50), nullable=True),
+            sa.Column('image', sa.String(length=255), nullable=True),
+            sa.Column('online_price', sa.Numeric(12, 2), nullable=True),
+            sa.Column('online_image', sa.String(length=255), nullable=True),
+            sa.Column('quantity', sa.Integer(), nullable=False, server_default='0'),
+            sa.Column('stock_before', sa.Integer(), nullable=True),
+            sa.ForeignKeyConstraint(['run_id'], ['import_runs.id'], ondelete='CASCADE'),
+            sa.PrimaryKeyConstraint('id'),
+        )
+        op.create_index('ix_import_staging_run_row', 'product_import_staging', ['run_id', 'rownum'])
+        op.create_index('ix_import_staging_run_product', 'product_import_staging', ['run_id', 'product_id'])
+
+
+def downgrade():
+    bind = op.get_bind()
+    inspector = inspect(bind)
+    tables = inspector.get_table_names()
+
+    if 'product_import_staging' in tables:
+        op.drop_index('ix_import_staging_run_product', table_name='product_import_staging')
+        op.drop_index('ix_import_staging_run_row', table_name='product_import_staging')
+        op.drop_table('product_import_staging')
+
+    if 'import_runs' in tables:
+        existing_cols = {col['name'] for col in inspector.get_columns('import_runs')}
+        with op.batch_alter_table('import_runs') as batch_op:
+            if 'status' in existing_cols:
+                batch_op.drop_index('ix_import_runs_status')
+                batch_op.drop_column('status')
+            for name in ('stage', 'processed', 'finished_at'):
+                if name in existing_cols:
+                    batch_op.drop_column(name)
@@ -0,0 +1,76 @@
+"""product stock totals per product
+
+Revision ID: 20251202_product_stock_totals
+Revises: 20251201_product_import_staging
+Create Date: 2025-12-02 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy import inspect
+
+
+revision = '20251202_product_stock_totals'
+down_revision = '20251201_product_import_staging'
+branch_labels = None
+depends_on = None
+
+
+TYPE_COLUMNS = {
+    'MAIN': 'main_qty',
+    'PARTNER': 'partner_qty',
+    'EXCHANGE': 'exchange_qty',
+    'ONLINE': 'online_qty',
+    'INVENTORY': 'inventory_qty',
+}
+
+
+def upgrade():
+    bind = op.get_bind()
+    inspector = inspect(bind)
+    tables = inspector.get_table_names()
+
+    if 'product_stock_totals' not in tables:
+        op.create_table(
+            'product_stock_totals',
+            sa.Column('product_id', sa.Integer(), nullable=False),
+            sa.Column('on_hand', sa.Integer(), nullable=False, server_default='0'),
+            sa.Column('reserved', sa.Integer(), nullable=False, server_default='0'),
+            sa.Column('available', sa.Integer(), nullable=False, server_default='0'),
+            *[sa.Column(col, sa.Integer(), nullable=False, server_default='0') for col in TYPE_COLUMNS.values()],
+            sa.Column('warehouses_count', sa.Integer(), nullable=False, server_default='0'),
+            sa.Column('updated_at', sa.DateTime(), nullable=False, server_default=sa.func.now()),
+            sa.ForeignKeyConstraint(['product_id'], ['products.id'], ondelete='CASCADE'),
+            sa.PrimaryKeyConstraint('product_id'),
+        )
+        op.create_index('ix_product_stock_totals_on_hand', 'product_stock_totals', ['on_hand'])
+
+    if 'stock_levels' not in tables or 'warehouses' not in tables:
+        return
+
+    # تعبئة أولية من مستويات المخزون الحالية
+    by_type = ", ".join(
+        f"SUM(CASE WHEN w.warehouse_type = '{wtype}' THEN COALESCE(s.quantity, 0) ELSE 0 END)"
+        for wtype in TYPE_COLUMNS
+    )
+    bind.execute(sa.text("DELETE FROM product_stock_totals"))
+    bind.execute(sa.text(
+        "INSERT INTO product_stock_totals (product_id, on_hand, reserved, available, "
+        f"{', '.join(TYPE_COLUMNS.values())}, warehouses_count, updated_at) "
+        "SELECT s.product_id, SUM(COALESCE(s.quantity, 0)), SUM(COALESCE(s.reserved_quantity, 0)), "
+        "SUM(CASE WHEN COALESCE(s.quantity, 0) > COALESCE(s.reserved_quantity, 0) "
+        "THEN COALESCE(s.quantity, 0) - COALESCE(s.reserved_quantity, 0) ELSE 0 END), "
+        f"{by_type}, SUM(CASE WHEN COALESCE(s.quantity, 0) > 0 THEN 1 ELSE 0 END), CURRENT_TIMESTAMP "
+        "FROM stock_levels s LEFT JOIN warehouses w ON w.id = s.warehouse_id "
+        "JOIN products p ON p.id = s.product_id "
+        "GROUP BY s.product_id"
+    ))
+
+
+def downgrade():
+    bind = op.get_bind()
+    inspector = inspect(bind)
+
+    if 'product_stock_totals' in inspector.get_table_names():
+        op.drop_index('ix_product_stock_totals_on_hand', table_name='product_stock_totals')
+        op.drop_table('product_stock_totals')
@@ -0,0 +1,52 @@
+"""reseed notification unread counters
+
+العدّادات صارت تشمل الإشعارات المنتهية الصلاحية حتى يحذفها التنظيف؛
+يُعاد بناؤها هنا من جدول الإشعارات، فقراءة العدد لا تكتب شيئاً بعدها.
+
+Revision ID: 20251203_reseed_notification_counters
+Revises: 20251202_product_stock_totals
+Create Date: 2025-12-03 00:00:00.000000
+
+"""
+from datetime import datetime
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy import inspect
+
+
+revision = '20251203_reseed_notification_counters'
+down_revision = '20251202_product_stock_totals'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    bind = op.get_bind()
+    tables = inspect(bind).get_table_names()
+    if 'notification_unread_counters' not in tables:
+        return
+    op.execute("DELETE FROM notification_unread_counters")
+    if 'notifications' not in tables or 'notification_broadcast_reads' not in tables:
+        return
+    params = {"f": False, "t": datetime.utcnow()}
+    bind.execute(sa.text(
+        "INSERT INTO notification_unread_counters (user_id, unread_count, broadcast_read_count, updated_at) "
+        "SELECT 0, COUNT(*), 0, :t FROM notifications WHERE user_id IS NULL AND is_read = :f"
+    ), params)
+    bind.execute(sa.text(
+        "INSERT INTO notification_unread_counters (user_id, unread_count, broadcast_read_count, updated_at) "
+        "SELECT k.uid, "
+        "(SELECT COUNT(*) FROM notifications n WHERE n.user_id = k.uid AND n.is_read = :f), "
+        "(SELECT COUNT(*) FROM notification_broadcast_reads r JOIN notifications n ON n.id = r.notification_id "
+        " WHERE r.user_id = k.uid AND n.is_read = :f), "
+        ":t "
+        "FROM (SELECT user_id AS uid FROM notifications WHERE user_id IS NOT NULL "
+        "      UNION SELECT user_id FROM notification_broadcast_reads) k"
+    ), params)
+
+
+def downgrade():
+    bind = op.get_bind()
+    if 'notification_unread_counters' in inspect(bind).get_table_names():
+        op.execute("DELETE FROM notification_unread_counters")
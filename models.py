@@ -804,6 +804,90 @@ class SystemSettings(db.Model):
         return setting
 
 
+class SchedulerLease(db.Model):
+    """عقد قيادة (lease) لاختيار عملية واحدة تنفذ المهام المجدولة"""
+    __tablename__ = "scheduler_leases"
+
+    name = db.Column(db.String(64), primary_key=True)
+    owner = db.Column(db.String(128), nullable=False)
+    acquired_at = db.Column(db.DateTime, nullable=False)
+    renewed_at = db.Column(db.DateTime, nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+
+
+class SchedulerJobRun(db.Model):
+    """سجل تشغيل المهام المجدولة (المدة والحالة) ومنع التداخل"""
+    __tablename__ = "scheduler_job_runs"
+
+    id = db.Column(db.Integer, primary_key=True)
+    job_id = db.Column(db.String(100), nullable=False)
+    owner = db.Column(db.String(128), nullable=False)
+    status = db.Column(db.String(20), nullable=False, default="RUNNING", index=True)  # RUNNING, SUCCESS, FAILED, SKIPPED
+    started_at = db.Column(db.DateTime, nullable=False, index=True)
+    finished_at = db.Column(db.DateTime)
+    duration_ms = db.Column(db.Integer)
+    error = db.Column(db.Text)
+
+    __table_args__ = (
+        db.Index("ix_scheduler_job_runs_job_started", "job_id", "started_at"),
+    )
+
+
+class CostLayer(db.Model):
+    """طبقة تكلفة واردة (وصول شحنة، توريد، عكس صرف) تُستهلك بالترتيب عند الصرف"""
+    __tablename__ = "cost_layers"
+
+    id = db.Column(db.Integer, primary_key=True)
+    product_id = db.Column(db.Integer, db.ForeignKey("products.id", ondelete="CASCADE"), nullable=False, index=True)
+    source_type = db.Column(db.String(30), nullable=False)  # SHIPMENT_ITEM, EXCHANGE, REVERSAL
+    source_id = db.Column(db.Integer)
+    received_at = db.Column(db.DateTime, nullable=False)
+    qty_in = db.Column(db.Integer, nullable=False)
+    qty_remaining = db.Column(db.Integer, nullable=False)
+    unit_cost = db.Column(db.Numeric(14, 4), nullable=False, default=0)  # بالشيكل
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.Index("ix_cost_layers_product_open", "product_id", "qty_remaining", "received_at"),
+        db.Index("ix_cost_layers_source", "source_type", "source_id"),
+    )
+
+
+class CogsEntry(db.Model):
+    """تكلفة مجمّدة لكل بند صادر (بند بيع، قطعة صيانة، بند تسوية) تُحدد عند الترحيل"""
+    __tablename__ = "cogs_entries"
+
+    id = db.Column(db.Integer, primary_key=True)
+    source_type = db.Column(db.String(30), nullable=False)  # SALE_LINE, SERVICE_PART, STOCK_ADJUSTMENT_ITEM
+    source_id = db.Column(db.Integer, nullable=False)
+    document_type = db.Column(db.String(30), nullable=False)  # SALE, SERVICE, STOCK_ADJUSTMENT
+    document_id = db.Column(db.Integer, nullable=False)
+    product_id = db.Column(db.Integer, db.ForeignKey("products.id", ondelete="CASCADE"), nullable=False, index=True)
+    quantity = db.Column(db.Integer, nullable=False)
+    unit_cost = db.Column(db.Numeric(14, 4), nullable=False, default=0)
+    total_cost = db.Column(db.Numeric(14, 2), nullable=False, default=0)
+    method = db.Column(db.String(10), nullable=False)  # FIFO, AVERAGE
+    cost_source = db.Column(db.String(30), nullable=False)  # layers, purchase_price, ..., estimated_70%, missing
+    posted_at = db.Column(db.DateTime, nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.UniqueConstraint("source_type", "source_id", name="uq_cogs_entries_source"),
+        db.Index("ix_cogs_entries_document", "document_type", "document_id"),
+        db.Index("ix_cogs_entries_doc_posted", "document_type", "posted_at"),
+    )
+
+
+class DocumentSequence(db.Model):
+    """آخر رقم مُصدر لكل نوع مستند في كل فترة (يوم/شهر) - يُزاد ذرياً"""
+    __tablename__ = "document_sequences"
+
+    doc_type = db.Column(db.String(20), primary_key=True)  # SAL, PMT, SRV, AZD, SS, ...
+    period = db.Column(db.String(10), primary_key=True)  # 20251128 أو 202511
+    last_value = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+
 class NotificationLog(db.Model):
     """سجل الإشعارات - Email & SMS"""
     __tablename__ = "notification_logs"
@@ -1003,6 +1087,30 @@ class ExchangeRate(db.Model):
         db.UniqueConstraint("base_code", "quote_code", "valid_from", name="uq_fx_pair_from"),
     )
 
+@event.listens_for(ExchangeRate, "after_insert")
+@event.listens_for(ExchangeRate, "after_update")
+@event.listens_for(ExchangeRate, "after_delete")
+def _exchange_rate_invalidate_snapshot(mapper, connection, target: "ExchangeRate"):
+    # الإبطال بعد commit فقط؛ قبله قد تُعيد عملية أخرى تحميل الأسعار القديمة وتحتفظ بها حتى FX_SNAPSHOT_TTL
+    session = object_session(target)
+    if session is None:
+        from services.fx_snapshot import fx_snapshot
+        fx_snapshot.invalidate()
+        return
+    session.info["_fx_snapshot_dirty"] = True
+
+
+@event.listens_for(_SA_Session, "after_commit")
+def _exchange_rate_snapshot_after_commit(session):
+    if session.info.pop("_fx_snapshot_dirty", None):
+        from services.fx_snapshot import fx_snapshot
+        fx_snapshot.invalidate()
+
+
+@event.listens_for(_SA_Session, "after_rollback")
+def _exchange_rate_snapshot_after_rollback(session):
+    session.info.pop("_fx_snapshot_dirty", None)
+
 def _currency_codes_from_db() -> set[str]:
     try:
         rows = db.session.query(Currency.code).filter(Currency.is_active.is_(True)).all()
@@ -1335,6 +1443,11 @@ def auto_update_missing_rates():
             'message': 'فشل في التحديث التلقائي'
         }
 
+def _flush_fx_rate(connection, base: str, quote: str) -> dict:
+    """سعر الصرف لمستمعي before_insert/before_update من لقطة الأسعار (services.fx_snapshot)"""
+    from services.fx_snapshot import snapshot_rate
+    return snapshot_rate(base, quote, connection=connection)
+
 def get_fx_rate_with_fallback(base: str, quote: str, at: datetime | None = None) -> dict:
     """الحصول على سعر الصرف مع معلومات المصدر والبديل الذكي - يدوي أولاً، ثم أونلاين"""
     try:
@@ -2689,9 +2802,8 @@ class SupplierSettlement(db.Model, TimestampMixin, AuditMixin):
     def ensure_code(self):
         if self.code:
             return
-        prefix = datetime.now(timezone.utc).strftime("SS-%Y%m")
-        cnt = db.session.query(func.count(SupplierSettlement.id)).filter(SupplierSettlement.code.like(f"{prefix}-%")).scalar() or 0
-        self.code = f"{prefix}-{cnt + 1:04d}"
+        from services.document_numbers import next_number
+        self.code = next_number(db.session.connection(), "SS")
 
     def mark_confirmed(self):
         self.status = SupplierSettlementStatus.CONFIRMED.value
@@ -2807,9 +2919,8 @@ def _ss_before_insert(_m, _c, t: SupplierSettlement):
     t.status = getattr(t.status, "value", t.status)
     t.mode = getattr(t.mode, "value", t.mode)
     if not t.code:
-        prefix = datetime.now(timezone.utc).strftime("SS-%Y%m")
-        cnt = db.session.query(func.count(SupplierSettlement.id)).filter(SupplierSettlement.code.like(f"{prefix}-%")).scalar() or 0
-        t.code = f"{prefix}-{cnt + 1:04d}"
+        from services.document_numbers import next_number
+        t.code = next_number(_c, "SS")
 
 @event.listens_for(SupplierSettlement, "before_update")
 def _ss_before_update(_m, connection, t: SupplierSettlement):
@@ -3295,9 +3406,8 @@ class PartnerSettlement(db.Model, TimestampMixin, AuditMixin):
     def ensure_code(self):
         if self.code:
             return
-        prefix = datetime.now(timezone.utc).strftime("PS-%Y%m")
-        cnt = db.session.query(func.count(PartnerSettlement.id)).filter(PartnerSettlement.code.like(f"{prefix}-%")).scalar() or 0
-        self.code = f"{prefix}-{cnt + 1:04d}"
+        from services.document_numbers import next_number
+        self.code = next_number(db.session.connection(), "PS")
 
     def mark_confirmed(self):
         self.status = PartnerSettlementStatus.CONFIRMED.value
@@ -4199,6 +4309,13 @@ def _enforce_single_online_default(mapper, connection, target):
     except Exception:
         pass
 
+@event.listens_for(Warehouse, "after_update")
+def _stock_totals_warehouse_type(mapper, connection, target):
+    from sqlalchemy.orm.attributes import get_history
+    if get_history(target, "warehouse_type").has_changes():
+        from services.stock_totals import refresh_warehouse
+        refresh_warehouse(connection, target.id)
+
 class StockLevel(db.Model, TimestampMixin):
     __tablename__ = 'stock_levels'
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
@@ -4260,6 +4377,45 @@ class StockLevel(db.Model, TimestampMixin):
     def last_updated(self): return self.updated_at
     def __repr__(self): return f"<StockLevel P{self.product_id} W{self.warehouse_id} Q{self.quantity} R{self.reserved_quantity}>"
 
+class ProductStockTotal(db.Model):
+    """إجمالي مخزون المنتج عبر كل المستودعات - يُحدَّث مع كل تعديل على stock_levels"""
+    __tablename__ = "product_stock_totals"
+    product_id = db.Column(db.Integer, db.ForeignKey("products.id", ondelete="CASCADE"), primary_key=True)
+    on_hand = db.Column(db.Integer, nullable=False, default=0, server_default=sa_text("0"))
+    reserved = db.Column(db.Integer, nullable=False, default=0, server_default=sa_text("0"))
+    available = db.Column(db.Integer, nullable=False, default=0, server_default=sa_text("0"))
+    main_qty = db.Column(db.Integer, nullable=False, default=0, server_default=sa_text("0"))
+    partner_qty = db.Column(db.Integer, nullable=False, default=0, server_default=sa_text("0"))
+    exchange_qty = db.Column(db.Integer, nullable=False, default=0, server_default=sa_text("0"))
+    online_qty = db.Column(db.Integer, nullable=False, default=0, server_default=sa_text("0"))
+    inventory_qty = db.Column(db.Integer, nullable=False, default=0, server_default=sa_text("0"))
+    warehouses_count = db.Column(db.Integer, nullable=False, default=0, server_default=sa_text("0"))
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    __table_args__ = (
+        db.Index("ix_product_stock_totals_on_hand", "on_hand"),
+    )
+    def __repr__(self) -> str:
+        return f"<ProductStockTotal P{self.product_id} on={self.on_hand} res={self.reserved}>"
+
+
+@event.listens_for(StockLevel, "after_insert")
+@event.listens_for(StockLevel, "after_delete")
+def _stock_totals_refresh(mapper, connection, target: "StockLevel"):
+    from services.stock_totals import refresh_products
+    refresh_products(connection, [target.product_id])
+
+
+@event.listens_for(StockLevel, "after_update")
+def _stock_totals_refresh_update(mapper, connection, target: "StockLevel"):
+    from sqlalchemy.orm.attributes import get_history
+    from services.stock_totals import refresh_products
+
+    changed = [get_history(target, attr) for attr in ("product_id", "warehouse_id", "quantity", "reserved_quantity")]
+    if not any(h.has_changes() for h in changed):
+        return
+    refresh_products(connection, [target.product_id, *changed[0].deleted])
+
+
 class ImportRun(db.Model, TimestampMixin):
     __tablename__ = "import_runs"
     id = db.Column(db.Integer, primary_key=True)
@@ -4276,12 +4432,64 @@ class ImportRun(db.Model, TimestampMixin):
     report_path = db.Column(db.String(255))
     notes = db.Column(db.String(255))
     meta = db.Column(db.JSON, default=dict)
+    status = db.Column(db.String(20), nullable=False, default="DONE", server_default=sa_text("'DONE'"), index=True)  # QUEUED, RUNNING, DONE, FAILED
+    stage = db.Column(db.String(20))  # read, match, apply, report
+    processed = db.Column(db.Integer, nullable=False, default=0, server_default=sa_text("0"))
+    finished_at = db.Column(db.DateTime)
     warehouse = db.relationship("Warehouse", backref=db.backref("import_runs", lazy="dynamic"))
     user = db.relationship("User", backref=db.backref("import_runs", lazy="dynamic"))
     __table_args__ = ()
     def __repr__(self) -> str:
         return f"<ImportRun id={self.id} wh={self.warehouse_id} dry={self.dry_run} ins={self.inserted} upd={self.updated} skp={self.skipped} err={self.errors}>"
 
+class ProductImportStaging(db.Model):
+    """صفوف ملف الاستيراد بعد التحقق - تُطابق وتُرحّل إلى products/stock_levels بعبارات مجمّعة ثم تُحذف"""
+    __tablename__ = "product_import_staging"
+    id = db.Column(db.Integer, primary_key=True)
+    run_id = db.Column(db.Integer, db.ForeignKey("import_runs.id", ondelete="CASCADE"), nullable=False)
+    rownum = db.Column(db.Integer, nullable=False)
+    action = db.Column(db.String(10))  # insert, update, skip, error
+    note = db.Column(db.String(64))
+    product_id = db.Column(db.Integer)
+    sku_key = db.Column(db.String(50))
+    part_key = db.Column(db.String(100))
+    serial_key = db.Column(db.String(100))
+    name = db.Column(db.String(255))
+    sku = db.Column(db.String(50))
+    part_number = db.Column(db.String(100))
+    brand = db.Column(db.String(100))
+    commercial_name = db.Column(db.String(100))
+    chassis_number = db.Column(db.String(100))
+    serial_no = db.Column(db.String(100))
+    barcode = db.Column(db.String(100))
+    unit = db.Column(db.String(50))
+    category_name = db.Column(db.String(100))
+    price = db.Column(db.Numeric(12, 2))
+    selling_price = db.Column(db.Numeric(12, 2))
+    purchase_price = db.Column(db.Numeric(12, 2))
+    cost_before_shipping = db.Column(db.Numeric(12, 2))
+    cost_after_shipping = db.Column(db.Numeric(12, 2))
+    unit_price_before_tax = db.Column(db.Numeric(12, 2))
+    min_price = db.Column(db.Numeric(12, 2))
+    max_price = db.Column(db.Numeric(12, 2))
+    tax_rate = db.Column(db.Numeric(5, 2))
+    min_qty = db.Column(db.Integer)
+    reorder_point = db.Column(db.Integer)
+    condition = db.Column(db.String(20))
+    origin_country = db.Column(db.String(50))
+    warranty_period = db.Column(db.Integer)
+    weight = db.Column(db.Numeric(10, 2))
+    dimensions = db.Column(db.String(50))
+    image = db.Column(db.String(255))
+    online_price = db.Column(db.Numeric(12, 2))
+    online_image = db.Column(db.String(255))
+    quantity = db.Column(db.Integer, nullable=False, default=0)
+    stock_before = db.Column(db.Integer)
+    __table_args__ = (
+        db.Index("ix_import_staging_run_row", "run_id", "rownum"),
+        db.Index("ix_import_staging_run_product", "run_id", "product_id"),
+    )
+
 def _ensure_stock_row(connection, product_id: int, warehouse_id: int):
     row = connection.execute(sa_text("SELECT id FROM stock_levels WHERE product_id = :p AND warehouse_id = :w"), {"p": product_id, "w": warehouse_id}).first()
     if row: return row
@@ -4320,6 +4528,8 @@ def _apply_stock_delta(connection, product_id: int, warehouse_id: int, delta_qty
         if getattr(res, "rowcount", None) != 1:
             raise ValueError(f"الكمية غير كافية للمنتج {product_id} في المستودع {warehouse_id}")
     qty = connection.execute(sa_text("SELECT quantity FROM stock_levels WHERE id = :id"), {"id": sid}).scalar_one()
+    from services.stock_totals import refresh_products
+    refresh_products(connection, [product_id])
     return int(qty)
 
 def _apply_reservation_delta(connection, product_id: int, warehouse_id: int, delta_qty: int):
@@ -4331,6 +4541,8 @@ def _apply_reservation_delta(connection, product_id: int, warehouse_id: int, del
             raise ValueError("الكمية المتاحة غير كافية للحجز")
     else:
         connection.execute(sa_text("UPDATE stock_levels SET reserved_quantity = CASE WHEN reserved_quantity + :q < 0 THEN 0 ELSE reserved_quantity + :q END WHERE id = :id"), {"id": sid, "q": qv})
+    from services.stock_totals import refresh_products
+    refresh_products(connection, [product_id])
 
 class Transfer(db.Model, TimestampMixin, AuditMixin):
     __tablename__ = 'transfers'
@@ -4362,8 +4574,8 @@ class Transfer(db.Model, TimestampMixin, AuditMixin):
 @event.listens_for(Transfer, 'before_insert', propagate=True)
 def _ensure_transfer_reference(mapper, connection, target: "Transfer"):
     if getattr(target, 'reference', None): return
-    prefix = datetime.now(timezone.utc).strftime("TRF%Y%m%d"); unique = uuid.uuid4().hex[:8].upper()
-    target.reference = f"{prefix}-{unique}"
+    from services.document_numbers import next_number
+    target.reference = next_number(connection, "TRF")
 
 @event.listens_for(Transfer, "after_insert", propagate=True)
 def _transfer_after_insert(mapper, connection, target: "Transfer"):
@@ -4732,8 +4944,8 @@ _ALLOWED_PREORDER_TRANSITIONS = {"PENDING":{"CONFIRMED","CANCELLED","FULFILLED"}
 @event.listens_for(PreOrder, 'before_insert')
 def _preorder_before_insert(mapper, connection, target):
     if not getattr(target, 'reference', None):
-        prefix = datetime.now(timezone.utc).strftime("PRE%Y%m%d"); unique = uuid.uuid4().hex[:8].upper()
-        target.reference = f"{prefix}-{unique}"
+        from services.document_numbers import next_number
+        target.reference = next_number(connection, "PRE")
     target.currency = ensure_currency(target.currency or 'ILS')
 
 @event.listens_for(PreOrder, 'before_update')
@@ -4967,6 +5179,7 @@ class Sale(db.Model, TimestampMixin, AuditMixin):
         db.CheckConstraint("refunded_total >= 0", name="ck_sale_refunded_total_non_negative"),
         db.Index("ix_sales_customer_status_date", "customer_id", "status", "sale_date"),
         db.Index("ix_sales_payment_status_date", "payment_status", "sale_date"),
+        db.Index("ix_sales_status_date", "status", "sale_date"),
     )
 
     @hybrid_property
@@ -5148,9 +5361,8 @@ class Sale(db.Model, TimestampMixin, AuditMixin):
 @event.listens_for(Sale, "before_insert")
 def _sale_before_insert_ref(mapper, connection, target: "Sale"):
     if not getattr(target, "sale_number", None):
-        prefix = datetime.now(timezone.utc).strftime("SAL%Y%m%d")
-        count = connection.execute(sa_text("SELECT COUNT(*) FROM sales WHERE sale_number LIKE :pfx"), {"pfx": f"{prefix}-%"}).scalar() or 0
-        target.sale_number = f"{prefix}-{count+1:04d}"
+        from services.document_numbers import next_number
+        target.sale_number = next_number(connection, "SAL")
     
     # حفظ سعر الصرف تلقائياً للمبيعات (فقط عند الإنشاء)
     sale_currency = target.currency or "ILS"
@@ -5158,11 +5370,11 @@ def _sale_before_insert_ref(mapper, connection, target: "Sale"):
     
     if sale_currency != default_currency:
         try:
-            rate_info = get_fx_rate_with_fallback(sale_currency, default_currency)
+            rate_info = _flush_fx_rate(connection, sale_currency, default_currency)
             if rate_info and rate_info.get('success'):
                 target.fx_rate_used = Decimal(str(rate_info.get('rate', 0)))
                 target.fx_rate_source = rate_info.get('source', 'unknown')
-                target.fx_rate_timestamp = datetime.now(timezone.utc)
+                target.fx_rate_timestamp = rate_info['timestamp']
                 target.fx_base_currency = sale_currency
                 target.fx_quote_currency = default_currency
         except Exception:
@@ -5650,55 +5862,62 @@ def _recompute_sale_total_amount(connection, sale_id: int):
 @event.listens_for(SaleLine, "after_delete")
 def _sale_line_touch_sale_total(mapper, connection, target: "SaleLine"):
     sid = getattr(target, "sale_id", None)
-    if sid:
-        # تحديث أرصدة الشركاء/الموردين المرتبطين بالقطعة
-        try:
-            from sqlalchemy import text as sa_text
-            pid = getattr(target, "product_id", None)
-            if pid:
-                # تحديث أرصدة الشركاء المرتبطين بهذه القطعة
-                partner_results = connection.execute(
-                    sa_text("""
-                        SELECT DISTINCT partner_id 
-                        FROM warehouse_partner_shares 
-                        WHERE product_id = :pid
-                        UNION
-                        SELECT DISTINCT partner_id 
-                        FROM product_partners 
-                        WHERE product_id = :pid
-                    """),
-                    {"pid": pid}
-                ).fetchall()
-                
-                for partner_row in partner_results:
-                    if partner_row[0]:
-                        update_partner_balance(partner_row[0], connection)
-        except Exception as e:
-            pass
-    if sid:
-        _recompute_sale_total_amount(connection, int(sid))
-        
-        # إنشاء/تحديث GLBatch للمبيعة بعد تحديث المجموع
-        sale_data = connection.execute(
-            sa_text("""
-                SELECT id, sale_number, total_amount, status, customer_id, currency
-                FROM sales WHERE id = :id
+    if not sid:
+        return
+    pid = getattr(target, "product_id", None)
+    if _mark_parent_dirty(target, "SALE", sid):
+        if pid:
+            _mark_parent_dirty(target, "SALE_PRODUCT", pid)
+        return
+    _refresh_sale_after_lines(connection, int(sid))
+
+
+def _refresh_sale_after_lines(connection, sid: int):
+    """إعادة حساب مجموع المبيعة وقيدها المحاسبي مرة واحدة بعد تعديل بنودها"""
+    _recompute_sale_total_amount(connection, sid)
+
+    # إنشاء/تحديث GLBatch للمبيعة بعد تحديث المجموع
+    sale_data = connection.execute(
+        sa_text("""
+            SELECT id, sale_number, total_amount, status, customer_id, currency
+            FROM sales WHERE id = :id
+        """),
+        {"id": sid}
+    ).first()
+
+    if sale_data and sale_data[2] > 0 and sale_data[3] == 'CONFIRMED':  # total > 0 and CONFIRMED
+        # استدعاء _sale_gl_batch_upsert يدوياً
+        from models import Sale as SaleModel
+        sale_obj = SaleModel()
+        sale_obj.id = sale_data[0]
+        sale_obj.sale_number = sale_data[1]
+        sale_obj.total_amount = sale_data[2]
+        sale_obj.status = sale_data[3]
+        sale_obj.customer_id = sale_data[4]
+        sale_obj.currency = sale_data[5]
+
+        _sale_gl_batch_upsert(None, connection, sale_obj)
+
+
+def _queue_product_partner_balances(session, connection, product_ids):
+    """أرصدة الشركاء المرتبطين بالقطع المباعة: استعلام واحد لكل flush بدل استعلام لكل بند"""
+    if not product_ids:
+        return
+    params = {f"p{i}": int(pid) for i, pid in enumerate(sorted(product_ids))}
+    in_clause = ", ".join(f":{k}" for k in params)
+    try:
+        partner_ids = connection.execute(
+            sa_text(f"""
+                SELECT DISTINCT partner_id FROM warehouse_partner_shares WHERE product_id IN ({in_clause})
+                UNION
+                SELECT DISTINCT partner_id FROM product_partners WHERE product_id IN ({in_clause})
             """),
-            {"id": sid}
-        ).first()
-        
-        if sale_data and sale_data[2] > 0 and sale_data[3] == 'CONFIRMED':  # total > 0 and CONFIRMED
-            # استدعاء _sale_gl_batch_upsert يدوياً
-            from models import Sale as SaleModel
-            sale_obj = SaleModel()
-            sale_obj.id = sale_data[0]
-            sale_obj.sale_number = sale_data[1]
-            sale_obj.total_amount = sale_data[2]
-            sale_obj.status = sale_data[3]
-            sale_obj.customer_id = sale_data[4]
-            sale_obj.currency = sale_data[5]
-            
-            _sale_gl_batch_upsert(None, connection, sale_obj)
+            params,
+        ).scalars().all()
+    except Exception:
+        return
+    for partner_id in partner_ids:
+        _queue_partner_balance(session, partner_id)
 
 class SaleReturn(db.Model, TimestampMixin, AuditMixin):
     __tablename__ = "sale_returns"
@@ -5733,6 +5952,7 @@ class SaleReturn(db.Model, TimestampMixin, AuditMixin):
     __table_args__ = (
         db.CheckConstraint("tax_rate >= 0 AND tax_rate <= 100", name="ck_sale_return_tax_rate_0_100"),
         db.CheckConstraint("tax_amount >= 0", name="ck_sale_return_tax_non_negative"),
+        db.Index("ix_sale_returns_status_created", "status", "created_at"),
     )
 
 class SaleReturnLine(db.Model):
@@ -6126,11 +6346,11 @@ def _invoice_normalize_and_total_insert(mapper, connection, target: "Invoice"):
     
     if invoice_currency != default_currency:
         try:
-            rate_info = get_fx_rate_with_fallback(invoice_currency, default_currency)
+            rate_info = _flush_fx_rate(connection, invoice_currency, default_currency)
             if rate_info and rate_info.get('success'):
                 target.fx_rate_used = Decimal(str(rate_info.get('rate', 0)))
                 target.fx_rate_source = rate_info.get('source', 'unknown')
-                target.fx_rate_timestamp = datetime.now(timezone.utc)
+                target.fx_rate_timestamp = rate_info['timestamp']
                 target.fx_base_currency = invoice_currency
                 target.fx_quote_currency = default_currency
         except Exception:
@@ -6416,10 +6636,14 @@ def _invoice_gl_batch_upsert(mapper, connection, target: "Invoice"):
 @event.listens_for(InvoiceLine, "after_update")
 @event.listens_for(InvoiceLine, "after_delete")
 def _inv_line_touch_invoice(mapper, connection, target: "InvoiceLine"):
-    """عند تعديل بنود الفاتورة: إعادة حساب المجموع + إنشاء GLBatch"""
-    if target.invoice_id:
-        invoice_id = int(target.invoice_id)
-        
+    """عند تعديل بنود الفاتورة: تُعلَّم الفاتورة وتُعالج مرة واحدة في after_flush"""
+    if target.invoice_id and not _mark_parent_dirty(target, "INVOICE", target.invoice_id):
+        _refresh_invoice_after_lines(connection, int(target.invoice_id))
+
+
+def _refresh_invoice_after_lines(connection, invoice_id: int):
+    """إعادة حساب المجموع + إنشاء GLBatch"""
+    if invoice_id:
         # 1. إعادة حساب المجموع
         _recompute_invoice_totals(connection, invoice_id)
         
@@ -6679,6 +6903,7 @@ class Payment(db.Model, TimestampMixin):
         db.Index("ix_pay_direction", "direction"),
         db.Index("ix_pay_currency", "currency"),
         db.Index("ix_pay_created_at", "payment_date"),
+        db.Index("ix_pay_status_date", "status", "payment_date"),
     )
 
     @property
@@ -7296,7 +7521,7 @@ def _payment_create_check_auto(mapper, connection, target: "Payment"):
             "created_at": datetime.now(timezone.utc),
             "updated_at": datetime.now(timezone.utc),
         }
-        check_values.update(_compute_issue_fx_fields(check_currency))
+        check_values.update(_compute_issue_fx_fields(check_currency, connection))
 
         connection.execute(Check.__table__.insert().values(**check_values))
         
@@ -7398,39 +7623,8 @@ class PaymentSplit(db.Model):
 
 
 def _next_payment_number(connection) -> str:
-    prefix = datetime.now(timezone.utc).strftime("PMT%Y%m%d")
-    # استخدام MAX بدلاً من COUNT لتجنب التكرار
-    result = connection.execute(
-        sa_text("SELECT payment_number FROM payments WHERE payment_number LIKE :pfx ORDER BY payment_number DESC LIMIT 1"), 
-        {"pfx": f"{prefix}-%"}
-    ).scalar()
-    
-    if result:
-        # استخراج الرقم الأخير وزيادته
-        try:
-            last_num = int(result.split('-')[-1])
-            next_num = last_num + 1
-        except (ValueError, IndexError):
-            next_num = 1
-    else:
-        next_num = 1
-    
-    # محاولة إنشاء رقم فريد، وفي حالة الفشل نحاول حتى نجد رقم متاح
-    max_attempts = 100
-    for attempt in range(max_attempts):
-        candidate = f"{prefix}-{next_num:04d}"
-        # التحقق من عدم وجود الرقم
-        exists = connection.execute(
-            sa_text("SELECT 1 FROM payments WHERE payment_number = :num LIMIT 1"),
-            {"num": candidate}
-        ).scalar()
-        if not exists:
-            return candidate
-        next_num += 1
-    
-    # في حالة الفشل، استخدم timestamp
-    import time
-    return f"{prefix}-{int(time.time() * 1000) % 10000:04d}"
+    from services.document_numbers import next_number
+    return next_number(connection, "PMT")
 
 
 @event.listens_for(Payment, "before_insert")
@@ -7474,11 +7668,11 @@ def _payment_before_insert(mapper, connection, target: "Payment"):
     
     if payment_currency != default_currency:
         try:
-            rate_info = get_fx_rate_with_fallback(payment_currency, default_currency)
+            rate_info = _flush_fx_rate(connection, payment_currency, default_currency)
             if rate_info and rate_info.get('success'):
                 target.fx_rate_used = Decimal(str(rate_info.get('rate', 0)))
                 target.fx_rate_source = rate_info.get('source', 'unknown')
-                target.fx_rate_timestamp = datetime.now(timezone.utc)
+                target.fx_rate_timestamp = rate_info['timestamp']
                 target.fx_base_currency = payment_currency
                 target.fx_quote_currency = default_currency
         except Exception:
@@ -7709,17 +7903,28 @@ def _payment_split_create_check_auto(mapper, connection, target: "PaymentSplit")
 @event.listens_for(PaymentSplit, "after_update")
 def _payment_split_gl_batch_upsert(mapper, connection, target: "PaymentSplit"):
     """✅ إنشاء/تحديث GLBatch لكل split منفصلاً - كل split يُعامل كدفعة مستقلة"""
+    if target.payment_id and _mark_parent_dirty(target, "PAYMENT_SPLIT", target.payment_id, member=target):
+        return
+    _post_payment_split_gl(connection, target)
+
+
+def _fetch_split_payment_row(connection, payment_id):
+    return connection.execute(
+        sa_text("""
+            SELECT id, payment_number, payment_date, currency, direction, status,
+                   customer_id, supplier_id, partner_id, entity_type, expense_id, created_by
+            FROM payments 
+            WHERE id = :pid
+        """),
+        {"pid": payment_id}
+    ).mappings().first()
+
+
+def _post_payment_split_gl(connection, target: "PaymentSplit", payment_row=None):
     try:
-        # جلب معلومات الدفعة الأصلية
-        payment_row = connection.execute(
-            sa_text("""
-                SELECT id, payment_number, payment_date, currency, direction, status,
-                       customer_id, supplier_id, partner_id, entity_type, expense_id, created_by
-                FROM payments 
-                WHERE id = :pid
-            """),
-            {"pid": target.payment_id}
-        ).mappings().first()
+        # جلب معلومات الدفعة الأصلية (مرة واحدة لكل دفعة عند المعالجة المجمعة)
+        if payment_row is None:
+            payment_row = _fetch_split_payment_row(connection, target.payment_id)
         
         if not payment_row:
             return
@@ -8395,7 +8600,7 @@ def _allocate_landed_costs(shp: "Shipment"):
 @event.listens_for(Shipment, "before_insert")
 def _shipment_before_insert(mapper, connection, target: "Shipment"):
     if not getattr(target, "shipment_number", None) and not getattr(target, "number", None):
-        import hashlib
+        from services.document_numbers import next_number
         
         # نظام تسلسل ذكي عصري عالمي مثل FedEx/DHL/UPS
         # التنسيق: AZD-YYYYMMDD-XXXX-CCC
@@ -8403,28 +8608,7 @@ def _shipment_before_insert(mapper, connection, target: "Shipment"):
         # YYYYMMDD = التاريخ
         # XXXX = رقم تسلسلي يومي (hexadecimal)
         # CCC = checksum للتحقق
-        
-        now = datetime.now(timezone.utc)
-        date_part = now.strftime("%Y%m%d")
-        
-        # حساب العدد اليومي
-        today_start = now.replace(hour=0, minute=0, second=0, microsecond=0)
-        count = connection.execute(
-            sa_text("SELECT COUNT(*) FROM shipments WHERE shipment_date >= :start"),
-            {"start": today_start},
-        ).scalar() or 0
-        
-        # رقم تسلسلي hexadecimal (أكثر احترافية وأقصر)
-        seq_hex = format(count + 1, '04X')  # 0001, 0002, ..., FFFF
-        
-        # بناء الرقم الأساسي
-        base_number = f"AZD-{date_part}-{seq_hex}"
-        
-        # حساب checksum (آخر 3 أحرف من hash)
-        hash_value = hashlib.md5(base_number.encode()).hexdigest()[:3].upper()
-        
-        # الرقم النهائي
-        tracking_number = f"{base_number}-{hash_value}"
+        tracking_number = next_number(connection, "AZD")
         
         target.shipment_number = tracking_number
         target.number = tracking_number
@@ -9187,12 +9371,8 @@ def _srv_enforce_transitions(mapper, connection, target: ServiceRequest):
 def _ensure_service_number(mapper, connection, target: ServiceRequest):
     if getattr(target, "service_number", None):
         return
-    prefix = datetime.now(timezone.utc).strftime("SRV%Y%m%d")
-    cnt = connection.execute(
-        sa_text("SELECT COUNT(*) FROM service_requests WHERE service_number LIKE :pfx"),
-        {"pfx": f"{prefix}-%"},
-    ).scalar() or 0
-    target.service_number = f"{prefix}-{cnt + 1:04d}"
+    from services.document_numbers import next_number
+    target.service_number = next_number(connection, "SRV")
 
 @event.listens_for(ServiceRequest.status, "set")
 def _set_completed_at_on_status_change(target, value, oldvalue, initiator):
@@ -9553,35 +9733,30 @@ class ServiceTask(db.Model, TimestampMixin):
     def __repr__(self):
         return f"<ServiceTask {self.description} for Service {self.service_id}>"
 
+def _service_line_touch(target):
+    sid = getattr(target, "service_id", None) or getattr(getattr(target, "request", None), "id", None)
+    if not _mark_parent_dirty(target, "SERVICE", sid) and target.request:
+        _recalc_service_request_totals(target.request)
+    if getattr(target, "partner_id", None):
+        _queue_partner_balance(target, target.partner_id)
+
 @event.listens_for(ServicePart, "after_insert")
 def _sp_after_insert(mapper, connection, target: ServicePart):
-    if target and target.request:
-        _recalc_service_request_totals(target.request)
-    if hasattr(target, 'partner_id') and target.partner_id:
-        update_partner_balance(target.partner_id, connection)
+    _service_line_touch(target)
 
 @event.listens_for(ServicePart, "after_update")
 def _sp_after_update(mapper, connection, target: ServicePart):
-    if target and target.request:
-        _recalc_service_request_totals(target.request)
-    if hasattr(target, 'partner_id') and target.partner_id:
-        update_partner_balance(target.partner_id, connection)
+    _service_line_touch(target)
 
 @event.listens_for(ServicePart, "after_delete")
 def _sp_after_delete(mapper, connection, target: ServicePart):
-    if target and target.request:
-        _recalc_service_request_totals(target.request)
-    if hasattr(target, 'partner_id') and target.partner_id:
-        update_partner_balance(target.partner_id, connection)
+    _service_line_touch(target)
 
 @event.listens_for(ServiceTask, "after_insert")
 @event.listens_for(ServiceTask, "after_update")
 @event.listens_for(ServiceTask, "after_delete")
 def _st_sync_totals(mapper, connection, target: ServiceTask):
-    if target and target.request:
-        _recalc_service_request_totals(target.request)
-    if hasattr(target, 'partner_id') and target.partner_id:
-        update_partner_balance(target.partner_id, connection)
+    _service_line_touch(target)
 
 class OnlineCart(db.Model, TimestampMixin):
     __tablename__ = 'online_carts'
@@ -9636,12 +9811,8 @@ class OnlineCart(db.Model, TimestampMixin):
 @event.listens_for(OnlineCart, 'before_insert')
 def _cart_before_insert(mapper, connection, target: 'OnlineCart'):
     if not getattr(target, 'cart_id', None):
-        prefix = datetime.now(timezone.utc).strftime("CRT%Y%m%d")
-        count = connection.execute(
-            sa_text("SELECT COUNT(*) FROM online_carts WHERE cart_id LIKE :pfx"),
-            {"pfx": f"{prefix}-%"},
-        ).scalar() or 0
-        target.cart_id = f"{prefix}-{count+1:04d}"
+        from services.document_numbers import next_number
+        target.cart_id = next_number(connection, "CRT")
     if not getattr(target, 'expires_at', None):
         target.expires_at = datetime.now(timezone.utc) + timedelta(days=7)
 
@@ -9826,12 +9997,8 @@ class OnlinePreOrder(db.Model, TimestampMixin):
 @event.listens_for(OnlinePreOrder, 'before_insert')
 def _op_before_insert(mapper, connection, target: 'OnlinePreOrder'):
     if not getattr(target, 'order_number', None):
-        prefix = datetime.now(timezone.utc).strftime("OPR%Y%m%d")
-        count = connection.execute(
-            sa_text("SELECT COUNT(*) FROM online_preorders WHERE order_number LIKE :pfx"),
-            {"pfx": f"{prefix}-%"},
-        ).scalar() or 0
-        target.order_number = f"{prefix}-{count + 1:04d}"
+        from services.document_numbers import next_number
+        target.order_number = next_number(connection, "OPR")
 
     if not getattr(target, 'warehouse_id', None):
         tval = WarehouseType.ONLINE.value
@@ -10253,12 +10420,8 @@ def _opay_touch_order(mapper, connection, target: "OnlinePayment"):
 @event.listens_for(OnlinePayment, "before_insert")
 def _opay_before_insert(mapper, connection, target: "OnlinePayment"):
     if not getattr(target, "payment_ref", None):
-        prefix = datetime.now(timezone.utc).strftime("OPAY%Y%m%d")
-        count = connection.execute(
-            sa_text("SELECT COUNT(*) FROM online_payments WHERE payment_ref LIKE :pfx"),
-            {"pfx": f"{prefix}-%"},
-        ).scalar() or 0
-        target.payment_ref = f"{prefix}-{count+1:04d}"
+        from services.document_numbers import next_number
+        target.payment_ref = next_number(connection, "OPAY")
     target.currency = ensure_currency(target.currency or "ILS")
     st = (target.status or "").upper()
     if st in ("SUCCESS", "FAILED", "REFUNDED") and not target.processed_at:
@@ -10417,7 +10580,7 @@ def _sa_sync_expense_amount(mapper, connection, target: StockAdjustment):
 def _sai_after_insert(mapper, connection, target: StockAdjustmentItem):
     if target.warehouse_id:
         _apply_stock_delta(connection, target.product_id, target.warehouse_id, -int(target.quantity or 0))
-    if target.adjustment_id:
+    if target.adjustment_id and not _mark_parent_dirty(target, "STOCK_ADJUSTMENT", target.adjustment_id):
         _recompute_stock_adjustment_total(connection, int(target.adjustment_id))
 
 
@@ -10425,7 +10588,7 @@ def _sai_after_insert(mapper, connection, target: StockAdjustmentItem):
 def _sai_after_delete(mapper, connection, target: StockAdjustmentItem):
     if target.warehouse_id:
         _apply_stock_delta(connection, target.product_id, target.warehouse_id, +int(target.quantity or 0))
-    if target.adjustment_id:
+    if target.adjustment_id and not _mark_parent_dirty(target, "STOCK_ADJUSTMENT", target.adjustment_id):
         _recompute_stock_adjustment_total(connection, int(target.adjustment_id))
 
 
@@ -10449,7 +10612,7 @@ def _sai_after_update(mapper, connection, target: StockAdjustmentItem):
     if new_wid:
         _apply_stock_delta(connection, int(new_pid), int(new_wid), -int(new_qty or 0))
 
-    if target.adjustment_id:
+    if target.adjustment_id and not _mark_parent_dirty(target, "STOCK_ADJUSTMENT", target.adjustment_id):
         _recompute_stock_adjustment_total(connection, int(target.adjustment_id))
 
 # ===================== ExpenseType =====================
@@ -11128,11 +11291,11 @@ def _expense_normalize_insert(mapper, connection, target: "Expense"):
     
     if expense_currency != default_currency:
         try:
-            rate_info = get_fx_rate_with_fallback(expense_currency, default_currency)
+            rate_info = _flush_fx_rate(connection, expense_currency, default_currency)
             if rate_info and rate_info.get('success'):
                 target.fx_rate_used = Decimal(str(rate_info.get('rate', 0)))
                 target.fx_rate_source = rate_info.get('source', 'unknown')
-                target.fx_rate_timestamp = datetime.now(timezone.utc)
+                target.fx_rate_timestamp = rate_info['timestamp']
                 target.fx_base_currency = expense_currency
                 target.fx_quote_currency = default_currency
         except Exception:
@@ -11412,11 +11575,11 @@ def _preorder_normalize_insert(mapper, connection, target: "PreOrder"):
     
     if preorder_currency != default_currency:
         try:
-            rate_info = get_fx_rate_with_fallback(preorder_currency, default_currency)
+            rate_info = _flush_fx_rate(connection, preorder_currency, default_currency)
             if rate_info and rate_info.get('success'):
                 target.fx_rate_used = Decimal(str(rate_info.get('rate', 0)))
                 target.fx_rate_source = rate_info.get('source', 'unknown')
-                target.fx_rate_timestamp = datetime.now(timezone.utc)
+                target.fx_rate_timestamp = rate_info['timestamp']
                 target.fx_base_currency = preorder_currency
                 target.fx_quote_currency = default_currency
         except Exception:
@@ -11439,11 +11602,11 @@ def _sale_normalize_insert(mapper, connection, target: "Sale"):
     
     if sale_currency != default_currency:
         try:
-            rate_info = get_fx_rate_with_fallback(sale_currency, default_currency)
+            rate_info = _flush_fx_rate(connection, sale_currency, default_currency)
             if rate_info and rate_info.get('success'):
                 target.fx_rate_used = Decimal(str(rate_info.get('rate', 0)))
                 target.fx_rate_source = rate_info.get('source', 'unknown')
-                target.fx_rate_timestamp = datetime.now(timezone.utc)
+                target.fx_rate_timestamp = rate_info['timestamp']
                 target.fx_base_currency = sale_currency
                 target.fx_quote_currency = default_currency
         except Exception:
@@ -11507,11 +11670,11 @@ def _sale_return_normalize_insert(mapper, connection, target: "SaleReturn"):
     
     if return_currency != default_currency:
         try:
-            rate_info = get_fx_rate_with_fallback(return_currency, default_currency)
+            rate_info = _flush_fx_rate(connection, return_currency, default_currency)
             if rate_info and rate_info.get('success'):
                 target.fx_rate_used = Decimal(str(rate_info.get('rate', 0)))
                 target.fx_rate_source = rate_info.get('source', 'unknown')
-                target.fx_rate_timestamp = datetime.now(timezone.utc)
+                target.fx_rate_timestamp = rate_info['timestamp']
                 target.fx_base_currency = return_currency
                 target.fx_quote_currency = default_currency
         except Exception:
@@ -11534,11 +11697,11 @@ def _shipment_normalize_insert(mapper, connection, target: "Shipment"):
     
     if shipment_currency != default_currency:
         try:
-            rate_info = get_fx_rate_with_fallback(shipment_currency, default_currency)
+            rate_info = _flush_fx_rate(connection, shipment_currency, default_currency)
             if rate_info and rate_info.get('success'):
                 target.fx_rate_used = Decimal(str(rate_info.get('rate', 0)))
                 target.fx_rate_source = rate_info.get('source', 'unknown')
-                target.fx_rate_timestamp = datetime.now(timezone.utc)
+                target.fx_rate_timestamp = rate_info['timestamp']
                 target.fx_base_currency = shipment_currency
                 target.fx_quote_currency = default_currency
         except Exception:
@@ -11563,11 +11726,11 @@ def _service_request_normalize_insert(mapper, connection, target: "ServiceReques
     
     if service_currency != default_currency:
         try:
-            rate_info = get_fx_rate_with_fallback(service_currency, default_currency)
+            rate_info = _flush_fx_rate(connection, service_currency, default_currency)
             if rate_info and rate_info.get('success'):
                 target.fx_rate_used = Decimal(str(rate_info.get('rate', 0)))
                 target.fx_rate_source = rate_info.get('source', 'unknown')
-                target.fx_rate_timestamp = datetime.now(timezone.utc)
+                target.fx_rate_timestamp = rate_info['timestamp']
                 target.fx_base_currency = service_currency
                 target.fx_quote_currency = default_currency
         except Exception:
@@ -11590,11 +11753,11 @@ def _online_preorder_normalize_insert(mapper, connection, target: "OnlinePreOrde
     
     if online_currency != default_currency:
         try:
-            rate_info = get_fx_rate_with_fallback(online_currency, default_currency)
+            rate_info = _flush_fx_rate(connection, online_currency, default_currency)
             if rate_info and rate_info.get('success'):
                 target.fx_rate_used = Decimal(str(rate_info.get('rate', 0)))
                 target.fx_rate_source = rate_info.get('source', 'unknown')
-                target.fx_rate_timestamp = datetime.now(timezone.utc)
+                target.fx_rate_timestamp = rate_info['timestamp']
                 target.fx_base_currency = online_currency
                 target.fx_quote_currency = default_currency
         except Exception:
@@ -11617,11 +11780,11 @@ def _online_payment_normalize_insert(mapper, connection, target: "OnlinePayment"
     
     if payment_currency != default_currency:
         try:
-            rate_info = get_fx_rate_with_fallback(payment_currency, default_currency)
+            rate_info = _flush_fx_rate(connection, payment_currency, default_currency)
             if rate_info and rate_info.get('success'):
                 target.fx_rate_used = Decimal(str(rate_info.get('rate', 0)))
                 target.fx_rate_source = rate_info.get('source', 'unknown')
-                target.fx_rate_timestamp = datetime.now(timezone.utc)
+                target.fx_rate_timestamp = rate_info['timestamp']
                 target.fx_base_currency = payment_currency
                 target.fx_quote_currency = default_currency
         except Exception:
@@ -11644,11 +11807,11 @@ def _supplier_settlement_normalize_insert(mapper, connection, target: "SupplierS
     
     if settlement_currency != default_currency:
         try:
-            rate_info = get_fx_rate_with_fallback(settlement_currency, default_currency)
+            rate_info = _flush_fx_rate(connection, settlement_currency, default_currency)
             if rate_info and rate_info.get('success'):
                 target.fx_rate_used = Decimal(str(rate_info.get('rate', 0)))
                 target.fx_rate_source = rate_info.get('source', 'unknown')
-                target.fx_rate_timestamp = datetime.now(timezone.utc)
+                target.fx_rate_timestamp = rate_info['timestamp']
                 target.fx_base_currency = settlement_currency
                 target.fx_quote_currency = default_currency
         except Exception:
@@ -11671,11 +11834,11 @@ def _partner_settlement_normalize_insert(mapper, connection, target: "PartnerSet
     
     if settlement_currency != default_currency:
         try:
-            rate_info = get_fx_rate_with_fallback(settlement_currency, default_currency)
+            rate_info = _flush_fx_rate(connection, settlement_currency, default_currency)
             if rate_info and rate_info.get('success'):
                 target.fx_rate_used = Decimal(str(rate_info.get('rate', 0)))
                 target.fx_rate_source = rate_info.get('source', 'unknown')
-                target.fx_rate_timestamp = datetime.now(timezone.utc)
+                target.fx_rate_timestamp = rate_info['timestamp']
                 target.fx_base_currency = settlement_currency
                 target.fx_quote_currency = default_currency
         except Exception:
@@ -11933,6 +12096,7 @@ class GLBatch(db.Model, TimestampMixin):
         db.UniqueConstraint("source_type", "source_id", "purpose", name="uq_gl_source_purpose"),
         db.Index("ix_gl_entity", "entity_type", "entity_id"),
         db.Index("ix_gl_status_source", "status", "source_type", "source_id"),
+        db.Index("ix_gl_source_posted", "source_type", "posted_at"),
     )
 
     @validates("currency")
@@ -12732,21 +12896,20 @@ class Check(db.Model, TimestampMixin, AuditMixin):
 
 # ==================== Event Listeners للشيكات ====================
 
-def _compute_issue_fx_fields(currency: str | None) -> dict:
+def _compute_issue_fx_fields(currency: str | None, connection=None) -> dict:
     check_currency = (currency or "ILS").upper()
     default_currency = "ILS"
     if check_currency == default_currency:
         return {}
     try:
-        rate_info = get_fx_rate_with_fallback(check_currency, default_currency)
+        rate_info = _flush_fx_rate(connection, check_currency, default_currency)
         if rate_info and rate_info.get("success"):
             rate_value = Decimal(str(rate_info.get("rate", 0)))
             if rate_value > 0:
-                now_ts = datetime.now(timezone.utc)
                 return {
                     "fx_rate_issue": rate_value,
                     "fx_rate_issue_source": rate_info.get("source", "unknown"),
-                    "fx_rate_issue_timestamp": now_ts,
+                    "fx_rate_issue_timestamp": rate_info["timestamp"],
                     "fx_rate_issue_base": check_currency,
                     "fx_rate_issue_quote": default_currency,
                 }
@@ -12758,7 +12921,7 @@ def _compute_issue_fx_fields(currency: str | None) -> dict:
 @event.listens_for(Check, "before_insert", propagate=True)
 def _check_before_insert(mapper, connection, target: "Check"):
     """تعيين سعر الصرف وقت إصدار الشيك تلقائياً"""
-    for key, value in _compute_issue_fx_fields(getattr(target, "currency", None)).items():
+    for key, value in _compute_issue_fx_fields(getattr(target, "currency", None), connection).items():
         setattr(target, key, value)
 
 
@@ -12839,25 +13002,12 @@ def _check_before_update(mapper, connection, target: "Check"):
     if hist.has_changes() and target.status == CheckStatus.CASHED.value:
         if check_currency != default_currency and not target.fx_rate_cash:
             try:
-                # محاولة الحصول على السعر الأونلاين أولاً
-                try:
-                    online_rate = _fetch_external_fx_rate(check_currency, default_currency, datetime.now(timezone.utc))
-                    if online_rate and online_rate > Decimal("0"):
-                        target.fx_rate_cash = online_rate
-                        target.fx_rate_cash_source = 'online'
-                        target.fx_rate_cash_timestamp = datetime.now(timezone.utc)
-                        target.fx_rate_cash_base = check_currency
-                        target.fx_rate_cash_quote = default_currency
-                        return  # نجح الحصول على السعر الأونلاين
-                except Exception:
-                    pass  # إذا فشل، نستخدم السعر المحلي
-                
-                # إذا فشل الأونلاين، استخدم get_fx_rate_with_fallback
-                rate_info = get_fx_rate_with_fallback(check_currency, default_currency)
+                # من لقطة الأسعار فقط: لا طلبات HTTP داخل معاملة الكتابة
+                rate_info = _flush_fx_rate(connection, check_currency, default_currency)
                 if rate_info and rate_info.get('success'):
                     target.fx_rate_cash = Decimal(str(rate_info.get('rate', 0)))
                     target.fx_rate_cash_source = rate_info.get('source', 'unknown')
-                    target.fx_rate_cash_timestamp = datetime.now(timezone.utc)
+                    target.fx_rate_cash_timestamp = rate_info['timestamp']
                     target.fx_rate_cash_base = check_currency
                     target.fx_rate_cash_quote = default_currency
             except Exception:
@@ -13482,6 +13632,50 @@ class CostCenterAllocation(db.Model, TimestampMixin):
         return f"<CostCenterAllocation {self.source_type}:{self.source_id} -> CC:{self.cost_center_id}>"
 
 
+class CostCenterMonthlyTotal(db.Model):
+    """مجموع توزيعات كل مركز تكلفة في كل شهر - يُحدّث مع كل إدراج/تعديل/حذف توزيع"""
+    __tablename__ = "cost_center_monthly_totals"
+
+    cost_center_id = db.Column(db.Integer, db.ForeignKey("cost_centers.id", ondelete="CASCADE"), primary_key=True)
+    period = db.Column(db.String(7), primary_key=True)  # YYYY-MM
+    amount = db.Column(db.Numeric(15, 2), nullable=False, default=0)
+    allocations_count = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.Index("ix_cc_monthly_period", "period"),
+    )
+
+
+@event.listens_for(CostCenterAllocation, "after_insert")
+def _cc_allocation_rollup_insert(mapper, connection, target: "CostCenterAllocation"):
+    from services.cost_center_analytics import apply_allocation_delta
+    apply_allocation_delta(connection, target.cost_center_id, target.allocation_date, target.amount, 1)
+
+
+@event.listens_for(CostCenterAllocation, "after_delete")
+def _cc_allocation_rollup_delete(mapper, connection, target: "CostCenterAllocation"):
+    from services.cost_center_analytics import apply_allocation_delta
+    apply_allocation_delta(connection, target.cost_center_id, target.allocation_date, -Decimal(str(target.amount or 0)), -1)
+
+
+@event.listens_for(CostCenterAllocation, "after_update")
+def _cc_allocation_rollup_update(mapper, connection, target: "CostCenterAllocation"):
+    from sqlalchemy.orm.attributes import get_history
+    from services.cost_center_analytics import apply_allocation_delta
+
+    def _old(attr):
+        h = get_history(target, attr)
+        return h.deleted[0] if h.deleted else getattr(target, attr)
+
+    old = (_old("cost_center_id"), _old("allocation_date"), _old("amount"))
+    new = (target.cost_center_id, target.allocation_date, target.amount)
+    if old == new:
+        return
+    apply_allocation_delta(connection, old[0], old[1], -Decimal(str(old[2] or 0)), -1)
+    apply_allocation_delta(connection, new[0], new[1], new[2], 1)
+
+
 class Project(db.Model, TimestampMixin, AuditMixin):
     __tablename__ = "projects"
     
@@ -14582,6 +14776,9 @@ def _auto_allocate_sale_to_cost_center(mapper, connection, target: "Sale"):
         if float(target.total_amount or 0) <= 0:
             return
         
+        from services.cost_center_analytics import allocation_keys, refresh_rollup_keys
+        before = allocation_keys(connection, 'SALE', target.id)
+
         existing = connection.execute(
             sa_text("""SELECT id FROM cost_center_allocations 
                     WHERE source_type = 'SALE' AND source_id = :sid AND cost_center_id = :ccid"""),
@@ -14612,6 +14809,7 @@ def _auto_allocate_sale_to_cost_center(mapper, connection, target: "Sale"):
                     "notes": f"توزيع تلقائي - بيع #{target.sale_number or target.id}"
                 }
             )
+        refresh_rollup_keys(connection, before | allocation_keys(connection, 'SALE', target.id))
     except Exception:
         pass
 
@@ -14620,11 +14818,14 @@ def _auto_allocate_sale_to_cost_center(mapper, connection, target: "Sale"):
 def _auto_remove_sale_cost_center_allocation(mapper, connection, target: "Sale"):
     try:
         if target.cost_center_id:
+            from services.cost_center_analytics import allocation_keys, refresh_rollup_keys
+            before = allocation_keys(connection, 'SALE', target.id)
             connection.execute(
                 sa_text("""DELETE FROM cost_center_allocations 
                         WHERE source_type = 'SALE' AND source_id = :sid"""),
                 {"sid": target.id}
             )
+            refresh_rollup_keys(connection, before)
     except Exception:
         pass
 
@@ -14639,6 +14840,9 @@ def _auto_allocate_service_to_cost_center(mapper, connection, target: "ServiceRe
         if float(target.total_amount or 0) <= 0:
             return
         
+        from services.cost_center_analytics import allocation_keys, refresh_rollup_keys
+        before = allocation_keys(connection, 'SERVICE', target.id)
+
         existing = connection.execute(
             sa_text("""SELECT id FROM cost_center_allocations 
                     WHERE source_type = 'SERVICE' AND source_id = :sid AND cost_center_id = :ccid"""),
@@ -14673,6 +14877,7 @@ def _auto_allocate_service_to_cost_center(mapper, connection, target: "ServiceRe
                     "notes": f"توزيع تلقائي - صيانة #{target.service_number or target.id}"
                 }
             )
+        refresh_rollup_keys(connection, before | allocation_keys(connection, 'SERVICE', target.id))
     except Exception:
         pass
 
@@ -14681,11 +14886,14 @@ def _auto_allocate_service_to_cost_center(mapper, connection, target: "ServiceRe
 def _auto_remove_service_cost_center_allocation(mapper, connection, target: "ServiceRequest"):
     try:
         if target.cost_center_id:
+            from services.cost_center_analytics import allocation_keys, refresh_rollup_keys
+            before = allocation_keys(connection, 'SERVICE', target.id)
             connection.execute(
                 sa_text("""DELETE FROM cost_center_allocations 
                         WHERE source_type = 'SERVICE' AND source_id = :sid"""),
                 {"sid": target.id}
             )
+            refresh_rollup_keys(connection, before)
     except Exception:
         pass
 
@@ -14701,6 +14909,9 @@ def _auto_allocate_expense_to_cost_center(mapper, connection, target: "Expense")
         if float(target.amount or 0) <= 0:
             return
         
+        from services.cost_center_analytics import allocation_keys, refresh_rollup_keys
+        before = allocation_keys(connection, 'EXPENSE', target.id)
+
         existing = connection.execute(
             sa_text("""SELECT id FROM cost_center_allocations 
                     WHERE source_type = 'EXPENSE' AND source_id = :eid AND cost_center_id = :ccid"""),
@@ -14735,6 +14946,7 @@ def _auto_allocate_expense_to_cost_center(mapper, connection, target: "Expense")
                     "notes": f"توزيع تلقائي - مصروف #{target.id}"
                 }
             )
+        refresh_rollup_keys(connection, before | allocation_keys(connection, 'EXPENSE', target.id))
     except Exception:
         pass
 
@@ -14744,11 +14956,14 @@ def _auto_remove_expense_cost_center_allocation(mapper, connection, target: "Exp
     try:
         cost_center_id = getattr(target, 'cost_center_id', None)
         if cost_center_id:
+            from services.cost_center_analytics import allocation_keys, refresh_rollup_keys
+            before = allocation_keys(connection, 'EXPENSE', target.id)
             connection.execute(
                 sa_text("""DELETE FROM cost_center_allocations 
                         WHERE source_type = 'EXPENSE' AND source_id = :eid"""),
                 {"eid": target.id}
             )
+            refresh_rollup_keys(connection, before)
     except Exception:
         pass
 
@@ -15146,6 +15361,186 @@ def _clear_pending_balance_updates(session):
     session.info.pop('_pending_balance_updates', None)
 
 
+# ===== تجميع إعادة حساب المستندات الأم على مستوى الـ flush =====
+# مستمعات البنود (SaleLine, InvoiceLine, ServicePart/Task, StockAdjustmentItem, PaymentSplit)
+# تُعلّم المستند الأم فقط، ثم يُعاد حساب كل مستند مرة واحدة في after_flush
+# بدل إعادة حساب المجموع والقيد مع كل بند (حفظ 100 بند = 100 إعادة حساب).
+_DIRTY_PARENTS_KEY = '_dirty_parent_totals'
+
+
+def _mark_parent_dirty(target, kind, parent_id, member=None):
+    """تسجيل المستند الأم للمعالجة في after_flush؛ False يعني المعالجة فوراً (لا جلسة)"""
+    if not parent_id:
+        return False
+    session = object_session(target)
+    if session is None:
+        return False
+    try:
+        parent_id = int(parent_id)
+    except (TypeError, ValueError):
+        return False
+    members = session.info.setdefault(_DIRTY_PARENTS_KEY, {}).setdefault(kind, {}).setdefault(parent_id, {})
+    if member is not None:
+        members[id(member)] = member
+    return True
+
+
+def _process_dirty_sales(session, connection, parents):
+    for sid in sorted(parents):
+        _refresh_sale_after_lines(connection, sid)
+
+
+def _process_dirty_sale_products(session, connection, parents):
+    _queue_product_partner_balances(session, connection, parents.keys())
+
+
+def _process_dirty_invoices(session, connection, parents):
+    for invoice_id in sorted(parents):
+        _refresh_invoice_after_lines(connection, invoice_id)
+
+
+def _process_dirty_services(session, connection, parents):
+    for service_id in sorted(parents):
+        sr = session.get(ServiceRequest, service_id)
+        if sr is not None and sr not in session.deleted:
+            _recalc_service_request_totals(sr)
+
+
+def _process_dirty_stock_adjustments(session, connection, parents):
+    for adjustment_id in sorted(parents):
+        _recompute_stock_adjustment_total(connection, adjustment_id)
+
+
+def _process_dirty_payment_splits(session, connection, parents):
+    for payment_id in sorted(parents):
+        payment_row = _fetch_split_payment_row(connection, payment_id)
+        if not payment_row:
+            continue
+        for split in parents[payment_id].values():
+            if split.id is not None and split not in session.deleted:
+                _post_payment_split_gl(connection, split, payment_row)
+
+
+def _cost_layer_processor(sync_name, with_removed=False):
+    """معالج طبقات التكلفة لمستند؛ الفشل لا يُسقط الحفظ ويُصلح عبر flask cogs-rebuild
+
+    كل مزامنة داخل SAVEPOINT، فالفشل في منتصفها يتراجع عن كتاباتها فقط ولا
+    يترك طبقات نصف مكتوبة أو معاملة معطلة تُثبَّت مع بيانات المستند.
+    """
+    def _process(session, connection, parents):
+        from services import cost_layers
+        sync = getattr(cost_layers, sync_name)
+        for doc_id in sorted(parents):
+            kwargs = {}
+            if with_removed:
+                kwargs["removed_ids"] = [
+                    m.id for m in parents[doc_id].values()
+                    if m.id is not None and (m in session.deleted or inspect(m).deleted)
+                ]
+            savepoint = connection.begin_nested()
+            try:
+                sync(connection, doc_id, **kwargs)
+                savepoint.commit()
+            except Exception:
+                savepoint.rollback()
+                _EVENT_LOGGER.exception("Cost layer sync failed: %s #%s", sync_name, doc_id)
+    return _process
+
+
+_DIRTY_PARENT_PROCESSORS = (
+    ("SALE", _process_dirty_sales),
+    ("SALE_PRODUCT", _process_dirty_sale_products),
+    ("INVOICE", _process_dirty_invoices),
+    ("SERVICE", _process_dirty_services),
+    ("STOCK_ADJUSTMENT", _process_dirty_stock_adjustments),
+    ("PAYMENT_SPLIT", _process_dirty_payment_splits),
+    # الواردة قبل الصادرة حتى يُصرف من الطبقات المضافة في نفس الـ flush
+    ("COST_SHIPMENT", _cost_layer_processor("sync_shipment", with_removed=True)),
+    ("COST_EXCHANGE", _cost_layer_processor("sync_exchange")),
+    ("COST_SALE", _cost_layer_processor("sync_sale")),
+    ("COST_SERVICE", _cost_layer_processor("sync_service")),
+    ("COST_ADJUSTMENT", _cost_layer_processor("sync_adjustment")),
+)
+
+
+# ===== طبقات التكلفة (FIFO / متوسط مرجح): تعليم المستندات فقط، والمزامنة في after_flush =====
+
+@event.listens_for(Sale, "after_update")
+def _cost_mark_sale_status(mapper, connection, target: "Sale"):
+    hist = inspect(target)
+    if hist.attrs.status.history.has_changes() or hist.attrs.sale_date.history.has_changes():
+        _mark_parent_dirty(target, "COST_SALE", target.id)
+
+
+@event.listens_for(SaleLine, "after_insert")
+@event.listens_for(SaleLine, "after_update")
+@event.listens_for(SaleLine, "after_delete")
+def _cost_mark_sale_line(mapper, connection, target: "SaleLine"):
+    _mark_parent_dirty(target, "COST_SALE", target.sale_id)
+
+
+@event.listens_for(ServiceRequest, "after_update")
+def _cost_mark_service_status(mapper, connection, target: "ServiceRequest"):
+    if inspect(target).attrs.status.history.has_changes():
+        _mark_parent_dirty(target, "COST_SERVICE", target.id)
+
+
+@event.listens_for(ServicePart, "after_insert")
+@event.listens_for(ServicePart, "after_update")
+@event.listens_for(ServicePart, "after_delete")
+def _cost_mark_service_part(mapper, connection, target: "ServicePart"):
+    _mark_parent_dirty(target, "COST_SERVICE", target.service_id)
+
+
+@event.listens_for(StockAdjustmentItem, "after_insert")
+@event.listens_for(StockAdjustmentItem, "after_update")
+@event.listens_for(StockAdjustmentItem, "after_delete")
+def _cost_mark_adjustment_item(mapper, connection, target: "StockAdjustmentItem"):
+    _mark_parent_dirty(target, "COST_ADJUSTMENT", target.adjustment_id)
+
+
+@event.listens_for(Shipment, "after_insert")
+@event.listens_for(Shipment, "after_update")
+def _cost_mark_shipment(mapper, connection, target: "Shipment"):
+    if inspect(target).attrs.status.history.has_changes():
+        _mark_parent_dirty(target, "COST_SHIPMENT", target.id)
+
+
+@event.listens_for(ShipmentItem, "after_insert")
+@event.listens_for(ShipmentItem, "after_update")
+@event.listens_for(ShipmentItem, "after_delete")
+def _cost_mark_shipment_item(mapper, connection, target: "ShipmentItem"):
+    # تعديل بنود شحنة واصلة يُعيد مطابقة طبقاتها (البند المحذوف يُمرَّر لحذف طبقته)
+    _mark_parent_dirty(target, "COST_SHIPMENT", target.shipment_id, member=target)
+    old_shipment = inspect(target).attrs.shipment_id.history.deleted
+    if old_shipment and old_shipment[0] and old_shipment[0] != target.shipment_id:
+        _mark_parent_dirty(target, "COST_SHIPMENT", old_shipment[0])
+
+
+@event.listens_for(ExchangeTransaction, "after_insert")
+@event.listens_for(ExchangeTransaction, "after_update")
+@event.listens_for(ExchangeTransaction, "after_delete")
+def _cost_mark_exchange(mapper, connection, target: "ExchangeTransaction"):
+    _mark_parent_dirty(target, "COST_EXCHANGE", target.id)
+
+
+@event.listens_for(_SA_Session, "after_flush")
+def _process_dirty_parents(session, flush_context):
+    dirty = session.info.pop(_DIRTY_PARENTS_KEY, None)
+    if not dirty:
+        return
+    connection = session.connection()
+    for kind, processor in _DIRTY_PARENT_PROCESSORS:
+        parents = dirty.get(kind)
+        if parents:
+            processor(session, connection, parents)
+
+
+@event.listens_for(_SA_Session, "after_rollback")
+def _clear_dirty_parents(session):
+    session.info.pop(_DIRTY_PARENTS_KEY, None)
+
+
 @event.listens_for(Payment, "after_insert")
 @event.listens_for(Payment, "after_update")
 @event.listens_for(Payment, "after_delete")
@@ -10,7 +10,7 @@ from enum import Enum
 from dataclasses import dataclass, asdict
 from flask import current_app, render_template
 from flask_socketio import emit, join_room, leave_room
-from sqlalchemy import Column, Integer, String, Text, DateTime, Boolean, JSON, ForeignKey
+from sqlalchemy import Column, Integer, String, Text, DateTime, Boolean, JSON, ForeignKey, Index, func, text
 from sqlalchemy.orm import relationship
 from extensions import db, socketio
 from models import TimestampMixin, AuditMixin
@@ -35,6 +35,11 @@ class NotificationPriority(Enum):
     URGENT = "urgent"
 
 
+# مفتاح صف العدّاد العام: يحفظ عدد الإشعارات العامة (broadcast) الفعّالة
+BROADCAST_COUNTER_KEY = 0
+CLEANUP_CHUNK_SIZE = 500
+
+
 @dataclass
 class NotificationData:
     title: str
@@ -64,6 +69,11 @@ class Notification(db.Model, TimestampMixin, AuditMixin):
     
     # العلاقات
     user = relationship("User", backref="notifications")
+
+    __table_args__ = (
+        Index("ix_notifications_user_id_id", "user_id", "id"),
+        Index("ix_notifications_expires_at", "expires_at"),
+    )
     
     def to_dict(self) -> Dict[str, Any]:
         """تحويل الإشعار إلى قاموس"""
@@ -81,12 +91,44 @@ class Notification(db.Model, TimestampMixin, AuditMixin):
             "created_at": self.created_at.isoformat(),
         }
     
-    def mark_as_read(self):
-        """تحديد الإشعار كمقروء"""
-        if not self.is_read:
-            self.is_read = True
-            self.read_at = datetime.utcnow()
-            db.session.commit()
+    def mark_as_read(self, user_id: Optional[int] = None):
+        """تحديد الإشعار كمقروء
+
+        الإشعار الخاص يُعلَّم مباشرة. الإشعار العام (broadcast) يُسجَّل كمقروء
+        للمستخدم المحدد فقط في جدول notification_broadcast_reads، وبدون
+        user_id يُعلَّم كمقروء للجميع.
+        """
+        if self.user_id is not None:
+            if not self.is_read:
+                self.is_read = True
+                self.read_at = datetime.utcnow()
+                db.session.flush()
+                _bump_counter(self.user_id, unread_delta=-1)
+                db.session.commit()
+            return
+
+        if user_id is None:
+            if not self.is_read:
+                self.is_read = True
+                self.read_at = datetime.utcnow()
+                db.session.flush()
+                _retire_broadcasts([self.id])
+                db.session.commit()
+            return
+
+        if self.is_read:
+            return
+        result = db.session.execute(
+            text(
+                "INSERT INTO notification_broadcast_reads (notification_id, user_id, read_at) "
+                "SELECT :n, :u, :t WHERE NOT EXISTS "
+                "(SELECT 1 FROM notification_broadcast_reads WHERE notification_id = :n AND user_id = :u)"
+            ),
+            {"n": self.id, "u": user_id, "t": datetime.utcnow()},
+        )
+        if result.rowcount:
+            _bump_counter(user_id, broadcast_read_delta=1)
+        db.session.commit()
     
     @classmethod
     def create_notification(
@@ -112,6 +154,11 @@ class Notification(db.Model, TimestampMixin, AuditMixin):
             expires_at=expires_at
         )
         db.session.add(notification)
+        db.session.flush()
+        _bump_counter(
+            user_id if user_id is not None else BROADCAST_COUNTER_KEY,
+            unread_delta=1,
+        )
         db.session.commit()
         
         # إرسال الإشعار عبر Socket.IO
@@ -119,6 +166,24 @@ class Notification(db.Model, TimestampMixin, AuditMixin):
         
         return notification
     
+    def is_expired(self, now: Optional[datetime] = None) -> bool:
+        return self.expires_at is not None and self.expires_at <= (now or datetime.utcnow())
+
+    @classmethod
+    def _visible_to(cls, user_id: int, now: datetime):
+        return (
+            ((cls.user_id == user_id) | (cls.user_id.is_(None)))
+            & ((cls.expires_at.is_(None)) | (cls.expires_at > now))
+        )
+
+    @classmethod
+    def _unread_for(cls, user_id: int):
+        read_marker = db.session.query(NotificationBroadcastRead.notification_id).filter(
+            NotificationBroadcastRead.notification_id == cls.id,
+            NotificationBroadcastRead.user_id == user_id,
+        ).exists()
+        return (cls.is_read == False) & ((cls.user_id.isnot(None)) | ~read_marker)
+
     @classmethod
     def get_user_notifications(
         cls,
@@ -127,38 +192,251 @@ class Notification(db.Model, TimestampMixin, AuditMixin):
         unread_only: bool = False
     ) -> List["Notification"]:
         """الحصول على إشعارات المستخدم"""
-        query = cls.query.filter(
-            (cls.user_id == user_id) | (cls.user_id.is_(None))
-        ).filter(
-            (cls.expires_at.is_(None)) | (cls.expires_at > datetime.utcnow())
-        )
+        query = cls.query.filter(cls._visible_to(user_id, datetime.utcnow()))
         
         if unread_only:
-            query = query.filter(cls.is_read == False)
+            query = query.filter(cls._unread_for(user_id))
         
         return query.order_by(cls.created_at.desc()).limit(limit).all()
+
+    @classmethod
+    def get_notifications_since(
+        cls,
+        user_id: int,
+        since_id: int = 0,
+        limit: int = 50
+    ) -> Dict[str, Any]:
+        """إشعارات المستخدم الأحدث من المؤشر since_id (للاستطلاع الدوري)
+
+        يعتمد على الفهرس (user_id, id) فيمسح فقط الصفوف الجديدة بدل الجدول كاملاً.
+        """
+        limit = max(1, min(int(limit or 50), 200))
+        rows = cls.query.filter(
+            cls._visible_to(user_id, datetime.utcnow()),
+            cls.id > int(since_id or 0),
+        ).order_by(cls.id.asc()).limit(limit).all()
+
+        read_ids = set()
+        broadcast_ids = [n.id for n in rows if n.user_id is None]
+        if broadcast_ids:
+            read_ids = {
+                nid for (nid,) in db.session.query(NotificationBroadcastRead.notification_id).filter(
+                    NotificationBroadcastRead.user_id == user_id,
+                    NotificationBroadcastRead.notification_id.in_(broadcast_ids),
+                )
+            }
+
+        items = []
+        for n in rows:
+            item = n.to_dict()
+            if n.id in read_ids:
+                item["is_read"] = True
+            items.append(item)
+        return {
+            "items": items,
+            "cursor": rows[-1].id if rows else int(since_id or 0),
+            "has_more": len(rows) == limit,
+        }
     
     @classmethod
     def get_unread_count(cls, user_id: int) -> int:
-        """عدد الإشعارات غير المقروءة"""
-        return cls.query.filter(
-            (cls.user_id == user_id) | (cls.user_id.is_(None))
-        ).filter(
-            cls.is_read == False
-        ).filter(
-            (cls.expires_at.is_(None)) | (cls.expires_at > datetime.utcnow())
-        ).count()
-    
+        """عدد الإشعارات غير المقروءة (من جدول العدّادات مباشرة، بدون أي كتابة)
+
+        كل كتابة تُنشئ صف عدّادها عند الحاجة (_bump_counter)، فغياب الصف يعني صفراً.
+        المنتهي الصلاحية يُخصم عند حذفه في cleanup_expired، والمهمة المجدولة
+        تشغّله كل NOTIFICATION_CLEANUP_MINUTES دقيقة.
+        """
+        keys = (BROADCAST_COUNTER_KEY, user_id)
+        counters = {
+            c.user_id: c for c in NotificationUnreadCounter.query.filter(
+                NotificationUnreadCounter.user_id.in_(keys)
+            )
+        }
+        own = counters.get(user_id)
+        broadcast = counters.get(BROADCAST_COUNTER_KEY)
+        broadcast_unread = (broadcast.unread_count if broadcast else 0) - (own.broadcast_read_count if own else 0)
+        return max((own.unread_count if own else 0) + max(broadcast_unread, 0), 0)
+
     @classmethod
-    def cleanup_expired(cls):
-        """تنظيف الإشعارات المنتهية الصلاحية"""
-        expired_count = cls.query.filter(
-            cls.expires_at < datetime.utcnow()
-        ).delete()
+    def rebuild_unread_counters(cls) -> int:
+        """إعادة بناء جميع العدّادات من جدول الإشعارات (للصيانة)"""
+        NotificationUnreadCounter.query.delete()
+        keys = {BROADCAST_COUNTER_KEY}
+        keys.update(uid for (uid,) in db.session.query(cls.user_id).filter(cls.user_id.isnot(None)).distinct())
+        keys.update(uid for (uid,) in db.session.query(NotificationBroadcastRead.user_id).distinct())
+        for key in keys:
+            _seed_counter(key)
         db.session.commit()
+        return len(keys)
+    
+    @classmethod
+    def cleanup_expired(cls, chunk_size: int = CLEANUP_CHUNK_SIZE) -> int:
+        """تنظيف الإشعارات المنتهية الصلاحية على دفعات
+
+        كل دفعة في معاملة قصيرة مستقلة حتى لا يبقى قفل الكتابة طويلاً،
+        مع تعديل العدّادات بما يقابل الإشعارات المحذوفة.
+        """
+        chunk_size = max(1, int(chunk_size or CLEANUP_CHUNK_SIZE))
+        expired_count = 0
+        while True:
+            now = datetime.utcnow()
+            ids = [
+                nid for (nid,) in db.session.query(cls.id).filter(
+                    cls.expires_at.isnot(None),
+                    cls.expires_at < now,
+                ).order_by(cls.id).limit(chunk_size)
+            ]
+            if not ids:
+                break
+            try:
+                unread_by_user = db.session.query(cls.user_id, func.count(cls.id)).filter(
+                    cls.id.in_(ids),
+                    cls.user_id.isnot(None),
+                    cls.is_read == False,
+                ).group_by(cls.user_id).all()
+                for uid, cnt in unread_by_user:
+                    _bump_counter(uid, unread_delta=-int(cnt))
+
+                broadcast_ids = [
+                    nid for (nid,) in db.session.query(cls.id).filter(
+                        cls.id.in_(ids),
+                        cls.user_id.is_(None),
+                        cls.is_read == False,
+                    )
+                ]
+                _retire_broadcasts(broadcast_ids)
+
+                NotificationBroadcastRead.query.filter(
+                    NotificationBroadcastRead.notification_id.in_(ids)
+                ).delete(synchronize_session=False)
+                cls.query.filter(cls.id.in_(ids)).delete(synchronize_session=False)
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                raise
+            expired_count += len(ids)
+            if len(ids) < chunk_size:
+                break
         return expired_count
 
 
+class NotificationUnreadCounter(db.Model):
+    """عدّاد الإشعارات غير المقروءة لكل مستخدم
+
+    الصف ذو user_id = 0 يحفظ عدد الإشعارات العامة الفعّالة، وصفوف المستخدمين
+    تحفظ عدد إشعاراتهم الخاصة غير المقروءة وعدد الإشعارات العامة التي قرؤوها.
+    """
+    __tablename__ = "notification_unread_counters"
+
+    user_id = Column(Integer, primary_key=True, autoincrement=False)
+    unread_count = Column(Integer, nullable=False, default=0, server_default=text("0"))
+    broadcast_read_count = Column(Integer, nullable=False, default=0, server_default=text("0"))
+    updated_at = Column(DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+class NotificationBroadcastRead(db.Model):
+    """علامة قراءة إشعار عام (broadcast) من قبل مستخدم"""
+    __tablename__ = "notification_broadcast_reads"
+
+    notification_id = Column(Integer, ForeignKey("notifications.id", ondelete="CASCADE"), primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True, index=True)
+    read_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+
+
+def _seed_counter(user_key: int) -> None:
+    """إنشاء صف العدّاد من جدول الإشعارات إن لم يكن موجوداً
+
+    يُعدّ كل غير المقروء الموجود بما فيه المنتهي الصلاحية، فهذا يُخصم من
+    العدّاد عند حذفه في cleanup_expired.
+    """
+    now = datetime.utcnow()
+    if user_key == BROADCAST_COUNTER_KEY:
+        unread = db.session.query(func.count(Notification.id)).filter(
+            Notification.user_id.is_(None),
+            Notification.is_read == False,
+        ).scalar() or 0
+        broadcast_read = 0
+    else:
+        unread = db.session.query(func.count(Notification.id)).filter(
+            Notification.user_id == user_key,
+            Notification.is_read == False,
+        ).scalar() or 0
+        broadcast_read = db.session.query(func.count(NotificationBroadcastRead.notification_id)).join(
+            Notification, Notification.id == NotificationBroadcastRead.notification_id
+        ).filter(
+            NotificationBroadcastRead.user_id == user_key,
+            Notification.is_read == False,
+        ).scalar() or 0
+    db.session.execute(
+        text(
+            "INSERT INTO notification_unread_counters (user_id, unread_count, broadcast_read_count, updated_at) "
+            "SELECT :k, :u, :b, :t WHERE NOT EXISTS "
+            "(SELECT 1 FROM notification_unread_counters WHERE user_id = :k)"
+        ),
+        {"k": user_key, "u": int(unread), "b": int(broadcast_read), "t": now},
+    )
+
+
+def reseed_unread_counters(connection) -> int:
+    """إعادة بناء كل العدّادات بإدراجين مجمّعين على اتصال مباشر (بعد دمج قاعدة فرعية)
+
+    نفس قاعدة _seed_counter: غير المقروء كله بما فيه المنتهي الصلاحية.
+    """
+    params = {"f": False, "t": datetime.utcnow(), "k": BROADCAST_COUNTER_KEY}
+    connection.execute(text("DELETE FROM notification_unread_counters"))
+    connection.execute(text(
+        "INSERT INTO notification_unread_counters (user_id, unread_count, broadcast_read_count, updated_at) "
+        "SELECT :k, COUNT(*), 0, :t FROM notifications WHERE user_id IS NULL AND is_read = :f"
+    ), params)
+    connection.execute(text(
+        "INSERT INTO notification_unread_counters (user_id, unread_count, broadcast_read_count, updated_at) "
+        "SELECT k.uid, "
+        "(SELECT COUNT(*) FROM notifications n WHERE n.user_id = k.uid AND n.is_read = :f), "
+        "(SELECT COUNT(*) FROM notification_broadcast_reads r JOIN notifications n ON n.id = r.notification_id "
+        " WHERE r.user_id = k.uid AND n.is_read = :f), "
+        ":t "
+        "FROM (SELECT user_id AS uid FROM notifications WHERE user_id IS NOT NULL "
+        "      UNION SELECT user_id FROM notification_broadcast_reads) k"
+    ), params)
+    return int(connection.execute(text("SELECT COUNT(*) FROM notification_unread_counters")).scalar() or 0)
+
+
+def _bump_counter(user_key: int, unread_delta: int = 0, broadcast_read_delta: int = 0) -> None:
+    """تعديل العدّاد ذرياً، وإنشاؤه من البيانات إن لم يكن موجوداً
+
+    يجب استدعاؤها بعد flush للتغيير حتى يشمله الإنشاء من البيانات.
+    """
+    result = db.session.execute(
+        text(
+            "UPDATE notification_unread_counters SET "
+            "unread_count = CASE WHEN unread_count + :u < 0 THEN 0 ELSE unread_count + :u END, "
+            "broadcast_read_count = CASE WHEN broadcast_read_count + :b < 0 THEN 0 ELSE broadcast_read_count + :b END, "
+            "updated_at = :t "
+            "WHERE user_id = :k"
+        ),
+        {"k": user_key, "u": int(unread_delta), "b": int(broadcast_read_delta), "t": datetime.utcnow()},
+    )
+    if not result.rowcount:
+        _seed_counter(user_key)
+
+
+def _retire_broadcasts(notification_ids: List[int]) -> None:
+    """إخراج إشعارات عامة من العدّادات (انتهاء صلاحية أو قراءة للجميع)"""
+    if not notification_ids:
+        return
+    _bump_counter(BROADCAST_COUNTER_KEY, unread_delta=-len(notification_ids))
+    readers = db.session.query(
+        NotificationBroadcastRead.user_id, func.count(NotificationBroadcastRead.notification_id)
+    ).filter(
+        NotificationBroadcastRead.notification_id.in_(notification_ids)
+    ).group_by(NotificationBroadcastRead.user_id).all()
+    for uid, cnt in readers:
+        _bump_counter(uid, broadcast_read_delta=-int(cnt))
+    NotificationBroadcastRead.query.filter(
+        NotificationBroadcastRead.notification_id.in_(notification_ids)
+    ).delete(synchronize_session=False)
+
+
 class NotificationManager:
     """مدير الإشعارات"""
     
@@ -275,7 +553,12 @@ def on_mark_notification_read(data):
     if notification_id:
         notification = Notification.query.get(notification_id)
         if notification:
-            notification.mark_as_read()
+            from flask_login import current_user
+            from models import User
+            reader_id = None
+            if getattr(current_user, "is_authenticated", False) and isinstance(current_user._get_current_object(), User):
+                reader_id = current_user.id
+            notification.mark_as_read(user_id=reader_id)
             emit('notification_read', {'notification_id': notification_id})
 
 
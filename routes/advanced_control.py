@@ -810,22 +810,7 @@ def backup_manager():
             
             return redirect(url_for('advanced.backup_manager'))
     
-    backups = []
-    now = datetime.now()
-    if os.path.exists(backup_dir):
-        for filename in sorted(os.listdir(backup_dir), reverse=True):
-            if filename.endswith('.db'):
-                filepath = os.path.join(backup_dir, filename)
-                size = os.path.getsize(filepath) / (1024 * 1024)
-                mtime = datetime.fromtimestamp(os.path.getmtime(filepath))
-                age_hours = (now - mtime).total_seconds() / 3600
-                backups.append({
-                    'name': filename,
-                    'size': f'{size:.2f} MB',
-                    'date': mtime.strftime('%Y-%m-%d %H:%M'),
-                    'timestamp': mtime.isoformat(),
-                    'age_hours': round(age_hours, 2)
-                })
+    backups = _list_backups(backup_dir)
     
     auto_backup_enabled = SystemSettings.query.filter_by(key='auto_backup_enabled').first()
     auto_backup_schedule = SystemSettings.query.filter_by(key='auto_backup_schedule').first()
@@ -865,6 +850,17 @@ def download_backup(filename):
         backup_dir = os.path.join(current_app.root_path, 'instance', 'backups', 'db')
         filepath = os.path.join(backup_dir, secure_filename(filename))
         
+        snapshot_id = _snapshot_id_from_name(filename)
+        if snapshot_id:
+            # اللقطة التزايدية تُعاد بناؤها في ملف مؤقت يُحذف بعد الإرسال
+            import tempfile
+            fd, tmp_path = tempfile.mkstemp(suffix='.db')
+            os.close(fd)
+            os.remove(tmp_path)
+            _backup_store().restore(tmp_path, snapshot_id)
+            response = send_file(tmp_path, as_attachment=True, download_name=f'{filename}.db')
+            response.call_on_close(lambda: os.path.exists(tmp_path) and os.remove(tmp_path))
+            return response
         if os.path.exists(filepath) and filename.endswith('.db'):
             return send_file(filepath, as_attachment=True, download_name=filename)
         else:
@@ -888,6 +884,18 @@ def restore_backup(filename):
             flash('❌ يجب كتابة اسم النسخة للتأكيد قبل الاستعادة', 'danger')
             return redirect(url_for('advanced.backup_manager'))
         
+        snapshot_id = _snapshot_id_from_name(filename)
+        if snapshot_id:
+            swapped = _restore_snapshot(snapshot_id)
+            flash(f'✅ تم استعادة اللقطة: {filename}', 'success')
+            if swapped.get('previous'):
+                flash(f'💾 تم حفظ القاعدة السابقة: {os.path.basename(swapped["previous"])}', 'info')
+            _log_owner_action('backup.restore', filename, {
+                'snapshot': snapshot_id,
+                'previous': os.path.basename(swapped.get('previous') or ''),
+            })
+            return redirect(url_for('advanced.backup_manager'))
+        
         if not os.path.exists(backup_path) or not filename.endswith('.db'):
             flash('❌ الملف غير موجود', 'danger')
             return redirect(url_for('advanced.backup_manager'))
@@ -926,7 +934,15 @@ def delete_backup(filename):
             flash('❌ يجب كتابة اسم النسخة للتأكيد قبل الحذف', 'danger')
             return redirect(url_for('advanced.backup_manager'))
         
-        if os.path.exists(filepath) and filename.endswith('.db'):
+        snapshot_id = _snapshot_id_from_name(filename)
+        if snapshot_id:
+            # حذف الـ manifest فقط؛ الكتل غير المستخدمة تُحذف في التنظيف التالي
+            if _backup_store().remove(snapshot_id):
+                flash(f'✅ تم حذف اللقطة: {filename}', 'success')
+                _log_owner_action('backup.delete', filename)
+            else:
+                flash('❌ اللقطة غير موجودة', 'danger')
+        elif os.path.exists(filepath) and filename.endswith('.db'):
             os.remove(filepath)
             flash(f'✅ تم حذف النسخة: {filename}', 'success')
             _log_owner_action('backup.delete', filename)
@@ -1111,40 +1127,16 @@ def system_health():
 
 
 def _merge_databases(source_db_path, mode='smart', ignored_tables=None):
-    ignored_set = set(ignored_tables or [])
-    conn_source = sqlite3.connect(source_db_path)
-    conn_target = sqlite3.connect(os.path.join(current_app.root_path, 'instance', 'app.db'))
-    
-    cursor_source = conn_source.cursor()
-    cursor_target = conn_target.cursor()
-    
-    tables = cursor_source.execute("SELECT name FROM sqlite_master WHERE type='table'").fetchall()
-    
-    added_count = 0
-    
-    for (table_name,) in tables:
-        if table_name.startswith('sqlite_') or table_name in ignored_set:
-            continue
-        
-        try:
-            rows = cursor_source.execute(f"SELECT * FROM {table_name}").fetchall()
-            
-            if mode == 'smart':
-                for row in rows:
-                    try:
-                        placeholders = ','.join(['?' for _ in row])
-                        cursor_target.execute(f"INSERT OR IGNORE INTO {table_name} VALUES ({placeholders})", row)
-                        added_count += cursor_target.rowcount
-                    except Exception:
-                        pass
-        except Exception:
-            pass
-    
-    conn_target.commit()
-    conn_source.close()
-    conn_target.close()
-    
-    return {'added': added_count}
+    """دمج قاعدة فرعية عبر ATTACH على دفعات بترتيب المفاتيح الأجنبية"""
+    from services.db_merge import merge_databases
+    target_path = os.path.join(current_app.root_path, 'instance', 'app.db')
+    result = merge_databases(
+        target_path, source_db_path, mode=mode, ignored_tables=ignored_tables,
+        batch_size=current_app.config.get('DB_MERGE_BATCH_SIZE', 5000),
+    )
+    for failed in result['errors']:
+        current_app.logger.warning(f"⚠️ فشل دمج الجدول {failed['table']}: {failed['error']}")
+    return result
 
 
 def _get_db_size():
@@ -1261,31 +1253,83 @@ def _collect_system_health_checks():
     return checks, round(overall)
 
 
-def _get_latest_backup_snapshot():
-    backup_dir = os.path.join(current_app.root_path, 'instance', 'backups', 'db')
-    latest = None
+def _backup_store():
+    from services.backup_store import BackupStore
+    return BackupStore.from_app(current_app)
+
+
+def _snapshot_id_from_name(filename):
+    """اسم اللقطة في الواجهة هو اسم ملف الـ manifest بدون الامتداد (snap_<id>)"""
+    from services.backup_store import MANIFEST_PREFIX
+    if not filename or not filename.startswith(MANIFEST_PREFIX):
+        return None
+    snapshot_id = filename[len(MANIFEST_PREFIX):]
+    return snapshot_id if snapshot_id.replace('_', '').isdigit() else None
+
+
+def _backup_entry(name, size_bytes, mtime, now, kind):
+    return {
+        'name': name,
+        'size': f'{size_bytes / (1024 * 1024):.2f} MB',
+        'date': mtime.strftime('%Y-%m-%d %H:%M'),
+        'timestamp': mtime.isoformat(),
+        'age_hours': round((now - mtime).total_seconds() / 3600, 2),
+        'kind': kind,
+    }
+
+
+def _list_backups(backup_dir=None):
+    """النسخ الكاملة (*.db) واللقطات التزايدية معاً من الأحدث للأقدم"""
+    from services.backup_store import MANIFEST_PREFIX, available
+    backup_dir = backup_dir or os.path.join(current_app.root_path, 'instance', 'backups', 'db')
+    now = datetime.now()
+    backups = []
     if os.path.exists(backup_dir):
-        backups = sorted(
-            [
-                filename for filename in os.listdir(backup_dir)
-                if filename.endswith('.db')
-            ],
-            reverse=True
-        )
-        if backups:
-            filename = backups[0]
-            filepath = os.path.join(backup_dir, filename)
-            size = os.path.getsize(filepath) / (1024 * 1024)
-            mtime = datetime.fromtimestamp(os.path.getmtime(filepath))
-            age_hours = (datetime.now() - mtime).total_seconds() / 3600
-            latest = {
-                'name': filename,
-                'size': f'{size:.2f} MB',
-                'date': mtime.strftime('%Y-%m-%d %H:%M'),
-                'timestamp': mtime.isoformat(),
-                'age_hours': round(age_hours, 2),
-            }
-    return latest or {'name': None, 'size': '0 MB', 'date': None, 'timestamp': None, 'age_hours': None}
+        for filename in os.listdir(backup_dir):
+            if filename.endswith('.db'):
+                filepath = os.path.join(backup_dir, filename)
+                backups.append(_backup_entry(
+                    filename, os.path.getsize(filepath),
+                    datetime.fromtimestamp(os.path.getmtime(filepath)), now, 'file',
+                ))
+    if available():
+        try:
+            for snap in _backup_store().list_snapshots():
+                created = datetime.fromisoformat(snap['created_at']).astimezone().replace(tzinfo=None)
+                backups.append(_backup_entry(
+                    f"{MANIFEST_PREFIX}{snap['id']}", snap.get('db_size', 0), created, now, 'snapshot',
+                ))
+        except Exception as e:
+            current_app.logger.warning(f"⚠️ تعذر قراءة اللقطات التزايدية: {e}")
+    backups.sort(key=lambda b: b['timestamp'], reverse=True)
+    return backups
+
+
+def _restore_snapshot(snapshot_id):
+    """إعادة بناء اللقطة بجانب القاعدة ثم فحصها واستبدالها ذرياً (نفس مسار main.restore_db)"""
+    from services import db_restore
+    uri = current_app.config.get("SQLALCHEMY_DATABASE_URI", "")
+    if not uri.startswith("sqlite:///"):
+        raise ValueError("قاعدة البيانات ليست SQLite")
+    db_path = uri.replace("sqlite:///", "")
+    staged = os.path.join(os.path.dirname(os.path.abspath(db_path)), f".restore_{snapshot_id}.db")
+    try:
+        _backup_store().restore(staged, snapshot_id)
+        db_restore.prepare(staged, os.path.join(current_app.root_path, "migrations"))
+        db.session.commit()
+        db.session.remove()
+        swapped = db_restore.swap(staged, db_path, engine=db.engine)
+        staged = None
+        return swapped
+    finally:
+        db_restore.discard(staged)
+
+
+def _get_latest_backup_snapshot():
+    backups = _list_backups()
+    if backups:
+        return backups[0]
+    return {'name': None, 'size': '0 MB', 'date': None, 'timestamp': None, 'age_hours': None}
 
 
 def _get_security_snapshot():
@@ -1478,7 +1522,11 @@ def _handle_db_merger_preview():
     if not file.filename.endswith('.db'):
         flash('❌ يجب أن يكون ملف .db', 'danger')
         return redirect(url_for('advanced.db_merger'))
+    from services.db_merge import CONFLICT_POLICIES
     merge_mode = request.form.get('merge_mode', 'smart')
+    if merge_mode not in CONFLICT_POLICIES:
+        flash('❌ وضع الدمج غير مدعوم', 'danger')
+        return redirect(url_for('advanced.db_merger'))
     ignored_tables = request.form.getlist('ignored_tables')
     try:
         temp_path = os.path.join(current_app.root_path, 'instance', 'temp_merge.db')
@@ -1507,7 +1555,8 @@ def _handle_db_merger_execute():
         return redirect(url_for('advanced.db_merger'))
     temp_path = preview.get('temp_path')
     merge_mode = preview.get('merge_mode', 'smart')
-    ignored_tables = preview.get('ignored_tables', [])
+    # نموذج الاعتماد يرسل اختيار الجداول المستثناة من جدول المعاينة
+    ignored_tables = request.form.getlist('ignored_tables')
     safety_backup = None
     try:
         safety_backup = _create_safety_backup()
@@ -1518,9 +1567,16 @@ def _handle_db_merger_execute():
         _log_owner_action('db_merger.execute', preview.get('file_name'), {
             'added': result['added'],
             'ignored_tables': ignored_tables,
+            'failed_tables': [t['table'] for t in result['errors']],
+            'fk_violations': result['fk_violations'],
+            'seconds': result['seconds'],
             'safety_backup': safety_backup
         })
-        flash(f'✅ تم الدمج بنجاح! {result["added"]} سجل مضاف', 'success')
+        flash(f'✅ تم الدمج بنجاح! {result["added"]} سجل مضاف في {result["seconds"]} ثانية', 'success')
+        if result['errors']:
+            flash('⚠️ تعذر دمج الجداول: ' + '، '.join(t['table'] for t in result['errors']), 'warning')
+        if result['fk_violations']:
+            flash(f'⚠️ سجلات بمراجع مفقودة بعد الدمج في {len(result["fk_violations"])} جدول', 'warning')
         return redirect(url_for('advanced.db_merger'))
     except Exception as e:
         flash(f'❌ خطأ أثناء الدمج: {str(e)}', 'danger')
@@ -1528,32 +1584,10 @@ def _handle_db_merger_execute():
 
 
 def _compare_databases(source_db_path, ignored_tables):
-    comparison = []
-    ignored_set = set(ignored_tables or [])
-    target_conn = sqlite3.connect(os.path.join(current_app.root_path, 'instance', 'app.db'))
-    source_conn = sqlite3.connect(source_db_path)
-    target_cursor = target_conn.cursor()
-    source_cursor = source_conn.cursor()
-    tables = source_cursor.execute("SELECT name FROM sqlite_master WHERE type='table'").fetchall()
-    for (table_name,) in tables:
-        if table_name.startswith('sqlite_') or table_name in ignored_set:
-            continue
-        try:
-            source_count = source_cursor.execute(f"SELECT COUNT(*) FROM {table_name}").fetchone()[0]
-        except Exception:
-            source_count = 'N/A'
-        try:
-            target_count = target_cursor.execute(f"SELECT COUNT(*) FROM {table_name}").fetchone()[0]
-        except Exception:
-            target_count = 'N/A'
-        comparison.append({
-            'table': table_name,
-            'source_count': source_count,
-            'target_count': target_count,
-        })
-    target_conn.close()
-    source_conn.close()
-    return comparison
+    """معاينة الدمج (dry-run): السجلات الجديدة والمتغيرة لكل جدول بدون أي كتابة"""
+    from services.db_merge import merge_databases
+    target_path = os.path.join(current_app.root_path, 'instance', 'app.db')
+    return merge_databases(target_path, source_db_path, ignored_tables=ignored_tables, dry_run=True)
 
 
 def _create_safety_backup():
@@ -3750,7 +3784,7 @@ def accounting_control_manual_backup():
 @advanced_bp.route("/accounting-control/report.pdf", methods=["GET"])
 @owner_only
 def accounting_control_report_pdf():
-    from weasyprint import HTML
+    from services.pdf_render import get_renderer
     
     settings_bundle = _get_accounting_settings_bundle()
     stats = _calculate_accounting_overview(settings_bundle)
@@ -3762,7 +3796,7 @@ def accounting_control_report_pdf():
         diagnostics=diagnostics,
         generated_at=datetime.now(timezone.utc)
     )
-    pdf_bytes = HTML(string=html, base_url=request.url_root).write_pdf()
+    pdf_bytes = get_renderer().render(html, base_url=request.url_root)
     filename = f"accounting_control_{datetime.now().strftime('%Y%m%d_%H%M%S')}.pdf"
     return Response(
         pdf_bytes,
@@ -3822,10 +3856,11 @@ def performance_profiler():
             
             try:
                 import psutil
+                from services.system_metrics import current_snapshot
                 process = psutil.Process()
                 profiler_data['system'] = {
                     'memory_mb': round(process.memory_info().rss / (1024 * 1024), 2),
-                    'cpu_percent': process.cpu_percent(interval=0.1),
+                    'cpu_percent': current_snapshot(current_app._get_current_object()).get('process_cpu_percent'),
                     'threads': process.num_threads()
                 }
             except Exception:
@@ -32,6 +32,7 @@ from models import (
     Product,
     ProductCategory,
     ProductPartnerShare,
+    ProductStockTotal,
     Role,
     Sale,
     SaleLine,
@@ -1606,33 +1607,50 @@ def api_products_by_warehouse(wid: int):
 @limiter.limit("60/minute")
 def api_inventory_summary():
     ids = request.args.getlist("warehouse_ids", type=int)
-    q = utils.q  # q is a function, not _q()
-    wh_ids = ids or [w.id for w in Warehouse.query.order_by(Warehouse.name).all()]
+    q = (request.args.get("q") or "").strip()
+    all_ids = [wid for (wid,) in db.session.query(Warehouse.id).order_by(Warehouse.name).all()]
+    wh_ids = ids or all_ids
     if not wh_ids:
         return jsonify({"data": []})
-    qry = (
-        db.session.query(
-            Product.id.label("pid"),
-            Product.name,
-            Product.sku,
-            func.coalesce(func.sum(StockLevel.quantity), 0).label("on_hand"),
-            func.coalesce(func.sum(func.coalesce(StockLevel.reserved_quantity, 0)), 0).label("reserved"),
+    if set(wh_ids) >= set(all_ids):
+        # كل المستودعات: الإجماليات محفوظة في product_stock_totals
+        qry = (
+            db.session.query(
+                Product.id.label("pid"),
+                Product.name,
+                Product.sku,
+                ProductStockTotal.on_hand,
+                ProductStockTotal.reserved,
+            )
+            .join(ProductStockTotal, ProductStockTotal.product_id == Product.id)
+            .order_by(Product.name.asc(), Product.id.asc())
+        )
+    else:
+        qry = (
+            db.session.query(
+                Product.id.label("pid"),
+                Product.name,
+                Product.sku,
+                func.coalesce(func.sum(StockLevel.quantity), 0).label("on_hand"),
+                func.coalesce(func.sum(func.coalesce(StockLevel.reserved_quantity, 0)), 0).label("reserved"),
+            )
+            .join(StockLevel, StockLevel.product_id == Product.id)
+            .filter(StockLevel.warehouse_id.in_(wh_ids))
+            .group_by(Product.id, Product.name, Product.sku)
+            .order_by(Product.name.asc(), Product.id.asc())
         )
-        .join(StockLevel, StockLevel.product_id == Product.id)
-        .filter(StockLevel.warehouse_id.in_(wh_ids))
-        .group_by(Product.id, Product.name, Product.sku)
-        .order_by(Product.name.asc())
-    )
     if q:
         like = f"%{q}%"
         qry = qry.filter(or_(Product.name.ilike(like), Product.sku.ilike(like)))
-    rows = qry.limit(utils._query_limit(200, 500)).all()
+    limit = utils._query_limit(200, 500)
+    page = max(request.args.get("page", 1, type=int) or 1, 1)
+    rows = qry.limit(limit).offset((page - 1) * limit).all()
     data = []
     for pid, name, sku, on_hand, reserved in rows:
         on_hand = int(on_hand or 0)
         reserved = int(reserved or 0)
         data.append({"product_id": pid, "name": name, "sku": sku, "on_hand": on_hand, "reserved": reserved, "available": max(on_hand - reserved, 0)})
-    return jsonify({"data": data, "warehouse_ids": wh_ids})
+    return jsonify({"data": data, "warehouse_ids": wh_ids, "page": page, "limit": limit, "has_more": len(rows) == limit})
 
 @bp.patch("/products/<int:id>")
 @login_required
@@ -4039,3 +4057,55 @@ def get_suppliers():
             'success': False,
             'error': 'حدث خطأ أثناء جلب الموردين'
         }), 500
+
+
+# ===== Notifications Polling API =====
+
+def _notification_reader_id():
+    if not isinstance(current_user._get_current_object(), User):
+        return None
+    return current_user.id
+
+
+@bp.route('/notifications/unread-count', methods=['GET'])
+@login_required
+def notifications_unread_count():
+    """عدد الإشعارات غير المقروءة لشارة شريط التنقل"""
+    try:
+        from notifications import Notification
+        user_id = _notification_reader_id()
+        count = Notification.get_unread_count(user_id) if user_id else 0
+        return jsonify({'success': True, 'unread': count})
+    except Exception as e:
+        db.session.rollback()
+        logging.error(f"[Notifications] Unread count error: {str(e)}")
+        return jsonify({
+            'success': False,
+            'error': 'حدث خطأ أثناء جلب الإشعارات'
+        }), 500
+
+
+@bp.route('/notifications/since', methods=['GET'])
+@login_required
+def notifications_since():
+    """الإشعارات الأحدث من المؤشر since_id - للعملاء الذين يستطلعون دورياً"""
+    try:
+        from notifications import Notification
+        user_id = _notification_reader_id()
+        since_id = request.args.get('since_id', 0, type=int) or 0
+        limit = request.args.get('limit', 50, type=int) or 50
+        if not user_id:
+            return jsonify({'success': True, 'items': [], 'cursor': since_id, 'has_more': False, 'unread': 0})
+        page = Notification.get_notifications_since(user_id, since_id=since_id, limit=limit)
+        return jsonify({
+            'success': True,
+            **page,
+            'unread': Notification.get_unread_count(user_id),
+        })
+    except Exception as e:
+        db.session.rollback()
+        logging.error(f"[Notifications] Polling error: {str(e)}")
+        return jsonify({
+            'success': False,
+            'error': 'حدث خطأ أثناء جلب الإشعارات'
+        }), 500
@@ -1,8 +1,6 @@
 
 
-import qrcode
 import io
-import base64
 import uuid
 from flask import Blueprint, render_template, request, jsonify, send_file, flash, redirect, url_for, abort, current_app
 from flask_login import login_required, current_user
@@ -11,7 +9,8 @@ from extensions import db
 from models import Product, ProductCategory, Supplier, Warehouse, StockLevel, ProductCondition
 import utils
 from utils import permission_required
-from barcodes import normalize_barcode, generate_barcode_image
+from barcodes import normalize_barcode
+from services import label_render
 from datetime import datetime
 import json
 
@@ -25,39 +24,27 @@ def _get_or_404(model, ident):
     return obj
 
 
+def _label_code(product, barcode_type):
+    """(البيانات، النوع) لرمز المنتج: QR بمعرّف المنتج، أو باركوده (EAN-13 خطي إن كان صالحاً)"""
+    if barcode_type == "QR":
+        return f"PRODUCT:{product.id}:{product.sku}", "qr"
+    return product.barcode or product.sku or str(product.id), "auto"
+
+
+def _label_size(code, kind, qr_size):
+    return (300, 100) if label_render.symbology(code, kind) == "ean13" else (qr_size, qr_size)
+
+
 def generate_unique_barcode():
-    import random
-    while True:
-        # توليد باركود من 13 رقم (EAN-13 format)
-        barcode = str(random.randint(1000000000000, 9999999999999))
-        # التأكد من أن الباركود فريد
-        existing = Product.query.filter_by(barcode=barcode).first()
-        if not existing:
-            return barcode
+    """باركود EAN-13 التالي تحت بادئة الشركة (BARCODE_COMPANY_PREFIX) من عداد document_sequences"""
+    from services.barcode_allocator import next_barcode
+    return next_barcode(db.session.connection())
 
 
 def auto_assign_barcodes():
     try:
-        products_without_barcode = Product.query.filter(
-            or_(
-                Product.barcode.is_(None),
-                Product.barcode == "",
-                Product.barcode == "None"
-            )
-        ).filter_by(is_active=True).all()
-        
-        assigned_count = 0
-        for product in products_without_barcode:
-            try:
-                product.barcode = generate_unique_barcode()
-                db.session.add(product)
-                assigned_count += 1
-            except Exception as e:
-                current_app.logger.error(f"Error assigning barcode to product {product.id}: {e}")
-                continue
-        
-        db.session.commit()
-        return assigned_count
+        from services.barcode_allocator import assign_missing
+        return assign_missing(db.session)
     except Exception as e:
         db.session.rollback()
         current_app.logger.error(f"Error in auto_assign_barcodes: {e}")
@@ -160,92 +147,24 @@ def generate_barcode_for_product():
         
         product = _get_or_404(Product, product_id)
         
-        # توليد الباركود
-        if barcode_type == "QR":
-            # QR Code
-            qr = qrcode.QRCode(
-                version=1,
-                error_correction=qrcode.constants.ERROR_CORRECT_L,
-                box_size=10,
-                border=4,
-            )
-            qr.add_data(f"PRODUCT:{product.id}:{product.sku}")
-            qr.make(fit=True)
-            
-            img = qr.make_image(fill_color="black", back_color="white")
-            
-            # تحويل إلى base64
-            buffer = io.BytesIO()
-            img.save(buffer, format='PNG')
-            buffer.seek(0)
-            img_data = base64.b64encode(buffer.getvalue()).decode()
-            
-            return jsonify({
-                "success": True,
-                "barcode_type": "QR",
-                "barcode_data": f"PRODUCT:{product.id}:{product.sku}",
-                "image": f"data:image/png;base64,{img_data}",
-                "product": {
-                    "id": product.id,
-                    "name": product.name,
-                    "sku": product.sku
-                }
-            })
-        
-        else:
-            # باركود خطي
-            barcode_data = product.barcode or product.sku or str(product.id)
-            
-            # استخدام مكتبة الباركود الموجودة
-            try:
-                barcode_image_data = generate_barcode_image(barcode_data)
-                
-                if barcode_image_data:
-                    return jsonify({
-                        "success": True,
-                        "barcode_type": barcode_type,
-                        "barcode_data": barcode_data,
-                        "image": barcode_image_data,
-                        "product": {
-                            "id": product.id,
-                            "name": product.name,
-                            "sku": product.sku,
-                            "barcode": product.barcode
-                        }
-                    })
-                else:
-                    # استخدام QR Code كبديل
-                    qr = qrcode.QRCode(
-                        version=1,
-                        error_correction=qrcode.constants.ERROR_CORRECT_L,
-                        box_size=10,
-                        border=4,
-                    )
-                    qr.add_data(barcode_data)
-                    qr.make(fit=True)
-                    img = qr.make_image(fill_color="black", back_color="white")
-                    
-                    # تحويل إلى base64
-                    buffer = io.BytesIO()
-                    img.save(buffer, format='PNG')
-                    buffer.seek(0)
-                    img_data = base64.b64encode(buffer.getvalue()).decode()
-                    
-                    return jsonify({
-                        "success": True,
-                        "barcode_type": "QR",
-                        "barcode_data": barcode_data,
-                        "image": f"data:image/png;base64,{img_data}",
-                        "product": {
-                            "id": product.id,
-                            "name": product.name,
-                            "sku": product.sku,
-                            "barcode": product.barcode
-                        }
-                    })
-                
-            except Exception as e:
-                return jsonify({"error": f"خطأ في توليد الباركود: {str(e)}"}), 500
+        # توليد الباركود (الصور من كاش label_render حسب الرمز والمقاس)
+        code, kind = _label_code(product, barcode_type)
+        width, height = _label_size(code, kind, 290)
+        try:
+            image = label_render.data_uri(code, kind=kind, width=width, height=height, border=4)
+        except Exception as e:
+            return jsonify({"error": f"خطأ في توليد الباركود: {str(e)}"}), 500
+
+        product_info = {"id": product.id, "name": product.name, "sku": product.sku}
+        if kind != "qr":
+            product_info["barcode"] = product.barcode
+        return jsonify({
+            "success": True,
+            "barcode_type": "QR" if kind == "qr" else barcode_type,
+            "barcode_data": code,
+            "image": image,
+            "product": product_info
+        })
         
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -263,41 +182,16 @@ def print_barcode(product_id):
         if quantity > 100:
             quantity = 100  # حد أقصى للطباعة
         
-        # توليد الباركود
-        barcode_data = product.barcode or product.sku or str(product.id)
-        
-        if barcode_type == "QR":
-            qr = qrcode.QRCode(
-                version=1,
-                error_correction=qrcode.constants.ERROR_CORRECT_L,
-                box_size=8,
-                border=2,
-            )
-            qr.add_data(f"PRODUCT:{product.id}:{product.sku}")
-            qr.make(fit=True)
-            img = qr.make_image(fill_color="black", back_color="white")
-        else:
-            # استخدام QR Code كبديل للباركود العادي
-            qr = qrcode.QRCode(
-                version=1,
-                error_correction=qrcode.constants.ERROR_CORRECT_L,
-                box_size=8,
-                border=2,
-            )
-            qr.add_data(barcode_data)
-            qr.make(fit=True)
-            img = qr.make_image(fill_color="black", back_color="white")
-        
-        # إرسال الصورة للطباعة
-        buffer = io.BytesIO()
-        img.save(buffer, format='PNG')
-        buffer.seek(0)
+        fmt = "svg" if request.args.get("format") == "svg" else "png"
+        code, kind = _label_code(product, barcode_type)
+        width, height = _label_size(code, kind, 200)
+        data = label_render.render(code, kind=kind, fmt=fmt, width=width, height=height)
         
         return send_file(
-            buffer,
-            mimetype='image/png',
+            io.BytesIO(data),
+            mimetype="image/svg+xml" if fmt == "svg" else "image/png",
             as_attachment=True,
-            download_name=f"barcode_{product.sku}_{quantity}.png"
+            download_name=f"barcode_{product.sku}_{quantity}.{fmt}"
         )
         
     except Exception as e:
@@ -316,53 +210,27 @@ def bulk_generate_barcodes():
         if not product_ids:
             return jsonify({"error": "لا توجد منتجات محددة"}), 400
         
-        if len(product_ids) > 50:
-            return jsonify({"error": "لا يمكن توليد أكثر من 50 باركود في المرة الواحدة"}), 400
+        limit = int(current_app.config.get("LABEL_BULK_LIMIT", 500))
+        if len(product_ids) > limit:
+            return jsonify({"error": f"لا يمكن توليد أكثر من {limit} باركود في المرة الواحدة"}), 400
         
+        products = {p.id: p for p in Product.query.filter(Product.id.in_(product_ids)).all()}
         results = []
         
         for product_id in product_ids:
             try:
-                product = Product.query.get(product_id)
+                product = products.get(int(product_id))
                 if not product:
                     continue
                 
-                barcode_data = product.barcode or product.sku or str(product.id)
-                
-                if barcode_type == "QR":
-                    qr = qrcode.QRCode(
-                        version=1,
-                        error_correction=qrcode.constants.ERROR_CORRECT_L,
-                        box_size=6,
-                        border=2,
-                    )
-                    qr.add_data(f"PRODUCT:{product.id}:{product.sku}")
-                    qr.make(fit=True)
-                    img = qr.make_image(fill_color="black", back_color="white")
-                else:
-                    # استخدام QR Code كبديل للباركود العادي
-                    qr = qrcode.QRCode(
-                        version=1,
-                        error_correction=qrcode.constants.ERROR_CORRECT_L,
-                        box_size=6,
-                        border=2,
-                    )
-                    qr.add_data(barcode_data)
-                    qr.make(fit=True)
-                    img = qr.make_image(fill_color="black", back_color="white")
-                
-                # تحويل إلى base64
-                buffer = io.BytesIO()
-                img.save(buffer, format='PNG')
-                buffer.seek(0)
-                img_data = base64.b64encode(buffer.getvalue()).decode()
-                
+                code, kind = _label_code(product, barcode_type)
+                width, height = _label_size(code, kind, 150)
                 results.append({
                     "product_id": product.id,
                     "product_name": product.name,
                     "sku": product.sku,
-                    "barcode_data": barcode_data,
-                    "image": f"data:image/png;base64,{img_data}"
+                    "barcode_data": code,
+                    "image": label_render.data_uri(code, kind=kind, width=width, height=height)
                 })
                 
             except Exception as e:
@@ -378,6 +246,97 @@ def bulk_generate_barcodes():
         return jsonify({"error": str(e)}), 500
 
 
+def _request_ids(data, key):
+    values = data.get(key)
+    if values is None:
+        values = request.values.getlist(key)
+    if isinstance(values, str):
+        values = values.split(",")
+    if not isinstance(values, (list, tuple)):
+        values = [values]
+    ids = []
+    for v in values:
+        try:
+            ids.append(int(v))
+        except (TypeError, ValueError):
+            continue
+    return ids
+
+
+@barcode_scanner_bp.route("/labels/sheet", methods=["GET", "POST"], endpoint="labels_sheet")
+@login_required
+def labels_sheet():
+    """ورقة ملصقات للطباعة: منتجات محددة أو كل بنود شحنة بكمياتها في عرض واحد
+
+    كل رمز مختلف يُرسم مرة واحدة كـ <symbol> SVG (من الكاش) والملصقات المكررة
+    تستخدمه بـ <use>، فمئات الملصقات لا تعني مئات الصور. format=pdf يمرر
+    الورقة نفسها إلى مولّد PDF.
+    """
+    from models import ShipmentItem
+
+    data = request.get_json(silent=True) or {}
+    arg = lambda key, default=None: data.get(key, request.values.get(key, default))
+    barcode_type = arg("type", "CODE128")
+    kind = "qr" if barcode_type == "QR" else "auto"
+    try:
+        columns = min(max(int(arg("columns", 4)), 1), 12)
+        rows = min(max(int(arg("rows", 10)), 1), 40)
+        copies = min(max(int(arg("quantity", 1)), 1), 1000)
+        shipment_id = int(arg("shipment_id") or 0)
+    except (TypeError, ValueError):
+        return jsonify({"error": "قيم غير صالحة"}), 400
+    show_price = str(arg("show_price", "1")).lower() not in ("0", "false", "no")
+
+    quantities = {}
+    if shipment_id:
+        for product_id, qty in (
+            db.session.query(ShipmentItem.product_id, func.sum(ShipmentItem.quantity))
+            .filter(ShipmentItem.shipment_id == shipment_id)
+            .group_by(ShipmentItem.product_id)
+            .order_by(ShipmentItem.product_id)
+        ):
+            quantities[product_id] = max(int(qty or 0), 0)
+    for product_id in _request_ids(data, "product_ids"):
+        quantities.setdefault(product_id, copies)
+    if not quantities:
+        return jsonify({"error": "لا توجد منتجات محددة"}), 400
+
+    max_labels = int(current_app.config.get("LABEL_SHEET_MAX", 2000))
+    products = {p.id: p for p in Product.query.filter(Product.id.in_(list(quantities))).all()}
+    labels = []
+    for product_id, qty in quantities.items():
+        product = products.get(product_id)
+        if not product:
+            continue
+        code, _ = _label_code(product, barcode_type)
+        price = product.selling_price or product.price
+        label = {"name": product.name, "code": code, "price": price if show_price and price else None}
+        labels.extend([label] * min(qty, max_labels - len(labels)))
+        if len(labels) >= max_labels:
+            break
+    truncated = len(labels) >= max_labels and sum(quantities.values()) > max_labels
+
+    html = render_template(
+        "barcode_scanner/labels_sheet.html",
+        pages=label_render.layout_pages(labels, columns, rows),
+        symbols=label_render.sheet_symbols((label["code"] for label in labels), kind),
+        columns=columns,
+        rows=rows,
+        total=len(labels),
+        truncated=truncated,
+        currency=current_app.config.get("DEFAULT_CURRENCY", "ILS"),
+    )
+    if arg("format") == "pdf":
+        try:
+            from services.pdf_render import get_renderer
+            pdf = get_renderer().render(html, base_url=request.url_root)
+            return send_file(io.BytesIO(pdf), mimetype="application/pdf", as_attachment=False,
+                             download_name=f"labels_{shipment_id or 'products'}.pdf")
+        except Exception as e:
+            current_app.logger.warning(f"labels_sheet pdf failed: {e}")
+    return html
+
+
 @barcode_scanner_bp.route("/inventory/update", methods=["POST"], endpoint="inventory_update")
 @login_required
 def inventory_update_by_barcode():
@@ -815,6 +774,11 @@ def barcode_stats():
         return jsonify({"success": False, "error": str(e)}), 500
 
 
+# حقول المنتج الموجود التي يُسمح بتحديثها من الاستيراد الجماعي، ووضع المخزون لكل إجراء
+BULK_UPDATE_FIELDS = ("name", "part_number", "brand", "commercial_name", "origin_country", "unit", "warranty_period", "price")
+BULK_STOCK_MODES = {"add_quantity": "add", "replace_quantity": "replace", "update_info_only": "none"}
+
+
 @barcode_scanner_bp.route("/bulk-import", methods=["POST"], endpoint="bulk_import_products")
 @login_required
 @permission_required("manage_warehouses")
@@ -865,127 +829,101 @@ def bulk_import_products():
             supplier_id = None
             logging.info(f"ℹ️ [Bulk Import] مستودع {warehouse_type} - لا يتطلب شريك/مورد")
         
-        imported_count = 0
-        updated_count = 0
+        from models import ImportRun
+        from services.product_import import ProductImporter
+
         errors = []
-        
-        for i, product_data in enumerate(products_data):
-            try:
-                barcode = product_data.get("barcode", "").strip()
-                name = product_data.get("name", "").strip()
-                part_number = product_data.get("part_number", "").strip()
-                brand = product_data.get("brand", "").strip()
-                commercial_name = product_data.get("commercial_name", "").strip()
-                origin_country = product_data.get("origin_country", "").strip()
-                unit = product_data.get("unit", "").strip()
-                warranty_period = int(product_data.get("warranty_period", 12))
-                price = float(product_data.get("price", 0))
-                quantity = int(product_data.get("quantity", 0))
-                
-                if not barcode or not name:
-                    errors.append(f"باركود أو اسم مفقود: {barcode}")
-                    continue
-                
-                # البحث عن المنتج بالباركود
-                existing_product = Product.query.filter_by(barcode=barcode).first()
-                
-                if existing_product:
-                    # تحديث المنتج الموجود (الحقول المحددة فقط)
-                    update_fields = product_data.get("update_fields", {})
-                    
-                    if update_fields.get("name") and update_fields["name"] != existing_product.name:
-                        existing_product.name = update_fields["name"]
-                    if update_fields.get("part_number") is not None:
-                        existing_product.part_number = update_fields["part_number"]
-                    if update_fields.get("brand") is not None:
-                        existing_product.brand = update_fields["brand"]
-                    if update_fields.get("commercial_name") is not None:
-                        existing_product.commercial_name = update_fields["commercial_name"]
-                    if update_fields.get("origin_country") is not None:
-                        existing_product.origin_country = update_fields["origin_country"]
-                    if update_fields.get("unit") is not None:
-                        existing_product.unit = update_fields["unit"]
-                    if update_fields.get("warranty_period") is not None:
-                        existing_product.warranty_period = update_fields["warranty_period"]
-                    if update_fields.get("price") and update_fields["price"] > 0:
-                        existing_product.price = update_fields["price"]
-                    
-                    existing_product.is_active = True
-                    db.session.add(existing_product)
-                    
-                    # التعامل مع المخزون حسب نوع العملية المحدد
-                    stock = StockLevel.query.filter_by(
-                        product_id=existing_product.id,
-                        warehouse_id=warehouse_id
-                    ).first()
-                    
-                    if stock:
-                        if existing_product_action == "add_quantity":
-                            # إضافة الكمية الجديدة إلى الكمية الموجودة (تراكمي)
-                            stock.quantity += quantity
-                        elif existing_product_action == "replace_quantity":
-                            # استبدال الكمية الموجودة بالكمية الجديدة
-                            stock.quantity = quantity
-                        # إذا كان update_info_only فلا نغير الكمية
-                        stock.updated_at = datetime.utcnow()
-                    else:
-                        # إنشاء مخزون جديد
-                        stock = StockLevel(
-                            product_id=existing_product.id,
-                            warehouse_id=warehouse_id,
-                            quantity=quantity
-                        )
-                    db.session.add(stock)
-                    updated_count += 1
-                    logging.info(f"✅ [Bulk Import] تحديث منتج: {name} ({barcode})")
-                    
-                else:
-                    # إنشاء منتج جديد
-                    new_product = Product(
-                        name=name,
-                        barcode=barcode,
-                        part_number=part_number if part_number else None,
-                        brand=brand if brand else None,
-                        commercial_name=commercial_name if commercial_name else None,
-                        origin_country=origin_country if origin_country else None,
-                        unit=unit if unit else 'قطعة',
-                        warranty_period=warranty_period if warranty_period > 0 else None,
-                        price=price,
-                        purchase_price=price,  # نفس السعر كسعر شراء
-                        selling_price=price,   # نفس السعر كسعر بيع
-                        condition=ProductCondition.NEW.value,  # افتراضياً جديد
-                        is_active=True
-                    )
-                    db.session.add(new_product)
-                    db.session.flush()  # للحصول على ID
-                    
-                    # إضافة المخزون
-                    stock = StockLevel(
-                        product_id=new_product.id,
-                        warehouse_id=warehouse_id,
-                        quantity=quantity
-                    )
-                    db.session.add(stock)
-                    imported_count += 1
-                    logging.info(f"✅ [Bulk Import] إنشاء منتج جديد: {name} ({barcode})")
-                    
-            except Exception as e:
-                error_msg = f"خطأ في المنتج {barcode}: {str(e)}"
-                errors.append(error_msg)
-                logging.error(f"❌ [Bulk Import] {error_msg}")
+        keys = {}
+        for product_data in products_data:
+            barcode = str(product_data.get("barcode") or "").strip()
+            key = normalize_barcode(barcode) if barcode else None
+            if key:
+                keys[barcode] = key
+
+        # البحث عن المنتجات الموجودة بالباركود (استعلامات IN مجزأة بدل استعلام لكل صف)
+        existing = set()
+        values = list(set(keys.values()))
+        for i in range(0, len(values), 500):
+            existing.update(b for (b,) in db.session.query(Product.barcode).filter(Product.barcode.in_(values[i:i + 500])))
+
+        rows = []
+        for product_data in products_data:
+            barcode = str(product_data.get("barcode") or "").strip()
+            name = str(product_data.get("name") or "").strip()
+            if not barcode or not name:
+                errors.append(f"باركود أو اسم مفقود: {barcode}")
                 continue
-        
+            quantity = product_data.get("quantity", 0)
+            if keys.get(barcode) in existing:
+                # تحديث المنتج الموجود (الحقول المحددة فقط)؛ القيم الفارغة لا تُغيّر شيئاً
+                update_fields = product_data.get("update_fields") or {}
+                price = update_fields.get("price")
+                try:
+                    price = price if price and float(price) > 0 else None
+                except (TypeError, ValueError):
+                    price = None
+                row = {f: update_fields.get(f) for f in BULK_UPDATE_FIELDS if f != "price"}
+                row.update(barcode=barcode, price=price, quantity=quantity)
+            else:
+                try:
+                    warranty_period = int(product_data.get("warranty_period", 12))
+                except (TypeError, ValueError):
+                    warranty_period = 12
+                price = product_data.get("price", 0)
+                row = {
+                    "barcode": barcode,
+                    "name": name,
+                    "part_number": product_data.get("part_number"),
+                    "brand": product_data.get("brand"),
+                    "commercial_name": product_data.get("commercial_name"),
+                    "origin_country": product_data.get("origin_country"),
+                    "unit": str(product_data.get("unit") or "").strip() or "قطعة",
+                    "warranty_period": warranty_period if warranty_period > 0 else None,
+                    "price": price,
+                    "purchase_price": price,  # نفس السعر كسعر شراء
+                    "selling_price": price,   # نفس السعر كسعر بيع
+                    "condition": ProductCondition.NEW.value,  # افتراضياً جديد
+                    "quantity": quantity,
+                }
+            rows.append(row)
+
+        run = ImportRun(
+            warehouse_id=warehouse.id,
+            user_id=current_user.id,
+            filename="barcode-scanner",
+            status="QUEUED",
+            meta={"source": "barcode_scanner", "rows": len(rows), "partner_id": partner_id, "supplier_id": supplier_id},
+        )
+        db.session.add(run)
         db.session.commit()
-        
-        logging.info(f"🎉 [Bulk Import] اكتمل الاستيراد: {imported_count} جديد، {updated_count} محدث، {len(errors)} خطأ")
-        
+        importer = ProductImporter(
+            db.session,
+            run,
+            warehouse_id=warehouse.id,
+            strategy="update_product",
+            stock_mode=BULK_STOCK_MODES.get(existing_product_action, "add"),
+            match_on=("barcode",),
+            update_fields=BULK_UPDATE_FIELDS,
+            require_name=False,
+            stock_all_rows=True,
+            activate=True,
+        )
+        counts = importer.execute(rows)
+        errors_count = len(errors) + counts["errors"] + counts["skipped"]
+        for problem in importer.problems:
+            errors.append(f"خطأ في المنتج {problem.get('barcode') or problem.get('name') or problem['rownum']}: {problem.get('note')}")
+        imported_count = counts["inserted"]
+        updated_count = counts["updated"]
+
+        logging.info(f"🎉 [Bulk Import] اكتمل الاستيراد: {imported_count} جديد، {updated_count} محدث، {errors_count} خطأ")
+
         return jsonify({
             "success": True,
             "imported_count": imported_count,
             "updated_count": updated_count,
             "total_processed": imported_count + updated_count,
             "errors": errors[:10],  # أول 10 أخطاء فقط
-            "errors_count": len(errors),
+            "errors_count": errors_count,
             "warehouse_type": warehouse_type,
             "partner_id": partner_id,
             "supplier_id": supplier_id
@@ -3,9 +3,11 @@ from flask_login import login_required, current_user
 from extensions import db
 from models import Budget, BudgetCommitment, Account, Branch, Site, SystemSettings, Expense, ExpenseType
 from sqlalchemy import func, extract
+from sqlalchemy.orm import joinedload
 from datetime import datetime, date
 from decimal import Decimal
 import utils
+from services.budget_analytics import budget_figures
 
 budgets_bp = Blueprint('budgets', __name__, url_prefix='/budgets')
 
@@ -31,22 +33,19 @@ def index():
         query = query.filter_by(branch_id=branch_id)
     
     budgets = query.all()
+    figures = budget_figures(budgets, fiscal_year)
     
     branches = Branch.query.filter_by(is_active=True).all()
     
     budget_data = []
     for budget in budgets:
-        actual = budget.get_actual_amount()
-        committed = budget.get_committed_amount()
-        available = budget.get_available_amount()
-        utilization = ((actual + committed) / float(budget.allocated_amount) * 100) if budget.allocated_amount > 0 else 0
-        
+        fig = figures[budget.id]
         budget_data.append({
             'budget': budget,
-            'actual': actual,
-            'committed': committed,
-            'available': available,
-            'utilization': utilization
+            'actual': fig['actual'],
+            'committed': fig['committed'],
+            'available': fig['available'],
+            'utilization': fig['utilization']
         })
     
     return render_template('budgets/index.html',
@@ -149,15 +148,13 @@ def budget_vs_actual():
     if branch_id:
         query = query.filter_by(branch_id=branch_id)
     
-    budgets = query.all()
+    budgets = query.options(joinedload(Budget.account), joinedload(Budget.branch)).all()
+    figures = budget_figures(budgets, fiscal_year)
     
     report_data = []
     for budget in budgets:
-        actual = budget.get_actual_amount()
-        committed = budget.get_committed_amount()
-        available = budget.get_available_amount()
-        variance = float(budget.allocated_amount) - actual
-        utilization = ((actual + committed) / float(budget.allocated_amount) * 100) if budget.allocated_amount > 0 else 0
+        fig = figures[budget.id]
+        utilization = fig['utilization']
         
         status = 'success'
         if utilization >= 95:
@@ -168,13 +165,15 @@ def budget_vs_actual():
         report_data.append({
             'account': budget.account,
             'branch': budget.branch,
-            'allocated': float(budget.allocated_amount),
-            'actual': actual,
-            'committed': committed,
-            'available': available,
-            'variance': variance,
+            'allocated': fig['allocated'],
+            'actual': fig['actual'],
+            'committed': fig['committed'],
+            'available': fig['available'],
+            'variance': fig['variance'],
             'utilization': utilization,
-            'status': status
+            'status': status,
+            'monthly_actual': fig['monthly_actual'],
+            'monthly_committed': fig['monthly_committed'],
         })
     
     branches = Branch.query.filter_by(is_active=True).all()
@@ -194,19 +193,24 @@ def variance_analysis():
     
     fiscal_year = request.args.get('year', datetime.now().year, type=int)
     
-    budgets = Budget.query.filter_by(fiscal_year=fiscal_year, is_active=True).all()
+    budgets = (
+        Budget.query.filter_by(fiscal_year=fiscal_year, is_active=True)
+        .options(joinedload(Budget.account), joinedload(Budget.branch))
+        .all()
+    )
+    figures = budget_figures(budgets, fiscal_year)
     
     variance_data = []
     for budget in budgets:
-        actual = budget.get_actual_amount()
-        variance = float(budget.allocated_amount) - actual
-        variance_pct = (variance / float(budget.allocated_amount) * 100) if budget.allocated_amount > 0 else 0
+        fig = figures[budget.id]
+        variance = fig['variance']
+        variance_pct = (variance / fig['allocated'] * 100) if fig['allocated'] > 0 else 0
         
         variance_data.append({
             'account': budget.account,
             'branch': budget.branch,
-            'allocated': float(budget.allocated_amount),
-            'actual': actual,
+            'allocated': fig['allocated'],
+            'actual': fig['actual'],
             'variance': variance,
             'variance_pct': variance_pct,
             'status': 'over' if variance < 0 else 'under'
@@ -232,22 +236,25 @@ def dashboard():
         is_active=True
     ).scalar() or 0
     
-    budgets = Budget.query.filter_by(fiscal_year=fiscal_year, is_active=True).all()
+    budgets = (
+        Budget.query.filter_by(fiscal_year=fiscal_year, is_active=True)
+        .options(joinedload(Budget.account), joinedload(Budget.branch))
+        .all()
+    )
+    figures = budget_figures(budgets, fiscal_year)
     
-    total_actual = sum(b.get_actual_amount() for b in budgets)
-    total_committed = sum(b.get_committed_amount() for b in budgets)
+    total_actual = sum(f['actual'] for f in figures.values())
+    total_committed = sum(f['committed'] for f in figures.values())
     total_available = float(total_allocated) - total_actual - total_committed
     
     utilization = ((total_actual + total_committed) / float(total_allocated) * 100) if total_allocated > 0 else 0
     
+    threshold_warning = SystemSettings.get_setting('budget_threshold_warning', 80)
+    threshold_critical = SystemSettings.get_setting('budget_threshold_critical', 95)
+    
     alerts = []
     for budget in budgets:
-        actual = budget.get_actual_amount()
-        committed = budget.get_committed_amount()
-        util = ((actual + committed) / float(budget.allocated_amount) * 100) if budget.allocated_amount > 0 else 0
-        
-        threshold_warning = SystemSettings.get_setting('budget_threshold_warning', 80)
-        threshold_critical = SystemSettings.get_setting('budget_threshold_critical', 95)
+        util = figures[budget.id]['utilization']
         
         if util >= threshold_critical:
             alerts.append({
@@ -280,3 +287,29 @@ def dashboard():
                          alerts=alerts,
                          by_branch=by_branch)
 
+
+
+@budgets_bp.route('/report/figures.json')
+@login_required
+def figures_json():
+    """أرقام كل ميزانيات السنة مع التوزيع الشهري (للوحات والرسوم البيانية) في طلب واحد"""
+    if not SystemSettings.get_setting('enable_budget_module', False):
+        return jsonify({'success': False, 'error': 'budget_module_disabled'}), 403
+    
+    fiscal_year = request.args.get('year', datetime.now().year, type=int)
+    branch_id = request.args.get('branch', None, type=int)
+    
+    query = Budget.query.filter_by(fiscal_year=fiscal_year, is_active=True)
+    if branch_id:
+        query = query.filter_by(branch_id=branch_id)
+    budgets = query.all()
+    figures = budget_figures(budgets, fiscal_year)
+    
+    return jsonify({
+        'success': True,
+        'fiscal_year': fiscal_year,
+        'budgets': [
+            dict(figures[b.id], id=b.id, account_code=b.account_code, branch_id=b.branch_id, site_id=b.site_id)
+            for b in budgets
+        ],
+    })
@@ -9,6 +9,7 @@ from sqlalchemy import func, and_, or_, desc, text as sa_text
 from datetime import datetime, date, timedelta
 from decimal import Decimal
 from functools import wraps
+from services.cost_center_analytics import center_totals, month_periods, monthly_matrix
 
 cost_centers_advanced_bp = Blueprint('cost_centers_advanced', __name__, url_prefix='/cost-centers')
 
@@ -54,13 +55,13 @@ def dashboard():
     ).group_by(CostCenter.id).order_by(desc('total')).limit(5).all()
     
     over_budget = []
-    for center in CostCenter.query.filter(
+    budgeted = CostCenter.query.filter(
         CostCenter.is_active == True,
         CostCenter.budget_amount > 0
-    ).all():
-        allocated = db.session.query(func.sum(CostCenterAllocation.amount)).filter_by(
-            cost_center_id=center.id
-        ).scalar() or 0
+    ).all()
+    totals = center_totals(db.session, [c.id for c in budgeted])
+    for center in budgeted:
+        allocated = Decimal(str(totals.get(center.id, 0)))
         
         if allocated > center.budget_amount:
             over_budget.append({
@@ -332,40 +333,32 @@ def report_trends():
     cost_center_id = request.args.get('cost_center', type=int)
     months = request.args.get('months', 12, type=int)
     
+    limit = min(max(request.args.get('limit', 10, type=int), 1), 500)
+    months = min(max(months, 1), 120)
+    
     if cost_center_id:
         center = CostCenter.query.get_or_404(cost_center_id)
         centers = [center]
     else:
-        centers = CostCenter.query.filter_by(is_active=True).order_by(CostCenter.code).limit(10).all()
+        centers = CostCenter.query.filter_by(is_active=True).order_by(CostCenter.code).limit(limit).all()
+    
+    # مصفوفة المراكز × الأشهر كاملة من جدول التجميع في استعلام واحد
+    periods = month_periods(months)
+    matrix = monthly_matrix(db.session, [c.id for c in centers], periods)
     
     trends_data = []
     
     for center in centers:
         monthly_data = []
         
-        for i in range(months):
-            month_date = date.today().replace(day=1) - timedelta(days=30 * i)
-            month_start = month_date.replace(day=1)
-            
-            if month_date.month == 12:
-                month_end = month_date.replace(year=month_date.year + 1, month=1, day=1) - timedelta(days=1)
-            else:
-                month_end = month_date.replace(month=month_date.month + 1, day=1) - timedelta(days=1)
-            
-            total = db.session.query(func.sum(CostCenterAllocation.amount)).filter(
-                CostCenterAllocation.cost_center_id == center.id,
-                CostCenterAllocation.allocation_date >= month_start,
-                CostCenterAllocation.allocation_date <= month_end
-            ).scalar() or 0
-            
+        for period, amount in zip(periods, matrix[center.id]):
+            month_date = datetime.strptime(period, '%Y-%m')
             monthly_data.append({
-                'month': month_date.strftime('%Y-%m'),
+                'month': period,
                 'month_name': month_date.strftime('%B %Y'),
-                'amount': float(total)
+                'amount': amount
             })
         
-        monthly_data.reverse()
-        
         avg_monthly = sum(m['amount'] for m in monthly_data) / len(monthly_data) if monthly_data else 0
         
         last_month = monthly_data[-1]['amount'] if monthly_data else 0
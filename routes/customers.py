@@ -397,10 +397,10 @@ def list_customers():
     if print_mode:
         context["pdf_export"] = True
         try:
-            from weasyprint import HTML
+            from services.pdf_render import get_renderer
 
             html_output = render_template("customers/list.html", **context)
-            pdf_bytes = HTML(string=html_output, base_url=request.url_root).write_pdf()
+            pdf_bytes = get_renderer().render(html_output, base_url=request.url_root)
             filename = f"customers_{datetime.utcnow().strftime('%Y%m%d_%H%M')}.pdf"
             return Response(
                 pdf_bytes,
@@ -940,19 +940,9 @@ def export_customer_vcf(customer_id):
     vcf = "BEGIN:VCARD\r\nVERSION:3.0\r\n" f"FN:{c.name}\r\n" f"TEL:{c.phone or ''}\r\n" f"EMAIL:{c.email or ''}\r\n" "END:VCARD\r\n"
     return Response(vcf, mimetype="text/vcard; charset=utf-8", headers={"Content-Disposition": f"attachment; filename={safe_name}.vcf"})
 
-@customers_bp.route("/<int:customer_id>/account_statement", methods=["GET"], endpoint="account_statement")
-@login_required
-def account_statement(customer_id):
-    if getattr(current_user, "__tablename__", "") == "customers" and getattr(current_user, "id", None) != customer_id:
-        abort(403)
-    from models import Check, CheckStatus
-    
-    c = db.session.get(Customer, customer_id) or abort(404)
-    db.session.refresh(c)
-    
-    from datetime import datetime, timedelta
-    start_date_arg = request.args.get("start_date")
-    end_date_arg = request.args.get("end_date")
+def _statement_period(args):
+    start_date_arg = args.get("start_date")
+    end_date_arg = args.get("end_date")
     try:
         start_date = datetime.strptime(start_date_arg, "%Y-%m-%d") if start_date_arg else datetime(2025, 1, 1)
     except Exception:
@@ -961,6 +951,14 @@ def account_statement(customer_id):
         end_date = datetime.strptime(end_date_arg, "%Y-%m-%d") if end_date_arg else datetime.now()
     except Exception:
         end_date = datetime.now()
+    return start_date, end_date
+
+
+def _account_statement_context(c, start_date, end_date) -> dict:
+    """بيانات كشف حساب العميل للفترة (تُستخدم للعرض وJSON وPDF والتصدير الجماعي)"""
+    from models import Check, CheckStatus
+    from datetime import datetime, timedelta
+    customer_id = c.id
 
     try:
         from flask import current_app
@@ -2478,14 +2476,30 @@ def account_statement(customer_id):
         "end_date": end_date,
         "money_fmt": money_fmt,
     }
+    return context
+
+
+def _statement_filename(c, start_date, end_date) -> str:
+    return f"statement_{c.id}_{start_date:%Y%m%d}_{end_date:%Y%m%d}.pdf"
+
+
+@customers_bp.route("/<int:customer_id>/account_statement", methods=["GET"], endpoint="account_statement")
+@login_required
+def account_statement(customer_id):
+    if getattr(current_user, "__tablename__", "") == "customers" and getattr(current_user, "id", None) != customer_id:
+        abort(403)
+    c = db.session.get(Customer, customer_id) or abort(404)
+    db.session.refresh(c)
+    start_date, end_date = _statement_period(request.args)
+    context = _account_statement_context(c, start_date, end_date)
     if request.args.get("format") == "json":
         return jsonify({
-            "total_debit": float(total_debit),
-            "total_credit": float(total_credit),
+            "total_debit": float(context["total_debit"]),
+            "total_credit": float(context["total_credit"]),
             "balance": float(context["balance"]),
-            "period_total_debit": float(total_debit_period),
-            "period_total_credit": float(total_credit_period),
-            "period_balance": float(balance_period),
+            "period_total_debit": float(context["period_total_debit"]),
+            "period_total_credit": float(context["period_total_credit"]),
+            "period_balance": float(context["period_balance"]),
             "entries": [
                 {
                     "date": (e.get("date").isoformat() if e.get("date") else None),
@@ -2495,11 +2509,54 @@ def account_statement(customer_id):
                     "debit": float(e.get("debit", 0) or 0),
                     "credit": float(e.get("credit", 0) or 0),
                 }
-                for e in entries
+                for e in context["ledger_entries"]
             ],
         })
+    if request.args.get("format") == "pdf":
+        from services.pdf_render import get_renderer
+        html_output = render_template("customers/account_statement.html", pdf_export=True, **context)
+        pdf_bytes = get_renderer().render(html_output, base_url=request.url_root)
+        return Response(
+            pdf_bytes,
+            mimetype="application/pdf",
+            headers={"Content-Disposition": f'inline; filename="{_statement_filename(c, start_date, end_date)}"'},
+        )
     return render_template("customers/account_statement.html", pdf_export=False, **context)
 
+
+@customers_bp.route("/account_statements.zip", methods=["GET", "POST"], endpoint="account_statements_zip")
+@login_required
+def account_statements_zip():
+    """كشوف حساب عدة عملاء دفعة واحدة: HTML يُبنى هنا وPDF يتولد بالتوازي في عمّال WeasyPrint"""
+    if getattr(current_user, "__tablename__", "") == "customers":
+        abort(403)
+    from services.pdf_render import get_renderer
+    raw_ids = request.values.getlist("ids") or (request.values.get("ids") or "").split(",")
+    ids = []
+    for value in raw_ids:
+        for part in str(value).split(","):
+            if part.strip().isdigit():
+                ids.append(int(part))
+    limit = int(current_app.config.get("PDF_BULK_LIMIT", 200) or 200)
+    ids = list(dict.fromkeys(ids))[:limit]
+    if not ids:
+        return jsonify(error="ids_required", message="حدد العملاء المطلوب تصدير كشوفهم"), 400
+    start_date, end_date = _statement_period(request.values)
+    items = []
+    for c in Customer.query.filter(Customer.id.in_(ids)).order_by(Customer.id).all():
+        context = _account_statement_context(c, start_date, end_date)
+        items.append((
+            _statement_filename(c, start_date, end_date),
+            render_template("customers/account_statement.html", pdf_export=True, **context),
+        ))
+    archive = get_renderer().render_zip(items, base_url=request.url_root)
+    filename = f"statements_{datetime.utcnow():%Y%m%d_%H%M}.zip"
+    return Response(
+        archive,
+        mimetype="application/zip",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
 @customers_bp.route("/advanced_filter", methods=["GET"], endpoint="advanced_filter")
 @login_required
 def advanced_filter():
@@ -7,7 +7,7 @@ import json
 
 from models import (
     db, Account, GLBatch, GLEntry, Customer, Supplier, Partner,
-    Sale, Payment, Expense, Invoice, ServiceRequest
+    Sale, Payment, Expense, Invoice, ServiceRequest, CogsEntry
 )
 from routes.security import owner_only
 
@@ -1012,6 +1012,15 @@ def profit_trends():
                 GLEntry.account.like('5%')
             ).scalar() or 0
             
+            # تكلفة البضاعة المباعة المجمدة (مبيعات + قطع صيانة)
+            cogs = db.session.query(
+                func.sum(CogsEntry.total_cost)
+            ).filter(
+                CogsEntry.document_type.in_(('SALE', 'SERVICE')),
+                CogsEntry.posted_at >= month_start,
+                CogsEntry.posted_at < month_end + timedelta(days=1)
+            ).scalar() or 0
+            
             profit = float(revenue) - float(expenses)
             
             monthly_data.append({
@@ -1019,6 +1028,8 @@ def profit_trends():
                 'month_name': month_start.strftime('%B %Y'),
                 'revenue': float(revenue),
                 'expenses': float(expenses),
+                'cogs': float(cogs),
+                'gross_profit': float(revenue) - float(cogs),
                 'profit': profit,
                 'margin': (profit / float(revenue) * 100) if float(revenue) > 0 else 0
             })
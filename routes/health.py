@@ -15,6 +15,7 @@ from sqlalchemy.exc import SQLAlchemyError
 
 from extensions import db, cache, socketio
 from models import User, Product, ServiceRequest, Sale, Payment
+from services.system_metrics import current_snapshot
 
 health_bp = Blueprint("health", __name__, url_prefix="/health")
 
@@ -34,10 +35,12 @@ def _check_database() -> Dict[str, Any]:
             }
 
             try:
-                from extensions import cache
+                counts = current_snapshot().get("counts") or {}
                 cache_key = 'health_records_stats'
                 cached = cache.get(cache_key)
-                if cached is not None:
+                if all(k in counts for k in ("users", "products", "services", "sales", "payments")):
+                    stats["records"] = {k: counts[k] for k in ("users", "products", "services", "sales", "payments")}
+                elif cached is not None:
                     stats["records"] = cached
                 else:
                     stats["records"] = {
@@ -188,7 +191,7 @@ def _get_system_info() -> Dict[str, Any]:
             "python_version": sys.version,
             "platform": sys.platform,
             "cpu_count": os.cpu_count(),
-            "cpu_percent": psutil.cpu_percent(interval=0.1),
+            "cpu_percent": current_snapshot().get("cpu_percent"),
         }
     except Exception as e:
         return {
@@ -267,9 +270,19 @@ def readiness():
         # فحص الاتصال بقاعدة البيانات فقط
         db.session.execute(text("SELECT 1")).scalar()
 
+        # في وضع LAZY_STARTUP: فشل فحص السلامة المؤجل يجعل العملية غير جاهزة
+        lazy = current_app.extensions.get("lazy_startup")
+        if lazy and lazy.get("integrity_error"):
+            return jsonify({
+                "status": "not_ready",
+                "timestamp": datetime.now(timezone.utc).isoformat() + "Z",
+                "error": lazy["integrity_error"],
+            }), 503
+
         return jsonify({
             "status": "ready",
             "timestamp": datetime.now(timezone.utc).isoformat() + "Z",
+            "warmup_done": lazy.get("done") if lazy else True,
         }), 200
     except Exception as e:
         return jsonify({
@@ -289,6 +302,31 @@ def liveness():
         "timestamp": datetime.now(timezone.utc).isoformat() + "Z",
     }), 200
 
+@health_bp.route("/compression", methods=["GET"])
+def compression_metrics():
+    """
+    مقاييس ضغط الاستجابات لكل endpoint (لهذه العملية فقط)
+    Per-endpoint response compression metrics
+    """
+    policy = current_app.extensions.get("compression_policy")
+    return jsonify({
+        "timestamp": datetime.now(timezone.utc).isoformat() + "Z",
+        "pid": os.getpid(),
+        "min_size": current_app.config.get("COMPRESS_MIN_SIZE"),
+        "endpoints": policy.metrics.snapshot() if policy else {},
+    }), 200
+
+@health_bp.route("/startup", methods=["GET"])
+def startup_profile():
+    """
+    تقرير زمن الإقلاع (متاح فقط عند التشغيل مع STARTUP_PROFILE=1)
+    Startup import/phase timings
+    """
+    data = current_app.extensions.get("startup_profile")
+    if not data:
+        return jsonify({"status": "disabled", "hint": "set STARTUP_PROFILE=1"}), 404
+    return jsonify(data), 200
+
 @health_bp.route("/metrics", methods=["GET"])
 def metrics():
     """
@@ -297,23 +335,25 @@ def metrics():
     """
     try:
         process = psutil.Process()
+        snapshot = current_snapshot()
 
         metrics_data = {
             "timestamp": datetime.now(timezone.utc).isoformat() + "Z",
             "process": {
                 "memory_rss_mb": round(process.memory_info().rss / (1024**2), 2),
                 "memory_percent": round(process.memory_percent(), 2),
-                "cpu_percent": round(process.cpu_percent(interval=0.1), 2),
+                "cpu_percent": snapshot.get("process_cpu_percent"),
                 "num_threads": process.num_threads(),
                 "create_time": datetime.fromtimestamp(process.create_time()).isoformat(),
             },
             "system": {
                 "cpu_count": os.cpu_count(),
-                "cpu_percent": psutil.cpu_percent(interval=0.1),
-                "memory_total_gb": round(psutil.virtual_memory().total / (1024**3), 2),
-                "memory_available_gb": round(psutil.virtual_memory().available / (1024**3), 2),
-                "memory_percent": round(psutil.virtual_memory().percent, 2),
-            }
+                "cpu_percent": snapshot.get("cpu_percent"),
+                "memory_total_gb": snapshot.get("memory_total_gb"),
+                "memory_available_gb": snapshot.get("memory_available_gb"),
+                "memory_percent": snapshot.get("memory_percent"),
+            },
+            "sampled_at": snapshot.get("sampled_at"),
         }
 
         return jsonify(metrics_data), 200
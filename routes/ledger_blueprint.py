@@ -3,8 +3,8 @@ from datetime import datetime, timedelta
 from flask import Blueprint, request, jsonify, render_template, current_app, abort
 from flask_login import login_required, current_user
 from flask_wtf.csrf import CSRFProtect
-from sqlalchemy import func, and_, or_, desc
-from extensions import db
+from sqlalchemy import func, and_, or_, desc, select
+from extensions import db, cache
 import utils
 from models import (
     Sale, SaleReturn, Expense, Payment, ServiceRequest,
@@ -17,11 +17,16 @@ from services.ledger_service import (
     SmartEntityExtractor, LedgerQueryOptimizer, CurrencyConverter,
     LedgerStatisticsCalculator, LedgerCache
 )
+from services.ledger_journal import (
+    KIND_RANK, JournalQuery, UnifiedJournal, decode_cursor
+)
 
 csrf = CSRFProtect()
 
 ledger_bp = Blueprint("ledger", __name__, url_prefix="/ledger")
 
+LEDGER_STATS_CACHE_TIMEOUT = 300
+
 
 @ledger_bp.before_request
 def _restrict_super_admin():
@@ -166,1214 +171,523 @@ def create_manual_entry():
         
         return jsonify({'success': False, 'error': str(e)}), 500
 
-@ledger_bp.route("/data", methods=["GET"], endpoint="get_ledger_data")
-@login_required
-def get_ledger_data():
-    """جلب بيانات دفتر الأستاذ من قاعدة البيانات الحقيقية"""
+
+_METHOD_AR = {
+    'cash': 'نقداً',
+    'card': 'بطاقة',
+    'bank': 'تحويل بنكي',
+    'online': 'إلكتروني',
+    'cheque': 'شيك'
+}
+
+
+def _method_raw(obj):
+    mv = getattr(obj, 'method', 'cash')
+    if hasattr(mv, 'value'):
+        mv = mv.value
+    return str(mv or '').lower()
+
+
+def _journal_entry(row):
+    """تحويل سطر القراءة الموحدة إلى شكل القيد الذي تعرضه الصفحة"""
+    kind = row['entry_type']
+    src_id = row['src_id']
+    if row['kind_rank'] in (KIND_RANK['opening'], KIND_RANK['stock']):
+        entry_id = 0
+    elif kind == 'prepaid':
+        entry_id = f"PREPAID-{src_id}"
+    elif kind == 'manual':
+        entry_id = f"MANUAL-{src_id}-{row['line_id']}"
+    else:
+        entry_id = src_id
+    entry_date = row['entry_date']
+    if isinstance(entry_date, datetime):
+        date_str = entry_date.strftime('%Y-%m-%d')
+    else:
+        date_str = str(entry_date or '')[:10]
+    return {
+        "id": entry_id,
+        "date": date_str,
+        "transaction_number": row['number'],
+        "type": kind,
+        "type_ar": row['type_ar'],
+        "description": row['description'] or '',
+        "debit": float(row['debit'] or 0),
+        "credit": float(row['credit'] or 0),
+        "balance": float(row['balance'] or 0),
+        "entity_name": row['entity_name'] or '—',
+        "entity_type": row['entity_type'] or ''
+    }
+
+
+def _enrich_expense_entries(entries):
+    """إضافة طرق ومراجع السداد للمصاريف بصفحة واحدة باستعلام واحد"""
+    ids = [e['id'] for e in entries]
+    if not ids:
+        return
+    linked = {}
     try:
-        from models import fx_rate
-        
-        from_date_str = request.args.get('from_date')
-        to_date_str = request.args.get('to_date')
-        transaction_type = request.args.get('transaction_type', '').strip()
-        
-        # تحليل التواريخ
-        from_date = datetime.strptime(from_date_str, '%Y-%m-%d') if from_date_str else None
-        to_date = datetime.strptime(to_date_str, '%Y-%m-%d').replace(hour=23, minute=59, second=59) if to_date_str else None
-        
-        ledger_entries = []
-        running_balance = 0.0
-        
-        # 0. الرصيد الافتتاحي لجميع العملاء/الموردين/الشركاء
-        if not transaction_type or transaction_type == 'opening':
-            opening_total = 0.0
-            
-            # جمع الرصيد الافتتاحي للعملاء
-            customers_opening = db.session.query(
-                func.coalesce(func.sum(Customer.opening_balance), 0)
-            ).scalar() or 0
-            opening_total += float(customers_opening)
-            
-            # جمع الرصيد الافتتاحي للموردين
-            suppliers_opening = db.session.query(
-                func.coalesce(func.sum(Supplier.opening_balance), 0)
-            ).scalar() or 0
-            opening_total += float(suppliers_opening)
-            
-            # جمع الرصيد الافتتاحي للشركاء
-            partners_opening = db.session.query(
-                func.coalesce(func.sum(Partner.opening_balance), 0)
-            ).scalar() or 0
-            opening_total += float(partners_opening)
-            
-            if opening_total != 0:
-                # موجب = له علينا → دائن
-                # سالب = عليه لنا → مدين
-                if opening_total < 0:  # سالب = عليه = مدين
-                    debit_val = abs(opening_total)
-                    credit_val = 0.0
-                    running_balance += abs(opening_total)
-                else:  # موجب = له = دائن
-                    debit_val = 0.0
-                    credit_val = opening_total
-                    running_balance -= opening_total
-                
-                opening_date = from_date.strftime('%Y-%m-%d') if from_date else '2024-01-01'
-                ledger_entries.append({
-                    "id": 0,
-                    "date": opening_date,
-                    "transaction_number": "OPENING-BALANCE",
-                    "type": "opening",
-                    "type_ar": "رصيد افتتاحي",
-                    "description": f"الرصيد الافتتاحي الإجمالي (عملاء + موردين + شركاء)",
-                    "debit": debit_val,
-                    "credit": credit_val,
-                    "balance": running_balance,
-                    "entity_name": "—",
-                    "entity_type": ""
-                })
-        
-        # 1. المخزون الحالي - يُعرض دائماً بغض النظر عن الفترة
-        if True:  # نعرض المخزون دائماً
-            # حساب قيمة المخزون كقيد افتتاحي
-            total_stock_value = 0.0
-            total_stock_qty = 0
-            
-            # جلب المخزون مجمّع حسب المنتج (بسعر التكلفة)
-            stock_summary = (
-                db.session.query(
-                    Product.id,
-                    Product.name,
-                    Product.purchase_price,
-                    Product.currency,
-                    func.sum(StockLevel.quantity).label('total_qty')
-                )
-                .join(StockLevel, StockLevel.product_id == Product.id)
-                .filter(StockLevel.quantity > 0)
-                .group_by(Product.id, Product.name, Product.purchase_price, Product.currency)
-                .all()
-            )
-            
-            for row in stock_summary:
-                qty = float(row.total_qty or 0)
-                price = float(row.purchase_price or 0)  # سعر التكلفة وليس سعر البيع
-                product_currency = row.currency
-                
-                # تحويل للشيقل - استخدام تاريخ اليوم دائماً
-                if product_currency and product_currency != 'ILS' and price > 0:
-                    try:
-                        rate = fx_rate(product_currency, 'ILS', datetime.utcnow(), raise_on_missing=False)
-                        if rate and rate > 0:
-                            price = float(price * float(rate))
-                    except Exception:
-                        pass
-                
-                total_stock_value += qty * price
-                total_stock_qty += int(qty)
-            
-            if total_stock_value > 0:
-                running_balance += total_stock_value
-                # استخدام التاريخ الأقدم أو اليوم
-                stock_date = from_date.strftime('%Y-%m-%d') if from_date else datetime.utcnow().strftime('%Y-%m-%d')
-                ledger_entries.append({
-                    "id": 0,
-                    "date": stock_date,
-                    "transaction_number": "STOCK-VALUE",
-                    "type": "opening",
-                    "type_ar": "قيمة المخزون",
-                    "description": f"قيمة المخزون الحالي ({total_stock_qty} قطعة من {len(stock_summary)} منتج)",
-                    "debit": total_stock_value,
-                    "credit": 0.0,
-                    "balance": running_balance,
-                    "entity_name": "—",
-                    "entity_type": ""
-                })
-        
-        # 1. المبيعات (Sales)
-        if not transaction_type or transaction_type == 'sale':
-            sales = LedgerQueryOptimizer.get_sales_optimized(from_date, to_date)
-            
-            for sale in sales:
-                customer_name = sale.customer.name if sale.customer else "عميل غير محدد"
-                debit = CurrencyConverter.convert_to_ils(
-                    float(sale.total_amount or 0),
-                    sale.currency or 'ILS',
-                    sale.sale_date,
-                    getattr(sale, 'fx_rate_used', None)
-                )
-                running_balance += debit
-                
-                ledger_entries.append({
-                    "id": sale.id,
-                    "date": sale.sale_date.strftime('%Y-%m-%d'),
-                    "transaction_number": f"SALE-{sale.id}",
-                    "type": "sale",
-                    "type_ar": "مبيعات",
-                    "description": f"فاتورة مبيعات - {customer_name}",
-                    "debit": debit,
-                    "credit": 0.0,
-                    "balance": running_balance,
-                    "entity_name": customer_name,
-                    "entity_type": "عميل"
-                })
+        rows = (
+            Payment.query.filter(Payment.expense_id.in_(ids))
+            .filter(Payment.status.in_(['COMPLETED', 'PENDING']))
+            .order_by(Payment.payment_date, Payment.id)
+            .all()
+        )
+    except Exception:
+        rows = []
+    for pmt in rows:
+        linked.setdefault(pmt.expense_id, []).append(pmt)
 
-        if not transaction_type or transaction_type in ['sale_return', 'return']:
-            sale_returns_query = SaleReturn.query.filter(SaleReturn.status == 'CONFIRMED')
-            if from_date:
-                sale_returns_query = sale_returns_query.filter(SaleReturn.created_at >= from_date)
-            if to_date:
-                sale_returns_query = sale_returns_query.filter(SaleReturn.created_at <= to_date)
-            sale_returns = sale_returns_query.order_by(SaleReturn.created_at, SaleReturn.id).all()
-            
-            for sale_return in sale_returns:
-                amount = CurrencyConverter.convert_to_ils(
-                    float(sale_return.total_amount or 0),
-                    sale_return.currency or 'ILS',
-                    sale_return.created_at or datetime.utcnow(),
-                    getattr(sale_return, 'fx_rate_used', None)
-                )
-                if amount <= 0:
-                    continue
-                customer_name = sale_return.customer.name if sale_return.customer else "عميل غير محدد"
-                running_balance -= amount
-                
-                ledger_entries.append({
-                    "id": sale_return.id,
-                    "date": (sale_return.created_at or datetime.utcnow()).strftime('%Y-%m-%d'),
-                    "transaction_number": f"RET-{sale_return.id}",
-                    "type": "sale_return",
-                    "type_ar": "مرتجع مبيعات",
-                    "description": f"مرتجع مبيعات - {customer_name}",
-                    "debit": 0.0,
-                    "credit": amount,
-                    "balance": running_balance,
-                    "entity_name": customer_name,
-                    "entity_type": "عميل"
-                })
-        
-        # 2. المشتريات والنفقات (Expenses)
-        if not transaction_type or transaction_type in ['purchase', 'expense']:
-            expenses = LedgerQueryOptimizer.get_expenses_optimized(from_date, to_date)
-            
-            for expense in expenses:
-                amount_ils = CurrencyConverter.convert_to_ils(
-                    float(expense.amount or 0),
-                    expense.currency or 'ILS',
-                    expense.date,
-                    getattr(expense, 'fx_rate_used', None)
-                )
-                
-                exp_type = expense.type.name if expense.type else "مصروف"
-                exp_type_code = None
-                if expense.type and hasattr(expense.type, 'code'):
-                    exp_type_code = (expense.type.code or '').strip().upper()
-                
-                is_supplier_service = (
-                    exp_type_code == "SUPPLIER_EXPENSE" or
-                    (expense.supplier_id and (getattr(expense, 'payee_type', '') or '').upper() == "SUPPLIER")
-                )
-                is_partner_service = (
-                    exp_type_code == "PARTNER_EXPENSE" or
-                    (expense.partner_id and (getattr(expense, 'payee_type', '') or '').upper() == "PARTNER")
-                )
-                
-                if is_supplier_service or is_partner_service:
-                    debit = amount_ils
-                    credit = 0.0
-                    running_balance += debit
-                else:
-                    debit = 0.0
-                    credit = amount_ils
-                    running_balance -= credit
-                
-                expense_entity_name = "غير محدد"
-                expense_entity_type = ""
-                if expense.customer:
-                    expense_entity_name = expense.customer.name
-                    expense_entity_type = "عميل"
-                elif expense.supplier:
-                    expense_entity_name = expense.supplier.name
-                    expense_entity_type = "مورد"
-                elif expense.partner:
-                    expense_entity_name = expense.partner.name
-                    expense_entity_type = "شريك"
-                elif expense.employee:
-                    expense_entity_name = expense.employee.name
-                    expense_entity_type = "موظف"
-                elif expense.paid_to:
-                    expense_entity_name = expense.paid_to
-                    expense_entity_type = "جهة"
-                elif expense.payee_name:
-                    expense_entity_name = expense.payee_name
-                    expense_entity_type = "جهة"
-                
-                try:
-                    linked_payments = Payment.query.filter(Payment.expense_id == expense.id).filter(Payment.status.in_(['COMPLETED','PENDING'])).order_by(Payment.payment_date, Payment.id).all()
-                except Exception:
-                    linked_payments = []
-
-                description = expense.description or f"مصروف - {exp_type}"
-                if linked_payments:
-                    methods = []
-                    refs = []
-                    checks_info = []
-                    for pmt in linked_payments:
-                        mv = getattr(pmt, 'method', 'cash')
-                        if hasattr(mv, 'value'):
-                            mv = mv.value
-                        mraw = str(mv or '').lower()
-                        method_ar = {
-                            'cash': 'نقداً',
-                            'card': 'بطاقة',
-                            'bank': 'تحويل بنكي',
-                            'online': 'إلكتروني',
-                            'cheque': 'شيك'
-                        }.get(mraw, mraw)
-                        methods.append(method_ar)
-                        refs.append(getattr(pmt, 'payment_number', None) or getattr(pmt, 'receipt_number', None) or f"PAY-{pmt.id}")
-                        if mraw == 'cheque':
-                            cn = getattr(pmt, 'check_number', None)
-                            cb = getattr(pmt, 'check_bank', None)
-                            cd = getattr(pmt, 'check_due_date', None)
-                            if cd:
-                                try:
-                                    cd_str = cd.strftime('%Y-%m-%d')
-                                except Exception:
-                                    cd_str = str(cd)
-                            else:
-                                cd_str = None
-                            parts = []
-                            if cn:
-                                parts.append(f"#{cn}")
-                            if cb:
-                                parts.append(cb)
-                            if cd_str:
-                                parts.append(f"استحقاق: {cd_str}")
-                            if parts:
-                                checks_info.append("شيك " + " - ".join(parts))
-                    mdisp = ", ".join(sorted(set([m for m in methods if m])))
-                    rdisp = ", ".join(sorted(set([r for r in refs if r])))
-                    cdisp = "; ".join(checks_info)
-                    parts = []
-                    if mdisp:
-                        parts.append(f"سداد: {mdisp}")
-                    if rdisp:
-                        parts.append(f"مراجع: {rdisp}")
-                    if cdisp:
-                        parts.append(cdisp)
-                    if parts:
-                        description = f"{description} — " + " | ".join(parts)
-
-                ledger_entries.append({
-                    "id": expense.id,
-                    "date": expense.date.strftime('%Y-%m-%d'),
-                    "transaction_number": f"EXP-{expense.id}",
-                    "type": "expense",
-                    "type_ar": exp_type,
-                    "description": description,
-                    "debit": debit,
-                    "credit": credit,
-                    "balance": running_balance,
-                    "entity_name": expense_entity_name,
-                    "entity_type": expense_entity_type
-                })
-        
-        # 3. الدفعات (Payments)
-        if not transaction_type or transaction_type == 'payment':
-            payments = LedgerQueryOptimizer.get_payments_optimized(from_date, to_date)
-            
-            for payment in payments:
-                if getattr(payment, 'expense_id', None):
-                    continue
-                payment_status = getattr(payment, 'status', 'COMPLETED')
-                
-                checks_related = LedgerQueryOptimizer.get_checks_for_payment(payment.id)
-                
-                splits = list(getattr(payment, 'splits', []) or [])
-                if splits:
-                    split_ids = [s.id for s in splits]
-                    split_checks = LedgerQueryOptimizer.get_checks_for_splits(split_ids)
-                    checks_related.extend(split_checks)
-                
-                has_returned_check = False
-                has_bounced_check = False
-                has_pending_check = False
-                check_statuses = []
-                
-                for check in checks_related:
-                    check_status = str(getattr(check, 'status', 'PENDING') or 'PENDING').upper()
-                    check_statuses.append(check_status)
-                    if check_status in ['RETURNED', 'BOUNCED']:
-                        has_returned_check = True
-                        if check_status == 'BOUNCED':
-                            has_bounced_check = True
-                    elif check_status == 'PENDING':
-                        has_pending_check = True
-                
-                if checks_related:
-                    is_bounced = has_returned_check or has_bounced_check
-                    is_pending = has_pending_check and not is_bounced
-                else:
-                    is_bounced = payment_status in ['FAILED']
-                    is_pending = payment_status == 'PENDING'
-                
-                amount = CurrencyConverter.convert_to_ils(
-                    float(payment.total_amount or 0),
-                    payment.currency or 'ILS',
-                    payment.payment_date,
-                    getattr(payment, 'fx_rate_used', None)
-                )
-                
-                # تحديد الاتجاه - الشيكات المرتدة تعكس القيد
-                if is_bounced:
-                    # الشيك المرتد = زي increase في الرصيد للمدين (نفس الفاتورة/البيع)
-                    # يعتمد على الاتجاه الأصلي
-                    if payment.direction == 'OUT':
-                        debit = amount  # عكس: كان دائن، صار مدين
-                        credit = 0.0
-                        running_balance += debit
-                    else:
-                        credit = amount  # عكس: كان مدين، صار دائن
-                        debit = 0.0
-                        running_balance -= credit
-                elif payment.direction == 'OUT':
-                    credit = amount
-                    debit = 0.0
-                    running_balance -= credit
-                else:
-                    debit = amount
-                    credit = 0.0
-                    running_balance += debit
-                
-                temp_batch = GLBatch(
-                    source_type='PAYMENT',
-                    source_id=payment.id,
-                    entity_type=payment.entity_type if hasattr(payment, 'entity_type') else None,
-                    entity_id=payment.customer_id or payment.supplier_id or payment.partner_id
-                )
-                entity_name, entity_type, _, _ = extract_entity_from_batch(temp_batch)
-                if payment.entity_type:
-                    et_raw = (payment.entity_type or '').upper()
+    for entry in entries:
+        linked_payments = linked.get(entry['id'])
+        if not linked_payments:
+            continue
+        methods = []
+        refs = []
+        checks_info = []
+        for pmt in linked_payments:
+            mraw = _method_raw(pmt)
+            methods.append(_METHOD_AR.get(mraw, mraw))
+            refs.append(getattr(pmt, 'payment_number', None) or getattr(pmt, 'receipt_number', None) or f"PAY-{pmt.id}")
+            if mraw == 'cheque':
+                cn = getattr(pmt, 'check_number', None)
+                cb = getattr(pmt, 'check_bank', None)
+                cd = getattr(pmt, 'check_due_date', None)
+                if cd:
                     try:
-                        entity_enum = PaymentEntityType(et_raw)
+                        cd_str = cd.strftime('%Y-%m-%d')
                     except Exception:
-                        entity_enum = None
-                    if entity_enum == PaymentEntityType.EXPENSE:
-                        if payment.customer_id:
-                            customer = db.session.get(Customer, payment.customer_id)
-                            if customer:
-                                entity_name = customer.name
-                                entity_type = 'عميل'
-                        elif payment.supplier_id:
-                            supplier = db.session.get(Supplier, payment.supplier_id)
-                            if supplier:
-                                entity_name = supplier.name
-                                entity_type = 'مورد'
-                        elif payment.partner_id:
-                            partner = db.session.get(Partner, payment.partner_id)
-                            if partner:
-                                entity_name = partner.name
-                                entity_type = 'شريك'
-                
-                # ✅ بناء الوصف مع تفاصيل الشيك
-                method_value = getattr(payment, 'method', 'cash')
-                if hasattr(method_value, 'value'):
-                    method_value = method_value.value
-                method_raw = str(method_value).lower()
-                
-                description_parts = []
-                if payment.entity_type and payment.entity_type.upper() == "EXPENSE":
-                    if payment.expense_id:
-                        expense = db.session.get(Expense, payment.expense_id)
-                        if expense:
-                            expense_info = f"مصروف #{expense.id}"
-                            if expense.description:
-                                expense_info += f" - {expense.description}"
-                            elif expense.type and expense.type.name:
-                                expense_info += f" - {expense.type.name}"
-                            
-                            if payment.reference and expense_info not in payment.reference:
-                                description_parts.append(f"{expense_info} | {payment.reference}")
-                            elif payment.reference:
-                                description_parts.append(payment.reference)
-                            else:
-                                description_parts.append(expense_info)
-                            
-                            if payment.notes and payment.notes not in (payment.reference or ""):
-                                description_parts.append(payment.notes)
-                        else:
-                            if payment.reference:
-                                description_parts.append(payment.reference)
-                            if payment.notes:
-                                description_parts.append(payment.notes)
-                    else:
-                        if payment.reference:
-                            description_parts.append(payment.reference)
-                        if payment.notes:
-                            description_parts.append(payment.notes)
-                else:
-                    description_parts.append(f"دفعة - {entity_name}")
-                
-                check_info = None
-                if checks_related:
-                    for check in checks_related:
-                        check_status = str(getattr(check, 'status', 'PENDING') or 'PENDING').upper()
-                        if check_status in ['RETURNED', 'BOUNCED', 'CASHED', 'RESUBMITTED', 'PENDING']:
-                            check_info = {
-                                'check_number': check.check_number,
-                                'check_bank': check.check_bank,
-                                'check_due_date': check.check_due_date,
-                                'status': check_status,
-                            }
-                            break
-                
-                if method_raw == 'cheque':
-                    display_check_number = check_info['check_number'] if check_info and check_info.get('check_number') else getattr(payment, 'check_number', None)
-                    display_check_bank = check_info['check_bank'] if check_info and check_info.get('check_bank') else getattr(payment, 'check_bank', None)
-                    display_check_due_date = check_info['check_due_date'] if check_info and check_info.get('check_due_date') else getattr(payment, 'check_due_date', None)
-                    display_check_status = check_info['status'] if check_info and check_info.get('status') else None
-                    
-                    if display_check_number:
-                        description_parts.append(f"شيك #{display_check_number}")
-                    else:
-                        description_parts.append("شيك")
-                    
-                    if display_check_bank:
-                        description_parts.append(f"- {display_check_bank}")
-                    
-                    if display_check_due_date:
-                        if isinstance(display_check_due_date, datetime):
-                            check_due_date_str = display_check_due_date.strftime('%Y-%m-%d')
-                        else:
-                            check_due_date_str = str(display_check_due_date)
-                        description_parts.append(f"استحقاق: {check_due_date_str}")
-                    
-                    if is_bounced:
-                        status_text = "❌ مرتد"
-                        if display_check_status == 'RETURNED':
-                            status_text = "❌ مرتد (مرتجع)"
-                        elif display_check_status == 'BOUNCED':
-                            status_text = "❌ مرتد (مرفوض)"
-                        description_parts.append(f"- {status_text}")
-                    elif is_pending:
-                        description_parts.append("- ⏳ معلق")
-                    elif display_check_status in ['CASHED', 'RESUBMITTED']:
-                        if display_check_status == 'CASHED':
-                            description_parts.append("- ✅ تم الصرف")
-                        elif display_check_status == 'RESUBMITTED':
-                            description_parts.append("- 🔄 أعيد للبنك")
-                else:
-                    # ✅ طريقة الدفع بالعربي
-                    method_arabic = {
-                        'cash': 'نقداً',
-                        'card': 'بطاقة',
-                        'bank': 'تحويل بنكي',
-                        'online': 'إلكتروني'
-                    }.get(method_raw, method_raw)
-                    description_parts.append(f"({method_arabic})")
-                
-                if payment.reference:
-                    description_parts.append(f"- {payment.reference}")
-                if getattr(payment, "notes", ""):
-                    description_parts.append(f"- {payment.notes}")
-                
-                linked_service_id = None
-                linked_service_number = None
-                linked_service_customer = None
-                linked_service_vehicle = None
-                linked_service_balance = None
-                
-                if getattr(payment, "service_id", None):
-                    linked_service_id = int(payment.service_id)
-                    service_obj = getattr(payment, "service", None)
-                    if service_obj is None:
-                        try:
-                            service_obj = db.session.get(ServiceRequest, linked_service_id)
-                        except Exception:
-                            service_obj = None
-                    if service_obj is not None:
-                        linked_service_number = service_obj.service_number or f"SRV-{service_obj.id}"
-                        linked_service_customer = getattr(getattr(service_obj, "customer", None), "name", None)
-                        linked_service_vehicle = service_obj.vehicle_model or service_obj.vehicle_vrn or getattr(getattr(service_obj, "vehicle_type", None), "name", None)
-                        try:
-                            balance_due_val = float(getattr(service_obj, "balance_due", None))
-                        except Exception:
-                            balance_due_val = None
-                        linked_service_balance = balance_due_val
-                        description_parts.append(f"- صيانة #{linked_service_number}")
-                        if linked_service_vehicle:
-                            description_parts.append(f"- المركبة: {linked_service_vehicle}")
-                        if linked_service_customer and linked_service_customer != entity_name:
-                            description_parts.append(f"- العميل: {linked_service_customer}")
-                
-                description = " ".join(description_parts)
-                
-                # ✅ تحديد نوع القيد حسب الحالة
-                if is_bounced:
-                    entry_type = "check_bounced"
-                    type_ar = "شيك مرتد"
-                elif is_pending and method_raw == 'cheque':
-                    entry_type = "check_pending"
-                    type_ar = "شيك معلق"
-                elif linked_service_id:
-                    entry_type = "service_payment"
-                    type_ar = "دفعة صيانة"
+                        cd_str = str(cd)
                 else:
-                    entry_type = "payment"
-                    type_ar = "دفعة"
-                
-                ledger_entries.append({
-                    "id": payment.id,
-                    "date": payment.payment_date.strftime('%Y-%m-%d'),
-                    "transaction_number": f"PAY-{payment.id}",
-                    "type": entry_type,
-                    "type_ar": type_ar,
-                    "description": description,
-                    "debit": debit,
-                    "credit": credit,
-                    "balance": running_balance,
-                    "entity_name": entity_name,
-                    "entity_type": entity_type,
-                    "payment_details": {
-                        "method": method_raw,
-                        "check_number": getattr(payment, 'check_number', None),
-                        "check_bank": getattr(payment, 'check_bank', None),
-                        "check_due_date": getattr(payment, 'check_due_date', None),
-                        "status": payment_status,
-                        "is_archived": getattr(payment, "is_archived", False),
-                        "service_id": linked_service_id,
-                        "service_number": linked_service_number,
-                        "service_vehicle": linked_service_vehicle,
-                        "service_customer": linked_service_customer,
-                        "service_balance_due": linked_service_balance
-                    }
-                })
-        
-        # 4. الصيانة (Service Requests)
-        ignore_tag = "[LEDGER_SKIP]"
-        ignore_tag_upper = ignore_tag.upper()
-        if not transaction_type or transaction_type in ['maintenance', 'service', 'payment']:
-            services = LedgerQueryOptimizer.get_services_optimized(from_date, to_date)
-            for service in services:
-                text_notes = " ".join(filter(None, [
-                    getattr(service, "description", None),
-                    getattr(service, "engineer_notes", None),
-                    getattr(service, "notes", None),
-                    getattr(service, "archive_reason", None),
-                ])).upper()
-                if ignore_tag_upper in text_notes:
-                    continue
-                
-                parts_total = float(service.parts_total or 0)
-                labor_total = float(service.labor_total or 0)
-                discount = float(service.discount_total or 0)
-                tax_rate = float(service.tax_rate or 0)
-                
-                service_total = float(service.total_amount or 0)
-                
-                if service_total <= 0:
-                    subtotal = parts_total + labor_total - discount
-                    if subtotal < 0:
-                        subtotal = 0
-                    tax_amount = subtotal * (tax_rate / 100.0)
-                    service_total = subtotal + tax_amount
-                
-                if service_total <= 0:
-                    continue
-                
-                service_currency = getattr(service, 'currency', 'ILS') or 'ILS'
-                debit = CurrencyConverter.convert_to_ils(
-                    service_total,
-                    service_currency,
-                    service.created_at or datetime.utcnow(),
-                    getattr(service, 'fx_rate_used', None)
-                )
-                
-                running_balance += debit
-                customer_name = service.customer.name if service.customer else "عميل غير محدد"
-                
-                description_parts = [f"صيانة - {customer_name}"]
-                description_parts.append(f"قطع: {parts_total:.2f} + عمالة: {labor_total:.2f}")
-                if discount > 0:
-                    description_parts.append(f"خصم: {discount:.2f}")
-                if tax_rate > 0:
-                    tax_amount_calc = (parts_total + labor_total - discount) * (tax_rate / 100.0)
-                    if tax_amount_calc > 0:
-                        description_parts.append(f"ضريبة ({tax_rate:.1f}%): {tax_amount_calc:.2f}")
-                description_parts.append(f"الإجمالي: {service_total:.2f}")
-                
-                ledger_entries.append({
-                    "id": service.id,
-                    "date": service.created_at.strftime('%Y-%m-%d') if service.created_at else datetime.utcnow().strftime('%Y-%m-%d'),
-                    "transaction_number": service.service_number or f"SRV-{service.id}",
-                    "type": "service",
-                    "type_ar": "صيانة",
-                    "description": " | ".join(description_parts),
-                    "debit": debit,
-                    "credit": 0.0,
-                    "balance": running_balance,
-                    "entity_name": customer_name,
-                    "entity_type": "عميل"
-                })
-        
-        # 5. الحجوزات المسبقة (Preorders)
-        if not transaction_type or transaction_type in ['preorder', 'prepaid']:
-            preorders_query = PreOrder.query.filter(
-                PreOrder.status != 'CANCELLED',
-                PreOrder.status != 'FULFILLED'
-            )
-            if from_date:
-                preorders_query = preorders_query.filter(PreOrder.preorder_date >= from_date)
-            if to_date:
-                preorders_query = preorders_query.filter(PreOrder.preorder_date <= to_date)
-            
-            for preorder in preorders_query.order_by(PreOrder.preorder_date).all():
-                total_amount = CurrencyConverter.convert_to_ils(
-                    float(preorder.total_amount or 0),
-                    preorder.currency or 'ILS',
-                    preorder.preorder_date or preorder.created_at or datetime.utcnow(),
-                    getattr(preorder, 'fx_rate_used', None)
-                )
-                
-                if total_amount > 0:
-                    customer_name = preorder.customer.name if preorder.customer else "عميل غير محدد"
-                    product_name = preorder.product.name if preorder.product else "منتج"
-                    running_balance += total_amount
-                    
-                    ledger_entries.append({
-                        "id": preorder.id,
-                        "date": (preorder.preorder_date or preorder.created_at or datetime.utcnow()).strftime('%Y-%m-%d'),
-                        "transaction_number": preorder.reference or f"PRE-{preorder.id}",
-                        "type": "preorder",
-                        "type_ar": "حجز مسبق",
-                        "description": f"حجز مسبق - {customer_name} - {product_name}",
-                        "debit": total_amount,
-                        "credit": 0.0,
-                        "balance": running_balance,
-                        "entity_name": customer_name,
-                        "entity_type": "عميل"
-                    })
-                
-                prepaid_amount = CurrencyConverter.convert_to_ils(
-                    float(preorder.prepaid_amount or 0),
-                    preorder.currency or 'ILS',
-                    preorder.preorder_date or preorder.created_at or datetime.utcnow(),
-                    getattr(preorder, 'fx_rate_used', None)
-                )
-                
-                if prepaid_amount > 0:
-                    customer_name = preorder.customer.name if preorder.customer else "عميل غير محدد"
-                    running_balance -= prepaid_amount
-                    
-                    ledger_entries.append({
-                        "id": f"PREPAID-{preorder.id}",
-                        "date": (preorder.preorder_date or preorder.created_at or datetime.utcnow()).strftime('%Y-%m-%d'),
-                        "transaction_number": preorder.reference or f"PRE-{preorder.id}",
-                        "type": "prepaid",
-                        "type_ar": "عربون حجز",
-                        "description": f"عربون حجز مسبق - {customer_name}",
-                        "debit": 0.0,
-                        "credit": prepaid_amount,
-                        "balance": running_balance,
-                        "entity_name": customer_name,
-                        "entity_type": "عميل"
-                    })
-        
-        # 6. التوريدات (Exchange Transactions)
-        if not transaction_type or transaction_type in ['purchase', 'exchange']:
-            from models import ExchangeTransaction, Warehouse, WarehouseType
-            exchange_warehouses = db.session.query(Warehouse.id).filter(
-                Warehouse.warehouse_type == WarehouseType.EXCHANGE.value
-            ).all()
-            warehouse_ids = [w[0] for w in exchange_warehouses]
-            
-            if warehouse_ids:
-                exchange_txs_query = ExchangeTransaction.query.filter(
-                    ExchangeTransaction.warehouse_id.in_(warehouse_ids)
-                )
-                if from_date:
-                    exchange_txs_query = exchange_txs_query.filter(ExchangeTransaction.created_at >= from_date)
-                if to_date:
-                    exchange_txs_query = exchange_txs_query.filter(ExchangeTransaction.created_at <= to_date)
-                
-                for tx in exchange_txs_query.order_by(ExchangeTransaction.created_at).all():
-                    qty = int(tx.quantity or 0)
-                    unit_cost = float(tx.unit_cost or 0)
-                    if unit_cost <= 0 and tx.product:
-                        unit_cost = float(tx.product.purchase_price or 0)
-                    
-                    amount = qty * unit_cost
-                    tx_currency = getattr(tx, 'currency', None) or (tx.product.currency if tx.product else 'ILS') or 'ILS'
-                    
-                    amount_ils = CurrencyConverter.convert_to_ils(
-                        amount,
-                        tx_currency,
-                        tx.created_at or datetime.utcnow(),
-                        getattr(tx, 'fx_rate_used', None)
-                    )
-                    
-                    if amount_ils <= 0:
-                        continue
-                    
-                    direction = (getattr(tx, 'direction', '') or '').upper()
-                    supplier_name = tx.supplier.name if tx.supplier else "مورد غير محدد"
-                    product_name = tx.product.name if tx.product else "منتج"
-                    
-                    if direction in {'IN', 'PURCHASE', 'CONSIGN_IN'}:
-                        running_balance -= amount_ils
-                        ledger_entries.append({
-                            "id": tx.id,
-                            "date": (tx.created_at or datetime.utcnow()).strftime('%Y-%m-%d'),
-                            "transaction_number": f"TX-{tx.id}",
-                            "type": "purchase",
-                            "type_ar": "توريد",
-                            "description": f"توريد {product_name} - {qty} قطعة - {supplier_name}",
-                            "debit": 0.0,
-                            "credit": amount_ils,
-                            "balance": running_balance,
-                            "entity_name": supplier_name,
-                            "entity_type": "مورد"
-                        })
-                    elif direction in {'OUT', 'RETURN', 'CONSIGN_OUT'}:
-                        running_balance += amount_ils
-                        ledger_entries.append({
-                            "id": tx.id,
-                            "date": (tx.created_at or datetime.utcnow()).strftime('%Y-%m-%d'),
-                            "transaction_number": f"TX-{tx.id}",
-                            "type": "return",
-                            "type_ar": "مرتجع",
-                            "description": f"مرتجع {product_name} - {qty} قطعة - {supplier_name}",
-                            "debit": amount_ils,
-                            "credit": 0.0,
-                            "balance": running_balance,
-                            "entity_name": supplier_name,
-                            "entity_type": "مورد"
-                        })
-        
-        # 7. القيود اليدوية (Manual Journal Entries)
-        if not transaction_type or transaction_type in ['manual', 'journal']:
-            manual_batches_query = GLBatch.query.filter(GLBatch.source_type == 'MANUAL')
-            if from_date:
-                manual_batches_query = manual_batches_query.filter(GLBatch.posted_at >= from_date)
-            if to_date:
-                manual_batches_query = manual_batches_query.filter(GLBatch.posted_at <= to_date)
-            
-            for batch in manual_batches_query.order_by(GLBatch.posted_at).all():
-                # 🧠 استخراج الجهة المرتبطة بذكاء
-                entity_name, entity_type_ar, entity_id_extracted, entity_type_code = extract_entity_from_batch(batch)
-                
-                # جلب القيود الفرعية لهذا القيد
-                entries = GLEntry.query.filter_by(batch_id=batch.id).all()
-                
-                for entry in entries:
-                    debit = float(entry.debit or 0)
-                    credit = float(entry.credit or 0)
-                    
-                    if debit > 0:
-                        running_balance += debit
-                    else:
-                        running_balance -= credit
-                    
-                    # جلب اسم الحساب
-                    account = Account.query.filter_by(code=entry.account).first()
-                    account_name = account.name if account else f"حساب {entry.account}"
-                    
-                    ledger_entries.append({
-                        "id": f"MANUAL-{batch.id}-{entry.id}",
-                        "date": batch.posted_at.strftime('%Y-%m-%d'),
-                        "transaction_number": f"MAN-{batch.id}",
-                        "type": "manual",
-                        "type_ar": "قيد يدوي",
-                        "description": f"{batch.memo} - {account_name}",
-                        "debit": debit,
-                        "credit": credit,
-                        "balance": running_balance,
-                        "entity_name": entity_name,  # ✅ استخدام الجهة المستخرجة بذكاء
-                        "entity_type": entity_type_ar,  # ✅ استخدام نوع الجهة بالعربي
-                        "manual_details": {
-                            "batch_id": batch.id,
-                            "account_code": entry.account,
-                            "account_name": account_name,
-                            "ref": entry.ref
-                        }
-                    })
-        
-        # ترتيب حسب التاريخ
-        sort = request.args.get('sort', 'date')
-        order = request.args.get('order', 'asc')
-        
-        if sort == 'date':
-            if order == 'asc':
-                ledger_entries.sort(key=lambda x: (x['date'], x.get('id', 0)))
-            else:
-                ledger_entries.sort(key=lambda x: (x['date'], x.get('id', 0)), reverse=True)
-        elif sort == 'debit':
-            if order == 'asc':
-                ledger_entries.sort(key=lambda x: (x['debit'], x.get('id', 0)))
-            else:
-                ledger_entries.sort(key=lambda x: (x['debit'], x.get('id', 0)), reverse=True)
-        elif sort == 'credit':
-            if order == 'asc':
-                ledger_entries.sort(key=lambda x: (x['credit'], x.get('id', 0)))
-            else:
-                ledger_entries.sort(key=lambda x: (x['credit'], x.get('id', 0)), reverse=True)
-        elif sort == 'balance':
-            if order == 'asc':
-                ledger_entries.sort(key=lambda x: (x.get('balance', 0), x.get('id', 0)))
-            else:
-                ledger_entries.sort(key=lambda x: (x.get('balance', 0), x.get('id', 0)), reverse=True)
-        elif sort == 'type':
-            if order == 'asc':
-                ledger_entries.sort(key=lambda x: (x.get('type_ar', ''), x.get('id', 0)))
+                    cd_str = None
+                parts = []
+                if cn:
+                    parts.append(f"#{cn}")
+                if cb:
+                    parts.append(cb)
+                if cd_str:
+                    parts.append(f"استحقاق: {cd_str}")
+                if parts:
+                    checks_info.append("شيك " + " - ".join(parts))
+        mdisp = ", ".join(sorted(set([m for m in methods if m])))
+        rdisp = ", ".join(sorted(set([r for r in refs if r])))
+        cdisp = "; ".join(checks_info)
+        parts = []
+        if mdisp:
+            parts.append(f"سداد: {mdisp}")
+        if rdisp:
+            parts.append(f"مراجع: {rdisp}")
+        if cdisp:
+            parts.append(cdisp)
+        if parts:
+            entry['description'] = f"{entry['description']} — " + " | ".join(parts)
+
+
+def _page_checks(payments):
+    """الشيكات المرتبطة بدفعات الصفحة (مباشرة أو عبر الدفعات الجزئية) باستعلامين"""
+    from models import Check
+
+    by_payment = {}
+    ids = [p.id for p in payments]
+    if not ids:
+        return by_payment
+    for check in Check.query.filter(Check.payment_id.in_(ids)).all():
+        by_payment.setdefault(check.payment_id, []).append(check)
+    split_owner = {}
+    for payment in payments:
+        for split in (getattr(payment, 'splits', None) or []):
+            split_owner[f"PMT-SPLIT-{split.id}"] = payment.id
+    if split_owner:
+        for check in Check.query.filter(Check.reference_number.in_(list(split_owner))).all():
+            by_payment.setdefault(split_owner[check.reference_number], []).append(check)
+    return by_payment
+
+
+def _enrich_payment_entries(entries):
+    """وصف الدفعة (الشيك، طريقة الدفع، الصيانة المرتبطة) لسطور الصفحة فقط"""
+    from sqlalchemy.orm import selectinload
+
+    ids = [e['id'] for e in entries]
+    if not ids:
+        return
+    payments = {
+        p.id: p for p in Payment.query.options(
+            selectinload(Payment.splits),
+        ).filter(Payment.id.in_(ids)).all()
+    }
+    checks_by_payment = _page_checks(list(payments.values()))
+    service_ids = {p.service_id for p in payments.values() if getattr(p, 'service_id', None)}
+    services = {}
+    if service_ids:
+        services = {s.id: s for s in ServiceRequest.query.filter(ServiceRequest.id.in_(service_ids)).all()}
+
+    for entry in entries:
+        payment = payments.get(entry['id'])
+        if payment is None:
+            continue
+        is_bounced = entry['type'] == 'check_bounced'
+        is_pending = entry['type'] == 'check_pending'
+        entity_name = entry['entity_name']
+        method_raw = _method_raw(payment)
+        checks_related = checks_by_payment.get(payment.id, [])
+
+        description_parts = []
+        if payment.entity_type and payment.entity_type.upper() == "EXPENSE":
+            if payment.reference:
+                description_parts.append(payment.reference)
+            if payment.notes:
+                description_parts.append(payment.notes)
+        else:
+            description_parts.append(f"دفعة - {entity_name}")
+
+        check_info = None
+        for check in checks_related:
+            check_status = str(getattr(check, 'status', 'PENDING') or 'PENDING').upper()
+            if check_status in ['RETURNED', 'BOUNCED', 'CASHED', 'RESUBMITTED', 'PENDING']:
+                check_info = {
+                    'check_number': check.check_number,
+                    'check_bank': check.check_bank,
+                    'check_due_date': check.check_due_date,
+                    'status': check_status,
+                }
+                break
+
+        if method_raw == 'cheque':
+            display_check_number = check_info['check_number'] if check_info and check_info.get('check_number') else getattr(payment, 'check_number', None)
+            display_check_bank = check_info['check_bank'] if check_info and check_info.get('check_bank') else getattr(payment, 'check_bank', None)
+            display_check_due_date = check_info['check_due_date'] if check_info and check_info.get('check_due_date') else getattr(payment, 'check_due_date', None)
+            display_check_status = check_info['status'] if check_info and check_info.get('status') else None
+
+            if display_check_number:
+                description_parts.append(f"شيك #{display_check_number}")
             else:
-                ledger_entries.sort(key=lambda x: (x.get('type_ar', ''), x.get('id', 0)), reverse=True)
+                description_parts.append("شيك")
+
+            if display_check_bank:
+                description_parts.append(f"- {display_check_bank}")
+
+            if display_check_due_date:
+                if isinstance(display_check_due_date, datetime):
+                    check_due_date_str = display_check_due_date.strftime('%Y-%m-%d')
+                else:
+                    check_due_date_str = str(display_check_due_date)
+                description_parts.append(f"استحقاق: {check_due_date_str}")
+
+            if is_bounced:
+                status_text = "❌ مرتد"
+                if display_check_status == 'RETURNED':
+                    status_text = "❌ مرتد (مرتجع)"
+                elif display_check_status == 'BOUNCED':
+                    status_text = "❌ مرتد (مرفوض)"
+                description_parts.append(f"- {status_text}")
+            elif is_pending:
+                description_parts.append("- ⏳ معلق")
+            elif display_check_status == 'CASHED':
+                description_parts.append("- ✅ تم الصرف")
+            elif display_check_status == 'RESUBMITTED':
+                description_parts.append("- 🔄 أعيد للبنك")
         else:
-            ledger_entries.sort(key=lambda x: (x['date'], x.get('id', 0)))
-        
-        # إعادة حساب الرصيد المتراكم
-        running_balance = 0.0
-        for entry in ledger_entries:
-            running_balance += entry['debit'] - entry['credit']
-            entry['balance'] = running_balance
-        
-        # حساب الإحصائيات الحقيقية من قاعدة البيانات
-        from models import fx_rate
-        
-        # 1. إجمالي المبيعات
-        sales_query = Sale.query.filter(Sale.status == 'CONFIRMED')
-        if from_date:
-            sales_query = sales_query.filter(Sale.sale_date >= from_date)
-        if to_date:
-            sales_query = sales_query.filter(Sale.sale_date <= to_date)
-        
-        total_sales = 0.0
-        for sale in sales_query.all():
-            amount = float(sale.total_amount or 0)
-            if sale.currency and sale.currency != 'ILS':
-                try:
-                    rate = fx_rate(sale.currency, 'ILS', sale.sale_date, raise_on_missing=False)
-                    if rate > 0:
-                        amount = float(amount * float(rate))
-                    else:
-                        current_app.logger.warning(f"⚠️ سعر صرف مفقود في إحصائيات دفتر الأستاذ: {sale.currency}/ILS للبيع #{sale.id}")
-                except Exception as e:
-                    current_app.logger.error(f"❌ خطأ في تحويل العملة في إحصائيات دفتر الأستاذ للبيع #{sale.id}: {str(e)}")
-            total_sales += amount
-        
-        # 2. إجمالي المشتريات والنفقات
-        expenses_query = Expense.query
-        if from_date:
-            expenses_query = expenses_query.filter(Expense.date >= from_date)
-        if to_date:
-            expenses_query = expenses_query.filter(Expense.date <= to_date)
-        
-        total_expenses = 0.0
-        for expense in expenses_query.all():
-            amount = float(expense.amount or 0)
-            if expense.currency and expense.currency != 'ILS':
-                try:
-                    rate = fx_rate(expense.currency, 'ILS', expense.date, raise_on_missing=False)
-                    if rate > 0:
-                        amount = float(amount * float(rate))
-                    else:
-                        current_app.logger.warning(f"⚠️ سعر صرف مفقود في إحصائيات دفتر الأستاذ: {expense.currency}/ILS للمصروف #{expense.id}")
-                except Exception as e:
-                    current_app.logger.error(f"❌ خطأ في تحويل العملة في إحصائيات دفتر الأستاذ للمصروف #{expense.id}: {str(e)}")
-            total_expenses += amount
-        
-        # 3. إجمالي الخدمات (الصيانة)
-        services_query = ServiceRequest.query
-        if from_date:
-            services_query = services_query.filter(ServiceRequest.created_at >= from_date)
-        if to_date:
-            services_query = services_query.filter(ServiceRequest.created_at <= to_date)
-        
-        total_services = 0.0
-        for service in services_query.limit(10000).all():
-            # استخدام total_amount المحفوظ في قاعدة البيانات (بعد الخصم والضريبة)
-            service_total = float(service.total_amount or 0)
-            
-            # إذا كان total_amount غير موجود أو صفر، نحسبه يدوياً
-            if service_total <= 0:
-                parts_total = float(service.parts_total or 0)
-                labor_total = float(service.labor_total or 0)
-                discount = float(service.discount_total or 0)
-                tax_rate = float(service.tax_rate or 0)
-                
-                # الحساب: (parts + labor - discount) * (1 + tax_rate/100)
-                subtotal = parts_total + labor_total - discount
-                if subtotal < 0:
-                    subtotal = 0
-                tax_amount = subtotal * (tax_rate / 100.0)
-                service_total = subtotal + tax_amount
-            
-            # تحويل للشيقل إذا كانت بعملة أخرى
-            service_currency = getattr(service, 'currency', 'ILS') or 'ILS'
-            if service_currency != 'ILS':
+            description_parts.append(f"({_METHOD_AR.get(method_raw, method_raw)})")
+
+        if payment.reference:
+            description_parts.append(f"- {payment.reference}")
+        if getattr(payment, "notes", ""):
+            description_parts.append(f"- {payment.notes}")
+
+        linked_service_id = None
+        linked_service_number = None
+        linked_service_customer = None
+        linked_service_vehicle = None
+        linked_service_balance = None
+        if getattr(payment, "service_id", None):
+            linked_service_id = int(payment.service_id)
+            service_obj = services.get(linked_service_id)
+            if service_obj is not None:
+                linked_service_number = service_obj.service_number or f"SRV-{service_obj.id}"
+                linked_service_customer = getattr(getattr(service_obj, "customer", None), "name", None)
+                linked_service_vehicle = service_obj.vehicle_model or service_obj.vehicle_vrn or getattr(getattr(service_obj, "vehicle_type", None), "name", None)
                 try:
-                    rate = fx_rate(service_currency, 'ILS', service.created_at or datetime.utcnow(), raise_on_missing=False)
-                    if rate > 0:
-                        service_total = float(service_total * float(rate))
-                    else:
-                        current_app.logger.warning(f"⚠️ سعر صرف مفقود في إحصائيات دفتر الأستاذ: {service_currency}/ILS للخدمة #{service.id}")
-                except Exception as e:
-                    current_app.logger.error(f"❌ خطأ في تحويل العملة في إحصائيات دفتر الأستاذ للخدمة #{service.id}: {str(e)}")
-            
-            total_services += service_total
-        
-        # 4. حساب تكلفة البضاعة المباعة (COGS - Cost of Goods Sold)
-        from models import SaleLine
-        
-        total_cogs = 0.0  # تكلفة البضاعة المباعة
-        cogs_details = []
-        products_without_cost = []  # منتجات بدون تكلفة شراء
-        estimated_products = []  # منتجات تم تقدير تكلفتها
-        
-        # جلب جميع أسطر المبيعات في الفترة
-        sale_lines_query = (
-            db.session.query(SaleLine)
-            .join(Sale, Sale.id == SaleLine.sale_id)
-        )
+                    linked_service_balance = float(getattr(service_obj, "balance_due", None))
+                except Exception:
+                    linked_service_balance = None
+                description_parts.append(f"- صيانة #{linked_service_number}")
+                if linked_service_vehicle:
+                    description_parts.append(f"- المركبة: {linked_service_vehicle}")
+                if linked_service_customer and linked_service_customer != entity_name:
+                    description_parts.append(f"- العميل: {linked_service_customer}")
+
+        entry['description'] = " ".join(description_parts)
+        entry['payment_details'] = {
+            "method": method_raw,
+            "check_number": getattr(payment, 'check_number', None),
+            "check_bank": getattr(payment, 'check_bank', None),
+            "check_due_date": getattr(payment, 'check_due_date', None),
+            "status": getattr(payment, 'status', 'COMPLETED'),
+            "is_archived": getattr(payment, "is_archived", False),
+            "service_id": linked_service_id,
+            "service_number": linked_service_number,
+            "service_vehicle": linked_service_vehicle,
+            "service_customer": linked_service_customer,
+            "service_balance_due": linked_service_balance
+        }
+
+
+def _enrich_service_entries(entries):
+    """تفصيل القطع والعمالة والخصم والضريبة لسطور الصيانة في الصفحة"""
+    ids = [e['id'] for e in entries]
+    if not ids:
+        return
+    services = {s.id: s for s in ServiceRequest.query.filter(ServiceRequest.id.in_(ids)).all()}
+    for entry in entries:
+        service = services.get(entry['id'])
+        if service is None:
+            continue
+        parts_total = float(service.parts_total or 0)
+        labor_total = float(service.labor_total or 0)
+        discount = float(service.discount_total or 0)
+        tax_rate = float(service.tax_rate or 0)
+        service_total = float(service.total_amount or 0)
+        if service_total <= 0:
+            subtotal = max(parts_total + labor_total - discount, 0)
+            service_total = subtotal + subtotal * (tax_rate / 100.0)
+
+        description_parts = [f"صيانة - {entry['entity_name']}"]
+        description_parts.append(f"قطع: {parts_total:.2f} + عمالة: {labor_total:.2f}")
+        if discount > 0:
+            description_parts.append(f"خصم: {discount:.2f}")
+        if tax_rate > 0:
+            tax_amount_calc = (parts_total + labor_total - discount) * (tax_rate / 100.0)
+            if tax_amount_calc > 0:
+                description_parts.append(f"ضريبة ({tax_rate:.1f}%): {tax_amount_calc:.2f}")
+        description_parts.append(f"الإجمالي: {service_total:.2f}")
+        entry['description'] = " | ".join(description_parts)
+
+
+def _enrich_manual_entries(entries):
+    """الجهة المستخرجة من القيد اليدوي وتفاصيل الحساب لسطور الصفحة"""
+    pairs = []
+    for entry in entries:
+        _, batch_id, entry_id = entry['id'].split('-')
+        pairs.append((entry, int(batch_id), int(entry_id)))
+    batches = {b.id: b for b in GLBatch.query.filter(GLBatch.id.in_({p[1] for p in pairs})).all()}
+    lines = {
+        row.id: row for row in db.session.query(GLEntry.id, GLEntry.account, GLEntry.ref, Account.name.label('account_name'))
+        .outerjoin(Account, Account.code == GLEntry.account)
+        .filter(GLEntry.id.in_([p[2] for p in pairs]))
+        .all()
+    }
+    extracted = {}
+    for entry, batch_id, entry_id in pairs:
+        batch = batches.get(batch_id)
+        if batch is not None:
+            if batch_id not in extracted:
+                extracted[batch_id] = extract_entity_from_batch(batch)
+            entity_name, entity_type_ar, _, _ = extracted[batch_id]
+            entry['entity_name'] = entity_name
+            entry['entity_type'] = entity_type_ar
+        line = lines.get(entry_id)
+        if line is not None:
+            entry['manual_details'] = {
+                "batch_id": batch_id,
+                "account_code": line.account,
+                "account_name": line.account_name or f"حساب {line.account}",
+                "ref": line.ref
+            }
+
+
+def _enrich_journal_entries(entries):
+    groups = {}
+    for entry in entries:
+        kind = entry['type']
+        if kind in ('payment', 'check_bounced', 'check_pending', 'service_payment'):
+            kind = 'payment'
+        groups.setdefault(kind, []).append(entry)
+    for kind, enrich in (
+        ('expense', _enrich_expense_entries),
+        ('payment', _enrich_payment_entries),
+        ('service', _enrich_service_entries),
+        ('manual', _enrich_manual_entries),
+    ):
+        if groups.get(kind):
+            try:
+                enrich(groups[kind])
+            except Exception as e:
+                current_app.logger.warning(f"⚠️ تعذر إكمال تفاصيل قيود {kind} في دفتر الأستاذ: {str(e)}")
+
+
+def _ledger_statistics(from_date, to_date, rates):
+    """إحصائيات الفترة (إيرادات، تكلفة، ربح، مخزون) مخزنة مؤقتاً لكل نطاق تواريخ"""
+    from models import CogsEntry
+    from services.ledger_journal import ils_amount, inventory_value, service_total_expr
+
+    cache_key = "ledger_statistics_{}_{}".format(
+        from_date.strftime('%Y%m%d') if from_date else 'all',
+        to_date.strftime('%Y%m%d') if to_date else 'all',
+    )
+    cached = cache.get(cache_key)
+    if cached is not None:
+        return cached
+
+    def _sum(expr, *criteria):
+        value = db.session.query(func.coalesce(func.sum(expr), 0)).filter(*criteria).scalar()
+        return float(value or 0)
+
+    def _range(col):
+        criteria = []
         if from_date:
-            sale_lines_query = sale_lines_query.filter(Sale.sale_date >= from_date)
+            criteria.append(col >= from_date)
         if to_date:
-            sale_lines_query = sale_lines_query.filter(Sale.sale_date <= to_date)
-        
-        for line in sale_lines_query.limit(100000).all():
-            if line.product:
-                qty_sold = float(line.quantity or 0)
-                product = line.product
-                unit_cost = None
-                cost_source = None
-                
-                # 1️⃣ محاولة استخدام تكلفة الشراء (الأفضل)
-                if product.purchase_price and product.purchase_price > 0:
-                    unit_cost = float(product.purchase_price)
-                    cost_source = "purchase_price"
-                # 2️⃣ التكلفة بعد الشحن
-                elif product.cost_after_shipping and product.cost_after_shipping > 0:
-                    unit_cost = float(product.cost_after_shipping)
-                    cost_source = "cost_after_shipping"
-                # 3️⃣ التكلفة قبل الشحن
-                elif product.cost_before_shipping and product.cost_before_shipping > 0:
-                    unit_cost = float(product.cost_before_shipping)
-                    cost_source = "cost_before_shipping"
-                # 4️⃣ تقدير محافظ: 70% من سعر البيع
-                elif product.price and product.price > 0:
-                    unit_cost = float(product.price) * 0.70  # 70% من سعر البيع
-                    cost_source = "estimated_70%"
-                    
-                    # تسجيل تحذير
-                    current_app.logger.warning(
-                        f"⚠️ تقدير تكلفة المنتج '{product.name}' (#{product.id}): "
-                        f"استخدام 70% من سعر البيع = {unit_cost:.2f} ₪"
-                    )
-                    
-                    # إضافة للقائمة
-                    estimated_products.append({
-                        'id': product.id,
-                        'name': product.name,
-                        'selling_price': float(product.price),
-                        'estimated_cost': unit_cost,
-                        'qty_sold': qty_sold
-                    })
-                # 5️⃣ لا يوجد أي سعر - تجاهل المنتج
-                else:
-                    current_app.logger.error(
-                        f"❌ المنتج '{product.name}' (#{product.id}) بدون تكلفة أو سعر - "
-                        f"تم تجاهله من حساب COGS"
-                    )
-                    products_without_cost.append({
-                        'id': product.id,
-                        'name': product.name,
-                        'qty_sold': qty_sold
-                    })
-                    continue  # تخطي هذا المنتج
-                
-                line_cogs = qty_sold * unit_cost
-                total_cogs += line_cogs
-                
-                if len(cogs_details) < 10:  # حفظ أول 10 لأغراض التفصيل
-                    cogs_details.append({
-                        'product': product.name,
-                        'qty': qty_sold,
-                        'unit_cost': unit_cost,
-                        'total': line_cogs,
-                        'source': cost_source
-                    })
-        
-        # 5. حساب تكلفة الخدمات (قطع الغيار المستخدمة)
-        from models import ServicePart
-        
-        total_service_costs = 0.0
-        
-        service_parts_query = (
-            db.session.query(ServicePart)
-            .join(ServiceRequest, ServiceRequest.id == ServicePart.service_id)
+            criteria.append(col <= to_date)
+        return criteria
+
+    # 1-3. المبيعات والنفقات والخدمات مجمّعة بالشيكل داخل SQL
+    total_sales = _sum(
+        ils_amount(Sale.total_amount, Sale.currency, rates, Sale.fx_rate_used),
+        Sale.status == 'CONFIRMED', *_range(Sale.sale_date)
+    )
+    total_expenses = _sum(
+        ils_amount(Expense.amount, Expense.currency, rates, Expense.fx_rate_used),
+        *_range(Expense.date)
+    )
+    total_services = _sum(
+        ils_amount(service_total_expr(), ServiceRequest.currency, rates, ServiceRequest.fx_rate_used),
+        *_range(ServiceRequest.created_at)
+    )
+
+    # 4-5. تكلفة البضاعة المباعة وتكلفة قطع الخدمات من التكلفة المجمدة (cogs_entries)
+    def _cogs_criteria(*document_types):
+        return [CogsEntry.document_type.in_(document_types), *_range(CogsEntry.posted_at)]
+
+    total_cogs = _sum(CogsEntry.total_cost, *_cogs_criteria('SALE'))
+    total_service_costs = _sum(CogsEntry.total_cost, *_cogs_criteria('SERVICE'))
+
+    cogs_details = [
+        {
+            'product': name,
+            'qty': float(qty or 0),
+            'unit_cost': float(unit_cost or 0),
+            'total': float(total or 0),
+            'source': source,
+        }
+        for name, qty, unit_cost, total, source in (
+            db.session.query(Product.name, CogsEntry.quantity, CogsEntry.unit_cost, CogsEntry.total_cost, CogsEntry.cost_source)
+            .join(Product, Product.id == CogsEntry.product_id)
+            .filter(*_cogs_criteria('SALE'))
+            .order_by(CogsEntry.posted_at, CogsEntry.id)
+            .limit(10)
+            .all()
         )
-        if from_date:
-            service_parts_query = service_parts_query.filter(ServiceRequest.created_at >= from_date)
-        if to_date:
-            service_parts_query = service_parts_query.filter(ServiceRequest.created_at <= to_date)
-        
-        for part in service_parts_query.limit(50000).all():
-            if part.part:  # part هو المنتج
-                qty_used = float(part.quantity or 0)
-                product = part.part
-                unit_cost = None
-                
-                # نفس المنطق: تكلفة فعلية أو تقدير
-                if product.purchase_price and product.purchase_price > 0:
-                    unit_cost = float(product.purchase_price)
-                elif product.cost_after_shipping and product.cost_after_shipping > 0:
-                    unit_cost = float(product.cost_after_shipping)
-                elif product.cost_before_shipping and product.cost_before_shipping > 0:
-                    unit_cost = float(product.cost_before_shipping)
-                elif product.price and product.price > 0:
-                    unit_cost = float(product.price) * 0.70  # 70% من سعر البيع
-                    current_app.logger.warning(
-                        f"⚠️ تقدير تكلفة قطعة الغيار '{product.name}' في الخدمات: "
-                        f"70% من سعر البيع = {unit_cost:.2f} ₪"
-                    )
-                    if product.id not in [p['id'] for p in estimated_products]:
-                        estimated_products.append({
-                            'id': product.id,
-                            'name': product.name,
-                            'selling_price': float(product.price),
-                            'estimated_cost': unit_cost,
-                            'qty_sold': qty_used,
-                            'in_service': True
-                        })
-                else:
-                    current_app.logger.error(
-                        f"❌ قطعة الغيار '{product.name}' بدون تكلفة - تم تجاهلها من حساب تكاليف الخدمات"
-                    )
-                    if product.id not in [p['id'] for p in products_without_cost]:
-                        products_without_cost.append({
-                            'id': product.id,
-                            'name': product.name,
-                            'qty_sold': qty_used,
-                            'in_service': True
-                        })
-                    continue
-                
-                total_service_costs += qty_used * unit_cost
-        
-        # 6. حساب الحجوزات المسبقة
-        preorders_query = PreOrder.query
-        if from_date:
-            preorders_query = preorders_query.filter(PreOrder.created_at >= from_date)
-        if to_date:
-            preorders_query = preorders_query.filter(PreOrder.created_at <= to_date)
-        
-        total_preorders = 0.0
-        for preorder in preorders_query.limit(10000).all():
-            amount = float(preorder.total_amount or 0)
-            preorder_currency = getattr(preorder, 'currency', 'ILS') or 'ILS'
-            if preorder_currency != 'ILS':
-                try:
-                    rate = fx_rate(preorder_currency, 'ILS', preorder.created_at or datetime.utcnow(), raise_on_missing=False)
-                    if rate > 0:
-                        amount = float(amount * float(rate))
-                except Exception as e:
-                    current_app.logger.warning(f"⚠️ خطأ في تحويل عملة الحجز المسبق #{preorder.id}: {str(e)}")
-            total_preorders += amount
-        
-        # 7. حساب قيمة المخزون (مجمّع حسب المنتج) - بسعر التكلفة
-        total_stock_value_stats = 0.0
-        total_stock_qty_stats = 0
-        
-        stock_summary_stats = (
+    ]
+
+    def _products_by_source(cost_source):
+        return (
             db.session.query(
-                Product.id,
-                Product.name,
-                Product.purchase_price,
-                Product.currency,
-                func.sum(StockLevel.quantity).label('total_qty')
+                Product.id, Product.name, Product.price,
+                func.sum(CogsEntry.quantity), func.avg(CogsEntry.unit_cost),
+                func.min(CogsEntry.document_type),
             )
-            .join(StockLevel, StockLevel.product_id == Product.id)
-            .filter(StockLevel.quantity > 0)
-            .group_by(Product.id, Product.name, Product.purchase_price, Product.currency)
+            .join(Product, Product.id == CogsEntry.product_id)
+            .filter(CogsEntry.cost_source == cost_source, *_cogs_criteria('SALE', 'SERVICE'))
+            .group_by(Product.id, Product.name, Product.price)
             .all()
         )
-        
-        for row in stock_summary_stats:
-            qty = float(row.total_qty or 0)
-            price = float(row.purchase_price or 0)  # سعر التكلفة وليس سعر البيع
-            product_currency = row.currency
-            
-            # تحويل للشيقل
-            if product_currency and product_currency != 'ILS' and price > 0:
-                try:
-                    rate = fx_rate(product_currency, 'ILS', datetime.utcnow(), raise_on_missing=False)
-                    if rate and rate > 0:
-                        price = float(price * float(rate))
-                except Exception:
-                    pass
-            
-            total_stock_value_stats += qty * price
-            total_stock_qty_stats += int(qty)
-        
-        # 8. صافي الربح الحقيقي
-        gross_profit_sales = total_sales - total_cogs  # ربح المبيعات
-        gross_profit_services = total_services - total_service_costs  # ربح الخدمات
-        total_gross_profit = gross_profit_sales + gross_profit_services
-        net_profit = total_gross_profit - total_expenses  # الربح الصافي
-        
-        statistics = {
-            "total_sales": total_sales,
-            "total_cogs": total_cogs,
-            "gross_profit_sales": gross_profit_sales,
-            "total_services": total_services,
-            "total_service_costs": total_service_costs,
-            "gross_profit_services": gross_profit_services,
-            "total_gross_profit": total_gross_profit,
-            "total_revenue": total_sales + total_services,
-            "total_expenses": total_expenses,
-            "net_profit": net_profit,
-            "profit_margin": (net_profit / (total_sales + total_services) * 100) if (total_sales + total_services) > 0 else 0,
-            "total_preorders": total_preorders,
-            "total_stock_value": total_stock_value_stats,
-            "total_stock_qty": total_stock_qty_stats,
-            "cogs_details": cogs_details,
-            "estimated_products_count": len(estimated_products),
-            "estimated_products": estimated_products,
-            "products_without_cost_count": len(products_without_cost),
-            "products_without_cost": products_without_cost
+
+    estimated_products = [
+        {
+            'id': pid,
+            'name': name,
+            'selling_price': float(price or 0),
+            'estimated_cost': float(avg_cost or 0),
+            'qty_sold': float(qty or 0),
+            **({'in_service': True} if first_doc == 'SERVICE' else {}),
         }
-        
-        search_term = (request.args.get('q') or '').strip()
-        filtered_entries = ledger_entries
-        if search_term:
-            search_lower = search_term.lower()
-
-            def _entry_matches(entry):
-                fields = [
-                    entry.get("transaction_number"),
-                    entry.get("type"),
-                    entry.get("type_ar"),
-                    entry.get("description"),
-                    entry.get("entity_name"),
-                    entry.get("entity_type"),
-                    entry.get("date"),
-                ]
-                for field in fields:
-                    if field and search_lower in str(field).lower():
-                        return True
-                for numeric in (entry.get("debit"), entry.get("credit"), entry.get("balance")):
-                    if numeric is not None and search_lower in f"{numeric}".lower():
-                        return True
-                payment_details = entry.get("payment_details")
-                if isinstance(payment_details, dict):
-                    for value in payment_details.values():
-                        if value and search_lower in str(value).lower():
-                            return True
-                return False
-
-            filtered_entries = [entry for entry in ledger_entries if _entry_matches(entry)]
+        for pid, name, price, qty, avg_cost, first_doc in _products_by_source('estimated_70%')
+    ]
+    products_without_cost = [
+        {
+            'id': pid,
+            'name': name,
+            'qty_sold': float(qty or 0),
+            **({'in_service': True} if first_doc == 'SERVICE' else {}),
+        }
+        for pid, name, _price, qty, _avg, first_doc in _products_by_source('missing')
+    ]
+    if estimated_products or products_without_cost:
+        current_app.logger.warning(
+            f"⚠️ تكلفة تقديرية لـ {len(estimated_products)} منتج وبدون تكلفة لـ {len(products_without_cost)} منتج في الفترة"
+        )
+
+    # 6. الحجوزات المسبقة (السعر × الكمية مع الضريبة)
+    preorder_total = (
+        select(func.coalesce(Product.price, 0) * PreOrder.quantity)
+        .where(Product.id == PreOrder.product_id)
+        .scalar_subquery()
+        * (1 + func.coalesce(PreOrder.tax_rate, 0) / 100.0)
+    )
+    total_preorders = _sum(
+        ils_amount(preorder_total, PreOrder.currency, rates, PreOrder.fx_rate_used),
+        *_range(PreOrder.created_at)
+    )
+
+    # 7. قيمة المخزون بسعر التكلفة (سعر صرف واحد لكل عملة)
+    stock = inventory_value(rates)
+
+    # 8. صافي الربح الحقيقي
+    gross_profit_sales = total_sales - total_cogs  # ربح المبيعات
+    gross_profit_services = total_services - total_service_costs  # ربح الخدمات
+    total_gross_profit = gross_profit_sales + gross_profit_services
+    net_profit = total_gross_profit - total_expenses  # الربح الصافي
+
+    statistics = {
+        "total_sales": total_sales,
+        "total_cogs": total_cogs,
+        "gross_profit_sales": gross_profit_sales,
+        "total_services": total_services,
+        "total_service_costs": total_service_costs,
+        "gross_profit_services": gross_profit_services,
+        "total_gross_profit": total_gross_profit,
+        "total_revenue": total_sales + total_services,
+        "total_expenses": total_expenses,
+        "net_profit": net_profit,
+        "profit_margin": (net_profit / (total_sales + total_services) * 100) if (total_sales + total_services) > 0 else 0,
+        "total_preorders": total_preorders,
+        "total_stock_value": stock["value"],
+        "total_stock_qty": stock["qty"],
+        "cogs_details": cogs_details,
+        "estimated_products_count": len(estimated_products),
+        "estimated_products": estimated_products,
+        "products_without_cost_count": len(products_without_cost),
+        "products_without_cost": products_without_cost
+    }
+    cache.set(cache_key, statistics, timeout=LEDGER_STATS_CACHE_TIMEOUT)
+    return statistics
+
+
+@ledger_bp.route("/data", methods=["GET"], endpoint="get_ledger_data")
+@login_required
+def get_ledger_data():
+    """دفتر الأستاذ: صفحة واحدة من القراءة الموحدة (UNION) مع الرصيد المتراكم والإجماليات من SQL"""
+    try:
+        from_date_str = request.args.get('from_date')
+        to_date_str = request.args.get('to_date')
+        transaction_type = request.args.get('transaction_type', '').strip()
+
+        # تحليل التواريخ
+        from_date = datetime.strptime(from_date_str, '%Y-%m-%d') if from_date_str else None
+        to_date = datetime.strptime(to_date_str, '%Y-%m-%d').replace(hour=23, minute=59, second=59) if to_date_str else None
+
+        journal = UnifiedJournal(JournalQuery(
+            from_date=from_date,
+            to_date=to_date,
+            transaction_type=transaction_type,
+            search=(request.args.get('q') or '').strip(),
+            sort=request.args.get('sort', 'date'),
+            order=request.args.get('order', 'asc'),
+        ))
+        totals = journal.totals()
+        total_entries = totals['count']
 
         page = request.args.get('page', 1, type=int) or 1
-        total_entries = len(filtered_entries)
         per_page_param = (request.args.get('per_page') or '').strip().lower()
         if per_page_param in {'all', 'max', '*', '0', '-1'}:
             per_page = total_entries if total_entries > 0 else 1
@@ -1383,17 +697,20 @@ def get_ledger_data():
             except ValueError:
                 per_page_value = 25
             per_page = max(10, min(per_page_value, 500))
-        start_idx = (page - 1) * per_page
-        end_idx = start_idx + per_page
-        paginated_entries = filtered_entries[start_idx:end_idx]
-        
-        # حساب إجماليات البيانات (لدفتر الأستاذ)
+
+        cursor = decode_cursor(request.args.get('cursor'))
+        rows = journal.page(per_page, offset=(page - 1) * per_page, cursor=cursor)
+        paginated_entries = [_journal_entry(row) for row in rows]
+        _enrich_journal_entries(paginated_entries)
+
+        statistics = _ledger_statistics(from_date, to_date, journal.rates)
+
         ledger_totals = {
-            'total_debit': sum(entry['debit'] for entry in filtered_entries),
-            'total_credit': sum(entry['credit'] for entry in filtered_entries),
-            'final_balance': filtered_entries[-1]['balance'] if filtered_entries else 0
+            'total_debit': totals['total_debit'],
+            'total_credit': totals['total_credit'],
+            'final_balance': totals['final_balance']
         }
-        
+
         return jsonify({
             "data": paginated_entries,
             "statistics": statistics,
@@ -1402,20 +719,24 @@ def get_ledger_data():
                 "page": page,
                 "per_page": per_page,
                 "total": total_entries,
-                "pages": (total_entries + per_page - 1) // per_page if total_entries > 0 else 1
+                "pages": (total_entries + per_page - 1) // per_page if total_entries > 0 else 1,
+                "next_cursor": journal.next_cursor(rows, per_page)
             }
         })
-        
+
     except Exception as e:
         current_app.logger.error(f"Error in get_ledger_data: {str(e)}")
         return jsonify({"error": str(e), "data": [], "statistics": {}}), 500
 
+
 @ledger_bp.route("/cogs-audit", methods=["GET"], endpoint="cogs_audit_report")
 @login_required
 def cogs_audit_report():
-    """تقرير شامل لفحص تكلفة البضاعة المباعة (COGS) بدقة"""
+    """تقرير شامل لفحص تكلفة البضاعة المباعة (COGS) من التكلفة المجمدة لكل بند بيع"""
     try:
-        from models import SaleLine, fx_rate
+        from models import CogsEntry, SaleLine
+        from services.cost_layers import cost_status
+        from services.ledger_journal import currency_rates, ils_amount
         
         from_date_str = request.args.get('from_date')
         to_date_str = request.args.get('to_date')
@@ -1423,98 +744,56 @@ def cogs_audit_report():
         from_date = datetime.strptime(from_date_str, '%Y-%m-%d') if from_date_str else None
         to_date = datetime.strptime(to_date_str, '%Y-%m-%d').replace(hour=23, minute=59, second=59) if to_date_str else None
         
-        sale_lines_query = (
-            db.session.query(SaleLine)
+        rates = currency_rates(to_date)
+        line_total_ils = ils_amount(SaleLine.quantity * SaleLine.unit_price, Sale.currency, rates, Sale.fx_rate_used)
+        
+        rows_query = (
+            db.session.query(
+                CogsEntry, SaleLine.unit_price, line_total_ils.label('line_total'),
+                Sale.sale_number, Sale.sale_date, Product,
+            )
+            .join(SaleLine, SaleLine.id == CogsEntry.source_id)
             .join(Sale, Sale.id == SaleLine.sale_id)
-            .filter(Sale.status == 'CONFIRMED')
+            .join(Product, Product.id == CogsEntry.product_id)
+            .filter(CogsEntry.source_type == 'SALE_LINE', Sale.status == 'CONFIRMED')
         )
         if from_date:
-            sale_lines_query = sale_lines_query.filter(Sale.sale_date >= from_date)
+            rows_query = rows_query.filter(CogsEntry.posted_at >= from_date)
         if to_date:
-            sale_lines_query = sale_lines_query.filter(Sale.sale_date <= to_date)
+            rows_query = rows_query.filter(CogsEntry.posted_at <= to_date)
         
         products_audit = []
-        total_cogs_actual = 0.0
-        total_cogs_estimated = 0.0
-        total_cogs_missing = 0.0
+        totals = {'actual': 0.0, 'estimated': 0.0, 'missing': 0.0}
+        counts = {'actual': 0, 'estimated': 0, 'missing': 0}
         total_sales_value = 0.0
         
-        estimated_count = 0
-        missing_count = 0
-        actual_count = 0
-        
-        for line in sale_lines_query.limit(100000).all():
-            if not line.product:
-                continue
-                
-            product = line.product
-            qty_sold = float(line.quantity or 0)
-            unit_price = float(line.unit_price or 0)
-            line_total = qty_sold * unit_price
-            
-            sale_currency = line.sale.currency or 'ILS'
-            if sale_currency != 'ILS':
-                try:
-                    rate = fx_rate(sale_currency, 'ILS', line.sale.sale_date, raise_on_missing=False)
-                    if rate > 0:
-                        line_total = float(line_total * float(rate))
-                except Exception:
-                    pass
+        for entry, unit_price, line_total, sale_number, sale_date, product in (
+            rows_query.order_by(CogsEntry.posted_at, CogsEntry.id).limit(100000).all()
+        ):
+            qty_sold = float(entry.quantity or 0)
+            line_total = float(line_total or 0)
+            unit_cost = float(entry.unit_cost or 0)
+            line_cogs = float(entry.total_cost or 0)
+            status = cost_status(entry.cost_source)
             
             total_sales_value += line_total
-            
-            unit_cost = None
-            cost_source = None
-            cost_status = None
-            
-            if product.purchase_price and product.purchase_price > 0:
-                unit_cost = float(product.purchase_price)
-                cost_source = "purchase_price"
-                cost_status = "actual"
-                actual_count += 1
-            elif product.cost_after_shipping and product.cost_after_shipping > 0:
-                unit_cost = float(product.cost_after_shipping)
-                cost_source = "cost_after_shipping"
-                cost_status = "actual"
-                actual_count += 1
-            elif product.cost_before_shipping and product.cost_before_shipping > 0:
-                unit_cost = float(product.cost_before_shipping)
-                cost_source = "cost_before_shipping"
-                cost_status = "actual"
-                actual_count += 1
-            elif product.price and product.price > 0:
-                unit_cost = float(product.price) * 0.70
-                cost_source = "estimated_70%"
-                cost_status = "estimated"
-                estimated_count += 1
-            else:
-                unit_cost = 0.0
-                cost_source = "missing"
-                cost_status = "missing"
-                missing_count += 1
-            
-            line_cogs = qty_sold * unit_cost
-            
-            if cost_status == "actual":
-                total_cogs_actual += line_cogs
-            elif cost_status == "estimated":
-                total_cogs_estimated += line_cogs
-            else:
-                total_cogs_missing += line_cogs
+            totals[status] += line_cogs
+            counts[status] += 1
             
             products_audit.append({
                 'product_id': product.id,
                 'product_name': product.name,
                 'product_sku': product.sku or 'N/A',
-                'sale_id': line.sale_id,
-                'sale_number': line.sale.sale_number or f'SAL-{line.sale_id}',
-                'sale_date': line.sale.sale_date.strftime('%Y-%m-%d') if line.sale.sale_date else 'N/A',
+                'sale_id': entry.document_id,
+                'sale_number': sale_number or f'SAL-{entry.document_id}',
+                'sale_date': sale_date.strftime('%Y-%m-%d') if sale_date else 'N/A',
                 'qty_sold': qty_sold,
-                'unit_price': unit_price,
+                'unit_price': float(unit_price or 0),
                 'line_total': line_total,
                 'unit_cost': unit_cost,
-                'cost_source': cost_source,
-                'cost_status': cost_status,
+                'cost_source': entry.cost_source,
+                'cost_status': status,
+                'cost_method': entry.method,
                 'line_cogs': line_cogs,
                 'gross_profit': line_total - line_cogs,
                 'profit_margin': ((line_total - line_cogs) / line_total * 100) if line_total > 0 else 0,
@@ -1524,6 +803,13 @@ def cogs_audit_report():
                 'selling_price': float(product.price) if product.price else None
             })
         
+        total_cogs_actual = totals['actual']
+        total_cogs_estimated = totals['estimated']
+        total_cogs_missing = totals['missing']
+        actual_count = counts['actual']
+        estimated_count = counts['estimated']
+        missing_count = counts['missing']
+        
         total_cogs = total_cogs_actual + total_cogs_estimated + total_cogs_missing
         total_gross_profit = total_sales_value - total_cogs
         overall_margin = (total_gross_profit / total_sales_value * 100) if total_sales_value > 0 else 0
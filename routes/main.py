@@ -30,9 +30,9 @@ from models import (
     ServiceRequest,
     Supplier,
     Partner,
-    StockLevel,
 )
 from models import convert_amount, fx_rate
+from services.stock_totals import inventory_totals, low_stock_query
 import utils
 from reports import sales_report, ar_aging_report
 
@@ -79,34 +79,14 @@ def dashboard():
     cache_key_inv = 'dashboard_inventory_stats'
     inv_stats = cache.get(cache_key_inv)
     if inv_stats is None:
-        inv_rows = (
-            db.session.query(Product, func.coalesce(func.sum(StockLevel.quantity), 0).label("on_hand_sum"))
-            .outerjoin(StockLevel, StockLevel.product_id == Product.id)
-            .filter(Product.is_active.is_(True))
-            .group_by(Product.id)
-            .limit(3000)
-            .all()
-        )
-        for p, qty in inv_rows:
-            setattr(p, "on_hand", int(qty))
-        low_stock = [p for p, qty in inv_rows if qty <= (p.min_qty or 0)]
-        inventory_total = int(sum(qty for _, qty in inv_rows))
-        inv_stats = {'inventory_total': inventory_total, 'low_stock_count': len(low_stock)}
+        # من product_stock_totals: استعلام واحد بدل SUM لكل منتج (ولا حد 3000 منتج)
+        inv_stats = inventory_totals(db.session)
         cache.set(cache_key_inv, inv_stats, timeout=120)
-    else:
-        inventory_total = inv_stats['inventory_total']
-        inv_rows = (
-            db.session.query(Product, func.coalesce(func.sum(StockLevel.quantity), 0).label("on_hand_sum"))
-            .outerjoin(StockLevel, StockLevel.product_id == Product.id)
-            .filter(Product.is_active.is_(True))
-            .group_by(Product.id)
-            .having(func.coalesce(func.sum(StockLevel.quantity), 0) <= Product.min_qty)
-            .limit(100)
-            .all()
-        )
-        for p, qty in inv_rows:
-            setattr(p, "on_hand", int(qty))
-        low_stock = [p for p, qty in inv_rows if qty <= (p.min_qty or 0)]
+    inventory_total = inv_stats['inventory_total']
+    inv_rows = low_stock_query(db.session, limit=100).all()
+    for p, qty in inv_rows:
+        setattr(p, "on_hand", int(qty))
+    low_stock = [p for p, _ in inv_rows]
 
     cache_key_exch = 'dashboard_exchanges'
     pending_exchanges = cache.get(cache_key_exch)
@@ -736,6 +716,7 @@ def dashboard():
     return render_template(
         "dashboard.html",
         low_stock=low_stock,
+        low_stock_count=inv_stats['low_stock_count'],
         inventory_total=inventory_total,
         pending_exchanges=pending_exchanges,
         partner_stock=partner_stock,
@@ -839,34 +820,76 @@ def restore_db():
         return redirect(url_for("main.dashboard"))
 
     form = RestoreForm()
-    if form.validate_on_submit() or (request.method == 'POST' and 'db_file' in request.files):
+    snapshot_id = request.form.get('snapshot_id') if request.method == 'POST' else None
+    wants_json = request.is_json or request.headers.get('Accept') == 'application/json'
+    if form.validate_on_submit() or (request.method == 'POST' and ('db_file' in request.files or snapshot_id)):
+        from services import db_restore
         uri = current_app.config.get("SQLALCHEMY_DATABASE_URI", "")
         if not uri.startswith("sqlite:///"):
-            if request.is_json or request.headers.get('Accept') == 'application/json':
+            if wants_json:
                 return jsonify({"success": False, "message": "قاعدة البيانات ليست SQLite"}), 400
             flash("قاعدة البيانات ليست SQLite.", "warning")
             return redirect(url_for("main.restore_db"))
         db_path = uri.replace("sqlite:///", "")
+        staged = None
         try:
-            db_file = form.db_file.data if form.validate_on_submit() else request.files.get('db_file')
-            if not db_file:
-                raise ValueError("لم يتم تحديد ملف")
-            
+            # 1) تجهيز الملف المؤقت بجانب القاعدة: رفع متدفق مع SHA-256 أو إعادة بناء لقطة تزايدية
+            if snapshot_id:
+                from services.backup_store import BackupStore
+                if not snapshot_id.replace('_', '').isdigit():
+                    raise db_restore.RestoreError("معرف لقطة غير صالح")
+                staged = os.path.join(os.path.dirname(os.path.abspath(db_path)), f".restore_{snapshot_id}.db")
+                BackupStore.from_app(current_app).restore(staged, snapshot_id)
+                source = {"path": staged, "sha256": None, "size": os.path.getsize(staged), "snapshot": snapshot_id}
+            else:
+                db_file = form.db_file.data if form.validate_on_submit() else request.files.get('db_file')
+                if not db_file:
+                    raise ValueError("لم يتم تحديد ملف")
+                source = db_restore.stage_stream(db_file.stream, db_path)
+                staged = source["path"]
+
+            # 2) فحص التكامل وإصدار المخطط (مع ترقية النسخة الأقدم) قبل لمس القاعدة الحية
+            checks = db_restore.prepare(staged, os.path.join(current_app.root_path, "migrations"))
+
+            # 3) استبدال ذري وإشعار بقية العمليات لإغلاق اتصالاتها
             db.session.commit()
             db.session.remove()
-            db.engine.dispose()
-            db_file.save(db_path)
+            swapped = db_restore.swap(staged, db_path, engine=db.engine)
+            staged = None
+            current_app.logger.info(
+                f"Database restored (sha256={source.get('sha256')}, snapshot={source.get('snapshot')}, "
+                f"revision={checks['revision']}, upgraded_from={checks['upgraded_from']}, "
+                f"swap={swapped['swap_ms']}ms, previous={swapped['previous']})"
+            )
             
-            if request.is_json or request.headers.get('Accept') == 'application/json':
-                return jsonify({"success": True, "message": "تمت الاستعادة بنجاح"}), 200
-            flash("✅ تمت الاستعادة بنجاح. قد تحتاج لإعادة تشغيل التطبيق.", "success")
+            if wants_json:
+                return jsonify({
+                    "success": True, "message": "تمت الاستعادة بنجاح",
+                    "sha256": source.get("sha256"), "size": source["size"], "revision": checks["revision"],
+                    "swap_ms": swapped["swap_ms"], "previous": os.path.basename(swapped["previous"] or ""),
+                }), 200
+            flash(f"✅ تمت الاستعادة بنجاح (المخطط {checks['revision']}).", "success")
             return redirect(url_for("main.dashboard"))
+        except db_restore.RestoreError as e:
+            if wants_json:
+                return jsonify({"success": False, "message": f"تم رفض النسخة: {str(e)}"}), 400
+            flash(f"❌ تم رفض النسخة: {str(e)}", "danger")
+            return redirect(url_for("main.restore_db"))
         except Exception as e:
-            if request.is_json or request.headers.get('Accept') == 'application/json':
+            if wants_json:
                 return jsonify({"success": False, "message": f"خطأ أثناء الاستعادة: {str(e)}"}), 500
             flash("❌ خطأ أثناء الاستعادة.", "danger")
             return redirect(url_for("main.restore_db"))
-    return render_template("restore_db.html", form=form)
+        finally:
+            db_restore.discard(staged)
+    snapshots = []
+    try:
+        from services.backup_store import BackupStore, available
+        if available():
+            snapshots = BackupStore.from_app(current_app).list_snapshots()[:20]
+    except Exception:
+        snapshots = []
+    return render_template("restore_db.html", form=form, snapshots=snapshots)
 
 @main_bp.route("/automated-backup-status", methods=["GET"], endpoint="automated_backup_status")
 @login_required
@@ -6,6 +6,7 @@ from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy import or_
 from extensions import db
 from models import Product, StockLevel
+from services.stock_totals import refresh_products
 import utils
 from barcodes import normalize_barcode, is_valid_ean13
 
@@ -155,6 +156,7 @@ def parts_delete(id):
         return redirect(url_for("parts_bp.parts_list"))
     try:
         StockLevel.query.filter_by(product_id=p.id).delete()
+        refresh_products(db.session.connection(), [p.id])
         db.session.delete(p)
         db.session.commit()
         if _wants_json():
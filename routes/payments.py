@@ -30,7 +30,6 @@ from sqlalchemy import (
     case,
     or_,
     select,
-    text as sa_text,
     nullslast,
 )
 from sqlalchemy.exc import IntegrityError, SQLAlchemyError
@@ -83,18 +82,20 @@ payments_bp = Blueprint('payments', __name__, url_prefix='/payments')
 
 SMART_PARTNER_BALANCE_START = datetime(2024, 1, 1)
 
-_FULL_LOAD_OPTIONS = (
-    joinedload(Payment.customer),
-    joinedload(Payment.supplier),
-    joinedload(Payment.partner),
-    joinedload(Payment.sale),
-    joinedload(Payment.invoice),
-    joinedload(Payment.service),
-    joinedload(Payment.preorder),
-    joinedload(Payment.shipment),
-    joinedload(Payment.loan_settlement),
-    joinedload(Payment.splits),
-)
+def _full_load_options():
+    # تُبنى عند أول استخدام: joinedload على مستوى الوحدة يفرض configure_mappers لكل النماذج أثناء الاستيراد
+    return (
+        joinedload(Payment.customer),
+        joinedload(Payment.supplier),
+        joinedload(Payment.partner),
+        joinedload(Payment.sale),
+        joinedload(Payment.invoice),
+        joinedload(Payment.service),
+        joinedload(Payment.preorder),
+        joinedload(Payment.shipment),
+        joinedload(Payment.loan_settlement),
+        joinedload(Payment.splits),
+    )
 
 def _wants_json() -> bool:
     fmt = (request.args.get("format") or "").lower()
@@ -121,7 +122,7 @@ def _ok_not_found(msg: str = "السند غير موجود"):
 
 def _safe_get_payment(payment_id: int, *, all_rels: bool = False) -> Payment | None:
     try:
-        opts = _FULL_LOAD_OPTIONS if all_rels else (joinedload(Payment.customer), joinedload(Payment.supplier))
+        opts = _full_load_options() if all_rels else (joinedload(Payment.customer), joinedload(Payment.supplier))
         stmt = select(Payment).options(*opts).where(Payment.id == int(payment_id))
         return db.session.execute(stmt).unique().scalar_one_or_none()
     except Exception:
@@ -395,15 +396,20 @@ def ensure_currency(cur):
         return _ensure_ccy(cur)
     return (cur or "ILS").strip().upper()
 
+_RECEIPT_PDF_CSS = "@page { size: A4; margin: 14mm; } html, body { direction: rtl; font-family: 'Cairo','Noto Naskh Arabic',Arial,sans-serif; font-size: 12px; } h1,h2,h3 { margin: 0 0 8px 0; } table { width: 100%; border-collapse: collapse; } th, td { padding: 6px 8px; border-bottom: 1px solid #ddd; } .muted { color: #666; }"
+
+def _payment_receipt_html(payment: Payment) -> str:
+    return render_template("payments/receipt.html", payment=payment, now=datetime.utcnow())
+
 def _render_payment_receipt_pdf(payment: Payment) -> bytes:
-    from weasyprint import HTML, CSS
-    html = render_template("payments/receipt.html", payment=payment, now=datetime.utcnow())
-    css_inline = "@page { size: A4; margin: 14mm; } html, body { direction: rtl; font-family: 'Cairo','Noto Naskh Arabic',Arial,sans-serif; font-size: 12px; } h1,h2,h3 { margin: 0 0 8px 0; } table { width: 100%; border-collapse: collapse; } th, td { padding: 6px 8px; border-bottom: 1px solid #ddd; } .muted { color: #666; }"
-    try:
-        return HTML(string=html, base_url=request.url_root).write_pdf(stylesheets=[CSS(string=css_inline)])
-    except Exception:
-        current_app.logger.exception("payment.receipt_pdf_failed", extra={"payment_id": getattr(payment, "id", None)})
-        return HTML(string=html, base_url=request.url_root).write_pdf()
+    from services.pdf_render import get_renderer
+    # مفتاح الكاش بصمة HTML نفسه: أي تغيير في الدفعة أو الجهات المرتبطة أو وقت الطباعة المعروض
+    # ينتج PDF جديداً، وبناء HTML أرخص بكثير من WeasyPrint
+    return get_renderer().render(
+        _payment_receipt_html(payment),
+        base_url=request.url_root,
+        css=_RECEIPT_PDF_CSS,
+    )
 
 MAX_SEARCH_LIMIT = 25
 
@@ -1875,6 +1881,14 @@ def download_receipt(payment_id: int):
     payment = _safe_get_payment(payment_id, all_rels=False)
     if not payment:
         return _ok_not_found("السند غير موجود للتنزيل")
+    if (request.args.get("async") or "").strip().lower() in ("1", "true", "yes"):
+        # مسار المهمة: يبدأ التوليد على العمّال ويعيد رابط الاستعلام بدل انتظار PDF داخل الطلب
+        from services.pdf_render import get_renderer
+        job_id = get_renderer().start(_payment_receipt_html(payment), base_url=request.url_root, css=_RECEIPT_PDF_CSS)
+        return jsonify(
+            job=job_id,
+            status_url=url_for("payments.receipt_job", payment_id=payment_id, job_id=job_id),
+        ), 202
     try:
         pdf_bytes = _render_payment_receipt_pdf(payment)
         if not pdf_bytes:
@@ -1886,6 +1900,29 @@ def download_receipt(payment_id: int):
         if _wants_json():
             return jsonify(error="exception", message=str(e)), 500
         return make_response("<!doctype html><meta charset='utf-8'><div style='padding:24px;font-family:system-ui,Arial,sans-serif'>حصل خطأ أثناء توليد PDF</div>", 500)
+    return _receipt_pdf_response(payment, pdf_bytes)
+
+@payments_bp.route("/<int:payment_id>/receipt/jobs/<job_id>", methods=["GET"], endpoint="receipt_job")
+@login_required
+def receipt_job(payment_id: int, job_id: str):
+    """حالة مهمة توليد السند؛ عند الجاهزية يُعاد PDF نفسه"""
+    from services.pdf_render import get_renderer
+    payment = _safe_get_payment(payment_id, all_rels=False)
+    if not payment:
+        return _ok_not_found("السند غير موجود للتنزيل")
+    if not re.fullmatch(r"[0-9a-f]{64}", job_id or ""):
+        return jsonify(error="bad_job", message="معرف مهمة غير صالح"), 400
+    status, pdf_bytes, error = get_renderer().poll(job_id)
+    if status == "ready":
+        return _receipt_pdf_response(payment, pdf_bytes)
+    if status == "pending":
+        return jsonify(job=job_id, status=status), 202
+    if status == "failed":
+        return jsonify(job=job_id, status=status, message=error or "تعذّر توليد PDF"), 500
+    return jsonify(job=job_id, status=status, message="المهمة غير موجودة، أعد طلب التوليد"), 404
+
+def _receipt_pdf_response(payment: Payment, pdf_bytes: bytes):
+    payment_id = payment.id
     safe_suffix = (getattr(payment, "receipt_number", "") or "").strip() or (getattr(payment, "payment_number", "") or "").strip() or f"{payment_id}_{datetime.utcnow():%Y%m%d}"
     safe_suffix = _safe_filename_component(safe_suffix)
     filename = f"payment_receipt_{safe_suffix or payment_id}.pdf"
@@ -1944,41 +1981,11 @@ def entity_fields():
     return render_template("payments/_entity_fields.html", form=form)
 
 def _ensure_payment_number(pmt: Payment) -> None:
+    """رقم الدفعة من نفس عداد document_sequences الذي يستخدمه before_insert لـ Payment"""
     if getattr(pmt, "payment_number", None):
         return
-    base_dt = getattr(pmt, "payment_date", None) or datetime.utcnow()
-    prefix = base_dt.strftime("PMT%Y%m%d")
-    
-    # استخدام MAX بدلاً من COUNT لتجنب التكرار
-    result = db.session.execute(
-        sa_text("SELECT payment_number FROM payments WHERE payment_number LIKE :pfx ORDER BY payment_number DESC LIMIT 1"), 
-        {"pfx": f"{prefix}-%"}
-    ).scalar()
-    
-    if result:
-        try:
-            last_num = int(result.split('-')[-1])
-            next_num = last_num + 1
-        except (ValueError, IndexError):
-            next_num = 1
-    else:
-        next_num = 1
-    
-    # محاولة إيجاد رقم فريد
-    for attempt in range(100):
-        candidate = f"{prefix}-{next_num:04d}"
-        exists = db.session.execute(
-            sa_text("SELECT 1 FROM payments WHERE payment_number = :num LIMIT 1"),
-            {"num": candidate}
-        ).scalar()
-        if not exists:
-            pmt.payment_number = candidate
-            return
-        next_num += 1
-    
-    # fallback: استخدام timestamp
-    import time
-    pmt.payment_number = f"{prefix}-{int(time.time() * 1000) % 10000:04d}"
+    from services.document_numbers import next_number
+    pmt.payment_number = next_number(db.session.connection(), "PMT")
 
 def _sum_splits_decimal(splits=None, parsed_splits=None) -> Decimal:
     seq = parsed_splits if parsed_splits is not None else splits
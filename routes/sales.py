@@ -966,10 +966,10 @@ def list_sales():
     if print_mode:
         context["pdf_export"] = True
         try:
-            from weasyprint import HTML
+            from services.pdf_render import get_renderer
 
             html_output = render_template("sales/list.html", **context)
-            pdf_bytes = HTML(string=html_output, base_url=request.url_root).write_pdf()
+            pdf_bytes = get_renderer().render(html_output, base_url=request.url_root)
             filename = f"sales_{datetime.utcnow().strftime('%Y%m%d_%H%M')}.pdf"
             return Response(
                 pdf_bytes,
@@ -5425,8 +5425,9 @@ def _get_recent_actions(limit=50):
 def _get_live_metrics():
     """مقاييس حية"""
     import psutil
+    from services.system_metrics import current_snapshot
     return {
-        'cpu': psutil.cpu_percent(interval=1),
+        'cpu': current_snapshot().get('cpu_percent', 0),
         'memory': psutil.virtual_memory().percent,
         'disk': psutil.disk_usage('/').percent,
     }
@@ -5516,8 +5517,8 @@ def _get_memory_usage():
 
 def _get_cpu_usage():
     """استخدام المعالج"""
-    import psutil
-    return psutil.cpu_percent(interval=1)
+    from services.system_metrics import current_snapshot
+    return current_snapshot().get('cpu_percent', 0)
 
 
 def _safe_count_table(table_name):
@@ -5880,8 +5881,9 @@ def monitoring_dashboard():
     
     try:
         import psutil
+        from services.system_metrics import current_snapshot
         system_metrics = {
-            'cpu': round(psutil.cpu_percent(interval=1), 2),
+            'cpu': round(current_snapshot().get('cpu_percent', 0), 2),
             'memory': round(psutil.virtual_memory().percent, 2),
             'disk': round(psutil.disk_usage('/').percent, 2),
         }
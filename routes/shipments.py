@@ -1118,12 +1118,9 @@ def mark_delivered(id):
                 # توليد باركود للمنتج إذا لم يكن موجوداً
                 product = db.session.get(Product, item.product_id)
                 if product and not product.barcode:
-                    # توليد باركود بسيط: PRD + timestamp + 4 أرقام عشوائية
-                    import random
-                    from datetime import datetime
-                    timestamp = datetime.now(timezone.utc).strftime("%Y%m%d%H%M%S")
-                    random_digits = str(random.randint(1000, 9999))
-                    product.barcode = f"PRD{timestamp}{random_digits}"
+                    # باركود EAN-13 تالٍ تحت بادئة الشركة
+                    from services.barcode_allocator import next_barcode
+                    product.barcode = next_barcode(db.session.connection())
             
             # حساب التكلفة الإجمالية للشحنة
             _compute_totals(sh)
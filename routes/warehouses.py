@@ -3,7 +3,6 @@ import csv
 import io
 import json
 import os
-import re
 import uuid
 import time
 import random
@@ -22,6 +21,7 @@ from flask import (
     request,
     url_for,
     send_file,
+    stream_with_context,
 )
 from flask_login import current_user, login_required
 from werkzeug.utils import secure_filename
@@ -29,11 +29,6 @@ from sqlalchemy import func, or_, delete as sa_delete
 from sqlalchemy.exc import SQLAlchemyError, IntegrityError
 from sqlalchemy.orm import joinedload
 
-try:
-    import openpyxl
-except Exception:
-    openpyxl = None
-
 try:
     from PIL import Image
 except Exception:
@@ -43,6 +38,10 @@ from extensions import db, csrf
 import utils
 from utils import _get_or_404, permission_required
 from routes.checks import create_check_record
+from services.stock_totals import InventoryPivot
+from services.product_import import (
+    ACTIVE_STATUSES, clean_int, clean_numeric, fail_stale_runs, load_openpyxl, normalize_header,
+)
 from forms import (
     ExchangeTransactionForm,
     ExchangeVendorForm,
@@ -86,75 +85,6 @@ warehouse_bp = Blueprint("warehouse_bp", __name__, url_prefix="/warehouses")
 IMPORT_TMP_DIR_KEY = "IMPORT_TMP_DIR"
 IMPORT_REPORT_DIR_KEY = "IMPORT_REPORT_DIR"
 
-HEADER_ALIASES = {
-    "الاسم": "name",
-    "رقم القطعة": "part_number",
-    "الماركة": "brand",
-    "الاسم التجاري": "commercial_name",
-    "رقم الشاصي": "chassis_number",
-    "الرقم التسلسلي": "serial_no",
-    "الباركود": "barcode",
-    "الوحدة": "unit",
-    "اسم الفئة": "category_name",
-    "سعر الشراء": "purchase_price",
-    "سعر البيع": "selling_price",
-    "التكلفة قبل الشحن": "cost_before_shipping",
-    "التكلفة بعد الشحن": "cost_after_shipping",
-    "سعر الوحدة قبل الضريبة": "unit_price_before_tax",
-    "السعر": "price",
-    "السعر الأساسي": "price",
-    "السعر الأدنى": "min_price",
-    "السعر الأعلى": "max_price",
-    "نسبة الضريبة": "tax_rate",
-    "الحد الأدنى": "min_qty",
-    "نقطة إعادة الطلب": "reorder_point",
-    "بلد المنشأ": "origin_country",
-    "مدة الضمان": "warranty_period",
-    "الوزن": "weight",
-    "الأبعاد": "dimensions",
-    "ملاحظات": "notes",
-    "الكمية": "quantity",
-    "سعر المتجر الإلكتروني": "online_price",
-    "صورة المتجر الإلكتروني": "online_image",
-    "name": "name",
-    "brand": "brand",
-    "part_number": "part_number",
-    "part-number": "part_number",
-    "part no": "part_number",
-    "partno": "part_number",
-    "sku": "sku",
-    "code": "sku",
-    "commercial_name": "commercial_name",
-    "chassis_number": "chassis_number",
-    "serial_no": "serial_no",
-    "barcode": "barcode",
-    "unit": "unit",
-    "category_name": "category_name",
-    "purchase_price": "purchase_price",
-    "cost": "purchase_price",
-    "selling_price": "selling_price",
-    "sell": "selling_price",
-    "cost_before_shipping": "cost_before_shipping",
-    "cost_after_shipping": "cost_after_shipping",
-    "unit_price_before_tax": "unit_price_before_tax",
-    "price": "price",
-    "min_price": "min_price",
-    "max_price": "max_price",
-    "tax_rate": "tax_rate",
-    "min_qty": "min_qty",
-    "reorder_point": "reorder_point",
-    "origin_country": "origin_country",
-    "warranty_period": "warranty_period",
-    "weight": "weight",
-    "dimensions": "dimensions",
-    "notes": "notes",
-    "quantity": "quantity",
-    "qty": "quantity",
-    "online_price": "online_price",
-    "online image": "online_image",
-    "online_image": "online_image",
-}
-
 REQUIRED_MIN = {"name"}
 DEFAULTS = {"condition": "NEW", "is_active": True}
 
@@ -172,9 +102,6 @@ NUMERIC_FIELDS = {
     "online_price",
 }
 INT_FIELDS = {"min_qty", "reorder_point", "warranty_period", "quantity"}
-_CURRENCY_RE = re.compile(r"[\s\$\£\€\¥\₺\₪\﷼\₽\₹\₩\₴\₦\₫\฿]+")
-
-
 def _json_default(o):
     if isinstance(o, Decimal):
         return float(o)
@@ -228,41 +155,6 @@ def _load_tmp_payload(key: str) -> dict | None:
         return None
 
 
-def _normalize_header(h: str) -> str:
-    if not h:
-        return ""
-    s = str(h).strip().lower()
-    s = s.replace(" ", "_").replace("-", "_")
-    s = re.sub(r"_+", "_", s).strip("_")
-    return HEADER_ALIASES.get(s, s)
-
-
-def _clean_numeric(v):
-    if v in (None, "", "None"):
-        return None
-    if isinstance(v, (int, float, Decimal)):
-        try:
-            return Decimal(str(v))
-        except Exception:
-            return None
-    s = str(v)
-    trans = str.maketrans("٠١٢٣٤٥٦٧٨٩٬٫", "0123456789,.")
-    s = s.translate(trans)
-    s = _CURRENCY_RE.sub("", s).replace(",", "").strip()
-    try:
-        return Decimal(s)
-    except Exception:
-        return None
-
-def _clean_int(v):
-    if v in (None, "", "None"):
-        return None
-    try:
-        return int(float(str(v).translate(str.maketrans("٠١٢٣٤٥٦٧٨٩", "0123456789"))))
-    except Exception:
-        return None
-
-
 def _read_rows_from_csv(file_storage) -> list[dict]:
     file_storage.stream.seek(0)
     raw = file_storage.stream.read()
@@ -281,13 +173,14 @@ def _read_rows_from_csv(file_storage) -> list[dict]:
     for raw in reader:
         row = {}
         for k, v in (raw or {}).items():
-            nk = _normalize_header(k)
+            nk = normalize_header(k)
             row[nk] = (v if isinstance(v, str) else str(v)) if v is not None else None
         rows.append(row)
     return rows
 
 
 def _read_rows_from_xlsx(file_storage) -> list[dict]:
+    openpyxl = load_openpyxl()
     if not openpyxl:
         raise RuntimeError("XLSX غير مدعوم: الرجاء تثبيت openpyxl أو ارفع CSV.")
     file_storage.stream.seek(0)
@@ -297,7 +190,7 @@ def _read_rows_from_xlsx(file_storage) -> list[dict]:
     rows = []
     for i, row in enumerate(ws.iter_rows(values_only=True)):
         if i == 0:
-            headers = [_normalize_header(x if x is not None else "") for x in row]
+            headers = [normalize_header(x if x is not None else "") for x in row]
             continue
         obj = {}
         for j, cell in enumerate(row):
@@ -321,10 +214,10 @@ def _normalize_row_types(r: dict) -> dict:
     out = dict(r or {})
     for f in NUMERIC_FIELDS:
         if f in out:
-            out[f] = _clean_numeric(out.get(f))
+            out[f] = clean_numeric(out.get(f))
     for f in INT_FIELDS:
         if f in out:
-            out[f] = _clean_int(out.get(f))
+            out[f] = clean_int(out.get(f))
     for k, v in list(out.items()):
         if isinstance(v, str):
             out[k] = v.strip()
@@ -536,34 +429,6 @@ def _analyze(rows: list[dict]) -> dict:
     }
     return {"normalized": normalized, "report": report}
 
-def _save_import_report_csv(rows: list[dict], *, filename_hint: str) -> str:
-    cols = [
-        "action",
-        "strategy",
-        "sku",
-        "name",
-        "product_id",
-        "qty_added",
-        "stock_before",
-        "stock_after",
-        "purchase_price",
-        "selling_price",
-        "min_price",
-        "max_price",
-        "tax_rate",
-        "note",
-    ]
-    path = os.path.join(_report_dir(), f"{filename_hint}.csv")
-    tmp = f"{path}.tmp"
-    with open(tmp, "w", encoding="utf-8-sig", newline="") as f:
-        w = csv.DictWriter(f, fieldnames=cols)
-        w.writeheader()
-        for r in rows or []:
-            w.writerow({k: r.get(k) for k in cols})
-    os.replace(tmp, path)
-    return path
-
-
 def _uploads_root():
     base = current_app.config.get("PRODUCT_UPLOAD_DIR")
     if base:
@@ -991,67 +856,53 @@ def goto_product_card():
 @login_required
 def inventory_summary():
     search = (request.args.get("q") or "").strip()
-    selected_ids = request.args.getlist("warehouse_ids", type=int)
-    if not selected_ids:
-        selected_ids = [w.id for w in Warehouse.query.order_by(Warehouse.name).all()]
-
-    whs = Warehouse.query.filter(Warehouse.id.in_(selected_ids)).order_by(Warehouse.name.asc()).all()
+    all_whs = Warehouse.query.order_by(Warehouse.name.asc()).all()
+    selected_ids = set(request.args.getlist("warehouse_ids", type=int))
+    whs = [w for w in all_whs if w.id in selected_ids] if selected_ids else all_whs
     wh_ids = [w.id for w in whs]
+    page = max(request.args.get("page", 1, type=int) or 1, 1)
+    per_page = min(max(request.args.get("per_page", 100, type=int) or 100, 10), 500)
 
-    if wh_ids:
-        q = (
-            db.session.query(StockLevel)
-            .join(Product, StockLevel.product_id == Product.id)
-            .filter(StockLevel.warehouse_id.in_(wh_ids))
-            .options(joinedload(StockLevel.product))
-            .order_by(Product.name.asc())
-        )
-        if search:
-            like = f"%{search}%"
-            q = q.filter(or_(Product.name.ilike(like), Product.sku.ilike(like), Product.part_number.ilike(like)))
-        rows = q.all()
-    else:
-        rows = []
-
-    pivot = {}
-    for sl in rows:
-        pid = sl.product_id
-        p = sl.product
-        if pid not in pivot:
-            pivot[pid] = {"product": p, "by": {wid: {"on": 0, "res": 0} for wid in wh_ids}, "total": 0}
-        on = int(sl.quantity or 0)
-        res = int(getattr(sl, "reserved_quantity", 0) or 0)
-        pivot[pid]["by"][sl.warehouse_id] = {"on": on, "res": res}
-        pivot[pid]["total"] += on
-
-    rows_data = sorted(pivot.values(), key=lambda d: (d["product"].name or "").lower())
+    pivot = InventoryPivot(db.session, wh_ids, all_selected=len(wh_ids) == len(all_whs), search=search)
 
     if (request.args.get("export") or "").lower() == "csv":
-        si = io.StringIO()
-        writer = csv.writer(si)
-        header = ["ID", "القطعة", "SKU"] + [w.name for w in whs] + ["الإجمالي"]
-        writer.writerow(header)
-        for r in rows_data:
-            p = r["product"]
-            sku = getattr(p, "sku", "") or ""
-            line = [str(getattr(p, "id", "") or ""), (p.name or ""), sku]
-            for wid in wh_ids:
-                line.append(str(r["by"][wid]["on"] if wid in r["by"] else 0))
-            line.append(str(r["total"]))
-            writer.writerow(line)
-        output = si.getvalue().encode("utf-8-sig")
+        def _generate():
+            si = io.StringIO()
+            writer = csv.writer(si)
+            si.write("\ufeff")
+            writer.writerow(["ID", "القطعة", "SKU"] + [w.name for w in whs] + ["الإجمالي"])
+            for r in pivot.iter_all():
+                p = r["product"]
+                writer.writerow(
+                    [str(p.id), p.name or "", p.sku or ""]
+                    + [str(r["by"][wid]["on"]) for wid in wh_ids]
+                    + [str(r["total"])]
+                )
+                if si.tell() > 65536:
+                    yield si.getvalue().encode("utf-8")
+                    si.seek(0)
+                    si.truncate(0)
+            yield si.getvalue().encode("utf-8")
+
         return Response(
-            output,
+            stream_with_context(_generate()),
             mimetype="text/csv; charset=utf-8",
             headers={"Content-Disposition": "attachment; filename=inventory_summary.csv"},
         )
 
+    summary = pivot.summary()
+    pages = max((summary["products"] + per_page - 1) // per_page, 1)
     return render_template(
         "warehouses/inventory_summary.html",
         warehouses=whs,
-        rows=rows_data,
+        all_warehouses=all_whs,
+        rows=pivot.page(min(page, pages), per_page),
         selected_ids=wh_ids,
         search=search,
+        summary=summary,
+        page=min(page, pages),
+        pages=pages,
+        per_page=per_page,
     )
 
 
@@ -1731,8 +1582,9 @@ def import_products(id):
     file_obj.seek(0, os.SEEK_END)
     size = file_obj.tell()
     file_obj.seek(0)
-    if size > 5 * 1024 * 1024:
-        flash("حجم الملف يتجاوز الحد المسموح (5MB).", "danger")
+    max_mb = int(current_app.config.get("IMPORT_MAX_UPLOAD_MB", 50) or 50)
+    if size > max_mb * 1024 * 1024:
+        flash(f"حجم الملف يتجاوز الحد المسموح ({max_mb}MB).", "danger")
         return render_template("warehouses/import_products.html", form=form, warehouse=w)
 
     head = file_obj.read(2)
@@ -1742,12 +1594,22 @@ def import_products(id):
         return render_template("warehouses/import_products.html", form=form, warehouse=w)
 
     try:
-        blob = file_obj.read()
+        digest = hashlib.sha256()
+        for chunk in iter(lambda: file_obj.read(1024 * 1024), b""):
+            digest.update(chunk)
         file_obj.seek(0)
-        file_sha256 = hashlib.sha256(blob).hexdigest()
+        file_sha256 = digest.hexdigest()
     except Exception:
         file_sha256 = None
 
+    strategy = getattr(form, "duplicate_strategy", None).data if hasattr(form, "duplicate_strategy") else "skip"
+    dry_run = bool(getattr(form, "dry_run", None).data) if hasattr(form, "dry_run") else True
+
+    preview_mb = int(current_app.config.get("IMPORT_PREVIEW_MAX_MB", 2) or 0)
+    if size > preview_mb * 1024 * 1024:
+        # الملفات الكبيرة: بدون معاينة قابلة للتعديل، تُستورد في الخلفية ويُتابع التقدم من سجل الاستيراد
+        return _start_background_import(w, file_obj, filename, file_sha256, strategy, dry_run)
+
     try:
         rows = _read_uploaded_rows(file_obj)
     except RuntimeError as e:
@@ -1762,8 +1624,8 @@ def import_products(id):
         "warehouse_id": w.id,
         "filename": filename or f"upload_{uuid.uuid4().hex}",
         "file_sha256": file_sha256,
-        "strategy": getattr(form, "duplicate_strategy", None).data if hasattr(form, "duplicate_strategy") else "skip",
-        "dry_run": bool(getattr(form, "dry_run", None).data) if hasattr(form, "dry_run") else True,
+        "strategy": strategy,
+        "dry_run": dry_run,
         "continue_after_warnings": bool(getattr(form, "continue_after_warnings", None).data) if hasattr(form, "continue_after_warnings") else False,
         "created_by": getattr(current_user, "id", None),
         "created_at": datetime.utcnow().isoformat(),
@@ -1777,6 +1639,46 @@ def import_products(id):
 
     return redirect(url_for("warehouse_bp.import_preview", id=w.id, token=key))
 
+def _import_report_path(w: Warehouse, token: str | None) -> str:
+    return os.path.join(_report_dir(), f"wh{w.id}_{token or uuid.uuid4().hex}_{int(time.time())}.csv")
+
+
+def _start_background_import(w: Warehouse, file_obj, filename: str, file_sha256: str | None, strategy: str, dry_run: bool):
+    from services.product_import import STRATEGIES, start_import
+
+    if strategy not in STRATEGIES:
+        strategy = "skip"
+    key = uuid.uuid4().hex
+    ext = filename.rsplit(".", 1)[-1].lower()
+    path = os.path.join(_tmp_dir(), f"{key}.{ext}")
+    file_obj.seek(0)
+    file_obj.save(path)
+    run = ImportRun(
+        warehouse_id=w.id,
+        user_id=current_user.id,
+        filename=filename,
+        file_sha256=file_sha256,
+        dry_run=dry_run,
+        status="QUEUED",
+        stage="queued",
+        notes="dry_run" if dry_run else None,
+        meta={"token": key, "strategy": strategy, "background": True},
+    )
+    db.session.add(run)
+    db.session.commit()
+    start_import(
+        current_app._get_current_object(),
+        run.id,
+        path,
+        warehouse_id=w.id,
+        strategy=strategy,
+        dry_run=dry_run,
+        report_path=None if dry_run else _import_report_path(w, key),
+    )
+    flash(f"⏳ بدأ استيراد الملف في الخلفية (عملية #{run.id}). تابع التقدم من سجل الاستيراد.", "info")
+    return redirect(url_for("warehouse_bp.import_runs", id=w.id))
+
+
 @warehouse_bp.route("/<int:warehouse_id>/preview/update", methods=["POST"], endpoint="preview_update")
 @login_required
 def preview_update(warehouse_id: int):
@@ -1797,10 +1699,10 @@ def preview_update(warehouse_id: int):
     int_fields = {"min_qty", "reorder_point", "warranty_period"}
 
     def as_decimal(v):
-        return _clean_numeric(v)
+        return clean_numeric(v)
 
     def as_int(v):
-        return _clean_int(v)
+        return clean_int(v)
 
     def _exists(col, val):
         if val in (None, "", "None"):
@@ -1959,330 +1861,33 @@ def import_commit(id):
             request.form.get("dry_run") or payload.get("dry_run", True)
         )
 
-        inserted = updated = skipped = errors = 0
-        t0 = time.perf_counter()
-        report_rows = []
-
-        # === Preload existing unique fields ===
-        all_skus = set()
-        all_barcodes = set()
-        all_serials = set()
-        for item in rows:
-            d = item.get("data") or {}
-            if d.get("sku"):
-                all_skus.add(d["sku"].strip().upper())
-            if d.get("part_number"):
-                all_skus.add(str(d["part_number"]).strip().upper())
-            if d.get("barcode"):
-                all_barcodes.add(d["barcode"].strip())
-            if d.get("serial_no"):
-                all_serials.add(d["serial_no"].strip().upper())
-
-        existing_skus = {
-            (s or "").upper(): pid
-            for pid, s in db.session.query(Product.id, Product.sku)
-            .filter(Product.sku.isnot(None))
-            .all()
-        }
-        existing_barcodes = {
-            b: pid
-            for pid, b in db.session.query(Product.id, Product.barcode)
-            .filter(Product.barcode.isnot(None))
-            .all()
-        }
-        existing_serials = {
-            (s or "").upper(): pid
-            for pid, s in db.session.query(Product.id, Product.serial_no)
-            .filter(Product.serial_no.isnot(None))
-            .all()
-        }
-
-        for item in rows:
-            data = dict(item.get("data") or {})
-            name = (data.get("name") or "").strip()
-            if not name:
-                skipped += 1
-                report_rows.append(
-                    {
-                        "action": "skip",
-                        "strategy": strategy,
-                        "sku": data.get("sku") or "",
-                        "name": "",
-                        "product_id": "",
-                        "qty_added": 0,
-                        "stock_before": 0,
-                        "stock_after": 0,
-                        "purchase_price": 0,
-                        "selling_price": 0,
-                        "min_price": 0,
-                        "max_price": 0,
-                        "tax_rate": 0,
-                        "note": "missing_name",
-                    }
-                )
-                continue
-
-            sku = (data.get("sku") or "").strip().upper()
-            if not sku and data.get("part_number"):
-                sku = str(data["part_number"]).strip().upper()
-
-            def _dv(k, d=None):
-                v = data.get(k)
-                if v in (None, "", "None"):
-                    return d
-                try:
-                    return Decimal(str(v))
-                except Exception:
-                    return d
-
-            def _iv(k):
-                try:
-                    v = data.get(k)
-                    return int(float(v)) if v not in (None, "", "None") else None
-                except Exception:
-                    return None
-
-            price = _dv("price")
-            selling_price = _dv("selling_price", price)
-            purchase_price = _dv("purchase_price")
-            online_price = _dv("online_price")
-            qty = max(_iv("quantity") or 0, 0)
-
-            pid = item.get("match", {}).get("product_id")
-            p = db.session.get(Product, pid) if pid else None
-
-            effective_action = None
-            before_qty = after_qty = 0
-
-            if p is None:
-                duplicate = False
-                for field, lookup, store in (
-                    ("sku", sku, existing_skus),
-                    ("barcode", (data.get("barcode") or "").strip(), existing_barcodes),
-                    ("serial_no", (data.get("serial_no") or "").strip().upper(), existing_serials),
-                ):
-                    if lookup and lookup in store:
-                        errors += 1
-                        report_rows.append(
-                            {
-                                "action": "skip",
-                                "strategy": strategy,
-                                "sku": data.get("sku") or "",
-                                "name": name,
-                                "product_id": "",
-                                "qty_added": 0,
-                                "stock_before": 0,
-                                "stock_after": 0,
-                                "purchase_price": 0,
-                                "selling_price": 0,
-                                "min_price": 0,
-                                "max_price": 0,
-                                "tax_rate": 0,
-                                "note": f"duplicate_{field}",
-                            }
-                        )
-                        duplicate = True
-                        break
-                if duplicate:
-                    continue
-
-                p = Product(
-                    name=name,
-                    sku=sku or None,
-                    part_number=data.get("part_number") or None,
-                    brand=data.get("brand") or None,
-                    commercial_name=data.get("commercial_name") or None,
-                    chassis_number=data.get("chassis_number") or None,
-                    serial_no=data.get("serial_no") or None,
-                    barcode=data.get("barcode") or None,
-                    unit=data.get("unit") or None,
-                    category_name=data.get("category_name") or None,
-                    price=price or 0,
-                    selling_price=selling_price or (price or 0),
-                    purchase_price=purchase_price or 0,
-                    cost_before_shipping=_dv("cost_before_shipping", 0),
-                    cost_after_shipping=_dv("cost_after_shipping", 0),
-                    unit_price_before_tax=_dv("unit_price_before_tax", 0),
-                    min_price=_dv("min_price"),
-                    max_price=_dv("max_price"),
-                    tax_rate=_dv("tax_rate", 0),
-                    min_qty=_iv("min_qty") or 0,
-                    reorder_point=_iv("reorder_point"),
-                    condition=data.get("condition") or "NEW",
-                    origin_country=data.get("origin_country") or None,
-                    warranty_period=_iv("warranty_period"),
-                    weight=_dv("weight"),
-                    dimensions=data.get("dimensions") or None,
-                    image=data.get("image") or None,
-                    online_price=online_price,
-                    online_image=data.get("online_image") or None,
-                    is_active=True,
-                    is_digital=False,
-                    is_exchange=False,
-                )
-                db.session.add(p)
-                db.session.flush()
-                if not p.category_id and p.category_name:
-                    p.category_id = _ensure_category_id(p.category_name)
-                inserted += 1
-                effective_action = "insert"
-            else:
-                if strategy == "skip":
-                    skipped += 1
-                    effective_action = "skip"
-                elif strategy in ("update_product", "stock_only"):
-                    if strategy == "update_product":
-                        dup_conflict = False
-                        for fld, lookup, store in (
-                            ("sku", sku, existing_skus),
-                            ("barcode", (data.get("barcode") or "").strip(), existing_barcodes),
-                            ("serial_no", (data.get("serial_no") or "").strip().upper(), existing_serials),
-                        ):
-                            if lookup and lookup in store and store[lookup] != p.id:
-                                errors += 1
-                                report_rows.append(
-                                    {
-                                        "action": "skip",
-                                        "strategy": strategy,
-                                        "sku": data.get("sku") or "",
-                                        "name": name,
-                                        "product_id": p.id,
-                                        "qty_added": 0,
-                                        "stock_before": 0,
-                                        "stock_after": 0,
-                                        "purchase_price": float(purchase_price or 0),
-                                        "selling_price": float(selling_price or 0),
-                                        "min_price": float(_dv("min_price") or 0),
-                                        "max_price": float(_dv("max_price") or 0),
-                                        "tax_rate": float(_dv("tax_rate", 0)),
-                                        "note": f"duplicate_{fld}_update",
-                                    }
-                                )
-                                dup_conflict = True
-                                break
-                        if dup_conflict:
-                            continue
-                        p.name = name or p.name
-                        p.brand = data.get("brand") or p.brand
-                        p.part_number = data.get("part_number") or p.part_number
-                        p.sku = sku or p.sku
-                        if price is not None:
-                            p.price = price
-                        if selling_price is not None:
-                            p.selling_price = selling_price
-                        if purchase_price is not None:
-                            p.purchase_price = purchase_price
-                        if online_price is not None:
-                            p.online_price = online_price
-                        p.min_price = _dv("min_price", p.min_price)
-                        p.max_price = _dv("max_price", p.max_price)
-                        p.tax_rate = _dv("tax_rate", p.tax_rate)
-                        p.unit = data.get("unit") or p.unit
-                        p.category_name = data.get("category_name") or p.category_name
-                        if not p.category_id and p.category_name:
-                            p.category_id = _ensure_category_id(p.category_name)
-                    updated += 1
-                    effective_action = "update"
-
-            if effective_action != "skip":
-                if qty > 0:
-                    sl = StockLevel.query.filter_by(
-                        warehouse_id=w.id, product_id=p.id
-                    ).first()
-                    before_qty = int(sl.quantity or 0) if sl else 0
-                    if not sl:
-                        sl = StockLevel(
-                            warehouse_id=w.id,
-                            product_id=p.id,
-                            quantity=0,
-                            reserved_quantity=0,
-                        )
-                        db.session.add(sl)
-                    sl.quantity = before_qty + qty
-                    after_qty = int(sl.quantity or 0)
-                else:
-                    sl = StockLevel.query.filter_by(
-                        warehouse_id=w.id, product_id=p.id
-                    ).first()
-                    before_qty = after_qty = int(sl.quantity or 0) if sl else 0
-
-            report_rows.append(
-                {
-                    "action": effective_action or "skip",
-                    "strategy": strategy,
-                    "sku": sku,
-                    "name": name,
-                    "product_id": p.id if p else "",
-                    "qty_added": qty if effective_action != "skip" else 0,
-                    "stock_before": before_qty,
-                    "stock_after": after_qty,
-                    "purchase_price": float(purchase_price or 0),
-                    "selling_price": float(selling_price or 0),
-                    "min_price": float(_dv("min_price") or 0),
-                    "max_price": float(_dv("max_price") or 0),
-                    "tax_rate": float(_dv("tax_rate", 0)),
-                    "note": item.get("note") or "",
-                }
-            )
-
-        duration_ms = int((time.perf_counter() - t0) * 1000)
-
+        # ترحيل مجمّع عبر staging بدل إنشاء Product/StockLevel صفاً صفاً عبر ORM
+        from services.product_import import STRATEGIES, ProductImporter
+
+        if strategy not in STRATEGIES:
+            strategy = "skip"
+
+        run = ImportRun(
+            warehouse_id=w.id,
+            user_id=current_user.id,
+            filename=payload.get("filename"),
+            file_sha256=payload.get("file_sha256"),
+            dry_run=dry_run,
+            status="QUEUED",
+            notes="dry_run" if dry_run else None,
+            meta={"token": token, "rows": len(rows)},
+        )
+        db.session.add(run)
+        db.session.commit()
+        counts = ProductImporter(db.session, run, warehouse_id=w.id, strategy=strategy, dry_run=dry_run).execute(
+            (item.get("data") or {} for item in rows),
+            report_path=None if dry_run else _import_report_path(w, token),
+        )
+        summary = f"جديد={counts['inserted']}, تحديث={counts['updated']}, متجاهل={counts['skipped']}, أخطاء={counts['errors']}"
         if dry_run:
-            db.session.rollback()
-            try:
-                db.session.add(
-                    ImportRun(
-                        warehouse_id=w.id,
-                        user_id=current_user.id,
-                        filename=payload.get("filename"),
-                        file_sha256=payload.get("file_sha256"),
-                        dry_run=True,
-                        inserted=inserted,
-                        updated=updated,
-                        skipped=skipped,
-                        errors=errors,
-                        duration_ms=duration_ms,
-                        notes="dry_run",
-                        meta={"token": token},
-                    )
-                )
-                db.session.commit()
-            except Exception:
-                db.session.rollback()
-            flash(
-                f"فحص فقط: جديد={inserted}, تحديث={updated}, متجاهل={skipped}, أخطاء={errors}",
-                "info",
-            )
+            flash(f"فحص فقط: {summary}", "info")
         else:
-            db.session.commit()
-            path = _save_import_report_csv(
-                report_rows,
-                filename_hint=f"wh{w.id}_{token or uuid.uuid4().hex}_{int(time.time())}",
-            )
-            try:
-                db.session.add(
-                    ImportRun(
-                        warehouse_id=w.id,
-                        user_id=current_user.id,
-                        filename=payload.get("filename"),
-                        file_sha256=payload.get("file_sha256"),
-                        dry_run=False,
-                        inserted=inserted,
-                        updated=updated,
-                        skipped=skipped,
-                        errors=errors,
-                        duration_ms=duration_ms,
-                        report_path=path,
-                        meta={"token": token, "rows": len(report_rows)},
-                    )
-                )
-                db.session.commit()
-            except Exception:
-                db.session.rollback()
-            flash(
-                f"تم الترحيل: جديد={inserted}, تحديث={updated}, متجاهل={skipped}, أخطاء={errors}",
-                "success",
-            )
+            flash(f"تم الترحيل: {summary}", "success")
     except Exception as e:
         db.session.rollback()
         flash(f"فشل الترحيل: {e}", "danger")
@@ -3259,11 +2864,36 @@ def list_import_runs(id):
                 "errors": r.errors,
                 "duration_ms": r.duration_ms,
                 "report_path": r.report_path,
+                "status": r.status,
+                "stage": r.stage,
+                "processed": r.processed,
             }
             for r in runs
         ])
     return render_template("warehouses/import_runs.html", warehouse=w, runs=runs)
 
+@warehouse_bp.route("/imports/<int:run_id>/status", methods=["GET"], endpoint="import_run_status")
+@login_required
+def import_run_status(run_id: int):
+    ir = _get_or_404(ImportRun, run_id)
+    if ir.status in ACTIVE_STATUSES:
+        fail_stale_runs(db.session, current_app.config.get("IMPORT_STALE_MINUTES", 30), run_ids=[ir.id])
+        db.session.refresh(ir)
+    return jsonify({
+        "id": ir.id,
+        "status": ir.status,
+        "stage": ir.stage,
+        "processed": ir.processed,
+        "inserted": ir.inserted,
+        "updated": ir.updated,
+        "skipped": ir.skipped,
+        "errors": ir.errors,
+        "duration_ms": ir.duration_ms,
+        "finished_at": ir.finished_at.isoformat() if ir.finished_at else None,
+        "notes": ir.notes,
+        "has_report": bool(ir.report_path),
+    })
+
 @warehouse_bp.route("/imports/<int:run_id>/download", methods=["GET"], endpoint="import_run_download")
 @login_required
 def download_import_run(run_id: int):
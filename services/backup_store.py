@@ -0,0 +1,331 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+try:
+    import zstandard as zstd
+except Exception:  # pragma: no cover - تبعية اختيارية
+    zstd = None
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHUNK_SIZE = 1024 * 1024
+DEFAULT_LEVEL = 3
+MANIFEST_PREFIX = "snap_"
+LOCK_NAME = ".lock"
+
+# يحمي الخيوط داخل العملية؛ قفل الملف في مجلد المخزن يحمي بين العمليات
+_LOCK = threading.Lock()
+
+
+def available() -> bool:
+    return zstd is not None
+
+
+class BackupStore:
+    """نسخ احتياطي تزايدي لقاعدة SQLite بمخزن كتل حسب المحتوى
+
+    كل لقطة تُؤخذ عبر SQLite backup API إلى ملف مؤقت ثم تُقسم إلى كتل بحجم
+    ثابت (مضاعف لحجم الصفحة). الكتلة تُخزن مرة واحدة باسم SHA-256 لمحتواها
+    مضغوطة بـ zstd، واللقطة نفسها ملف manifest يسرد الكتل بالترتيب. لذلك
+    تكلفة كل لقطة تقارب حجم الصفحات المتغيرة فقط وليس حجم القاعدة كاملة.
+    """
+
+    def __init__(self, root, chunk_size: int = DEFAULT_CHUNK_SIZE, level: int = DEFAULT_LEVEL,
+                 backup_pages: int = 1024, backup_sleep: float = 0.1):
+        self.root = Path(root)
+        self.chunks_dir = self.root / "chunks"
+        self.manifests_dir = self.root / "manifests"
+        self.chunk_size = max(int(chunk_size or DEFAULT_CHUNK_SIZE), 4096)
+        self.level = int(level or DEFAULT_LEVEL)
+        self.backup_pages = int(backup_pages or 1024) if int(backup_pages or 0) > 0 else 1024
+        self.backup_sleep = float(backup_sleep or 0.1) if float(backup_sleep or 0) > 0 else 0.1
+
+    @classmethod
+    def from_app(cls, app) -> "BackupStore":
+        cfg = app.config
+        return cls(
+            cfg.get("BACKUP_STORE_DIR") or os.path.join(cfg.get("BACKUP_DIR") or app.instance_path, "store"),
+            chunk_size=cfg.get("BACKUP_CHUNK_SIZE") or DEFAULT_CHUNK_SIZE,
+            level=cfg.get("BACKUP_ZSTD_LEVEL") or DEFAULT_LEVEL,
+            backup_pages=cfg.get("BACKUP_DB_PAGES") or 1024,
+            backup_sleep=cfg.get("BACKUP_DB_SLEEP") or 0.1,
+        )
+
+    # ------------------------------------------------------------ مسارات
+
+    def _chunk_path(self, digest: str) -> Path:
+        return self.chunks_dir / digest[:2] / f"{digest}.zst"
+
+    def manifest_path(self, snapshot_id: str) -> Path:
+        return self.manifests_dir / f"{MANIFEST_PREFIX}{snapshot_id}.json"
+
+    @contextmanager
+    def _locked(self):
+        """قفل حصري على المخزن بين كل العمليات (المجدول، flask backup-prune، العمال)
+
+        بدونه قد يحذف prune في عملية كتلة أشارت إليها لقطة تُكتب في عملية أخرى.
+        """
+        with _LOCK:
+            self.root.mkdir(parents=True, exist_ok=True)
+            with open(self.root / LOCK_NAME, "a+") as fh:
+                try:
+                    import fcntl
+                    fcntl.flock(fh, fcntl.LOCK_EX)
+                except ImportError:
+                    import msvcrt
+                    fh.seek(0)
+                    msvcrt.locking(fh.fileno(), msvcrt.LK_LOCK, 1)
+                try:
+                    yield
+                finally:
+                    try:
+                        import fcntl
+                        fcntl.flock(fh, fcntl.LOCK_UN)
+                    except ImportError:
+                        import msvcrt
+                        fh.seek(0)
+                        msvcrt.locking(fh.fileno(), msvcrt.LK_UNLCK, 1)
+
+    def _ensure_dirs(self):
+        self.chunks_dir.mkdir(parents=True, exist_ok=True)
+        self.manifests_dir.mkdir(parents=True, exist_ok=True)
+
+    @staticmethod
+    def _atomic_write(path: Path, data: bytes):
+        tmp = path.with_name(path.name + ".tmp")
+        with open(tmp, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+
+    # ------------------------------------------------------------ اللقطات
+
+    def snapshot(self, db_path: str, version: Optional[str] = None) -> Dict[str, Any]:
+        """أخذ لقطة جديدة وإرجاع الـ manifest الخاص بها"""
+        if zstd is None:
+            raise RuntimeError("zstandard غير مثبت")
+        if not os.path.exists(db_path):
+            raise FileNotFoundError(db_path)
+
+        with self._locked():
+            self._ensure_dirs()
+            snapshot_id = datetime.now(timezone.utc).strftime("%Y%m%d_%H%M%S_%f")
+            staging = self.root / f".staging_{snapshot_id}.db"
+            try:
+                page_size = self._copy_consistent(db_path, staging)
+                chunk_size = max(page_size, self.chunk_size - self.chunk_size % page_size)
+
+                compressor = zstd.ZstdCompressor(level=self.level)
+                whole = hashlib.sha256()
+                chunks: List[str] = []
+                new_chunks = 0
+                new_bytes = 0
+                with open(staging, "rb") as f:
+                    while True:
+                        block = f.read(chunk_size)
+                        if not block:
+                            break
+                        whole.update(block)
+                        digest = hashlib.sha256(block).hexdigest()
+                        chunks.append(digest)
+                        path = self._chunk_path(digest)
+                        if not path.exists():
+                            path.parent.mkdir(parents=True, exist_ok=True)
+                            data = compressor.compress(block)
+                            self._atomic_write(path, data)
+                            new_chunks += 1
+                            new_bytes += len(data)
+
+                manifest = {
+                    "id": snapshot_id,
+                    "created_at": datetime.now(timezone.utc).isoformat(),
+                    "source": os.path.basename(db_path),
+                    "db_size": staging.stat().st_size,
+                    "page_size": page_size,
+                    "chunk_size": chunk_size,
+                    "sha256": whole.hexdigest(),
+                    "chunks": chunks,
+                    "new_chunks": new_chunks,
+                    "new_bytes": new_bytes,
+                    "version": version or "unknown",
+                }
+                self._atomic_write(
+                    self.manifest_path(snapshot_id),
+                    json.dumps(manifest, ensure_ascii=False).encode("utf-8"),
+                )
+                return manifest
+            finally:
+                for leftover in (staging, Path(f"{staging}-journal")):
+                    try:
+                        leftover.unlink()
+                    except FileNotFoundError:
+                        pass
+
+    def _copy_consistent(self, db_path: str, target: Path) -> int:
+        """نسخة متسقة عبر backup API مع فحص التكامل، وإرجاع حجم الصفحة"""
+        src = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True, timeout=60)
+        dst = sqlite3.connect(str(target), timeout=60)
+        try:
+            src.execute("PRAGMA busy_timeout=60000")
+            src.backup(dst, pages=self.backup_pages, sleep=self.backup_sleep)
+            # اللقطة ملف مستقل بدون WAL حتى تكون صورة الصفحات كاملة في ملف واحد
+            dst.execute("PRAGMA journal_mode=DELETE")
+            result = dst.execute("PRAGMA quick_check").fetchone()
+            if not result or result[0] != "ok":
+                raise RuntimeError(f"Backup integrity check failed: {result[0] if result else '-'}")
+            return int(dst.execute("PRAGMA page_size").fetchone()[0])
+        finally:
+            src.close()
+            dst.close()
+
+    # ------------------------------------------------------------ القراءة
+
+    def list_snapshots(self) -> List[Dict[str, Any]]:
+        """اللقطات من الأحدث للأقدم (بدون قائمة الكتل)"""
+        items = []
+        if not self.manifests_dir.exists():
+            return items
+        for path in sorted(self.manifests_dir.glob(f"{MANIFEST_PREFIX}*.json"), reverse=True):
+            try:
+                manifest = json.loads(path.read_text(encoding="utf-8"))
+            except Exception as e:
+                logger.warning(f"⚠️ manifest تالف {path.name}: {e}")
+                continue
+            manifest["chunk_count"] = len(manifest.pop("chunks", []))
+            manifest["path"] = str(path)
+            items.append(manifest)
+        return items
+
+    def remove(self, snapshot_id: str) -> bool:
+        """حذف manifest لقطة واحدة؛ كتلها تُحذف في prune التالي إن لم تُستخدم"""
+        with self._locked():
+            try:
+                self.manifest_path(snapshot_id).unlink()
+            except FileNotFoundError:
+                return False
+            return True
+
+    def load(self, snapshot_id: Optional[str] = None) -> Dict[str, Any]:
+        if snapshot_id is None:
+            snapshots = self.list_snapshots()
+            if not snapshots:
+                raise FileNotFoundError("لا توجد لقطات")
+            snapshot_id = snapshots[0]["id"]
+        path = self.manifest_path(snapshot_id)
+        if not path.exists():
+            raise FileNotFoundError(f"snapshot {snapshot_id} not found")
+        return json.loads(path.read_text(encoding="utf-8"))
+
+    def _read_chunk(self, digest: str, decompressor) -> bytes:
+        with open(self._chunk_path(digest), "rb") as f:
+            return decompressor.decompress(f.read())
+
+    def verify(self, snapshot_id: Optional[str] = None, deep: bool = True) -> Dict[str, Any]:
+        """التحقق من وجود كل كتل اللقطة، ومع deep من محتواها وبصمة الصورة كاملة"""
+        manifest = self.load(snapshot_id)
+        missing, corrupt = [], []
+        whole = hashlib.sha256()
+        decompressor = zstd.ZstdDecompressor() if (deep and zstd is not None) else None
+        for digest in manifest["chunks"]:
+            if not self._chunk_path(digest).exists():
+                missing.append(digest)
+                continue
+            if decompressor is None:
+                continue
+            try:
+                block = self._read_chunk(digest, decompressor)
+            except Exception:
+                corrupt.append(digest)
+                continue
+            if hashlib.sha256(block).hexdigest() != digest:
+                corrupt.append(digest)
+            whole.update(block)
+        ok = not missing and not corrupt
+        if ok and decompressor is not None:
+            ok = whole.hexdigest() == manifest["sha256"]
+        return {"id": manifest["id"], "ok": ok, "missing": missing, "corrupt": corrupt, "chunks": len(manifest["chunks"])}
+
+    def restore(self, target_path: str, snapshot_id: Optional[str] = None) -> Dict[str, Any]:
+        """إعادة بناء ملف القاعدة من اللقطة إلى target_path (ملف جديد، لا يلمس القاعدة الحية)"""
+        if zstd is None:
+            raise RuntimeError("zstandard غير مثبت")
+        manifest = self.load(snapshot_id)
+        target = Path(target_path)
+        target.parent.mkdir(parents=True, exist_ok=True)
+        tmp = target.with_name(target.name + ".restoring")
+        decompressor = zstd.ZstdDecompressor()
+        whole = hashlib.sha256()
+        try:
+            with open(tmp, "wb") as out:
+                for digest in manifest["chunks"]:
+                    block = self._read_chunk(digest, decompressor)
+                    whole.update(block)
+                    out.write(block)
+                out.flush()
+                os.fsync(out.fileno())
+            if whole.hexdigest() != manifest["sha256"]:
+                raise RuntimeError("restored image checksum mismatch")
+            conn = sqlite3.connect(str(tmp))
+            try:
+                result = conn.execute("PRAGMA integrity_check").fetchone()
+            finally:
+                conn.close()
+            if not result or result[0] != "ok":
+                raise RuntimeError(f"restored database integrity check failed: {result[0] if result else '-'}")
+            os.replace(tmp, target)
+        finally:
+            if tmp.exists():
+                tmp.unlink()
+        return {"id": manifest["id"], "path": str(target), "size": manifest["db_size"]}
+
+    # ------------------------------------------------------------ التنظيف
+
+    def prune(self, keep_last: int) -> Dict[str, int]:
+        """حذف اللقطات الأقدم من آخر keep_last ثم الكتل التي لم تعد أي لقطة تشير إليها"""
+        keep_last = max(int(keep_last or 1), 1)
+        with self._locked():
+            manifests = sorted(self.manifests_dir.glob(f"{MANIFEST_PREFIX}*.json"), reverse=True) \
+                if self.manifests_dir.exists() else []
+            removed_snapshots = 0
+            for path in manifests[keep_last:]:
+                path.unlink()
+                removed_snapshots += 1
+
+            referenced = set()
+            for path in manifests[:keep_last]:
+                try:
+                    referenced.update(json.loads(path.read_text(encoding="utf-8"))["chunks"])
+                except Exception as e:
+                    # manifest غير مقروء: لا نحذف أي كتلة حتى لا نفقد بيانات لقطة سليمة
+                    logger.warning(f"⚠️ تعذر قراءة {path.name}، تم إيقاف تنظيف الكتل: {e}")
+                    return {"snapshots": removed_snapshots, "chunks": 0, "bytes": 0}
+
+            removed_chunks = 0
+            removed_bytes = 0
+            if self.chunks_dir.exists():
+                for chunk in self.chunks_dir.glob("*/*.zst"):
+                    if chunk.stem not in referenced:
+                        removed_bytes += chunk.stat().st_size
+                        chunk.unlink()
+                        removed_chunks += 1
+            return {"snapshots": removed_snapshots, "chunks": removed_chunks, "bytes": removed_bytes}
+
+    def stats(self) -> Dict[str, Any]:
+        snapshots = self.list_snapshots()
+        store_bytes = sum(p.stat().st_size for p in self.chunks_dir.glob("*/*.zst")) if self.chunks_dir.exists() else 0
+        return {
+            "snapshots": len(snapshots),
+            "store_bytes": store_bytes,
+            "logical_bytes": sum(s.get("db_size", 0) for s in snapshots),
+            "latest": snapshots[0] if snapshots else None,
+        }
@@ -0,0 +1,118 @@
+import logging
+from typing import List, Optional
+
+from sqlalchemy import bindparam, or_, select, update
+
+from barcodes import compute_ean13_check_digit
+from services.document_numbers import Sequence, _increment
+
+logger = logging.getLogger(__name__)
+
+DOC_TYPE = "EAN"
+# البادئات 200-299 محجوزة لدى GS1 للاستخدام الداخلي (باركود المتجر)
+DEFAULT_PREFIX = "200"
+DEFAULT_BATCH_SIZE = 1000
+_CHUNK = 500
+
+
+def _config(key, default=None):
+    try:
+        from flask import current_app
+        return current_app.config.get(key, default)
+    except Exception:
+        return default
+
+
+def company_prefix() -> str:
+    prefix = str(_config("BARCODE_COMPANY_PREFIX", DEFAULT_PREFIX) or DEFAULT_PREFIX).strip()
+    if not prefix.isdigit() or not 2 <= len(prefix) <= 10:
+        raise ValueError(f"بادئة الباركود غير صالحة: {prefix}")
+    return prefix
+
+
+def _sequence(prefix: str) -> Sequence:
+    """عداد EAN لكل بادئة في document_sequences (period = البادئة)
+
+    يُهيأ أول مرة من أعلى رقم صنف موجود تحت نفس البادئة في products.barcode؛ يُحتسب فقط
+    ما يطابق شكل ean13() (13 رقماً ورقم تحقق صحيح)، فرمز مكتوب خطأً لا يقفز بالعداد.
+    """
+    def parse(value: str) -> Optional[int]:
+        value = value.strip()
+        if len(value) != 13 or not value.isdigit() or not value.startswith(prefix):
+            return None
+        if int(value[12]) != compute_ean13_check_digit(value[:12]):
+            return None
+        return int(value[len(prefix):12])
+
+    return Sequence(DOC_TYPE, "products", "barcode", legacy_prefix=lambda p: p, parse=parse)
+
+
+def ean13(prefix: str, item: int) -> str:
+    base = f"{prefix}{item:0{12 - len(prefix)}d}"
+    return base + str(compute_ean13_check_digit(base))
+
+
+def _taken(connection, codes: List[str]) -> set:
+    from models import Product
+
+    P = Product.__table__
+    found = set()
+    for i in range(0, len(codes), _CHUNK):
+        found.update(connection.execute(select(P.c.barcode).where(P.c.barcode.in_(codes[i:i + _CHUNK]))).scalars())
+    return found
+
+
+def allocate(connection, count: int) -> List[str]:
+    """حجز count رمز EAN-13 متتالياً وصالح رقم التحقق بزيادة ذرية واحدة للعداد
+
+    الرموز التي أُدخلت يدوياً داخل نطاق البادئة تُستبعد بفحص IN واحد لكل كتلة
+    ويُحجز بدلها من الكتلة التالية.
+    """
+    count = int(count or 0)
+    if count <= 0:
+        return []
+    prefix = company_prefix()
+    seq = _sequence(prefix)
+    capacity = 10 ** (12 - len(prefix)) - 1
+    codes: List[str] = []
+    while len(codes) < count:
+        need = count - len(codes)
+        end = _increment(connection, seq, prefix, need)
+        if end > capacity:
+            raise RuntimeError(f"نفدت أرقام الباركود تحت البادئة {prefix}")
+        block = [ean13(prefix, v) for v in range(end - need + 1, end + 1)]
+        taken = _taken(connection, block)
+        if taken:
+            logger.warning(f"⚠️ {len(taken)} باركود مستخدم مسبقاً تحت البادئة {prefix} - تم تخطيه")
+        codes.extend(c for c in block if c not in taken)
+    return codes
+
+
+def next_barcode(connection) -> str:
+    return allocate(connection, 1)[0]
+
+
+def assign_missing(session, batch_size: Optional[int] = None, active_only: bool = True) -> int:
+    """إعطاء باركود لكل منتج بدونه: لكل دفعة استعلام معرفات، حجز كتلة، وUPDATE مجمّع واحد"""
+    from models import Product
+
+    P = Product.__table__
+    batch_size = max(int(batch_size or _config("BARCODE_ASSIGN_BATCH", DEFAULT_BATCH_SIZE) or DEFAULT_BATCH_SIZE), 1)
+    missing = or_(P.c.barcode.is_(None), P.c.barcode == "", P.c.barcode == "None")
+    q = select(P.c.id).where(missing).order_by(P.c.id).limit(batch_size)
+    if active_only:
+        q = q.where(P.c.is_active.is_(True))
+    stmt = update(P).where(P.c.id == bindparam("pid")).values(barcode=bindparam("code"))
+    assigned = 0
+    while True:
+        ids = session.execute(q).scalars().all()
+        if not ids:
+            break
+        codes = allocate(session.connection(), len(ids))
+        session.execute(stmt, [{"pid": pid, "code": code} for pid, code in zip(ids, codes)])
+        session.commit()
+        assigned += len(ids)
+    return assigned
+
+
+__all__ = ["allocate", "assign_missing", "company_prefix", "ean13", "next_barcode"]
@@ -0,0 +1,138 @@
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime
+from typing import Dict, Iterable, List, Tuple
+
+from sqlalchemy import event, extract, func
+
+DEFAULT_TTL = 300
+OPEN_COMMITMENT_STATUSES = ("PENDING", "APPROVED")
+
+_cache: Dict[int, Tuple[int, float, dict]] = {}
+_cache_lock = threading.Lock()
+_generation = 0
+
+
+def invalidate(*_args) -> None:
+    """أي مصروف أو التزام أو ميزانية جديدة/معدلة تُسقط الأرقام المحسوبة"""
+    global _generation
+    with _cache_lock:
+        _generation += 1
+        _cache.clear()
+
+
+def _ttl() -> int:
+    try:
+        from flask import current_app
+        return int(current_app.config.get("BUDGET_ANALYTICS_TTL", DEFAULT_TTL) or DEFAULT_TTL)
+    except Exception:
+        return DEFAULT_TTL
+
+
+def _year_aggregates(fiscal_year: int) -> dict:
+    """استعلامان مجمّعان لكل السنة: المصروفات حسب (فرع، موقع، شهر) والالتزامات المفتوحة حسب (ميزانية، شهر)"""
+    from extensions import db
+    from models import Budget, BudgetCommitment, Expense
+
+    month = extract("month", Expense.date)
+    expenses = (
+        db.session.query(Expense.branch_id, Expense.site_id, month, func.sum(Expense.amount))
+        .filter(Expense.date >= datetime(fiscal_year, 1, 1), Expense.date < datetime(fiscal_year + 1, 1, 1))
+        .group_by(Expense.branch_id, Expense.site_id, month)
+        .all()
+    )
+    c_month = extract("month", BudgetCommitment.commitment_date)
+    commitments = (
+        db.session.query(BudgetCommitment.budget_id, c_month, func.sum(BudgetCommitment.committed_amount))
+        .join(Budget, Budget.id == BudgetCommitment.budget_id)
+        .filter(Budget.fiscal_year == fiscal_year, BudgetCommitment.status.in_(OPEN_COMMITMENT_STATUSES))
+        .group_by(BudgetCommitment.budget_id, c_month)
+        .all()
+    )
+    actual: Dict[Tuple, List[float]] = defaultdict(lambda: [0.0] * 12)
+    for branch_id, site_id, m, total in expenses:
+        actual[(branch_id, site_id)][int(m) - 1] += float(total or 0)
+    committed: Dict[int, List[float]] = defaultdict(lambda: [0.0] * 12)
+    for budget_id, m, total in commitments:
+        committed[budget_id][int(m) - 1] += float(total or 0)
+    return {"actual": dict(actual), "committed": dict(committed)}
+
+
+def year_aggregates(fiscal_year: int) -> dict:
+    now = time.monotonic()
+    with _cache_lock:
+        cached = _cache.get(fiscal_year)
+        if cached and cached[0] == _generation and now - cached[1] < _ttl():
+            return cached[2]
+    generation = _generation
+    data = _year_aggregates(fiscal_year)
+    with _cache_lock:
+        _cache[fiscal_year] = (generation, now, data)
+    return data
+
+
+def budget_figures(budgets: Iterable, fiscal_year: int) -> Dict[int, dict]:
+    """الفعلي والملتزم والمتاح ونسبة الاستخدام لكل ميزانية مع التوزيع الشهري
+
+    نفس منطق Budget.get_actual_amount: مصروفات فرع الميزانية في السنة (ومقيدة
+    بالموقع إن حُدد)، والملتزم هو الالتزامات PENDING/APPROVED للميزانية.
+    """
+    data = year_aggregates(fiscal_year)
+    result: Dict[int, dict] = {}
+    for budget in budgets:
+        monthly_actual = [0.0] * 12
+        for (branch_id, site_id), months in data["actual"].items():
+            if branch_id != budget.branch_id or (budget.site_id and site_id != budget.site_id):
+                continue
+            monthly_actual = [a + b for a, b in zip(monthly_actual, months)]
+        monthly_committed = data["committed"].get(budget.id, [0.0] * 12)
+        allocated = float(budget.allocated_amount or 0)
+        actual = sum(monthly_actual)
+        committed = sum(monthly_committed)
+        result[budget.id] = {
+            "allocated": allocated,
+            "actual": actual,
+            "committed": committed,
+            "available": allocated - actual - committed,
+            "variance": allocated - actual,
+            "utilization": ((actual + committed) / allocated * 100) if allocated > 0 else 0,
+            "monthly_actual": monthly_actual,
+            "monthly_committed": list(monthly_committed),
+        }
+    return result
+
+
+_DIRTY_FLAG = "_budget_analytics_dirty"
+
+
+def _register_listeners() -> None:
+    """الـ flush يعلّم الجلسة فقط، والإبطال بعد commit
+
+    الإبطال أثناء الـ flush يترك طلباً آخر يعيد حساب السنة من البيانات
+    القديمة (قبل commit) ويحتفظ بها حتى BUDGET_ANALYTICS_TTL.
+    """
+    from sqlalchemy.orm import Session
+    from models import Budget, BudgetCommitment, Expense
+    tracked = (Expense, BudgetCommitment, Budget)
+
+    def _mark(session, _flush_context):
+        if any(isinstance(obj, tracked) for obj in (*session.new, *session.dirty, *session.deleted)):
+            session.info[_DIRTY_FLAG] = True
+
+    def _after_commit(session):
+        if session.info.pop(_DIRTY_FLAG, None):
+            invalidate()
+
+    def _after_rollback(session):
+        session.info.pop(_DIRTY_FLAG, None)
+
+    event.listen(Session, "after_flush", _mark)
+    event.listen(Session, "after_commit", _after_commit)
+    event.listen(Session, "after_rollback", _after_rollback)
+
+
+_register_listeners()
+
+
+__all__ = ["budget_figures", "year_aggregates", "invalidate"]
@@ -0,0 +1,272 @@
+from collections import defaultdict
+from datetime import date, datetime, timedelta, timezone
+from decimal import Decimal
+from typing import Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+from sqlalchemy import Numeric, bindparam, extract, func, insert, select, text as sa_text
+
+SPIKE_BASELINE_MONTHS = 3
+DEFAULT_COOLDOWN_HOURS = 24
+
+_UPSERT = sa_text(
+    "INSERT INTO cost_center_monthly_totals (cost_center_id, period, amount, allocations_count, updated_at) "
+    "VALUES (:c, :p, :a, :n, :now) "
+    "ON CONFLICT (cost_center_id, period) DO UPDATE SET "
+    "amount = cost_center_monthly_totals.amount + excluded.amount, "
+    "allocations_count = cost_center_monthly_totals.allocations_count + excluded.allocations_count, "
+    "updated_at = excluded.updated_at"
+).bindparams(bindparam("a", type_=Numeric(15, 2)))
+
+_REPLACE = sa_text(
+    "INSERT INTO cost_center_monthly_totals (cost_center_id, period, amount, allocations_count, updated_at) "
+    "VALUES (:c, :p, :a, :n, :now) "
+    "ON CONFLICT (cost_center_id, period) DO UPDATE SET "
+    "amount = excluded.amount, allocations_count = excluded.allocations_count, updated_at = excluded.updated_at"
+).bindparams(bindparam("a", type_=Numeric(15, 2)))
+
+
+def period_of(value) -> str:
+    return f"{value.year:04d}-{value.month:02d}"
+
+
+def month_periods(months: int, end: Optional[date] = None) -> List[str]:
+    """آخر months شهراً تقويمياً حتى شهر end (تصاعدياً) بصيغة YYYY-MM"""
+    end = end or date.today()
+    year, month = end.year, end.month
+    periods = []
+    for _ in range(max(int(months or 0), 0)):
+        periods.append(f"{year:04d}-{month:02d}")
+        year, month = (year - 1, 12) if month == 1 else (year, month - 1)
+    return periods[::-1]
+
+
+def _utcnow() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+# ------------------------------------------------------------ جدول التجميع
+
+def apply_allocation_delta(connection, cost_center_id, allocation_date, amount, count: int) -> None:
+    """إضافة (أو طرح) مبلغ توزيع إلى مجموع شهره؛ يُستدعى من مستمعي CostCenterAllocation داخل flush"""
+    if not cost_center_id or allocation_date is None:
+        return
+    connection.execute(_UPSERT, {
+        "c": cost_center_id,
+        "p": period_of(allocation_date),
+        "a": Decimal(str(amount or 0)),
+        "n": count,
+        "now": _utcnow(),
+    })
+
+
+def allocation_keys(connection, source_type: str, source_id) -> Set[Tuple[int, str]]:
+    """(مركز، فترة) لكل توزيعات مصدر واحد؛ تُقرأ قبل وبعد كتابة التوزيعات بـ SQL خام"""
+    from models import CostCenterAllocation
+
+    table = CostCenterAllocation.__table__
+    return {
+        (center_id, period_of(allocation_date))
+        for center_id, allocation_date in connection.execute(
+            select(table.c.cost_center_id, table.c.allocation_date)
+            .where(table.c.source_type == source_type, table.c.source_id == source_id)
+        )
+        if allocation_date is not None
+    }
+
+
+def refresh_rollup_keys(connection, keys: Iterable[Tuple[int, str]]) -> None:
+    """إعادة حساب صفوف (مركز، فترة) محددة من cost_center_allocations مباشرة
+
+    لمسارات تكتب التوزيعات بـ SQL خام فلا تمر بمستمعي CostCenterAllocation.
+    """
+    from models import CostCenterAllocation, CostCenterMonthlyTotal
+
+    table = CostCenterAllocation.__table__
+    totals = CostCenterMonthlyTotal.__table__
+    now = _utcnow()
+    for center_id, period in keys:
+        year, month = (int(p) for p in period.split("-"))
+        start = date(year, month, 1)
+        end = date(year + 1, 1, 1) if month == 12 else date(year, month + 1, 1)
+        amount, n = connection.execute(
+            select(func.coalesce(func.sum(table.c.amount), 0), func.count(table.c.id))
+            .where(table.c.cost_center_id == center_id,
+                   table.c.allocation_date >= start, table.c.allocation_date < end)
+        ).one()
+        if n:
+            connection.execute(_REPLACE, {"c": center_id, "p": period, "a": Decimal(str(amount)), "n": n, "now": now})
+        else:
+            connection.execute(
+                totals.delete().where(totals.c.cost_center_id == center_id, totals.c.period == period)
+            )
+
+
+def allocation_matrix(session, center_ids: Optional[Iterable[int]] = None,
+                      since: Optional[date] = None) -> Dict[int, Dict[str, Tuple[Decimal, int]]]:
+    """استعلام GROUP BY (مركز، سنة، شهر) واحد على التوزيعات الخام → {مركز: {YYYY-MM: (مبلغ، عدد)}}"""
+    from models import CostCenterAllocation as A
+
+    year, month = extract("year", A.allocation_date), extract("month", A.allocation_date)
+    q = select(A.cost_center_id, year, month, func.sum(A.amount), func.count(A.id)).group_by(A.cost_center_id, year, month)
+    if center_ids is not None:
+        q = q.where(A.cost_center_id.in_(list(center_ids)))
+    if since is not None:
+        q = q.where(A.allocation_date >= since)
+    matrix: Dict[int, Dict[str, Tuple[Decimal, int]]] = defaultdict(dict)
+    for center_id, y, m, total, n in session.execute(q):
+        matrix[center_id][f"{int(y):04d}-{int(m):02d}"] = (Decimal(str(total or 0)), int(n or 0))
+    return matrix
+
+
+def rebuild_rollup(session) -> int:
+    """إعادة بناء cost_center_monthly_totals بالكامل من التوزيعات (بعد استيراد أو حذف جماعي)"""
+    from models import CostCenterMonthlyTotal
+
+    table = CostCenterMonthlyTotal.__table__
+    now = _utcnow()
+    rows = [
+        {"cost_center_id": center_id, "period": period, "amount": total, "allocations_count": n, "updated_at": now}
+        for center_id, periods in allocation_matrix(session).items()
+        for period, (total, n) in periods.items()
+    ]
+    session.execute(table.delete())
+    if rows:
+        session.execute(insert(table), rows)
+    return len(rows)
+
+
+def monthly_matrix(session, center_ids: Sequence[int], periods: Sequence[str]) -> Dict[int, List[float]]:
+    """مصفوفة المركز × الشهر كاملة من جدول التجميع في استعلام واحد؛ الأشهر بلا توزيعات = 0"""
+    from models import CostCenterMonthlyTotal as T
+
+    index = {p: i for i, p in enumerate(periods)}
+    matrix = {cid: [0.0] * len(periods) for cid in center_ids}
+    if not center_ids or not periods:
+        return matrix
+    for center_id, period, amount in session.execute(
+        select(T.cost_center_id, T.period, T.amount)
+        .where(T.cost_center_id.in_(list(center_ids)), T.period >= periods[0], T.period <= periods[-1])
+    ):
+        i = index.get(period)
+        if i is not None and center_id in matrix:
+            matrix[center_id][i] = float(amount or 0)
+    return matrix
+
+
+def center_totals(session, center_ids: Optional[Iterable[int]] = None) -> Dict[int, float]:
+    """إجمالي توزيعات كل مركز (كل الفترات) بـ GROUP BY واحد على جدول التجميع"""
+    from models import CostCenterMonthlyTotal as T
+
+    q = select(T.cost_center_id, func.sum(T.amount)).group_by(T.cost_center_id)
+    if center_ids is not None:
+        q = q.where(T.cost_center_id.in_(list(center_ids)))
+    return {cid: float(total or 0) for cid, total in session.execute(q)}
+
+
+# ------------------------------------------------------------ التنبيهات
+
+def _cooldown_hours() -> int:
+    try:
+        from flask import current_app
+        return int(current_app.config.get("COST_CENTER_ALERT_COOLDOWN_HOURS", DEFAULT_COOLDOWN_HOURS))
+    except Exception:
+        return DEFAULT_COOLDOWN_HOURS
+
+
+def _check(alert, budget: float, total: float, current: float, baseline: float):
+    """(القيمة المقاسة، الشدة، الرسالة) إذا تحقق شرط التنبيه، وإلا None"""
+    threshold = float(alert.threshold_value or 0)
+    pct = alert.threshold_type == "PERCENTAGE"
+    if alert.alert_type in ("BUDGET_EXCEEDED", "BUDGET_WARNING"):
+        if pct:
+            if budget <= 0:
+                return None
+            value = total / budget * 100
+        else:
+            value = total
+        if value < threshold:
+            return None
+        severity = "CRITICAL" if alert.alert_type == "BUDGET_EXCEEDED" else "WARNING"
+        label = "تجاوز الميزانية" if alert.alert_type == "BUDGET_EXCEEDED" else "اقتراب من حد الميزانية"
+        return value, severity, f"{label}: المصروف {total:,.2f} من ميزانية {budget:,.2f}"
+    if alert.alert_type == "UNUSUAL_SPIKE":
+        if pct:
+            if baseline <= 0:
+                return None
+            value = (current - baseline) / baseline * 100
+        else:
+            value = current - baseline
+        if value < threshold or current <= baseline:
+            return None
+        return value, "WARNING", f"ارتفاع غير عادي: {current:,.2f} هذا الشهر مقابل متوسط {baseline:,.2f}"
+    if alert.alert_type == "NO_ACTIVITY":
+        if pct:
+            if baseline <= 0:
+                return None
+            value = current / baseline * 100
+        else:
+            value = current
+        if value > threshold:
+            return None
+        return value, "INFO", f"لا نشاط: {current:,.2f} هذا الشهر (المتوسط {baseline:,.2f})"
+    return None
+
+
+def evaluate_alerts(session, today: Optional[date] = None) -> Dict[str, int]:
+    """تقييم كل التنبيهات النشطة دفعة واحدة مقابل جدول التجميع
+
+    استعلام للتنبيهات مع مراكزها، GROUP BY للإجماليات، واستعلام واحد لأشهر
+    المقارنة (الشهر الحالي + SPIKE_BASELINE_MONTHS قبله)، ثم إدراج كل السجلات
+    معاً. التنبيه الذي أُطلق خلال COST_CENTER_ALERT_COOLDOWN_HOURS لا يتكرر.
+    """
+    from models import CostCenter, CostCenterAlert, CostCenterAlertLog
+
+    today = today or date.today()
+    now = _utcnow()
+    cutoff = now - timedelta(hours=_cooldown_hours())
+    alerts = session.execute(
+        select(CostCenterAlert, CostCenter.budget_amount)
+        .join(CostCenter, CostCenter.id == CostCenterAlert.cost_center_id)
+        .where(CostCenterAlert.is_active.is_(True), CostCenter.is_active.is_(True))
+    ).all()
+    counts = {"alerts": len(alerts), "triggered": 0}
+    alerts = [(a, b) for a, b in alerts if a.last_triggered_at is None or a.last_triggered_at < cutoff]
+    if not alerts:
+        return counts
+
+    center_ids = sorted({a.cost_center_id for a, _ in alerts})
+    periods = month_periods(SPIKE_BASELINE_MONTHS + 1, today)
+    totals = center_totals(session, center_ids)
+    matrix = monthly_matrix(session, center_ids, periods)
+
+    logs = []
+    for alert, budget in alerts:
+        months = matrix.get(alert.cost_center_id) or [0.0] * len(periods)
+        baseline = sum(months[:-1]) / SPIKE_BASELINE_MONTHS
+        hit = _check(alert, float(budget or 0), totals.get(alert.cost_center_id, 0.0), months[-1], baseline)
+        if hit is None:
+            continue
+        value, severity, message = hit
+        logs.append({
+            "alert_id": alert.id,
+            "cost_center_id": alert.cost_center_id,
+            "triggered_at": now,
+            "trigger_value": Decimal(str(round(value, 2))),
+            "threshold_value": alert.threshold_value,
+            "message": message,
+            "severity": severity,
+            "created_at": now,
+            "updated_at": now,
+        })
+        alert.last_triggered_at = now
+        alert.trigger_count = (alert.trigger_count or 0) + 1
+    if logs:
+        session.execute(insert(CostCenterAlertLog.__table__), logs)
+    counts["triggered"] = len(logs)
+    return counts
+
+
+__all__ = [
+    "apply_allocation_delta", "allocation_matrix", "rebuild_rollup", "monthly_matrix",
+    "center_totals", "evaluate_alerts", "month_periods", "period_of",
+]
@@ -0,0 +1,484 @@
+import logging
+from datetime import datetime
+from decimal import Decimal
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import and_, delete, func, insert, select, update
+
+from models import (
+    CogsEntry, CostLayer, ExchangeRate, ExchangeTransaction, Product, Sale, SaleLine,
+    ServicePart, ServiceRequest, Shipment, ShipmentItem, StockAdjustment, StockAdjustmentItem,
+)
+
+
+logger = logging.getLogger(__name__)
+
+METHODS = ("FIFO", "AVERAGE")
+DEFAULT_METHOD = "FIFO"
+
+INBOUND_DIRECTIONS = ("IN", "ADJUSTMENT")
+
+# مصادر التكلفة التي تعتبر "فعلية" في تقرير COGS؛ estimated_70% تقدير و missing مفقودة
+ACTUAL_SOURCES = ("layers", "purchase_price", "cost_after_shipping", "cost_before_shipping")
+
+_layers = CostLayer.__table__
+_entries = CogsEntry.__table__
+
+_ZERO = Decimal("0")
+_UNIT_Q = Decimal("0.0001")
+_MONEY_Q = Decimal("0.01")
+
+
+def cost_method() -> str:
+    """طريقة التكلفة المفعلة (COGS_METHOD): FIFO أو AVERAGE"""
+    try:
+        from flask import current_app
+        method = str(current_app.config.get("COGS_METHOD") or DEFAULT_METHOD).strip().upper()
+    except RuntimeError:
+        method = DEFAULT_METHOD
+    return method if method in METHODS else DEFAULT_METHOD
+
+
+def cost_status(cost_source: Optional[str]) -> str:
+    if cost_source in ACTUAL_SOURCES:
+        return "actual"
+    if cost_source == "estimated_70%":
+        return "estimated"
+    return "missing"
+
+
+def _dec(value) -> Decimal:
+    if value is None:
+        return _ZERO
+    return value if isinstance(value, Decimal) else Decimal(str(value))
+
+
+def _rate_to_ils(connection, currency: Optional[str], at: Optional[datetime]) -> Decimal:
+    """سعر التحويل للشيكل من جدول exchange_rates مباشرة (بدون جلب خارجي داخل الـ flush)"""
+    code = (currency or "ILS").strip().upper()
+    if code == "ILS":
+        return Decimal("1")
+    at = at or datetime.utcnow()
+    for base, quote, invert in ((code, "ILS", False), ("ILS", code, True)):
+        rate = connection.execute(
+            select(ExchangeRate.rate)
+            .where(
+                ExchangeRate.base_code == base,
+                ExchangeRate.quote_code == quote,
+                ExchangeRate.is_active.is_(True),
+                ExchangeRate.valid_from <= at,
+            )
+            .order_by(ExchangeRate.valid_from.desc())
+            .limit(1)
+        ).scalar()
+        if rate and _dec(rate) > 0:
+            return Decimal("1") / _dec(rate) if invert else _dec(rate)
+    logger.warning(f"⚠️ لا يوجد سعر صرف {code}/ILS محلي لتكلفة الطبقة، تم اعتماد 1")
+    return Decimal("1")
+
+
+def _estimate_unit_cost(connection, product_id: int) -> Tuple[Decimal, str]:
+    """تكلفة تقديرية من بطاقة المنتج عند نفاد الطبقات (نفس ترتيب تقرير COGS السابق)"""
+    row = connection.execute(
+        select(Product.purchase_price, Product.cost_after_shipping, Product.cost_before_shipping, Product.price)
+        .where(Product.id == product_id)
+    ).first()
+    if row is None:
+        return _ZERO, "missing"
+    purchase_price, after_shipping, before_shipping, price = row
+    for value, source in (
+        (purchase_price, "purchase_price"),
+        (after_shipping, "cost_after_shipping"),
+        (before_shipping, "cost_before_shipping"),
+    ):
+        if value and _dec(value) > 0:
+            return _dec(value), source
+    if price and _dec(price) > 0:
+        return _dec(price) * Decimal("0.70"), "estimated_70%"
+    return _ZERO, "missing"
+
+
+# ----------------------------------------------------------------- الطبقات
+
+def receive(connection, product_id: int, qty: int, unit_cost_ils, source_type: str,
+            source_id: Optional[int], at: Optional[datetime]) -> None:
+    qty = int(qty or 0)
+    if qty <= 0 or not product_id:
+        return
+    connection.execute(insert(_layers).values(
+        product_id=int(product_id),
+        source_type=source_type,
+        source_id=source_id,
+        received_at=at or datetime.utcnow(),
+        qty_in=qty,
+        qty_remaining=qty,
+        unit_cost=_dec(unit_cost_ils).quantize(_UNIT_Q),
+        created_at=datetime.utcnow(),
+    ))
+
+
+def _average_takes(layers, qty: int) -> List[int]:
+    """توزيع الكمية على كل الطبقات المفتوحة بنسبة المتبقي منها (أكبر باقٍ للكسور)
+
+    الصرف النسبي يُبقي متوسط الطبقات المتبقية كما هو، فتبقى قيمتها + ما صُرف
+    مساوية لقيمة المشتريات.
+    """
+    open_qty = sum(int(r.qty_remaining) for r in layers)
+    if qty >= open_qty:
+        return [int(r.qty_remaining) for r in layers]
+    takes, fractions = [], []
+    for i, layer in enumerate(layers):
+        whole, part = divmod(qty * int(layer.qty_remaining), open_qty)
+        takes.append(whole)
+        fractions.append((-part, i))
+    for _part, i in sorted(fractions)[:qty - sum(takes)]:
+        takes[i] += 1
+    return takes
+
+
+def consume(connection, product_id: int, qty: int,
+            method: Optional[str] = None) -> Tuple[Decimal, Decimal, str]:
+    """صرف كمية من الطبقات المفتوحة وإرجاع (تكلفة الوحدة، التكلفة الإجمالية، مصدر التكلفة)
+
+    FIFO تصرف من الأقدم أولاً، و AVERAGE تصرف من كل الطبقات المفتوحة بنسبة
+    المتبقي منها فتُحمّل المتوسط المرجح. في الحالتين التكلفة المحمّلة هي قيمة
+    الكميات المخصومة من الطبقات نفسها، وأي كمية لا تغطيها الطبقات تُسعّر من
+    بطاقة المنتج ويُسجل مصدرها.
+    """
+    qty = int(qty or 0)
+    if qty <= 0:
+        return _ZERO, _ZERO, "missing"
+    method = method or cost_method()
+    layers = connection.execute(
+        select(_layers.c.id, _layers.c.qty_remaining, _layers.c.unit_cost)
+        .where(_layers.c.product_id == product_id, _layers.c.qty_remaining > 0)
+        .order_by(_layers.c.received_at, _layers.c.id)
+    ).all()
+
+    if method == "AVERAGE":
+        takes = _average_takes(layers, qty)
+    else:
+        takes, left = [], qty
+        for layer in layers:
+            take = min(left, int(layer.qty_remaining))
+            takes.append(take)
+            left -= take
+
+    layered_cost = _ZERO
+    for layer, take in zip(layers, takes):
+        if take <= 0:
+            continue
+        connection.execute(
+            update(_layers).where(_layers.c.id == layer.id)
+            .values(qty_remaining=_layers.c.qty_remaining - take)
+        )
+        layered_cost += take * _dec(layer.unit_cost)
+
+    remaining = qty - sum(takes)
+    source = "layers"
+    total = layered_cost
+    if remaining > 0:
+        estimate, source = _estimate_unit_cost(connection, product_id)
+        total += remaining * estimate
+    return (total / qty).quantize(_UNIT_Q), total.quantize(_MONEY_Q), source
+
+
+def reverse_entry(connection, entry) -> None:
+    """عكس بند صادر: إرجاع كميته كطبقة بتكلفته المجمدة ثم حذف البند"""
+    receive(connection, entry.product_id, entry.quantity, entry.unit_cost, "REVERSAL", entry.id, entry.posted_at)
+    connection.execute(delete(_entries).where(_entries.c.id == entry.id))
+
+
+def _remove_layers(connection, source_type: str, source_ids) -> None:
+    """حذف الطبقات الواردة لمصدر أُلغي؛ ما صُرف منها بقي مجمداً في cogs_entries"""
+    source_ids = [int(s) for s in source_ids]
+    if source_ids:
+        connection.execute(
+            delete(_layers).where(_layers.c.source_type == source_type, _layers.c.source_id.in_(source_ids))
+        )
+
+
+# ---------------------------------------------------------- مزامنة المستندات
+
+def _sync_outgoing(connection, document_type: str, document_id: int, source_type: str,
+                   desired: Dict[int, Tuple[int, int]], posted_at: Optional[datetime],
+                   method: Optional[str] = None) -> None:
+    """مطابقة بنود cogs_entries لمستند مع بنوده الحالية {source_id: (product_id, qty)}
+
+    البند الموجود بنفس المنتج والكمية لا يُلمس (تكلفته مجمدة)، والبند المتغير
+    أو المحذوف يُعكس، والبند الجديد يُصرف من الطبقات الآن.
+    """
+    existing = connection.execute(
+        select(_entries).where(_entries.c.document_type == document_type, _entries.c.document_id == document_id)
+    ).all()
+    kept = set()
+    for entry in existing:
+        want = desired.get(entry.source_id) if entry.source_type == source_type else None
+        if want and (int(entry.product_id), int(entry.quantity)) == (int(want[0]), int(want[1])):
+            kept.add(entry.source_id)
+            continue
+        reverse_entry(connection, entry)
+
+    method = method or cost_method()
+    posted_at = posted_at or datetime.utcnow()
+    for source_id in sorted(desired):
+        if source_id in kept:
+            continue
+        product_id, qty = desired[source_id]
+        if not product_id or int(qty or 0) <= 0:
+            continue
+        unit_cost, total_cost, cost_source = consume(connection, int(product_id), int(qty), method)
+        connection.execute(insert(_entries).values(
+            source_type=source_type,
+            source_id=int(source_id),
+            document_type=document_type,
+            document_id=int(document_id),
+            product_id=int(product_id),
+            quantity=int(qty),
+            unit_cost=unit_cost,
+            total_cost=total_cost,
+            method=method,
+            cost_source=cost_source,
+            posted_at=posted_at,
+            created_at=datetime.utcnow(),
+        ))
+
+
+def sync_sale(connection, sale_id: int, method: Optional[str] = None) -> None:
+    sale = connection.execute(
+        select(Sale.status, Sale.sale_date, Sale.cancelled_at).where(Sale.id == sale_id)
+    ).first()
+    desired = {}
+    if (
+        sale is not None
+        and str(getattr(sale.status, "value", sale.status)) == "CONFIRMED"
+        and sale.cancelled_at is None
+    ):
+        desired = {
+            r.id: (r.product_id, r.quantity)
+            for r in connection.execute(
+                select(SaleLine.id, SaleLine.product_id, SaleLine.quantity).where(SaleLine.sale_id == sale_id)
+            )
+        }
+    _sync_outgoing(connection, "SALE", sale_id, "SALE_LINE", desired, sale.sale_date if sale else None, method)
+
+
+def sync_service(connection, service_id: int, method: Optional[str] = None) -> None:
+    """قطع الصيانة بنود صادرة؛ إلغاء الطلب (CANCELLED) يعكسها كلها إلى الطبقات"""
+    service = connection.execute(
+        select(ServiceRequest.created_at, ServiceRequest.received_at, ServiceRequest.status)
+        .where(ServiceRequest.id == service_id)
+    ).first()
+    desired = {}
+    if service is not None and str(getattr(service.status, "value", service.status) or "").upper() != "CANCELLED":
+        desired = {
+            r.id: (r.part_id, r.quantity)
+            for r in connection.execute(
+                select(ServicePart.id, ServicePart.part_id, ServicePart.quantity).where(ServicePart.service_id == service_id)
+            )
+        }
+    posted_at = (service.created_at or service.received_at) if service is not None else None
+    _sync_outgoing(connection, "SERVICE", service_id, "SERVICE_PART", desired, posted_at, method)
+
+
+def sync_adjustment(connection, adjustment_id: int, method: Optional[str] = None) -> None:
+    adjustment = connection.execute(
+        select(StockAdjustment.date).where(StockAdjustment.id == adjustment_id)
+    ).first()
+    desired = {}
+    if adjustment is not None:
+        desired = {
+            r.id: (r.product_id, r.quantity)
+            for r in connection.execute(
+                select(StockAdjustmentItem.id, StockAdjustmentItem.product_id, StockAdjustmentItem.quantity)
+                .where(StockAdjustmentItem.adjustment_id == adjustment_id)
+            )
+        }
+    _sync_outgoing(
+        connection, "STOCK_ADJUSTMENT", adjustment_id, "STOCK_ADJUSTMENT_ITEM", desired,
+        adjustment.date if adjustment else None, method,
+    )
+
+
+def _shipment_item_rows(connection, shipment_ids):
+    return connection.execute(
+        select(
+            ShipmentItem.id, ShipmentItem.shipment_id, ShipmentItem.product_id, ShipmentItem.quantity,
+            ShipmentItem.unit_cost, ShipmentItem.landed_unit_cost,
+        ).where(ShipmentItem.shipment_id.in_(list(shipment_ids)))
+    ).all()
+
+
+def _shipment_unit_cost_ils(connection, item, shipment) -> Decimal:
+    unit_cost = _dec(item.landed_unit_cost) if _dec(item.landed_unit_cost) > 0 else _dec(item.unit_cost)
+    if (shipment.currency or "ILS").upper() == "ILS":
+        return unit_cost
+    rate = _dec(shipment.fx_rate_used)
+    if rate <= 0:
+        rate = _rate_to_ils(connection, shipment.currency, shipment.arrived_at)
+    return unit_cost * rate
+
+
+def _shipment_row(connection, shipment_id: int):
+    return connection.execute(
+        select(
+            Shipment.id, Shipment.status, Shipment.currency, Shipment.fx_rate_used,
+            func.coalesce(Shipment.actual_arrival, Shipment.shipment_date, Shipment.date).label("arrived_at"),
+        ).where(Shipment.id == shipment_id)
+    ).first()
+
+
+def sync_shipment(connection, shipment_id: int, removed_ids=()) -> None:
+    """وصول الشحنة يضيف طبقة لكل بند، وتعديل بنودها بعد الوصول يُطابق طبقاتها
+
+    إلغاء الوصول (أي حالة غير ARRIVED بما فيها CANCELLED) أو حذف بند يحذف
+    طبقته؛ ما صُرف منها قبل ذلك يبقى مجمداً في cogs_entries.
+    """
+    shipment = _shipment_row(connection, shipment_id)
+    items = _shipment_item_rows(connection, [shipment_id])
+    item_ids = [it.id for it in items]
+    _remove_layers(connection, "SHIPMENT_ITEM", [i for i in removed_ids if i not in item_ids])
+    arrived = shipment is not None and str(shipment.status or "").upper() == "ARRIVED"
+    if not arrived:
+        _remove_layers(connection, "SHIPMENT_ITEM", item_ids)
+        return
+    have = {}
+    if item_ids:
+        have = {
+            layer.source_id: layer for layer in connection.execute(
+                select(_layers.c.id, _layers.c.source_id, _layers.c.product_id, _layers.c.qty_in,
+                       _layers.c.qty_remaining, _layers.c.unit_cost)
+                .where(_layers.c.source_type == "SHIPMENT_ITEM", _layers.c.source_id.in_(item_ids))
+            )
+        }
+    for item in items:
+        unit_cost = _shipment_unit_cost_ils(connection, item, shipment).quantize(_UNIT_Q)
+        layer = have.get(item.id)
+        if layer is None:
+            receive(connection, item.product_id, item.quantity, unit_cost, "SHIPMENT_ITEM", item.id, shipment.arrived_at)
+        elif (int(layer.product_id), int(layer.qty_in), _dec(layer.unit_cost)) != (
+            int(item.product_id), int(item.quantity), unit_cost
+        ):
+            consumed = int(layer.qty_in) - int(layer.qty_remaining)
+            connection.execute(
+                update(_layers).where(_layers.c.id == layer.id).values(
+                    product_id=int(item.product_id),
+                    qty_in=int(item.quantity),
+                    qty_remaining=max(0, int(item.quantity) - consumed),
+                    unit_cost=unit_cost,
+                )
+            )
+
+
+def sync_exchange(connection, exchange_id: int, method: Optional[str] = None) -> None:
+    """حركة التبادل: IN/ADJUSTMENT طبقة واردة، OUT بند صادر بتكلفة مجمدة"""
+    row = connection.execute(
+        select(
+            ExchangeTransaction.product_id, ExchangeTransaction.quantity, ExchangeTransaction.direction,
+            ExchangeTransaction.unit_cost, ExchangeTransaction.created_at,
+        ).where(ExchangeTransaction.id == exchange_id)
+    ).first()
+    direction = str(getattr(row.direction, "value", row.direction) or "").upper() if row else ""
+    inbound = direction in INBOUND_DIRECTIONS
+
+    layer = connection.execute(
+        select(_layers).where(_layers.c.source_type == "EXCHANGE", _layers.c.source_id == exchange_id)
+    ).first()
+    if not inbound:
+        if layer is not None:
+            _remove_layers(connection, "EXCHANGE", [exchange_id])
+    elif layer is None:
+        receive(connection, row.product_id, row.quantity, row.unit_cost, "EXCHANGE", exchange_id, row.created_at)
+    elif (int(layer.product_id), int(layer.qty_in), _dec(layer.unit_cost)) != (
+        int(row.product_id), int(row.quantity), _dec(row.unit_cost).quantize(_UNIT_Q)
+    ):
+        consumed = int(layer.qty_in) - int(layer.qty_remaining)
+        connection.execute(
+            update(_layers).where(_layers.c.id == layer.id).values(
+                product_id=int(row.product_id),
+                qty_in=int(row.quantity),
+                qty_remaining=max(0, int(row.quantity) - consumed),
+                unit_cost=_dec(row.unit_cost).quantize(_UNIT_Q),
+            )
+        )
+
+    desired = {exchange_id: (row.product_id, row.quantity)} if row is not None and direction == "OUT" else {}
+    _sync_outgoing(
+        connection, "EXCHANGE", exchange_id, "EXCHANGE_OUT", desired,
+        row.created_at if row is not None else None, method,
+    )
+
+
+# ----------------------------------------------------------- إعادة البناء
+
+def rebuild_all(session, method: Optional[str] = None, batch_size: int = 500) -> Dict[str, int]:
+    """إعادة بناء الطبقات وبنود التكلفة من التاريخ بالترتيب الزمني
+
+    الحركات الواردة تسبق الصادرة عند تساوي الوقت. يعمل داخل معاملة الجلسة
+    ويترك الـ commit للمستدعي.
+    """
+    method = method or cost_method()
+    connection = session.connection()
+    connection.execute(delete(_entries))
+    connection.execute(delete(_layers))
+
+    events: List[Tuple[datetime, int, str, int]] = []
+
+    arrived = connection.execute(
+        select(Shipment.id, func.coalesce(Shipment.actual_arrival, Shipment.shipment_date, Shipment.date))
+        .where(Shipment.status == "ARRIVED")
+    ).all()
+    events += [(at or datetime.min, 0, "shipment", sid) for sid, at in arrived]
+
+    exchanges = connection.execute(
+        select(ExchangeTransaction.id, ExchangeTransaction.created_at, ExchangeTransaction.direction)
+    ).all()
+    for xid, at, direction in exchanges:
+        inbound = str(getattr(direction, "value", direction) or "").upper() in INBOUND_DIRECTIONS
+        events.append((at or datetime.min, 0 if inbound else 1, "exchange", xid))
+
+    sales = connection.execute(select(Sale.id, Sale.sale_date).where(Sale.status == "CONFIRMED")).all()
+    events += [(at or datetime.min, 1, "sale", sid) for sid, at in sales]
+
+    services = connection.execute(
+        select(ServiceRequest.id, func.coalesce(ServiceRequest.created_at, ServiceRequest.received_at))
+        .where(ServiceRequest.id.in_(select(ServicePart.service_id)))
+    ).all()
+    events += [(at or datetime.min, 1, "service", sid) for sid, at in services]
+
+    adjustments = connection.execute(select(StockAdjustment.id, StockAdjustment.date)).all()
+    events += [(at or datetime.min, 1, "adjustment", aid) for aid, at in adjustments]
+
+    events.sort(key=lambda e: (e[0].replace(tzinfo=None), e[1], e[3]))
+    handlers = {
+        "shipment": lambda c, i: sync_shipment(c, i),
+        "exchange": lambda c, i: sync_exchange(c, i, method),
+        "sale": lambda c, i: sync_sale(c, i, method),
+        "service": lambda c, i: sync_service(c, i, method),
+        "adjustment": lambda c, i: sync_adjustment(c, i, method),
+    }
+    counts: Dict[str, int] = {}
+    for n, (_at, _rank, kind, doc_id) in enumerate(events, 1):
+        handlers[kind](connection, doc_id)
+        counts[kind] = counts.get(kind, 0) + 1
+        if n % batch_size == 0:
+            session.flush()
+
+    counts["layers"] = connection.execute(select(func.count()).select_from(_layers)).scalar() or 0
+    counts["entries"] = connection.execute(select(func.count()).select_from(_entries)).scalar() or 0
+    return counts
+
+
+# ---------------------------------------------------------------- التقارير
+
+def cogs_total(document_type: str, from_date=None, to_date=None, session=None) -> float:
+    """مجموع التكلفة المجمدة لنوع مستند ضمن فترة (استعلام مجمّع على ix_cogs_entries_doc_posted)"""
+    from extensions import db
+    session = session or db.session
+    criteria = [CogsEntry.document_type == document_type]
+    if from_date:
+        criteria.append(CogsEntry.posted_at >= from_date)
+    if to_date:
+        criteria.append(CogsEntry.posted_at <= to_date)
+    value = session.query(func.coalesce(func.sum(CogsEntry.total_cost), 0)).filter(and_(*criteria)).scalar()
+    return float(value or 0)
@@ -0,0 +1,323 @@
+import logging
+import sqlite3
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# سياسات التعارض: smart يتجاهل أي سجل يتعارض مع مفتاح فريد، append ينسخ فقط السجلات التي
+# لا يوجد مفتاحها الأساسي في القاعدة الحالية. لا يوجد وضع استبدال: INSERT OR REPLACE مع
+# تعطيل المفاتيح الأجنبية يحذف الصف الموجود ويترك أبناءه يشيرون لسجل آخر بنفس المعرّف
+CONFLICT_POLICIES = {
+    "smart": "INSERT OR IGNORE",
+    "append": "INSERT OR IGNORE",
+}
+DEFAULT_BATCH_SIZE = 5000
+SOURCE_ALIAS = "src"
+
+
+def _rebuild_stock_totals(connection) -> int:
+    from services.stock_totals import rebuild
+    return rebuild(connection)
+
+
+def _rebuild_cost_center_rollup(connection) -> int:
+    from services.cost_center_analytics import rebuild_rollup
+    return rebuild_rollup(connection)
+
+
+def _rebuild_unread_counters(connection) -> int:
+    from notifications import reseed_unread_counters
+    return reseed_unread_counters(connection)
+
+
+def _reseed_document_sequences(connection) -> int:
+    from services.document_numbers import reseed
+    return reseed(connection)
+
+
+def _rebuild_cost_layers(connection) -> int:
+    from sqlalchemy.orm import Session
+    from services.cost_layers import rebuild_all
+    with Session(bind=connection) as session:
+        counts = rebuild_all(session)
+    return counts["layers"] + counts["entries"]
+
+
+# جداول مشتقة لا تُدمج صفوفها (INSERT OR IGNORE يترك مجاميع وعدادات وطبقات قديمة):
+# يُعاد بناء كل مجموعة بعد الدمج من جداولها الأساسية في القاعدة المدمجة
+DERIVED_TABLES: Dict[Tuple[str, ...], Callable[[Any], int]] = {
+    ("product_stock_totals",): _rebuild_stock_totals,
+    ("cost_center_monthly_totals",): _rebuild_cost_center_rollup,
+    ("notification_unread_counters",): _rebuild_unread_counters,
+    ("document_sequences",): _reseed_document_sequences,
+    ("cost_layers", "cogs_entries"): _rebuild_cost_layers,
+}
+DERIVED_TABLE_NAMES = {name for group in DERIVED_TABLES for name in group}
+
+
+def _q(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+
+class DatabaseMerger:
+    """دمج قاعدة SQLite فرعية في القاعدة الحالية عبر ATTACH
+
+    الجداول تُنسخ بترتيب اعتماد المفاتيح الأجنبية (الآباء أولاً) على دفعات
+    INSERT … SELECT مرتبة بـ rowid، مع commit لكل دفعة حتى لا تُحمّل أي
+    جداول في الذاكرة ولا يتضخم ملف WAL. الأعمدة المنسوخة هي المشتركة بين
+    القاعدتين فقط، فلا يفشل الدمج عند اختلاف بسيط في المخطط.
+    """
+
+    def __init__(self, target_path: str, source_path: str, mode: str = "smart",
+                 ignored_tables: Optional[Iterable[str]] = None, batch_size: int = DEFAULT_BATCH_SIZE,
+                 progress: Optional[Callable[[str, int, int], None]] = None):
+        if mode not in CONFLICT_POLICIES:
+            raise ValueError(f"unknown merge mode: {mode}")
+        self.target_path = target_path
+        self.source_path = source_path
+        self.mode = mode
+        self.ignored = set(ignored_tables or [])
+        self.batch_size = max(int(batch_size or DEFAULT_BATCH_SIZE), 1)
+        self.progress = progress
+        self.conn: Optional[sqlite3.Connection] = None
+
+    # ------------------------------------------------------------ الاتصال
+
+    def __enter__(self):
+        self.conn = sqlite3.connect(self.target_path, timeout=60, isolation_level=None)
+        self.conn.execute("PRAGMA busy_timeout=60000")
+        # الترتيب حسب الاعتماد يكفي؛ القيود تُفحص بعد الدمج بدل رفض دفعات كاملة
+        self.conn.execute("PRAGMA foreign_keys=OFF")
+        self.conn.execute(f"ATTACH DATABASE ? AS {SOURCE_ALIAS}", (self.source_path,))
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self.conn is not None:
+            try:
+                if self.conn.in_transaction:
+                    self.conn.rollback()
+                self.conn.execute(f"DETACH DATABASE {SOURCE_ALIAS}")
+            except sqlite3.Error:
+                pass
+            self.conn.close()
+            self.conn = None
+
+    # ------------------------------------------------------------ المخطط
+
+    def _tables(self, schema: str) -> List[str]:
+        rows = self.conn.execute(
+            f"SELECT name FROM {schema}.sqlite_master WHERE type='table' AND name NOT LIKE 'sqlite_%'"
+        ).fetchall()
+        return [r[0] for r in rows]
+
+    def _columns(self, schema: str, table: str) -> List[Dict[str, Any]]:
+        rows = self.conn.execute(f"PRAGMA {schema}.table_info({_q(table)})").fetchall()
+        return [{"name": r[1], "pk": r[5]} for r in rows]
+
+    def _has_rowid(self, schema: str, table: str) -> bool:
+        try:
+            self.conn.execute(f"SELECT rowid FROM {schema}.{_q(table)} LIMIT 0")
+            return True
+        except sqlite3.OperationalError:
+            return False
+
+    def ordered_tables(self) -> List[str]:
+        """الجداول المشتركة غير المستثناة مرتبة بحيث يسبق الجدول الأب أبناءه"""
+        source = set(self._tables(SOURCE_ALIAS))
+        tables = [t for t in self._tables("main") if t in source and t not in self.ignored
+                  and t not in DERIVED_TABLE_NAMES and not t.startswith("alembic_")]
+        deps = {}
+        for table in tables:
+            parents = {r[2] for r in self.conn.execute(f"PRAGMA main.foreign_key_list({_q(table)})")}
+            deps[table] = {p for p in parents if p in tables and p != table}
+
+        ordered, done = [], set()
+        pending = sorted(tables)
+        while pending:
+            ready = [t for t in pending if deps[t] <= done]
+            if not ready:
+                # دورة اعتماد: تُنسخ المتبقية بالترتيب الأبجدي
+                ready = pending[:1]
+            for t in ready:
+                ordered.append(t)
+                done.add(t)
+            pending = [t for t in pending if t not in done]
+        return ordered
+
+    def _plan(self, table: str) -> Dict[str, Any]:
+        target_cols = self._columns("main", table)
+        source_names = {c["name"] for c in self._columns(SOURCE_ALIAS, table)}
+        cols = [c["name"] for c in target_cols if c["name"] in source_names]
+        pk = [c["name"] for c in sorted(target_cols, key=lambda c: c["pk"]) if c["pk"] and c["name"] in source_names]
+        return {
+            "columns": cols,
+            "pk": pk,
+            "missing_in_source": [c["name"] for c in target_cols if c["name"] not in source_names],
+            "extra_in_source": sorted(source_names - {c["name"] for c in target_cols}),
+            "rowid": self._has_rowid(SOURCE_ALIAS, table),
+        }
+
+    def _pk_absent(self, table: str, pk: List[str], alias: str = "s") -> str:
+        match = " AND ".join(f"t.{_q(c)} = {alias}.{_q(c)}" for c in pk)
+        return f"NOT EXISTS (SELECT 1 FROM main.{_q(table)} t WHERE {match})"
+
+    def _count(self, sql: str, params=()) -> int:
+        return int(self.conn.execute(sql, params).fetchone()[0] or 0)
+
+    # ------------------------------------------------------------ المعاينة
+
+    def diff(self) -> List[Dict[str, Any]]:
+        """معاينة بدون كتابة: عدد السجلات الجديدة والمتغيرة لكل جدول"""
+        report = []
+        for table in self.ordered_tables():
+            plan = self._plan(table)
+            src = f"{SOURCE_ALIAS}.{_q(table)}"
+            entry = {
+                "table": table,
+                "source_count": self._count(f"SELECT COUNT(*) FROM {src}"),
+                "target_count": self._count(f"SELECT COUNT(*) FROM main.{_q(table)}"),
+                "new": None,
+                "changed": None,
+                "missing_in_source": plan["missing_in_source"],
+                "extra_in_source": plan["extra_in_source"],
+            }
+            if plan["pk"] and plan["columns"]:
+                entry["new"] = self._count(f"SELECT COUNT(*) FROM {src} s WHERE {self._pk_absent(table, plan['pk'])}")
+                cols = ", ".join(_q(c) for c in plan["columns"])
+                match = " AND ".join(f"t.{_q(c)} = s.{_q(c)}" for c in plan["pk"])
+                entry["changed"] = self._count(
+                    f"SELECT COUNT(*) FROM (SELECT {cols} FROM {src} s "
+                    f"WHERE EXISTS (SELECT 1 FROM main.{_q(table)} t WHERE {match}) "
+                    f"EXCEPT SELECT {cols} FROM main.{_q(table)})"
+                )
+            report.append(entry)
+        return report
+
+    # ------------------------------------------------------------ الدمج
+
+    def merge(self) -> Dict[str, Any]:
+        verb = CONFLICT_POLICIES[self.mode]
+        tables = []
+        total_added = 0
+        started = time.perf_counter()
+        for table in self.ordered_tables():
+            result = self._merge_table(table, verb)
+            total_added += result["added"]
+            tables.append(result)
+            logger.info(
+                f"merge {table}: +{result['added']} / {result['scanned']} rows "
+                f"in {result['seconds']:.1f}s{' ⚠ ' + result['error'] if result['error'] else ''}"
+            )
+        rebuilt = self._rebuild_derived() if total_added else {}
+        return {
+            "added": total_added,
+            "tables": tables,
+            "errors": [t for t in tables if t["error"]],
+            "fk_violations": self._fk_violations([t["table"] for t in tables if t["added"]]),
+            "rebuilt": rebuilt,
+            "seconds": round(time.perf_counter() - started, 2),
+        }
+
+    def _rebuild_derived(self) -> Dict[str, Any]:
+        """إعادة بناء الجداول المشتقة من جداولها الأساسية بعد الدمج، كل جدول في معاملة مستقلة"""
+        from sqlalchemy import create_engine
+        from sqlalchemy.pool import NullPool
+
+        existing = set(self._tables("main"))
+        engine = create_engine(f"sqlite:///{self.target_path}", poolclass=NullPool,
+                               connect_args={"timeout": 60})
+        rebuilt: Dict[str, Any] = {}
+        try:
+            for group, rebuild in DERIVED_TABLES.items():
+                if not existing.issuperset(group):
+                    continue
+                table = "/".join(group)
+                try:
+                    with engine.begin() as connection:
+                        rebuilt[table] = rebuild(connection)
+                except Exception as e:
+                    logger.warning(f"⚠️ تعذر إعادة بناء {table} بعد الدمج: {e}")
+                    rebuilt[table] = None
+        finally:
+            engine.dispose()
+        return rebuilt
+
+    def _merge_table(self, table: str, verb: str) -> Dict[str, Any]:
+        plan = self._plan(table)
+        started = time.perf_counter()
+        result = {"table": table, "added": 0, "scanned": 0, "error": None, "seconds": 0.0}
+        if not plan["columns"]:
+            result["error"] = "no common columns"
+            return result
+
+        cols = ", ".join(_q(c) for c in plan["columns"])
+        src = f"{SOURCE_ALIAS}.{_q(table)}"
+        where = []
+        if self.mode == "append" and plan["pk"]:
+            where.append(self._pk_absent(table, plan["pk"]))
+        total = self._count(f"SELECT COUNT(*) FROM {src}")
+
+        try:
+            if not plan["rowid"]:
+                # جداول WITHOUT ROWID: دفعة واحدة
+                cond = f" WHERE {' AND '.join(where)}" if where else ""
+                self.conn.execute("BEGIN")
+                before = self.conn.total_changes
+                self.conn.execute(f"{verb} INTO main.{_q(table)} ({cols}) SELECT {cols} FROM {src} s{cond}")
+                result["added"] = self.conn.total_changes - before
+                result["scanned"] = total
+                self.conn.execute("COMMIT")
+            else:
+                last_rowid = None
+                while True:
+                    batch_where = list(where)
+                    params = []
+                    if last_rowid is not None:
+                        batch_where.append("s.rowid > ?")
+                        params.append(last_rowid)
+                    cond = f" WHERE {' AND '.join(batch_where)}" if batch_where else ""
+                    bounds = self.conn.execute(
+                        f"SELECT MAX(r), COUNT(*) FROM (SELECT s.rowid AS r FROM {src} s{cond} "
+                        f"ORDER BY s.rowid LIMIT {self.batch_size})",
+                        params,
+                    ).fetchone()
+                    upper, scanned = bounds
+                    if not scanned:
+                        break
+                    self.conn.execute("BEGIN")
+                    before = self.conn.total_changes
+                    self.conn.execute(
+                        f"{verb} INTO main.{_q(table)} ({cols}) SELECT {cols} FROM {src} s"
+                        f"{cond}{' AND' if cond else ' WHERE'} s.rowid <= ? ORDER BY s.rowid",
+                        params + [upper],
+                    )
+                    result["added"] += self.conn.total_changes - before
+                    self.conn.execute("COMMIT")
+                    result["scanned"] += scanned
+                    last_rowid = upper
+                    if self.progress:
+                        self.progress(table, result["scanned"], total)
+        except sqlite3.Error as e:
+            if self.conn.in_transaction:
+                self.conn.rollback()
+            result["error"] = str(e)
+        result["seconds"] = round(time.perf_counter() - started, 2)
+        return result
+
+    def _fk_violations(self, tables: List[str]) -> Dict[str, int]:
+        violations = {}
+        for table in tables:
+            try:
+                n = len(self.conn.execute(f"PRAGMA main.foreign_key_check({_q(table)})").fetchmany(10000))
+            except sqlite3.Error:
+                continue
+            if n:
+                violations[table] = n
+        return violations
+
+
+def merge_databases(target_path: str, source_path: str, mode: str = "smart", ignored_tables=None,
+                    dry_run: bool = False, batch_size: int = DEFAULT_BATCH_SIZE, progress=None):
+    with DatabaseMerger(target_path, source_path, mode, ignored_tables, batch_size, progress) as merger:
+        return merger.diff() if dry_run else merger.merge()
@@ -0,0 +1,281 @@
+import hashlib
+import logging
+import os
+import re
+import sqlite3
+import time
+import uuid
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+SQLITE_HEADER = b"SQLite format 3\x00"
+STREAM_CHUNK = 1024 * 1024
+REQUIRED_TABLES = ("users", "alembic_version")
+GENERATION_SUFFIX = ".generation"
+
+_REVISION_RE = re.compile(r"^revision\s*=\s*['\"]([^'\"]+)['\"]", re.M)
+_DOWN_REVISION_RE = re.compile(r"^down_revision\s*=\s*(.+)$", re.M)
+_QUOTED_RE = re.compile(r"['\"]([^'\"]+)['\"]")
+_revision_graph: Optional[Dict[str, Set[str]]] = None
+
+
+class RestoreError(Exception):
+    pass
+
+
+def _load_revision_graph(migrations_dir: str) -> Dict[str, Set[str]]:
+    """المراجعات المعروفة ورؤوس السلسلة (head) من ملفات versions (تُقرأ مرة واحدة)"""
+    global _revision_graph
+    if _revision_graph is None:
+        revisions, parents = set(), set()
+        versions = Path(migrations_dir) / "versions"
+        for path in versions.glob("*.py"):
+            try:
+                source = path.read_text(encoding="utf-8", errors="ignore")
+            except OSError:
+                continue
+            match = _REVISION_RE.search(source)
+            if not match:
+                continue
+            revisions.add(match.group(1))
+            down = _DOWN_REVISION_RE.search(source)
+            if down:
+                parents.update(_QUOTED_RE.findall(down.group(1).split("#", 1)[0]))
+        _revision_graph = {"known": revisions, "heads": revisions - parents}
+    return _revision_graph
+
+
+def known_revisions(migrations_dir: str) -> Set[str]:
+    """كل مراجعات alembic المعروفة لهذا الإصدار من الكود"""
+    return _load_revision_graph(migrations_dir)["known"]
+
+
+def head_revisions(migrations_dir: str) -> Set[str]:
+    """المراجعة (أو المراجعات) الأخيرة التي يتوقعها الكود الحالي"""
+    return _load_revision_graph(migrations_dir)["heads"]
+
+
+def stage_stream(stream, live_path: str) -> Dict[str, Any]:
+    """نسخ الملف المرفوع على دفعات إلى ملف مؤقت بجانب القاعدة مع حساب SHA-256
+
+    الملف المؤقت في نفس المجلد حتى يكون الاستبدال النهائي os.replace ذرياً.
+    """
+    directory = os.path.dirname(os.path.abspath(live_path))
+    staged = os.path.join(directory, f".restore_{uuid.uuid4().hex}.db")
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        with open(staged, "wb") as out:
+            while True:
+                block = stream.read(STREAM_CHUNK)
+                if not block:
+                    break
+                if size == 0 and not block.startswith(SQLITE_HEADER[:len(block)]):
+                    raise RestoreError("الملف ليس قاعدة SQLite")
+                digest.update(block)
+                out.write(block)
+                size += len(block)
+            out.flush()
+            os.fsync(out.fileno())
+    except Exception:
+        discard(staged)
+        raise
+    if size < 512:
+        discard(staged)
+        raise RestoreError("الملف فارغ أو غير مكتمل")
+    return {"path": staged, "sha256": digest.hexdigest(), "size": size}
+
+
+def validate(staged: str, migrations_dir: str) -> Dict[str, Any]:
+    """فحص التكامل والمخطط قبل الاستبدال؛ يرفع RestoreError عند الرفض"""
+    conn = sqlite3.connect(f"file:{staged}?mode=ro", uri=True)
+    try:
+        result = conn.execute("PRAGMA integrity_check").fetchone()
+        if not result or result[0] != "ok":
+            raise RestoreError(f"فشل فحص التكامل: {result[0] if result else '-'}")
+        tables = {r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type='table'")}
+        missing = [t for t in REQUIRED_TABLES if t not in tables]
+        if missing:
+            raise RestoreError(f"النسخة لا تحتوي الجداول الأساسية: {', '.join(missing)}")
+        revision = conn.execute("SELECT version_num FROM alembic_version").fetchone()
+    except sqlite3.DatabaseError as e:
+        raise RestoreError(f"ملف قاعدة بيانات غير صالح: {e}") from e
+    finally:
+        conn.close()
+
+    revision = revision[0] if revision else None
+    known = known_revisions(migrations_dir)
+    if known and revision not in known:
+        # نسخة من إصدار أحدث من الكود (أو بدون مراجعة): تشغيلها قد يفسد البيانات
+        raise RestoreError(f"إصدار مخطط غير معروف: {revision or '-'}")
+    heads = head_revisions(migrations_dir)
+    return {"revision": revision, "tables": len(tables), "upgrade_required": bool(heads) and revision not in heads}
+
+
+def upgrade(staged: str, migrations_dir: str) -> str:
+    """ترقية مخطط النسخة المؤقتة إلى head قبل الاستبدال (القاعدة الحية لا تُلمس)
+
+    env.py يستخدم الاتصال الممرر في config.attributes بدل محرك التطبيق.
+    """
+    from alembic import command
+    from alembic.config import Config as AlembicConfig
+    from sqlalchemy import create_engine
+    from sqlalchemy.pool import NullPool
+
+    cfg = AlembicConfig(os.path.join(migrations_dir, "alembic.ini"))
+    cfg.set_main_option("script_location", migrations_dir)
+    engine = create_engine(f"sqlite:///{staged}", poolclass=NullPool)
+    try:
+        with engine.begin() as connection:
+            cfg.attributes["connection"] = connection
+            command.upgrade(cfg, "heads")
+            revision = connection.exec_driver_sql("SELECT version_num FROM alembic_version").scalar()
+    except Exception as e:
+        raise RestoreError(f"فشلت ترقية مخطط النسخة: {e}") from e
+    finally:
+        engine.dispose()
+    return revision
+
+
+def prepare(staged: str, migrations_dir: str) -> Dict[str, Any]:
+    """فحص النسخة ثم ترقيتها إن كانت على مراجعة أقدم، وإعادة الفحص بعد الترقية"""
+    checks = validate(staged, migrations_dir)
+    if not checks.pop("upgrade_required"):
+        return dict(checks, upgraded_from=None)
+    upgraded_from = checks["revision"]
+    upgrade(staged, migrations_dir)
+    checks = validate(staged, migrations_dir)
+    if checks.pop("upgrade_required"):
+        raise RestoreError(f"النسخة ما زالت على مخطط أقدم ({checks['revision']}) بعد الترقية")
+    return dict(checks, upgraded_from=upgraded_from)
+
+
+def discard(path: Optional[str]) -> None:
+    if path:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def _sidecars(path: str):
+    return (f"{path}-wal", f"{path}-shm", f"{path}-journal")
+
+
+def _keep_previous(live_path: str) -> str:
+    """الاحتفاظ بالملف الحالي باسم .pre-restore دون إزالته من مساره (رابط صلب، أو نسخة backup)"""
+    previous = f"{live_path}.pre-restore-{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+    try:
+        os.link(live_path, previous)
+    except OSError:
+        src = sqlite3.connect(live_path)
+        dst = sqlite3.connect(previous)
+        try:
+            src.backup(dst)
+        finally:
+            dst.close()
+            src.close()
+    return previous
+
+
+def _pause_local_scheduler():
+    try:
+        from extensions import scheduler
+    except Exception:
+        return None
+    if scheduler.running:
+        scheduler.pause()
+        return scheduler
+    return None
+
+
+def swap(staged: str, live_path: str, engine=None, keep_previous: bool = True) -> Dict[str, Any]:
+    """استبدال القاعدة الحية بالنسخة المفحوصة بإعادة تسمية ذرية واحدة ثم إشعار بقية العمليات
+
+    1) إيقاف مهام المجدول في هذه العملية، checkpoint للـ WAL ثم إغلاق اتصالاتها
+    2) حفظ الملف الحالي باسم .pre-restore برابط صلب (المسار الحي لا يختفي)
+    3) حذف ملفات -wal/-shm الفارغة حتى لا تُطبق على الملف الجديد
+    4) os.replace واحدة للنسخة الجديدة فوق المسار الحي ثم رفع رقم الجيل
+    """
+    started = time.perf_counter()
+    paused = _pause_local_scheduler()
+    try:
+        if engine is not None:
+            try:
+                with engine.connect() as conn:
+                    conn.exec_driver_sql("PRAGMA wal_checkpoint(TRUNCATE)")
+            except Exception as e:
+                logger.warning(f"⚠️ WAL checkpoint قبل الاستعادة فشل: {e}")
+            engine.dispose()
+
+        previous = None
+        if os.path.exists(live_path):
+            if keep_previous:
+                previous = _keep_previous(live_path)
+            for sidecar in _sidecars(live_path):
+                discard(sidecar)
+        os.replace(staged, live_path)
+        generation = bump_generation(live_path)
+    finally:
+        if paused is not None:
+            paused.resume()
+    return {
+        "previous": previous,
+        "generation": generation,
+        "swap_ms": round((time.perf_counter() - started) * 1000, 1),
+    }
+
+
+# ------------------------------------------------------------ جيل القاعدة
+
+def _generation_path(live_path: str) -> str:
+    return f"{live_path}{GENERATION_SUFFIX}"
+
+
+def bump_generation(live_path: str) -> str:
+    token = uuid.uuid4().hex
+    tmp = _generation_path(live_path) + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(token)
+    os.replace(tmp, _generation_path(live_path))
+    return token
+
+
+def read_generation(live_path: str) -> Optional[str]:
+    try:
+        with open(_generation_path(live_path), encoding="utf-8") as f:
+            return f.read().strip() or None
+    except OSError:
+        return None
+
+
+def init_app(app, engine_getter) -> None:
+    """كل عملية تقارن جيل القاعدة قبل الطلب وتغلق مجمع اتصالاتها إذا استُعيدت القاعدة في عملية أخرى"""
+    uri = app.config.get("SQLALCHEMY_DATABASE_URI", "")
+    if not uri.startswith("sqlite:///"):
+        return
+    live_path = uri.replace("sqlite:///", "")
+    gen_path = _generation_path(live_path)
+    state = {"mtime": None, "generation": read_generation(live_path)}
+    try:
+        state["mtime"] = os.stat(gen_path).st_mtime_ns
+    except OSError:
+        pass
+
+    @app.before_request
+    def _dispose_pool_after_restore():
+        try:
+            mtime = os.stat(gen_path).st_mtime_ns
+        except OSError:
+            return
+        if mtime == state["mtime"]:
+            return
+        state["mtime"] = mtime
+        generation = read_generation(live_path)
+        if generation and generation != state["generation"]:
+            state["generation"] = generation
+            engine_getter().dispose()
+            app.logger.info(f"🔄 تم تحديث اتصالات قاعدة البيانات بعد الاستعادة (الجيل {generation[:8]})")
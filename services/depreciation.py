@@ -0,0 +1,203 @@
+import calendar
+import logging
+from collections import defaultdict
+from datetime import date
+from decimal import Decimal
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import insert, select
+
+logger = logging.getLogger(__name__)
+
+CENT = Decimal("0.01")
+GL_PURPOSE = "DEP_PERIOD"
+
+Period = Tuple[int, int]
+
+
+def parse_period(value: str) -> Period:
+    """YYYY-MM → (year, month)"""
+    try:
+        year, month = (int(p) for p in str(value).strip().split("-", 1))
+    except ValueError:
+        raise ValueError(f"صيغة الفترة يجب أن تكون YYYY-MM: {value}")
+    if not 1 <= month <= 12:
+        raise ValueError(f"شهر غير صالح: {value}")
+    return year, month
+
+
+def ensure_not_future(period: Period, today: Optional[date] = None) -> Period:
+    """رفض فترة بعد الشهر الحالي: قسط لم يحن وقته يُرحّل مصروفاً مسبقاً ولا يُعاد حسابه"""
+    today = today or date.today()
+    if period > (today.year, today.month):
+        raise ValueError(f"لا يمكن الاستهلاك لفترة مستقبلية: {period[0]}-{period[1]:02d}")
+    return period
+
+
+def _next(period: Period) -> Period:
+    year, month = period
+    return (year + 1, 1) if month == 12 else (year, month + 1)
+
+
+def _period_date(period: Period, day: int) -> date:
+    year, month = period
+    return date(year, month, min(max(day, 1), calendar.monthrange(year, month)[1]))
+
+
+def due_through(today: Optional[date] = None, day_of_month: int = 1) -> Period:
+    """آخر فترة مستحقة: الشهر الحالي إذا وصلنا يوم الاستهلاك، وإلا الشهر السابق"""
+    today = today or date.today()
+    if today.day >= day_of_month:
+        return today.year, today.month
+    return (today.year - 1, 12) if today.month == 1 else (today.year, today.month - 1)
+
+
+class _Schedule:
+    """جدول استهلاك أصل واحد بنفس قواعد المهمة السابقة (قسط ثابت أو متناقص، بحد أقصى سعر الشراء)"""
+
+    def __init__(self, asset_id, price, purchase_date, life_years, method, rate):
+        self.asset_id = asset_id
+        self.price = Decimal(str(price or 0))
+        self.purchase_date = purchase_date
+        self.life_years = int(life_years or 0)
+        self.method = method
+        self.rate = Decimal(str(rate or 0)) / 100
+        self.accumulated = Decimal("0")
+
+    def amount_for(self, period_date: date) -> Optional[Decimal]:
+        if self.life_years <= 0 or (period_date - self.purchase_date).days / 365.25 >= self.life_years:
+            return None
+        if self.method == "STRAIGHT_LINE":
+            monthly = self.price / self.life_years / 12
+        else:
+            monthly = (self.price - self.accumulated) * self.rate / 12
+        monthly = min(monthly.quantize(CENT), self.price - self.accumulated)
+        return monthly if monthly > 0 else None
+
+
+def run_depreciation(session, through: Period, day_of_month: int = 1, post_gl: bool = True) -> Dict[str, int]:
+    """إنشاء كل أقساط الاستهلاك الناقصة حتى الفترة through لكل الأصول النشطة
+
+    قراءة الأصول والأقساط السابقة في استعلامين، حساب الجدول في الذاكرة، ثم إدراج
+    الصفوف دفعة واحدة وقيد يومية واحد لكل فترة. الفترات الموجودة مسبقاً لا
+    تُعاد (قيد uq_depreciation_asset_period)، فإعادة التشغيل آمنة. الترحيل يلتقط
+    كل قسط بلا gl_batch_id (ترحيل سابق فشل أو تشغيل بـ --no-gl) وليس فقط ما أُدرج الآن.
+    """
+    from models import AssetDepreciation, FixedAsset, FixedAssetCategory
+
+    assets = session.execute(
+        select(
+            FixedAsset.id, FixedAsset.purchase_price, FixedAsset.purchase_date,
+            FixedAssetCategory.useful_life_years, FixedAssetCategory.depreciation_method,
+            FixedAssetCategory.depreciation_rate, FixedAssetCategory.depreciation_account_code,
+        )
+        .join(FixedAssetCategory, FixedAssetCategory.id == FixedAsset.category_id)
+        .where(FixedAsset.status == "ACTIVE")
+    ).all()
+    if not assets:
+        return {"assets": 0, "rows": 0, "periods": 0, "batches": _post_pending(session, through) if post_gl else 0}
+
+    done: Dict[int, Dict[Period, Decimal]] = defaultdict(dict)
+    dep = AssetDepreciation.__table__
+    for asset_id, year, month, amount in session.execute(
+        select(dep.c.asset_id, dep.c.fiscal_year, dep.c.fiscal_month, dep.c.depreciation_amount)
+        .join(FixedAsset.__table__, FixedAsset.id == dep.c.asset_id)
+        .where(FixedAsset.status == "ACTIVE")
+    ):
+        done[asset_id][(year, month or 1)] = Decimal(str(amount or 0))
+
+    rows: Dict[Period, List[dict]] = defaultdict(list)
+    credit_accounts: Dict[int, str] = {}
+    for asset_id, price, purchase_date, life, method, rate, account_code in assets:
+        if not purchase_date:
+            continue
+        credit_accounts[asset_id] = account_code
+        sched = _Schedule(asset_id, price, purchase_date, life, method, rate)
+        existing = done.get(asset_id, {})
+        # أول قسط في الشهر التالي للشراء، والفترات المسجلة سابقاً تدخل في الرصيد المتراكم فقط
+        period = _next((purchase_date.year, purchase_date.month))
+        while period <= through:
+            if period in existing:
+                sched.accumulated += existing[period]
+            else:
+                period_date = _period_date(period, day_of_month)
+                amount = sched.amount_for(period_date)
+                if amount is None:
+                    break
+                sched.accumulated += amount
+                rows[period].append({
+                    "asset_id": asset_id,
+                    "fiscal_year": period[0],
+                    "fiscal_month": period[1],
+                    "depreciation_date": period_date,
+                    "depreciation_amount": amount,
+                    "accumulated_depreciation": sched.accumulated,
+                    "book_value": sched.price - sched.accumulated,
+                })
+            period = _next(period)
+
+    counts = {"assets": len(assets), "rows": 0, "periods": 0, "batches": 0}
+    for period in sorted(rows):
+        inserted = session.execute(insert(dep).returning(dep.c.id), rows[period]).all()
+        counts["rows"] += len(inserted)
+        counts["periods"] += 1
+    if post_gl:
+        counts["batches"] = _post_pending(session, through)
+    return counts
+
+
+def _post_pending(session, through: Period) -> int:
+    """ترحيل كل الأقساط غير المرحلة حتى through: قيد واحد لكل فترة داخل savepoint مستقل"""
+    from models import AssetDepreciation, FixedAsset, FixedAssetCategory, GL_ACCOUNTS, _gl_upsert_batch_and_entries
+
+    dep = AssetDepreciation.__table__
+    year, month = through
+    pending: Dict[Period, List[Tuple[int, str, Decimal]]] = defaultdict(list)
+    for dep_id, fy, fm, amount, account_code in session.execute(
+        select(
+            dep.c.id, dep.c.fiscal_year, dep.c.fiscal_month, dep.c.depreciation_amount,
+            FixedAssetCategory.depreciation_account_code,
+        )
+        .join(FixedAsset.__table__, FixedAsset.id == dep.c.asset_id)
+        .join(FixedAssetCategory, FixedAssetCategory.id == FixedAsset.category_id)
+        .where(
+            dep.c.gl_batch_id.is_(None),
+            (dep.c.fiscal_year < year) | ((dep.c.fiscal_year == year) & (dep.c.fiscal_month <= month)),
+        )
+    ):
+        pending[(fy, fm or 1)].append((dep_id, account_code, Decimal(str(amount or 0))))
+
+    batches = 0
+    expense_account = GL_ACCOUNTS.get("DEPRECIATION_EXP", "6800_DEPRECIATION")
+    for period in sorted(pending):
+        items = pending[period]
+        ids = [i for i, _, _ in items]
+        credits: Dict[str, Decimal] = defaultdict(Decimal)
+        for _, account_code, amount in items:
+            credits[account_code] += amount
+        total = sum(credits.values(), Decimal("0"))
+        if total <= 0:
+            continue
+        entries = [(expense_account, float(total), 0)] + [(acc, 0, float(v)) for acc, v in sorted(credits.items())]
+        try:
+            with session.begin_nested():
+                batch_id = _gl_upsert_batch_and_entries(
+                    session.connection(),
+                    source_type="DEPRECIATION",
+                    source_id=min(ids),
+                    purpose=GL_PURPOSE,
+                    currency="ILS",
+                    memo=f"استهلاك الأصول {period[0]}/{period[1]:02d} ({len(ids)} أصل)",
+                    entries=entries,
+                    ref=f"DEP-{period[0]}{period[1]:02d}",
+                    entity_type=None,
+                    entity_id=None,
+                )
+                session.execute(dep.update().where(dep.c.id.in_(ids)).values(gl_batch_id=batch_id))
+            batches += 1
+        except Exception as e:
+            logger.warning(f"⚠️ تعذر ترحيل قيد الاستهلاك للفترة {period[0]}-{period[1]:02d}: {e}")
+    return batches
+
+
+__all__ = ["run_depreciation", "parse_period", "due_through", "ensure_not_future"]
@@ -0,0 +1,184 @@
+import hashlib
+import logging
+import os
+import threading
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Optional, Tuple
+
+from sqlalchemy import text as sa_text
+
+logger = logging.getLogger(__name__)
+
+DAILY = "%Y%m%d"
+MONTHLY = "%Y%m"
+
+
+def _decimal_suffix(value: str) -> Optional[int]:
+    suffix = value.rsplit("-", 1)[-1]
+    # المراجع القديمة لبعض المستندات كانت uuid سداسي عشري بطول 8؛ لا تُعد أرقاماً تسلسلية
+    if suffix.isdigit() and len(suffix) < 8:
+        return int(suffix)
+    return None
+
+
+def _shipment_suffix(value: str) -> Optional[int]:
+    parts = value.split("-")
+    try:
+        return int(parts[2], 16) if len(parts) == 4 else None
+    except ValueError:
+        return None
+
+
+class Sequence:
+    """تعريف نوع مستند: الجدول/العمود القديم (لتهيئة العداد أول مرة) وصيغة الرقم"""
+
+    def __init__(self, doc_type: str, table: str, column: str, period_format: str = DAILY,
+                 legacy_prefix: Optional[Callable[[str], str]] = None,
+                 parse: Callable[[str], Optional[int]] = _decimal_suffix):
+        self.doc_type = doc_type
+        self.table = table
+        self.column = column
+        self.period_format = period_format
+        self.legacy_prefix = legacy_prefix or (lambda period: f"{doc_type}{period}-")
+        self.parse = parse
+
+    def format(self, period: str, value: int) -> str:
+        return f"{self.legacy_prefix(period)}{value:04d}"
+
+
+class ShipmentSequence(Sequence):
+    """AZD-YYYYMMDD-XXXX-CCC: تسلسل يومي سداسي عشري + checksum"""
+
+    def format(self, period: str, value: int) -> str:
+        base = f"AZD-{period}-{value:04X}"
+        return f"{base}-{hashlib.md5(base.encode()).hexdigest()[:3].upper()}"
+
+
+SEQUENCES: Dict[str, Sequence] = {s.doc_type: s for s in (
+    Sequence("SAL", "sales", "sale_number"),
+    Sequence("PMT", "payments", "payment_number"),
+    Sequence("SRV", "service_requests", "service_number"),
+    Sequence("TRF", "transfers", "reference"),
+    Sequence("PRE", "preorders", "reference"),
+    Sequence("CRT", "online_carts", "cart_id"),
+    Sequence("OPR", "online_preorders", "order_number"),
+    Sequence("OPAY", "online_payments", "payment_ref"),
+    Sequence("SS", "supplier_settlements", "code", MONTHLY, lambda p: f"SS-{p}-"),
+    Sequence("PS", "partner_settlements", "code", MONTHLY, lambda p: f"PS-{p}-"),
+    ShipmentSequence("AZD", "shipments", "shipment_number", DAILY, lambda p: f"AZD-{p}-", _shipment_suffix),
+)}
+
+
+# ------------------------------------------------------------ الحجز بالكتل
+
+_blocks: Dict[Tuple[int, str, str], List[int]] = {}
+_blocks_lock = threading.Lock()
+
+
+def _block_size(connection) -> int:
+    # SQLite: القفل على مستوى القاعدة، واتصال ثانٍ أثناء flush سينتظر نفس القفل
+    if connection.dialect.name == "sqlite":
+        return 1
+    try:
+        from flask import current_app
+        return max(int(current_app.config.get("DOC_NUMBER_BLOCK_SIZE", 1) or 1), 1)
+    except Exception:
+        return 1
+
+
+def _legacy_max(connection, seq: Sequence, period: str) -> int:
+    """أعلى رقم صادر بالطريقة القديمة لهذه الفترة (مرة واحدة عند إنشاء صف التسلسل)"""
+    prefix = seq.legacy_prefix(period)
+    try:
+        rows = connection.execute(
+            sa_text(f"SELECT {seq.column} FROM {seq.table} WHERE {seq.column} LIKE :pfx"),
+            {"pfx": f"{prefix}%"},
+        ).scalars()
+    except Exception as e:
+        logger.warning(f"⚠️ تعذر قراءة الأرقام السابقة لـ {seq.doc_type}: {e}")
+        return 0
+    values = [seq.parse(v) for v in rows if v]
+    return max((v for v in values if v is not None), default=0)
+
+
+def _sequence_for(doc_type: str, period: str) -> Optional[Sequence]:
+    if doc_type in SEQUENCES:
+        return SEQUENCES[doc_type]
+    from services import barcode_allocator
+    if doc_type == barcode_allocator.DOC_TYPE:
+        return barcode_allocator._sequence(period)
+    return None
+
+
+def reseed(connection) -> int:
+    """رفع كل عداد إلى أعلى رقم صادر فعلاً في جدوله (بعد دمج قاعدة فرعية)
+
+    العداد لا ينزل أبداً؛ الفترات غير الموجودة تُهيأ من الجدول عند أول استخدام.
+    """
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    rows = connection.execute(sa_text("SELECT doc_type, period, last_value FROM document_sequences")).all()
+    raised = 0
+    for doc_type, period, last_value in rows:
+        seq = _sequence_for(doc_type, period)
+        if seq is None:
+            continue
+        top = _legacy_max(connection, seq, period)
+        if top > int(last_value or 0):
+            connection.execute(
+                sa_text("UPDATE document_sequences SET last_value = :v, updated_at = :now "
+                        "WHERE doc_type = :t AND period = :p"),
+                {"v": top, "now": now, "t": doc_type, "p": period},
+            )
+            raised += 1
+    return raised
+
+
+def _increment(connection, seq: Sequence, period: str, count: int) -> int:
+    """زيادة ذرية للعداد بـ count وإرجاع القيمة الجديدة (آخر رقم في الكتلة)"""
+    params = {"t": seq.doc_type, "p": period, "n": count, "now": datetime.now(timezone.utc).replace(tzinfo=None)}
+    update = sa_text(
+        "UPDATE document_sequences SET last_value = last_value + :n, updated_at = :now "
+        "WHERE doc_type = :t AND period = :p"
+    )
+    if connection.execute(update, params).rowcount == 0:
+        seed = _legacy_max(connection, seq, period)
+        insert = (
+            "INSERT INTO document_sequences (doc_type, period, last_value, updated_at) "
+            "VALUES (:t, :p, :seed, :now) ON CONFLICT (doc_type, period) DO NOTHING"
+        )
+        connection.execute(sa_text(insert), dict(params, seed=seed))
+        connection.execute(update, params)
+    return int(connection.execute(
+        sa_text("SELECT last_value FROM document_sequences WHERE doc_type = :t AND period = :p"), params
+    ).scalar())
+
+
+def next_value(connection, doc_type: str, period: Optional[str] = None) -> Tuple[str, int]:
+    """الرقم التالي لنوع المستند في الفترة الحالية
+
+    الوضع الافتراضي: زيادة داخل نفس معاملة الإدراج (بدون فجوات إلا عند التراجع).
+    مع DOC_NUMBER_BLOCK_SIZE > 1 (خارج SQLite) يحجز كل عامل كتلة أرقام في
+    معاملة مستقلة ويوزعها من الذاكرة، مقابل فجوات محتملة عند إعادة التشغيل.
+    """
+    seq = SEQUENCES[doc_type]
+    period = period or datetime.now(timezone.utc).strftime(seq.period_format)
+    block = _block_size(connection)
+    if block == 1:
+        return period, _increment(connection, seq, period, 1)
+
+    key = (os.getpid(), doc_type, period)
+    with _blocks_lock:
+        current = _blocks.get(key)
+        if not current or current[0] > current[1]:
+            with connection.engine.begin() as own:
+                end = _increment(own, seq, period, block)
+            current = _blocks[key] = [end - block + 1, end]
+        value = current[0]
+        current[0] += 1
+    return period, value
+
+
+def next_number(connection, doc_type: str) -> str:
+    """الرقم التالي منسقاً بصيغة المستند (SAL20251128-0001، SS-202511-0001، AZD-…)"""
+    period, value = next_value(connection, doc_type)
+    return SEQUENCES[doc_type].format(period, value)
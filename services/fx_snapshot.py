@@ -0,0 +1,127 @@
+import logging
+import threading
+import time
+from datetime import datetime, timezone
+from decimal import Decimal
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import text as sa_text
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TTL = 300
+EXTERNAL_SOURCE = "External API"
+
+_Entry = Tuple[datetime, Decimal, str]
+
+
+def _naive_utc(value: Optional[datetime]) -> datetime:
+    value = value or datetime.now(timezone.utc)
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+class FxRateSnapshot:
+    """لقطة أسعار الصرف في الذاكرة لاستخدامها داخل flush
+
+    تُبنى من جدول exchange_rates فقط (استعلام محلي واحد)، ولا تتصل أبداً
+    بمزودي الأسعار الخارجيين؛ السحب من الإنترنت يتم في update_exchange_rates_job
+    ثم تُعاد تهيئة اللقطة. بعد FX_SNAPSHOT_TTL تُقرأ من القاعدة مجدداً حتى ترى
+    العمليات الأخرى الأسعار الجديدة.
+    """
+
+    def __init__(self, ttl: int = DEFAULT_TTL):
+        self.ttl = ttl
+        self._rates: Dict[Tuple[str, str], List[_Entry]] = {}
+        self._loaded_at = 0.0
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._generation += 1
+            self._loaded_at = 0.0
+
+    def _ttl(self) -> int:
+        try:
+            from flask import current_app
+            return int(current_app.config.get("FX_SNAPSHOT_TTL", self.ttl) or self.ttl)
+        except Exception:
+            return self.ttl
+
+    def load(self, connection=None) -> int:
+        if connection is None:
+            from extensions import db
+            connection = db.session.connection()
+        generation = self._generation
+        rows = connection.execute(sa_text(
+            "SELECT base_code, quote_code, rate, valid_from, source FROM exchange_rates "
+            "WHERE is_active = :active ORDER BY valid_from DESC"
+        ), {"active": True}).fetchall()
+        rates: Dict[Tuple[str, str], List[_Entry]] = {}
+        for base, quote, rate, valid_from, source in rows:
+            if rate is None or Decimal(str(rate)) <= 0:
+                continue
+            kind = "online" if source == EXTERNAL_SOURCE else "manual"
+            rates.setdefault((str(base).upper(), str(quote).upper()), []).append(
+                (_naive_utc(valid_from), Decimal(str(rate)), kind)
+            )
+        with self._lock:
+            self._rates = rates
+            # تحميل بدأ قبل إبطال لاحق يُستخدم مرة واحدة ولا يُعتبر صالحاً حتى TTL
+            self._loaded_at = time.monotonic() if generation == self._generation else 0.0
+        return len(rates)
+
+    def _ensure_loaded(self, connection=None) -> None:
+        if time.monotonic() - self._loaded_at < self._ttl():
+            return
+        try:
+            self.load(connection)
+        except Exception as e:
+            # نستمر بآخر لقطة متاحة بدل إفشال عملية الإدراج
+            logger.warning(f"⚠️ تعذر تحديث لقطة أسعار الصرف: {e}")
+
+    def lookup(self, base: str, quote: str, at: Optional[datetime] = None,
+               connection=None) -> Optional[Dict]:
+        """أحدث سعر نشط صالح عند at كـ {'rate', 'source', 'timestamp'} أو None"""
+        self._ensure_loaded(connection)
+        t = _naive_utc(at)
+        for valid_from, rate, source in self._rates.get((base.upper(), quote.upper()), ()):
+            if valid_from <= t:
+                return {"rate": rate, "source": source, "timestamp": valid_from.replace(tzinfo=timezone.utc)}
+        return None
+
+
+fx_snapshot = FxRateSnapshot()
+
+
+def snapshot_rate(base: str, quote: str, at: Optional[datetime] = None, connection=None) -> dict:
+    """بديل get_fx_rate_with_fallback لمستمعي flush: نفس شكل النتيجة، بدون أي طلب HTTP"""
+    b, qv = (base or "").upper(), (quote or "").upper()
+    if b == qv:
+        return {"rate": 1.0, "source": "same_currency", "base": base, "quote": quote,
+                "timestamp": at or datetime.now(timezone.utc), "success": True}
+    found = fx_snapshot.lookup(b, qv, at, connection)
+    if found is None:
+        return {"rate": 0.0, "source": "unavailable", "base": base, "quote": quote,
+                "timestamp": at or datetime.now(timezone.utc), "success": False}
+    return {"rate": float(found["rate"]), "source": found["source"], "base": base, "quote": quote,
+            "timestamp": found["timestamp"], "success": True}
+
+
+def refresh_fx_snapshot(fetch_missing: bool = True) -> dict:
+    """سحب الأسعار الناقصة من الخارج (خارج أي معاملة كتابة) ثم إعادة بناء اللقطة"""
+    from extensions import db
+    result = {"success": True, "updated_rates": 0}
+    if fetch_missing:
+        from models import auto_update_missing_rates
+        result = auto_update_missing_rates()
+        db.session.commit()
+    result["snapshot_pairs"] = fx_snapshot.load()
+    return result
+
+
+__all__ = ["FxRateSnapshot", "fx_snapshot", "snapshot_rate", "refresh_fx_snapshot"]
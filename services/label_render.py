@@ -0,0 +1,330 @@
+import base64
+import io
+import logging
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, Iterable, List, NamedTuple, Optional, Sequence, Tuple
+
+from services.pdf_render import cache_key
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MEMORY_ITEMS = 1024
+DEFAULT_CACHE_MB = 64
+KINDS = ("auto", "ean13", "qr")
+FORMATS = ("png", "svg")
+
+_INIT_LOCK = threading.Lock()
+_fallback = None
+
+# ------------------------------------------------------------ ترميز EAN-13
+
+_L = ("0001101", "0011001", "0010011", "0111101", "0100011", "0110001", "0101111", "0111011", "0110111", "0001011")
+_R = tuple("".join("1" if b == "0" else "0" for b in code) for code in _L)
+_G = tuple(code[::-1] for code in _R)
+_PARITY = ("LLLLLL", "LLGLGG", "LLGGLG", "LLGGGL", "LGLLGG", "LGGLLG", "LGGGLL", "LGLGLG", "LGLGGL", "LGGLGL")
+# يُرفع مع أي تغيير في الترميز ليتجاوز الرموز المخزنة سابقاً في ذاكرة القرص
+_ENCODING_VERSION = 2
+_QUIET_LEFT, _QUIET_RIGHT = 11, 7
+_BAR_H, _GUARD_H, _TEXT_H = 60, 65, 72
+
+
+class Symbol(NamedTuple):
+    """رمز بوحدات الموديول: مستطيلات سوداء (x, y, w, h) ونص اختياري أسفله"""
+    width: int
+    height: int
+    rects: Tuple[Tuple[int, int, int, int], ...]
+    text: Optional[str] = None
+
+
+def _ean13_modules(code: str) -> str:
+    first, left, right = int(code[0]), code[1:7], code[7:]
+    bits = "101"
+    for digit, parity in zip(left, _PARITY[first]):
+        bits += (_L if parity == "L" else _G)[int(digit)]
+    bits += "01010"
+    for digit in right:
+        bits += _R[int(digit)]
+    return bits + "101"
+
+
+# رموز مرجعية محسوبة يدوياً من جداول المواصفة (بادئة 9 لـ ISBN وبادئة 7)، تحرس جدول التماثل
+_KNOWN_EAN13 = {
+    "9780201379624": "10101110110001001010011100100110100111001100101010100001010001001110100101000011011001011100101",
+    "7290000000008": "10100100110010111000110101001110001101010011101010111001011100101110010111001011100101001000101",
+}
+
+
+def _self_check() -> None:
+    for code, bits in _KNOWN_EAN13.items():
+        if _ean13_modules(code) != bits:
+            raise RuntimeError(f"ترميز EAN-13 غير مطابق للمرجع: {code}")
+
+
+_self_check()
+
+
+def _ean13_symbol(code: str) -> Symbol:
+    bits = _ean13_modules(code)
+    guards = set(range(0, 3)) | set(range(45, 50)) | set(range(92, 95))
+    rects = []
+    i = 0
+    while i < len(bits):
+        if bits[i] != "1":
+            i += 1
+            continue
+        j = i
+        while j < len(bits) and bits[j] == "1":
+            j += 1
+        rects.append((_QUIET_LEFT + i, 0, j - i, _GUARD_H if i in guards else _BAR_H))
+        i = j
+    return Symbol(_QUIET_LEFT + len(bits) + _QUIET_RIGHT, _TEXT_H + 2, tuple(rects), code)
+
+
+def _qr_symbol(data: str, border: int = 2) -> Symbol:
+    import qrcode
+
+    qr = qrcode.QRCode(error_correction=qrcode.constants.ERROR_CORRECT_L, border=border)
+    qr.add_data(data)
+    qr.make(fit=True)
+    matrix = qr.get_matrix()
+    rects = []
+    for y, row in enumerate(matrix):
+        x = 0
+        while x < len(row):
+            if not row[x]:
+                x += 1
+                continue
+            start = x
+            while x < len(row) and row[x]:
+                x += 1
+            rects.append((start, y, x - start, 1))
+    return Symbol(len(matrix), len(matrix), tuple(rects))
+
+
+def symbology(code: str, kind: str = "auto") -> str:
+    """ean13 للرموز الصالحة (خطي حقيقي)، وإلا QR كما كان سابقاً"""
+    if kind in ("ean13", "auto"):
+        from barcodes import is_valid_ean13
+        if code and is_valid_ean13(code):
+            return "ean13"
+    return "qr"
+
+
+def build_symbol(code: str, kind: str = "auto", border: int = 2) -> Symbol:
+    if symbology(code, kind) == "ean13":
+        return _ean13_symbol("".join(ch for ch in code if ch.isdigit()))
+    return _qr_symbol(code, border)
+
+
+# ------------------------------------------------------------ الإخراج
+
+def symbol_svg_body(symbol: Symbol) -> str:
+    """محتوى SVG (مسار واحد + النص) بوحدات الموديول - يُستخدم داخل <svg> أو <symbol>"""
+    d = "".join(f"M{x} {y}h{w}v{h}h-{w}z" for x, y, w, h in symbol.rects)
+    body = f'<path d="{d}" fill="#000"/>'
+    if symbol.text:
+        body += (f'<text x="{symbol.width / 2:g}" y="{symbol.height - 1}" font-family="monospace" '
+                 f'font-size="9" text-anchor="middle" fill="#000">{symbol.text}</text>')
+    return body
+
+
+def to_svg(symbol: Symbol, width: int, height: int) -> bytes:
+    return (
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{height}" '
+        f'viewBox="0 0 {symbol.width} {symbol.height}" shape-rendering="crispEdges">'
+        f'<rect width="100%" height="100%" fill="#fff"/>{symbol_svg_body(symbol)}</svg>'
+    ).encode("utf-8")
+
+
+def to_png(symbol: Symbol, width: int, height: int) -> bytes:
+    """PNG بمقياس صحيح للموديول (حواف حادة قابلة للمسح) يتوسط لوحة width×height"""
+    from PIL import Image, ImageDraw, ImageFont
+
+    if symbol.text:
+        # الخطوط عمودية: عرض الموديول صحيح والارتفاع يملأ المساحة المتبقية فوق الأرقام
+        text_h = 12 if height >= 40 else 0
+        bars_h = _GUARD_H
+        sx = max(width // symbol.width, 1)
+        sy = max(height - text_h, bars_h) / bars_h
+    else:
+        text_h, bars_h = 0, symbol.height
+        sx = sy = max(min(width, height) // symbol.width, 1)
+    img = Image.new("L", (max(width, symbol.width * sx), max(height, round(bars_h * sy) + text_h)), 255)
+    ox = (img.width - symbol.width * sx) // 2
+    oy = (img.height - round(bars_h * sy) - text_h) // 2
+    draw = ImageDraw.Draw(img)
+    for x, y, w, h in symbol.rects:
+        draw.rectangle((ox + x * sx, oy + round(y * sy), ox + (x + w) * sx - 1, oy + round((y + h) * sy) - 1), fill=0)
+    if text_h:
+        font = ImageFont.load_default()
+        tw = draw.textlength(symbol.text, font=font)
+        draw.text(((img.width - tw) / 2, oy + round(bars_h * sy) + 1), symbol.text, fill=0, font=font)
+    buf = io.BytesIO()
+    img.save(buf, format="PNG", optimize=True)
+    return buf.getvalue()
+
+
+# ------------------------------------------------------------ الكاش
+
+class LabelCache:
+    """كاش الصور المولدة: LRU في الذاكرة لكل عملية + ملفات على القرص مشتركة بين العمّال"""
+
+    def __init__(self, cache_dir: Optional[str], memory_items: int = DEFAULT_MEMORY_ITEMS,
+                 max_cache_mb: int = DEFAULT_CACHE_MB):
+        self.cache_dir = cache_dir
+        self.memory_items = max(int(memory_items or 0), 0)
+        self.max_cache_bytes = max(int(max_cache_mb or 0), 0) * 1024 * 1024
+        self._memory: "OrderedDict[str, bytes]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._writes = 0
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], f"{key}.bin")
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            data = self._memory.get(key)
+            if data is not None:
+                self._memory.move_to_end(key)
+                return data
+        if not self.cache_dir or not self.max_cache_bytes:
+            return None
+        try:
+            with open(self._path(key), "rb") as f:
+                data = f.read()
+        except OSError:
+            return None
+        self._remember(key, data)
+        return data
+
+    def _remember(self, key: str, data: bytes) -> None:
+        if not self.memory_items:
+            return
+        with self._lock:
+            self._memory[key] = data
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_items:
+                self._memory.popitem(last=False)
+
+    def put(self, key: str, data: bytes) -> None:
+        self._remember(key, data)
+        if not self.cache_dir or not self.max_cache_bytes or not data:
+            return
+        path = self._path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp = f"{path}.{os.getpid()}.tmp"
+            with open(tmp, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+        except OSError as e:
+            logger.warning(f"⚠️ تعذر حفظ صورة الباركود في الكاش: {e}")
+            return
+        self._writes += 1
+        if self._writes % 200 == 0:
+            self.prune()
+
+    def prune(self) -> None:
+        """حذف الأقدم تعديلاً حتى يعود حجم الكاش تحت LABEL_CACHE_MAX_MB"""
+        files = []
+        for root, _, names in os.walk(self.cache_dir):
+            for name in names:
+                if name.endswith(".bin"):
+                    path = os.path.join(root, name)
+                    try:
+                        st = os.stat(path)
+                    except OSError:
+                        continue
+                    files.append((st.st_mtime, st.st_size, path))
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.max_cache_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+
+
+def get_cache(app=None) -> LabelCache:
+    """كاش التطبيق الحالي (instance/label_cache)؛ خارج سياق Flask كاش ذاكرة فقط"""
+    global _fallback
+    if app is None:
+        try:
+            from flask import current_app
+            app = current_app._get_current_object()
+        except RuntimeError:
+            app = None
+    if app is None:
+        with _INIT_LOCK:
+            if _fallback is None:
+                _fallback = LabelCache(None)
+        return _fallback
+    cache = app.extensions.get("label_cache")
+    if cache is None:
+        with _INIT_LOCK:
+            cache = app.extensions.get("label_cache")
+            if cache is None:
+                cache = LabelCache(
+                    app.config.get("LABEL_CACHE_DIR") or os.path.join(app.instance_path, "label_cache"),
+                    memory_items=app.config.get("LABEL_MEMORY_ITEMS", DEFAULT_MEMORY_ITEMS),
+                    max_cache_mb=app.config.get("LABEL_CACHE_MAX_MB", DEFAULT_CACHE_MB),
+                )
+                app.extensions["label_cache"] = cache
+    return cache
+
+
+def render(code: str, kind: str = "auto", fmt: str = "png", width: int = 300, height: int = 100,
+           border: int = 2) -> bytes:
+    """صورة الرمز (PNG أو SVG) من الكاش بمفتاح (النوع، الرمز، المقاس)، وتُولد مرة واحدة فقط"""
+    kind = symbology(code, kind)
+    fmt = fmt if fmt in FORMATS else "png"
+    key = cache_key("label", _ENCODING_VERSION, kind, code, int(width), int(height), int(border), fmt)
+    cache = get_cache()
+    data = cache.get(key)
+    if data is None:
+        symbol = build_symbol(code, kind, border)
+        data = to_svg(symbol, width, height) if fmt == "svg" else to_png(symbol, width, height)
+        cache.put(key, data)
+    return data
+
+
+def data_uri(code: str, kind: str = "auto", width: int = 300, height: int = 100, fmt: str = "png",
+             border: int = 2) -> str:
+    mime = "image/svg+xml" if fmt == "svg" else "image/png"
+    return f"data:{mime};base64,{base64.b64encode(render(code, kind, fmt, width, height, border)).decode()}"
+
+
+# ------------------------------------------------------------ ورقة الملصقات
+
+def sheet_symbols(codes: Iterable[str], kind: str = "auto") -> Dict[str, dict]:
+    """تعريف <symbol> واحد لكل رمز مختلف؛ الملصقات المكررة تستخدم <use> بلا إعادة توليد"""
+    cache = get_cache()
+    symbols: Dict[str, dict] = {}
+    for code in codes:
+        if not code or code in symbols:
+            continue
+        resolved = symbology(code, kind)
+        key = cache_key("symbol", _ENCODING_VERSION, resolved, code)
+        body = cache.get(key)
+        if body is None:
+            symbol = build_symbol(code, resolved)
+            body = f"{symbol.width} {symbol.height}|{symbol_svg_body(symbol)}".encode("utf-8")
+            cache.put(key, body)
+        viewbox, svg = body.decode("utf-8").split("|", 1)
+        symbols[code] = {"id": f"sym{len(symbols)}", "kind": resolved, "viewbox": f"0 0 {viewbox}", "svg": svg}
+    return symbols
+
+
+def layout_pages(labels: Sequence[dict], columns: int, rows: int) -> List[List[dict]]:
+    per_page = max(int(columns), 1) * max(int(rows), 1)
+    return [list(labels[i:i + per_page]) for i in range(0, len(labels), per_page)]
+
+
+__all__ = [
+    "LabelCache", "Symbol", "build_symbol", "data_uri", "get_cache", "layout_pages", "render",
+    "sheet_symbols", "symbology", "to_png", "to_svg",
+]
@@ -0,0 +1,686 @@
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+import sqlalchemy as sa
+from sqlalchemy import and_, case, func, literal, or_, select, tuple_, union_all
+
+from extensions import db
+from models import (
+    Account, Check, Currency, Customer, Employee, ExchangeTransaction, Expense, ExpenseType,
+    GLBatch, GLEntry, Partner, Payment, PaymentSplit, PreOrder, Product, Sale, SaleReturn,
+    ServiceRequest, StockLevel, Supplier, Warehouse, WarehouseType,
+)
+from services.ledger_service import LedgerCache
+
+
+LEDGER_SKIP_TAG = "[LEDGER_SKIP]"
+DEFAULT_OPENING_DATE = datetime(2024, 1, 1)
+
+# ترتيب الأنواع داخل نفس اللحظة، وهو جزء من مفتاح المؤشر (cursor)
+KIND_RANK = {
+    "opening": 0, "stock": 1, "sale": 2, "sale_return": 3, "expense": 4, "payment": 5,
+    "service": 6, "preorder": 7, "prepaid": 8, "exchange": 9, "manual": 10,
+}
+
+# قيم فلتر transaction_type التي يظهر فيها كل مصدر (نفس سلوك الصفحة السابق)
+SOURCE_FILTERS = {
+    "opening": {"opening"},
+    "sale": {"sale"},
+    "sale_return": {"sale_return", "return"},
+    "expense": {"purchase", "expense"},
+    "payment": {"payment"},
+    "service": {"maintenance", "service", "payment"},
+    "preorder": {"preorder", "prepaid"},
+    "exchange": {"purchase", "exchange"},
+    "manual": {"manual", "journal"},
+}
+
+SORT_COLUMNS = {"debit", "credit", "type", "balance"}
+
+
+def _str(value: str):
+    return literal(value, sa.String)
+
+
+def _concat(*parts):
+    """ربط نصوص بـ || مع تحويل NULL إلى نص فارغ (concat غير متاحة في SQLite)"""
+    expr = _str("")
+    for part in parts:
+        if isinstance(part, str):
+            expr = expr + _str(part)
+        else:
+            expr = expr + func.coalesce(sa.cast(part, sa.String), _str(""))
+    return expr
+
+
+def currency_rates(at: Optional[datetime] = None) -> Dict[str, float]:
+    """سعر التحويل إلى ILS لكل عملة معرفة، باستدعاء واحد لكل عملة وليس لكل سطر"""
+    at = at or datetime.utcnow()
+    rates: Dict[str, float] = {}
+    try:
+        codes = [row[0] for row in db.session.query(Currency.code).filter(Currency.code != "ILS").all()]
+    except Exception:
+        codes = []
+    for code in codes:
+        rate = LedgerCache.get_fx_rate(code, "ILS", at)
+        if rate and rate > 0:
+            rates[code] = float(rate)
+    return rates
+
+
+def ils_rate(currency_col, rates: Dict[str, float], fx_used_col=None):
+    """تعبير SQL لسعر التحويل: ILS=1، ثم fx_rate_used المحفوظ، ثم سعر العملة الحالي"""
+    fallback = case(*[(currency_col == code, rate) for code, rate in rates.items()], else_=1.0) if rates else literal(1.0)
+    whens = [(or_(currency_col.is_(None), currency_col == "ILS"), 1.0)]
+    if fx_used_col is not None:
+        whens.append((fx_used_col > 0, fx_used_col))
+    return case(*whens, else_=fallback)
+
+
+def ils_amount(amount_col, currency_col, rates: Dict[str, float], fx_used_col=None):
+    return sa.cast(func.coalesce(amount_col, 0) * ils_rate(currency_col, rates, fx_used_col), sa.Float)
+
+
+def _row(date, kind, src_id, line_id, entry_type, type_ar, number, entity_name, entity_type,
+         description, search_text, debit, credit, currency, fx):
+    """أعمدة القراءة الموحدة لكل مصدر في الـ UNION"""
+    return [
+        sa.type_coerce(date, sa.DateTime).label("entry_date"),
+        literal(KIND_RANK[kind], sa.Integer).label("kind_rank"),
+        sa.cast(src_id, sa.Integer).label("src_id"),
+        sa.cast(line_id, sa.Integer).label("line_id"),
+        (_str(entry_type) if isinstance(entry_type, str) else entry_type).label("entry_type"),
+        (_str(type_ar) if isinstance(type_ar, str) else type_ar).label("type_ar"),
+        sa.cast(number, sa.String).label("number"),
+        (_str(entity_name) if isinstance(entity_name, str) else entity_name).label("entity_name"),
+        (_str(entity_type) if isinstance(entity_type, str) else entity_type).label("entity_type"),
+        sa.cast(description, sa.String).label("description"),
+        sa.cast(search_text, sa.String).label("search_text"),
+        sa.cast(debit, sa.Float).label("debit"),
+        sa.cast(credit, sa.Float).label("credit"),
+        (_str(currency) if isinstance(currency, str) else currency).label("currency"),
+        sa.cast(fx, sa.Float).label("fx"),
+    ]
+
+
+def _date_range(query, col, from_date, to_date):
+    if from_date:
+        query = query.where(col >= from_date)
+    if to_date:
+        query = query.where(col <= to_date)
+    return query
+
+
+def _sales(from_date, to_date, rates):
+    name = func.coalesce(Customer.name, _str("عميل غير محدد"))
+    amount = ils_amount(Sale.total_amount, Sale.currency, rates, Sale.fx_rate_used)
+    q = select(*_row(
+        Sale.sale_date, "sale", Sale.id, 0, "sale", "مبيعات", _concat("SALE-", Sale.id),
+        name, "عميل", _concat("فاتورة مبيعات - ", name), _concat(Sale.sale_number, " ", Sale.notes),
+        amount, 0.0, Sale.currency, ils_rate(Sale.currency, rates, Sale.fx_rate_used),
+    )).select_from(Sale).outerjoin(Customer, Customer.id == Sale.customer_id).where(Sale.status == "CONFIRMED")
+    return _date_range(q, Sale.sale_date, from_date, to_date)
+
+
+def _sale_returns(from_date, to_date, rates):
+    name = func.coalesce(Customer.name, _str("عميل غير محدد"))
+    amount = ils_amount(SaleReturn.total_amount, SaleReturn.currency, rates, SaleReturn.fx_rate_used)
+    q = select(*_row(
+        SaleReturn.created_at, "sale_return", SaleReturn.id, 0, "sale_return", "مرتجع مبيعات",
+        _concat("RET-", SaleReturn.id), name, "عميل", _concat("مرتجع مبيعات - ", name),
+        _concat(SaleReturn.reason, " ", SaleReturn.notes),
+        0.0, amount, SaleReturn.currency, ils_rate(SaleReturn.currency, rates, SaleReturn.fx_rate_used),
+    )).select_from(SaleReturn).outerjoin(Customer, Customer.id == SaleReturn.customer_id).where(
+        SaleReturn.status == "CONFIRMED", amount > 0,
+    )
+    return _date_range(q, SaleReturn.created_at, from_date, to_date)
+
+
+def _expenses(from_date, to_date, rates):
+    amount = ils_amount(Expense.amount, Expense.currency, rates, Expense.fx_rate_used)
+    type_code = func.upper(func.coalesce(ExpenseType.code, _str("")))
+    payee = func.upper(func.coalesce(Expense.payee_type, _str("")))
+    # مصاريف خدمات الموردين/الشركاء تُسجل مديناً (مستحق لهم يُخصم من رصيدهم)
+    is_service = or_(
+        type_code.in_(["SUPPLIER_EXPENSE", "PARTNER_EXPENSE"]),
+        and_(Expense.supplier_id.isnot(None), payee == "SUPPLIER"),
+        and_(Expense.partner_id.isnot(None), payee == "PARTNER"),
+    )
+    entity_name = func.coalesce(
+        Customer.name, Supplier.name, Partner.name, Employee.name,
+        Expense.paid_to, Expense.payee_name, _str("غير محدد"),
+    )
+    entity_type = case(
+        (Customer.name.isnot(None), _str("عميل")),
+        (Supplier.name.isnot(None), _str("مورد")),
+        (Partner.name.isnot(None), _str("شريك")),
+        (Employee.name.isnot(None), _str("موظف")),
+        (or_(Expense.paid_to.isnot(None), Expense.payee_name.isnot(None)), _str("جهة")),
+        else_=_str(""),
+    )
+    type_name = func.coalesce(ExpenseType.name, _str("مصروف"))
+    q = select(*_row(
+        Expense.date, "expense", Expense.id, 0, "expense", type_name, _concat("EXP-", Expense.id),
+        entity_name, entity_type,
+        func.coalesce(Expense.description, _concat("مصروف - ", type_name)),
+        _concat(Expense.notes, " ", Expense.tax_invoice_number, " ", Expense.check_number, " ", ExpenseType.name),
+        case((is_service, amount), else_=0.0), case((is_service, 0.0), else_=amount),
+        Expense.currency, ils_rate(Expense.currency, rates, Expense.fx_rate_used),
+    )).select_from(Expense).outerjoin(ExpenseType, ExpenseType.id == Expense.type_id).outerjoin(
+        Customer, Customer.id == Expense.customer_id
+    ).outerjoin(Supplier, Supplier.id == Expense.supplier_id).outerjoin(
+        Partner, Partner.id == Expense.partner_id
+    ).outerjoin(Employee, Employee.id == Expense.employee_id)
+    return _date_range(q, Expense.date, from_date, to_date)
+
+
+def check_flags_subquery():
+    """حالة الشيكات لكل دفعة (مباشرة أو عبر PaymentSplit بمرجع PMT-SPLIT-<id>) في استعلام واحد"""
+    direct = select(Check.payment_id.label("payment_id"), Check.status.label("status")).where(
+        Check.payment_id.isnot(None)
+    )
+    via_split = select(PaymentSplit.payment_id.label("payment_id"), Check.status.label("status")).select_from(
+        Check
+    ).join(
+        PaymentSplit,
+        PaymentSplit.id == sa.cast(func.substr(Check.reference_number, 11), sa.Integer),
+    ).where(Check.reference_number.like("PMT-SPLIT-%"))
+    statuses = union_all(direct, via_split).subquery("payment_check_statuses")
+    status = func.upper(func.coalesce(sa.cast(statuses.c.status, sa.String), _str("PENDING")))
+    return select(
+        statuses.c.payment_id,
+        func.count().label("checks"),
+        func.max(case((status.in_(["RETURNED", "BOUNCED"]), 1), else_=0)).label("bounced"),
+        func.max(case((status == "PENDING", 1), else_=0)).label("pending"),
+    ).group_by(statuses.c.payment_id).subquery("payment_check_flags")
+
+
+def _payments(from_date, to_date, rates):
+    flags = check_flags_subquery()
+    has_checks = func.coalesce(flags.c.checks, 0) > 0
+    is_bounced = case(
+        (has_checks, flags.c.bounced == 1),
+        else_=Payment.status == "FAILED",
+    )
+    is_pending = case(
+        (has_checks, and_(flags.c.pending == 1, flags.c.bounced == 0)),
+        else_=Payment.status == "PENDING",
+    )
+    amount = ils_amount(Payment.total_amount, Payment.currency, rates, Payment.fx_rate_used)
+    # الشيك المرتد يعكس اتجاه الدفعة
+    is_debit = case((is_bounced, Payment.direction == "OUT"), else_=Payment.direction != "OUT")
+    entity_name = func.coalesce(Customer.name, Supplier.name, Partner.name, _str("—"))
+    entity_type = case(
+        (Customer.name.isnot(None), _str("عميل")),
+        (Supplier.name.isnot(None), _str("مورد")),
+        (Partner.name.isnot(None), _str("شريك")),
+        else_=_str(""),
+    )
+    is_cheque = func.lower(sa.cast(Payment.method, sa.String)) == "cheque"
+    entry_type = case(
+        (is_bounced, _str("check_bounced")),
+        (and_(is_pending, is_cheque), _str("check_pending")),
+        (Payment.service_id.isnot(None), _str("service_payment")),
+        else_=_str("payment"),
+    )
+    type_ar = case(
+        (is_bounced, _str("شيك مرتد")),
+        (and_(is_pending, is_cheque), _str("شيك معلق")),
+        (Payment.service_id.isnot(None), _str("دفعة صيانة")),
+        else_=_str("دفعة"),
+    )
+    q = select(*_row(
+        Payment.payment_date, "payment", Payment.id, 0, entry_type, type_ar, _concat("PAY-", Payment.id),
+        entity_name, entity_type, _concat("دفعة - ", entity_name),
+        _concat(
+            Payment.payment_number, " ", Payment.receipt_number, " ", Payment.reference, " ",
+            Payment.notes, " ", Payment.check_number, " ", Payment.check_bank, " ", Payment.status,
+        ),
+        case((is_debit, amount), else_=0.0), case((is_debit, 0.0), else_=amount),
+        Payment.currency, ils_rate(Payment.currency, rates, Payment.fx_rate_used),
+    )).select_from(Payment).outerjoin(flags, flags.c.payment_id == Payment.id).outerjoin(
+        Customer, Customer.id == Payment.customer_id
+    ).outerjoin(Supplier, Supplier.id == Payment.supplier_id).outerjoin(
+        Partner, Partner.id == Payment.partner_id
+    ).where(
+        Payment.status.in_(["COMPLETED", "PENDING", "FAILED"]),
+        Payment.expense_id.is_(None),
+    )
+    return _date_range(q, Payment.payment_date, from_date, to_date)
+
+
+def service_total_expr():
+    """total_amount المحفوظ، أو (قطع + عمالة - خصم) مع الضريبة إذا لم يُحفظ"""
+    subtotal = (
+        func.coalesce(ServiceRequest.parts_total, 0)
+        + func.coalesce(ServiceRequest.labor_total, 0)
+        - func.coalesce(ServiceRequest.discount_total, 0)
+    )
+    subtotal = case((subtotal < 0, 0), else_=subtotal)
+    computed = subtotal * (1 + func.coalesce(ServiceRequest.tax_rate, 0) / 100.0)
+    return case((func.coalesce(ServiceRequest.total_amount, 0) > 0, ServiceRequest.total_amount), else_=computed)
+
+
+def _services(from_date, to_date, rates):
+    name = func.coalesce(Customer.name, _str("عميل غير محدد"))
+    total = service_total_expr()
+    notes = func.upper(_concat(
+        ServiceRequest.description, " ", ServiceRequest.engineer_notes, " ",
+        ServiceRequest.notes, " ", ServiceRequest.archive_reason,
+    ))
+    q = select(*_row(
+        ServiceRequest.created_at, "service", ServiceRequest.id, 0, "service", "صيانة",
+        func.coalesce(ServiceRequest.service_number, _concat("SRV-", ServiceRequest.id)),
+        name, "عميل", _concat("صيانة - ", name),
+        _concat(ServiceRequest.vehicle_vrn, " ", ServiceRequest.vehicle_model, " ", ServiceRequest.description),
+        ils_amount(total, ServiceRequest.currency, rates, ServiceRequest.fx_rate_used), 0.0,
+        ServiceRequest.currency, ils_rate(ServiceRequest.currency, rates, ServiceRequest.fx_rate_used),
+    )).select_from(ServiceRequest).outerjoin(Customer, Customer.id == ServiceRequest.customer_id).where(
+        ~notes.like(f"%{LEDGER_SKIP_TAG}%"), total > 0,
+    )
+    return _date_range(q, ServiceRequest.created_at, from_date, to_date)
+
+
+def _preorders(from_date, to_date, rates) -> List[Any]:
+    name = func.coalesce(Customer.name, _str("عميل غير محدد"))
+    product = func.coalesce(Product.name, _str("منتج"))
+    date = func.coalesce(PreOrder.preorder_date, PreOrder.created_at)
+    number = func.coalesce(PreOrder.reference, _concat("PRE-", PreOrder.id))
+    rate = ils_rate(PreOrder.currency, rates, PreOrder.fx_rate_used)
+    total = ils_amount(
+        func.coalesce(Product.price, 0) * PreOrder.quantity * (1 + func.coalesce(PreOrder.tax_rate, 0) / 100.0),
+        PreOrder.currency, rates, PreOrder.fx_rate_used,
+    )
+    prepaid = ils_amount(PreOrder.prepaid_amount, PreOrder.currency, rates, PreOrder.fx_rate_used)
+
+    def _base(*cols):
+        q = select(*cols).select_from(PreOrder).outerjoin(Customer, Customer.id == PreOrder.customer_id).outerjoin(
+            Product, Product.id == PreOrder.product_id
+        ).where(PreOrder.status.notin_(["CANCELLED", "FULFILLED"]))
+        return _date_range(q, PreOrder.preorder_date, from_date, to_date)
+
+    return [
+        _base(*_row(
+            date, "preorder", PreOrder.id, 0, "preorder", "حجز مسبق", number, name, "عميل",
+            _concat("حجز مسبق - ", name, " - ", product), PreOrder.notes, total, 0.0, PreOrder.currency, rate,
+        )).where(total > 0),
+        _base(*_row(
+            date, "prepaid", PreOrder.id, 1, "prepaid", "عربون حجز", number, name, "عميل",
+            _concat("عربون حجز مسبق - ", name), PreOrder.notes, 0.0, prepaid, PreOrder.currency, rate,
+        )).where(prepaid > 0),
+    ]
+
+
+def _exchange(from_date, to_date, rates):
+    supplier = func.coalesce(Supplier.name, _str("مورد غير محدد"))
+    product = func.coalesce(Product.name, _str("منتج"))
+    unit_cost = case(
+        (func.coalesce(ExchangeTransaction.unit_cost, 0) > 0, ExchangeTransaction.unit_cost),
+        else_=func.coalesce(Product.purchase_price, 0),
+    )
+    currency = func.coalesce(Product.currency, _str("ILS"))
+    amount = ils_amount(ExchangeTransaction.quantity * unit_cost, currency, rates)
+    direction = func.upper(sa.cast(ExchangeTransaction.direction, sa.String))
+    incoming = direction.in_(["IN", "PURCHASE", "CONSIGN_IN"])
+    q = select(*_row(
+        ExchangeTransaction.created_at, "exchange", ExchangeTransaction.id, 0,
+        case((incoming, _str("purchase")), else_=_str("return")),
+        case((incoming, _str("توريد")), else_=_str("مرتجع")),
+        _concat("TX-", ExchangeTransaction.id), supplier, "مورد",
+        _concat(
+            case((incoming, _str("توريد ")), else_=_str("مرتجع ")), product, " - ",
+            ExchangeTransaction.quantity, " قطعة - ", supplier,
+        ),
+        ExchangeTransaction.notes,
+        case((incoming, 0.0), else_=amount), case((incoming, amount), else_=0.0),
+        currency, ils_rate(currency, rates),
+    )).select_from(ExchangeTransaction).join(
+        Warehouse, Warehouse.id == ExchangeTransaction.warehouse_id
+    ).outerjoin(Product, Product.id == ExchangeTransaction.product_id).outerjoin(
+        Supplier, Supplier.id == ExchangeTransaction.supplier_id
+    ).where(
+        Warehouse.warehouse_type == WarehouseType.EXCHANGE.value,
+        direction.in_(["IN", "PURCHASE", "CONSIGN_IN", "OUT", "RETURN", "CONSIGN_OUT"]),
+        amount > 0,
+    )
+    return _date_range(q, ExchangeTransaction.created_at, from_date, to_date)
+
+
+def _manual(from_date, to_date, rates):
+    account_name = func.coalesce(Account.name, _concat("حساب ", GLEntry.account))
+    q = select(*_row(
+        GLBatch.posted_at, "manual", GLBatch.id, GLEntry.id, "manual", "قيد يدوي",
+        _concat("MAN-", GLBatch.id), "—", "", _concat(GLBatch.memo, " - ", account_name),
+        _concat(GLEntry.account, " ", GLEntry.ref),
+        func.coalesce(GLEntry.debit, 0), case((func.coalesce(GLEntry.debit, 0) > 0, 0), else_=func.coalesce(GLEntry.credit, 0)),
+        GLEntry.currency, 1.0,
+    )).select_from(GLEntry).join(GLBatch, GLBatch.id == GLEntry.batch_id).outerjoin(
+        Account, Account.code == GLEntry.account
+    ).where(GLBatch.source_type == "MANUAL")
+    return _date_range(q, GLBatch.posted_at, from_date, to_date)
+
+
+def opening_total() -> float:
+    """مجموع الأرصدة الافتتاحية للعملاء والموردين والشركاء (موجب = له علينا)"""
+    row = db.session.query(
+        select(func.coalesce(func.sum(Customer.opening_balance), 0)).scalar_subquery(),
+        select(func.coalesce(func.sum(Supplier.opening_balance), 0)).scalar_subquery(),
+        select(func.coalesce(func.sum(Partner.opening_balance), 0)).scalar_subquery(),
+    ).one()
+    return float(sum(float(v or 0) for v in row))
+
+
+def inventory_value(rates: Dict[str, float]) -> Dict[str, float]:
+    """قيمة المخزون بسعر التكلفة مجمّعة حسب عملة المنتج (سعر صرف واحد لكل عملة)"""
+    rows = (
+        db.session.query(
+            Product.currency,
+            func.sum(StockLevel.quantity * Product.purchase_price),
+            func.sum(StockLevel.quantity),
+            func.count(func.distinct(Product.id)),
+        )
+        .join(StockLevel, StockLevel.product_id == Product.id)
+        .filter(StockLevel.quantity > 0)
+        .group_by(Product.currency)
+        .all()
+    )
+    value = qty = products = 0.0
+    for currency, cost, units, count in rows:
+        rate = 1.0 if not currency or currency == "ILS" else rates.get(currency, 1.0)
+        value += float(cost or 0) * rate
+        qty += float(units or 0)
+        products += int(count or 0)
+    return {"value": value, "qty": int(qty), "products": int(products)}
+
+
+def _literal_row(date, kind, number, type_ar, description, debit, credit):
+    return select(*_row(
+        literal(date, sa.DateTime), kind, literal(0, sa.Integer), literal(0, sa.Integer), "opening", type_ar,
+        _str(number), "—", "", _str(description), _str(""), literal(debit, sa.Float), literal(credit, sa.Float),
+        "ILS", literal(1.0, sa.Float),
+    ))
+
+
+@dataclass
+class JournalQuery:
+    from_date: Optional[datetime] = None
+    to_date: Optional[datetime] = None
+    transaction_type: str = ""
+    search: str = ""
+    sort: str = "date"
+    order: str = "asc"
+
+
+class UnifiedJournal:
+    """قراءة موحدة لدفتر الأستاذ: UNION ALL لكل المصادر بأعمدة مشتركة
+
+    (entry_date, kind_rank, src_id, line_id) مفتاح فريد ومرتب زمنياً يُستخدم
+    للترقيم بالمؤشر. في الترتيب الزمني يُرتكز الرصيد المتراكم على حد الصفحة:
+    مجموع واحد (SUM) لما قبل أول سطر، ثم جمع تراكمي لسطور الصفحة فقط، وشرط
+    المؤشر يُطبق داخل كل مصدر قبل الـ UNION. دالة النافذة SUM() OVER على كامل
+    الدفتر تبقى فقط لترتيب الأعمدة الأخرى (مدين/دائن/نوع/رصيد).
+    """
+
+    def __init__(self, params: JournalQuery, rates: Optional[Dict[str, float]] = None):
+        self.params = params
+        self.rates = rates if rates is not None else currency_rates(params.to_date)
+        self._parts = None
+        self._ledger = None
+
+    def _wanted(self, source: str) -> bool:
+        tt = self.params.transaction_type
+        return not tt or tt in SOURCE_FILTERS[source]
+
+    def selects(self) -> List[Any]:
+        if self._parts is not None:
+            return self._parts
+        p, rates = self.params, self.rates
+        parts = []
+        if self._wanted("opening"):
+            total = opening_total()
+            if total:
+                parts.append(_literal_row(
+                    p.from_date or DEFAULT_OPENING_DATE, "opening", "OPENING-BALANCE", "رصيد افتتاحي",
+                    "الرصيد الافتتاحي الإجمالي (عملاء + موردين + شركاء)",
+                    abs(total) if total < 0 else 0.0, total if total > 0 else 0.0,
+                ))
+        # قيمة المخزون تظهر دائماً بغض النظر عن الفترة والنوع
+        stock = inventory_value(rates)
+        if stock["value"] > 0:
+            parts.append(_literal_row(
+                p.from_date or datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0),
+                "stock", "STOCK-VALUE", "قيمة المخزون",
+                f"قيمة المخزون الحالي ({stock['qty']} قطعة من {stock['products']} منتج)",
+                stock["value"], 0.0,
+            ))
+        if self._wanted("sale"):
+            parts.append(_sales(p.from_date, p.to_date, rates))
+        if self._wanted("sale_return"):
+            parts.append(_sale_returns(p.from_date, p.to_date, rates))
+        if self._wanted("expense"):
+            parts.append(_expenses(p.from_date, p.to_date, rates))
+        if self._wanted("payment"):
+            parts.append(_payments(p.from_date, p.to_date, rates))
+        if self._wanted("service"):
+            parts.append(_services(p.from_date, p.to_date, rates))
+        if self._wanted("preorder"):
+            parts.extend(_preorders(p.from_date, p.to_date, rates))
+        if self._wanted("exchange"):
+            parts.append(_exchange(p.from_date, p.to_date, rates))
+        if self._wanted("manual"):
+            parts.append(_manual(p.from_date, p.to_date, rates))
+        self._parts = parts
+        return parts
+
+    def _journal(self, *bounds: Tuple[str, Tuple], name: str = "journal", search: bool = False,
+                 top: Optional[int] = None):
+        """الـ UNION، مع شروط مفتاح (op, key) مطبقة داخل كل مصدر لتستفيد من فهارس التاريخ
+
+        search يطبق فلتر البحث داخل كل مصدر، وtop يأخذ أول top سطراً من كل مصدر
+        بترتيب الصفحة فيُمسح من كل فهرس مدى الصفحة فقط بدل كامل ما بعد المؤشر.
+        """
+        parts = self.selects()
+        if not parts:
+            return None
+        if bounds or search or top is not None:
+            filtered = []
+            for part in parts:
+                sub = part.subquery()
+                key = tuple_(*self._key(sub))
+                conds = []
+                for op, bound in bounds:
+                    limit = tuple_(*[literal(v) for v in bound])
+                    conds.append({">": key > limit, ">=": key >= limit, "<": key < limit, "<=": key <= limit}[op])
+                cond = self._search(sub) if search else None
+                if cond is not None:
+                    conds.append(cond)
+                query = select(sub).where(*conds)
+                if top is not None:
+                    query = select(query.order_by(*self._chrono_order(sub)).limit(top).subquery())
+                filtered.append(query)
+            parts = filtered
+        return (union_all(*parts) if len(parts) > 1 else parts[0]).subquery(name)
+
+    def _chrono_order(self, table):
+        return [c.desc() if self._desc() else c.asc() for c in self._key(table)]
+
+    def _search(self, table):
+        term = (self.params.search or "").strip().lower()
+        if not term:
+            return None
+        return func.lower(_concat(
+            table.c.number, " ", table.c.entry_type, " ", table.c.type_ar, " ",
+            table.c.entity_name, " ", table.c.entity_type, " ", table.c.description, " ",
+            table.c.search_text, " ", table.c.entry_date,
+        )).like(f"%{term}%")
+
+    def ledger(self):
+        """الـ UNION مع الرصيد المتراكم على كامل الدفتر (لترتيب الأعمدة غير الزمنية فقط)"""
+        if self._ledger is not None:
+            return self._ledger
+        journal = self._journal()
+        if journal is None:
+            self._ledger = False
+            return False
+        chrono = self._key(journal)
+        balance = func.sum(journal.c.debit - journal.c.credit).over(order_by=chrono, rows=(None, 0))
+        ledger = select(journal, balance.label("balance")).subquery("ledger")
+        query = select(ledger)
+        cond = self._search(ledger)
+        if cond is not None:
+            query = query.where(cond)
+        self._ledger = query.subquery("ledger_filtered")
+        return self._ledger
+
+    def _key(self, table):
+        return [table.c.entry_date, table.c.kind_rank, table.c.src_id, table.c.line_id]
+
+    @staticmethod
+    def _row_key(row) -> Tuple:
+        return (row["entry_date"], row["kind_rank"], row["src_id"], row["line_id"])
+
+    def _desc(self) -> bool:
+        return (self.params.order or "asc").lower() == "desc"
+
+    def _chronological(self) -> bool:
+        return self.params.sort not in SORT_COLUMNS
+
+    def _order_by(self, ledger):
+        key = self._key(ledger)
+        sort = self.params.sort if self.params.sort in SORT_COLUMNS else "date"
+        column = {
+            "debit": ledger.c.debit, "credit": ledger.c.credit,
+            "type": ledger.c.type_ar, "balance": ledger.c.balance,
+        }.get(sort)
+        cols = ([column] if column is not None else []) + key
+        return [c.desc() if self._desc() else c.asc() for c in cols]
+
+    def _net(self, *bounds: Tuple[str, Tuple]) -> float:
+        """صافي (مدين - دائن) لسطور الدفتر ضمن حدود المفتاح (بدون فلتر البحث)"""
+        journal = self._journal(*bounds, name="journal_net")
+        if journal is None:
+            return 0.0
+        return float(db.session.execute(
+            select(func.coalesce(func.sum(journal.c.debit - journal.c.credit), 0))
+        ).scalar() or 0)
+
+    def totals(self) -> Dict[str, Any]:
+        journal = self._journal()
+        if journal is None:
+            return {"count": 0, "total_debit": 0.0, "total_credit": 0.0, "final_balance": 0.0}
+        query = select(
+            func.count(), func.coalesce(func.sum(journal.c.debit), 0), func.coalesce(func.sum(journal.c.credit), 0)
+        ).select_from(journal)
+        cond = self._search(journal)
+        if cond is not None:
+            query = query.where(cond)
+        count, debit, credit = db.session.execute(query).one()
+        if cond is None:
+            final = float(debit or 0) - float(credit or 0)
+        else:
+            # رصيد آخر سطر مطابق = مجموع كل الدفتر حتى مفتاحه
+            last = db.session.execute(
+                select(*self._key(journal)).where(cond).order_by(*[c.desc() for c in self._key(journal)]).limit(1)
+            ).first()
+            final = self._net(("<=", tuple(last))) if last else 0.0
+        return {
+            "count": int(count or 0),
+            "total_debit": float(debit or 0),
+            "total_credit": float(credit or 0),
+            "final_balance": final,
+        }
+
+    def page(self, limit: int, offset: int = 0, cursor: Optional[Tuple] = None) -> List[Dict[str, Any]]:
+        """صفحة واحدة؛ في الترتيب الزمني مع cursor يُستخدم keyset بدل OFFSET
+
+        المؤشر يحمل الرصيد عند حده، فيُرتكز عليه رصيد الصفحة التالية بدل جمع كل ما قبلها.
+        """
+        if not self._chronological():
+            ledger = self.ledger()
+            if ledger is False:
+                return []
+            query = select(ledger).order_by(*self._order_by(ledger)).offset(max(0, offset))
+            return [dict(row._mapping) for row in db.session.execute(query.limit(limit))]
+
+        key = tuple(cursor[:4]) if cursor is not None else None
+        offset = 0 if key is not None else max(0, offset)
+        bounds = [("<" if self._desc() else ">", key)] if key is not None else []
+        searched = bool((self.params.search or "").strip())
+        journal = self._journal(*bounds, search=searched, top=offset + limit)
+        if journal is None:
+            return []
+        query = select(journal).order_by(*self._chrono_order(journal)).offset(offset).limit(limit)
+        rows = [dict(row._mapping) for row in db.session.execute(query)]
+        if rows:
+            anchor = cursor[4] if cursor is not None and len(cursor) > 4 else None
+            self._fill_balances(rows, key if anchor is not None else None, anchor, searched=searched)
+        return rows
+
+    def _opening(self, rows: List[Dict[str, Any]], low: Tuple, cursor: Optional[Tuple],
+                 carry: Optional[float], searched: bool) -> float:
+        """الرصيد قبل أقدم سطر في الصفحة (low)، مرتكزاً على الرصيد المحمول في المؤشر إن وُجد
+
+        المحمول تصاعدياً = رصيد سطر المؤشر، وتنازلياً = الرصيد قبله؛ بدون بحث لا
+        يفصل الصفحة عن المؤشر أي سطر فلا يلزم أي استعلام.
+        """
+        if cursor is None:
+            return self._net(("<", low))
+        if self._desc():
+            between = self._net((">=", low), ("<", cursor)) if searched else sum(
+                float(r["debit"] or 0) - float(r["credit"] or 0) for r in rows
+            )
+            return carry - between
+        return carry + self._net((">", cursor), ("<", low)) if searched else carry
+
+    def _fill_balances(self, rows: List[Dict[str, Any]], cursor: Optional[Tuple], anchor: Optional[float],
+                       searched: bool) -> None:
+        """الرصيد المتراكم لسطور الصفحة: رصيد ما قبل أقدم سطر + جمع تراكمي تصاعدي"""
+        chrono = rows[::-1] if self._desc() else rows
+        low, high = self._row_key(chrono[0]), self._row_key(chrono[-1])
+        balance = self._opening(rows, low, cursor, anchor, searched)
+        if not searched:
+            for row in chrono:
+                balance += float(row["debit"] or 0) - float(row["credit"] or 0)
+                row["balance"] = balance
+            return
+        # مع البحث: الرصيد يشمل السطور غير المطابقة الواقعة بين سطور الصفحة
+        journal = self._journal((">=", low), ("<=", high), name="journal_range")
+        wanted = {self._row_key(row): row for row in chrono}
+        for *key, net in db.session.execute(
+            select(*self._key(journal), (journal.c.debit - journal.c.credit).label("net")).order_by(*self._key(journal))
+        ):
+            balance += float(net or 0)
+            row = wanted.get(tuple(key))
+            if row is not None:
+                row["balance"] = balance
+
+    def next_cursor(self, rows: List[Dict[str, Any]], limit: int) -> Optional[str]:
+        """مؤشر الصفحة التالية؛ المؤشر مفتاح زمني فلا معنى له مع ترتيب الأعمدة الأخرى"""
+        if not self._chronological() or len(rows) < limit:
+            return None
+        last = rows[-1]
+        carry = float(last.get("balance") or 0)
+        if self._desc():
+            carry -= float(last["debit"] or 0) - float(last["credit"] or 0)
+        return encode_cursor(last, carry)
+
+
+def encode_cursor(row: Dict[str, Any], carry: Optional[float] = None) -> str:
+    date = row["entry_date"]
+    date = date.isoformat(sep=" ") if isinstance(date, datetime) else str(date)
+    key = f"{date}|{row['kind_rank']}|{row['src_id']}|{row['line_id']}"
+    return key if carry is None else f"{key}|{carry!r}"
+
+
+def decode_cursor(value: str) -> Optional[Tuple]:
+    """(التاريخ، النوع، المصدر، السطر، الرصيد المحمول)؛ المؤشر بلا رصيد يُقبل بأربعة حقول"""
+    try:
+        fields = (value or "").split("|")
+        date, rank, src, line = fields[:4]
+        key = (datetime.fromisoformat(date), int(rank), int(src), int(line))
+        if len(fields) == 5:
+            return key + (float(fields[4]),)
+        return key if len(fields) == 4 else None
+    except (TypeError, ValueError):
+        return None
@@ -0,0 +1,260 @@
+import hashlib
+import io
+import logging
+import multiprocessing
+import os
+import threading
+import zipfile
+from collections import OrderedDict
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Callable, Iterable, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_WORKERS = 2
+DEFAULT_TIMEOUT = 120
+DEFAULT_CACHE_MB = 256
+# المهام المنتهية التي تبقى نتيجتها/خطؤها في الذاكرة لاستعلام poll()
+MAX_FINISHED_JOBS = 64
+
+_INIT_LOCK = threading.Lock()
+
+
+def _write_pdf(html: str, base_url: Optional[str], css: Optional[str]) -> bytes:
+    """يعمل داخل عملية العامل: WeasyPrint يستهلك المعالج بعيداً عن عملية الويب"""
+    from weasyprint import HTML, CSS
+    if css:
+        try:
+            return HTML(string=html, base_url=base_url).write_pdf(stylesheets=[CSS(string=css)])
+        except Exception:
+            logger.exception("pdf.render_with_css_failed")
+    return HTML(string=html, base_url=base_url).write_pdf()
+
+
+def _failed(future: Future) -> bool:
+    return future.cancelled() or future.exception() is not None
+
+
+def cache_key(*parts) -> str:
+    """بصمة SHA-256 لأجزاء المفتاح (عادة محتوى HTML نفسه مع CSS)"""
+    raw = "\x1f".join("" if p is None else (p.isoformat() if hasattr(p, "isoformat") else str(p)) for p in parts)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class PdfRenderer:
+    """توليد PDF عبر مجموعة عمليات WeasyPrint مع كاش على القرص
+
+    الكاش مشترك بين عمّال الويب (ملفات في instance/pdf_cache)، فالمستند الذي
+    لم يتغير لا يُعاد توليده. workers=0 يعني التوليد داخل العملية نفسها.
+    render() ينتظر نتيجة العامل؛ start()/poll() يبدآن التوليد ويعيدان مفتاح
+    المهمة فيستعلم العميل عنه بدل حجز خيط الطلب حتى ينتهي WeasyPrint.
+    """
+
+    def __init__(self, cache_dir: str, workers: int = DEFAULT_WORKERS, timeout: int = DEFAULT_TIMEOUT,
+                 max_cache_mb: int = DEFAULT_CACHE_MB):
+        self.cache_dir = cache_dir
+        self.workers = max(int(workers or 0), 0)
+        self.timeout = max(int(timeout or DEFAULT_TIMEOUT), 1)
+        self.max_cache_bytes = max(int(max_cache_mb or 0), 0) * 1024 * 1024
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+        self._writes = 0
+        self._jobs: "OrderedDict[str, Future]" = OrderedDict()
+
+    # ------------------------------------------------------------ العمّال
+
+    def _pool(self) -> Optional[ProcessPoolExecutor]:
+        if not self.workers:
+            return None
+        with self._lock:
+            if self._executor is None:
+                # لا fork: عملية الويب متعددة الخيوط (SocketIO، المجدول، خيوط التفريغ) ونسخها
+                # مع أقفال محجوزة قد يجمّد العامل. forkserver/spawn يبدآن عمّالاً نظيفة؛
+                # خادم forkserver يحمّل هذه الوحدة فقط بدل __main__، وapp.py لا يبني
+                # التطبيق عند استيراده كـ __mp_main__ داخل العامل.
+                methods = multiprocessing.get_all_start_methods()
+                context = multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+                if context.get_start_method() == "forkserver":
+                    context.set_forkserver_preload([__name__])
+                self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=context)
+            return self._executor
+
+    def _reset_pool(self) -> None:
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+
+    def submit(self, html: str, base_url: Optional[str] = None, css: Optional[str] = None) -> Future:
+        pool = self._pool()
+        if pool is not None:
+            try:
+                return pool.submit(_write_pdf, html, base_url, css)
+            except BrokenProcessPool:
+                self._reset_pool()
+                pool = self._pool()
+                if pool is not None:
+                    return pool.submit(_write_pdf, html, base_url, css)
+        future: Future = Future()
+        try:
+            future.set_result(_write_pdf(html, base_url, css))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+    def shutdown(self) -> None:
+        self._reset_pool()
+
+    # ------------------------------------------------------------ الكاش
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], f"{key}.pdf")
+
+    def cached(self, key: str) -> Optional[bytes]:
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            os.utime(path, None)
+            return data
+        except OSError:
+            return None
+
+    def store(self, key: str, data: bytes) -> None:
+        if not self.max_cache_bytes or not data:
+            return
+        path = self._path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp = f"{path}.{os.getpid()}.tmp"
+            with open(tmp, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+        except OSError as e:
+            logger.warning(f"⚠️ تعذر حفظ PDF في الكاش: {e}")
+            return
+        self._writes += 1
+        if self._writes % 50 == 0:
+            self.prune()
+
+    def prune(self) -> None:
+        """حذف الأقدم استخداماً حتى يعود حجم الكاش تحت PDF_CACHE_MAX_MB"""
+        files = []
+        for root, _, names in os.walk(self.cache_dir):
+            for name in names:
+                if name.endswith(".pdf"):
+                    path = os.path.join(root, name)
+                    try:
+                        st = os.stat(path)
+                    except OSError:
+                        continue
+                    files.append((st.st_mtime, st.st_size, path))
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.max_cache_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+
+    # ------------------------------------------------------------ التوليد
+
+    def render(self, html: str, base_url: Optional[str] = None, css: Optional[str] = None,
+               key: Optional[str] = None) -> bytes:
+        """PDF لمحتوى HTML؛ بدون key يكون المفتاح بصمة المحتوى نفسه"""
+        key = key or cache_key("html", html, css)
+        data = self.cached(key)
+        if data is None:
+            data = self.submit(html, base_url, css).result(timeout=self.timeout)
+            self.store(key, data)
+        return data
+
+    def start(self, html: str, base_url: Optional[str] = None, css: Optional[str] = None) -> str:
+        """بدء توليد PDF دون انتظار وإرجاع مفتاح المهمة (بصمة المحتوى) لاستعلام poll()"""
+        key = cache_key("html", html, css)
+        if os.path.exists(self._path(key)):
+            return key
+        with self._lock:
+            job = self._jobs.get(key)
+            if job is not None and not (job.done() and _failed(job)):
+                return key
+        future = self.submit(html, base_url, css)
+        with self._lock:
+            self._jobs[key] = future
+            self._jobs.move_to_end(key)
+        future.add_done_callback(lambda f: self._finish(key, f))
+        return key
+
+    def _finish(self, key: str, future: Future) -> None:
+        if not _failed(future):
+            self.store(key, future.result())
+        with self._lock:
+            finished = [k for k, f in self._jobs.items() if f.done()]
+            for k in finished[:max(len(finished) - MAX_FINISHED_JOBS, 0)]:
+                self._jobs.pop(k, None)
+
+    def poll(self, key: str) -> Tuple[str, Optional[bytes], Optional[str]]:
+        """حالة مهمة: ready مع PDF، أو pending، أو failed مع الخطأ، أو missing
+
+        النتيجة المحفوظة في الكاش المشترك تُقرأ من أي عامل ويب، أما pending و
+        failed فتعرفهما العملية التي بدأت المهمة فقط.
+        """
+        data = self.cached(key)
+        if data is not None:
+            return "ready", data, None
+        with self._lock:
+            job = self._jobs.get(key)
+        if job is None:
+            return "missing", None, None
+        if not job.done():
+            return "pending", None, None
+        if _failed(job):
+            return "failed", None, "cancelled" if job.cancelled() else str(job.exception())
+        return "ready", job.result(), None
+
+    def render_zip(self, items: Iterable[Tuple[str, str]], base_url: Optional[str] = None,
+                   css: Optional[str] = None) -> bytes:
+        """توليد دفعة مستندات (اسم الملف، HTML) بالتوازي على العمّال وضمها في ZIP"""
+        jobs: List[Tuple[str, str, Optional[bytes], Optional[Future]]] = []
+        for filename, html in items:
+            key = cache_key("html", html, css)
+            data = self.cached(key)
+            jobs.append((filename, key, data, None if data is not None else self.submit(html, base_url, css)))
+        buf = io.BytesIO()
+        with zipfile.ZipFile(buf, "w", zipfile.ZIP_DEFLATED) as zf:
+            for filename, key, data, future in jobs:
+                if future is not None:
+                    try:
+                        data = future.result(timeout=self.timeout)
+                    except Exception as e:
+                        logger.warning(f"⚠️ تعذر توليد {filename}: {e}")
+                        continue
+                    self.store(key, data)
+                zf.writestr(filename, data)
+        return buf.getvalue()
+
+
+def get_renderer(app=None) -> PdfRenderer:
+    """مولّد PDF الخاص بهذه العملية؛ مجموعة العمّال تبدأ عند أول طلب PDF"""
+    if app is None:
+        from flask import current_app
+        app = current_app._get_current_object()
+    renderer = app.extensions.get("pdf_renderer")
+    if renderer is None:
+        with _INIT_LOCK:
+            renderer = app.extensions.get("pdf_renderer")
+            if renderer is None:
+                renderer = PdfRenderer(
+                    app.config.get("PDF_CACHE_DIR") or os.path.join(app.instance_path, "pdf_cache"),
+                    workers=0 if app.config.get("TESTING") else app.config.get("PDF_RENDER_WORKERS", DEFAULT_WORKERS),
+                    timeout=app.config.get("PDF_RENDER_TIMEOUT", DEFAULT_TIMEOUT),
+                    max_cache_mb=app.config.get("PDF_CACHE_MAX_MB", DEFAULT_CACHE_MB),
+                )
+                app.extensions["pdf_renderer"] = renderer
+    return renderer
+
+
+__all__ = ["PdfRenderer", "cache_key", "get_renderer"]
@@ -0,0 +1,768 @@
+import codecs
+import csv
+import logging
+import os
+import re
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence
+
+from sqlalchemy import and_, bindparam, exists, func, insert, or_, select, text as sa_text, update
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH_ROWS = 5000
+DEFAULT_STALE_MINUTES = 30
+ACTIVE_STATUSES = ("QUEUED", "RUNNING")
+
+TEXT_FIELDS = (
+    "name", "sku", "part_number", "brand", "commercial_name", "chassis_number", "serial_no", "barcode",
+    "unit", "category_name", "condition", "origin_country", "dimensions", "image", "online_image",
+)
+MONEY_FIELDS = (
+    "price", "selling_price", "purchase_price", "cost_before_shipping", "cost_after_shipping",
+    "unit_price_before_tax", "min_price", "max_price", "tax_rate", "weight", "online_price",
+)
+INT_FIELDS = ("min_qty", "reorder_point", "warranty_period")
+PRODUCT_FIELDS = TEXT_FIELDS + MONEY_FIELDS + INT_FIELDS
+# أعمدة NOT NULL في products قيمتها الافتراضية صفر عند الإدراج
+ZERO_DEFAULTS = ("price", "selling_price", "purchase_price", "cost_before_shipping", "cost_after_shipping",
+                 "unit_price_before_tax", "tax_rate", "min_qty")
+# الحقول التي يحدّثها الاستيراد مع strategy=update_product (نفس حقول المسار السابق)
+DEFAULT_UPDATE_FIELDS = ("name", "brand", "part_number", "sku", "price", "selling_price", "purchase_price",
+                         "online_price", "min_price", "max_price", "tax_rate", "unit", "category_name")
+CONDITIONS = ("NEW", "USED", "REFURBISHED")
+STRATEGIES = ("skip", "update_product", "stock_only")
+# add: إضافة للكمية الحالية | replace: استبدالها | none: إنشاء صف المخزون الناقص فقط
+STOCK_MODES = {
+    "add": "stock_levels.quantity + excluded.quantity",
+    "replace": "excluded.quantity",
+    "none": "stock_levels.quantity",
+}
+REPORT_COLUMNS = [
+    "action", "strategy", "sku", "name", "product_id", "qty_added", "stock_before", "stock_after",
+    "purchase_price", "selling_price", "min_price", "max_price", "tax_rate", "note",
+]
+
+
+def _utcnow() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+# ------------------------------------------------------------ العناوين والقيم
+
+# أسماء الأعمدة المقبولة في ملفات الاستيراد (عربي/إنجليزي) → حقول Product
+HEADER_ALIASES = {
+    "الاسم": "name",
+    "رقم القطعة": "part_number",
+    "الماركة": "brand",
+    "الاسم التجاري": "commercial_name",
+    "رقم الشاصي": "chassis_number",
+    "الرقم التسلسلي": "serial_no",
+    "الباركود": "barcode",
+    "الوحدة": "unit",
+    "اسم الفئة": "category_name",
+    "سعر الشراء": "purchase_price",
+    "سعر البيع": "selling_price",
+    "التكلفة قبل الشحن": "cost_before_shipping",
+    "التكلفة بعد الشحن": "cost_after_shipping",
+    "سعر الوحدة قبل الضريبة": "unit_price_before_tax",
+    "السعر": "price",
+    "السعر الأساسي": "price",
+    "السعر الأدنى": "min_price",
+    "السعر الأعلى": "max_price",
+    "نسبة الضريبة": "tax_rate",
+    "الحد الأدنى": "min_qty",
+    "نقطة إعادة الطلب": "reorder_point",
+    "بلد المنشأ": "origin_country",
+    "مدة الضمان": "warranty_period",
+    "الوزن": "weight",
+    "الأبعاد": "dimensions",
+    "ملاحظات": "notes",
+    "الكمية": "quantity",
+    "سعر المتجر الإلكتروني": "online_price",
+    "صورة المتجر الإلكتروني": "online_image",
+    "name": "name",
+    "brand": "brand",
+    "part_number": "part_number",
+    "part-number": "part_number",
+    "part no": "part_number",
+    "partno": "part_number",
+    "sku": "sku",
+    "code": "sku",
+    "commercial_name": "commercial_name",
+    "chassis_number": "chassis_number",
+    "serial_no": "serial_no",
+    "barcode": "barcode",
+    "unit": "unit",
+    "category_name": "category_name",
+    "purchase_price": "purchase_price",
+    "cost": "purchase_price",
+    "selling_price": "selling_price",
+    "sell": "selling_price",
+    "cost_before_shipping": "cost_before_shipping",
+    "cost_after_shipping": "cost_after_shipping",
+    "unit_price_before_tax": "unit_price_before_tax",
+    "price": "price",
+    "min_price": "min_price",
+    "max_price": "max_price",
+    "tax_rate": "tax_rate",
+    "min_qty": "min_qty",
+    "reorder_point": "reorder_point",
+    "origin_country": "origin_country",
+    "warranty_period": "warranty_period",
+    "weight": "weight",
+    "dimensions": "dimensions",
+    "notes": "notes",
+    "quantity": "quantity",
+    "qty": "quantity",
+    "online_price": "online_price",
+    "online image": "online_image",
+    "online_image": "online_image",
+}
+
+_CURRENCY_RE = re.compile(r"[\s\$\£\€\¥\₺\₪\﷼\₽\₹\₩\₴\₦\₫\฿]+")
+
+
+def load_openpyxl():
+    # استيراد openpyxl عند أول رفع XLSX فقط (يكلف ~0.2 ثانية عند الإقلاع)
+    try:
+        import openpyxl
+    except Exception:
+        return None
+    return openpyxl
+
+
+def normalize_header(h: str) -> str:
+    if not h:
+        return ""
+    s = str(h).strip().lower()
+    s = s.replace(" ", "_").replace("-", "_")
+    s = re.sub(r"_+", "_", s).strip("_")
+    return HEADER_ALIASES.get(s, s)
+
+
+def clean_numeric(v):
+    if v in (None, "", "None"):
+        return None
+    if isinstance(v, (int, float, Decimal)):
+        try:
+            return Decimal(str(v))
+        except Exception:
+            return None
+    s = str(v)
+    trans = str.maketrans("٠١٢٣٤٥٦٧٨٩٬٫", "0123456789,.")
+    s = s.translate(trans)
+    s = _CURRENCY_RE.sub("", s).replace(",", "").strip()
+    try:
+        return Decimal(s)
+    except Exception:
+        return None
+
+
+def clean_int(v):
+    if v in (None, "", "None"):
+        return None
+    try:
+        return int(float(str(v).translate(str.maketrans("٠١٢٣٤٥٦٧٨٩", "0123456789"))))
+    except Exception:
+        return None
+
+
+# ------------------------------------------------------------ القراءة المتدفقة
+
+def _sniff_encoding(path: str) -> str:
+    with open(path, "rb") as f:
+        head = f.read(64 * 1024)
+    for enc in ("utf-8-sig", "utf-8", "cp1256"):
+        try:
+            codecs.getincrementaldecoder(enc)().decode(head, final=False)
+            return enc
+        except UnicodeDecodeError:
+            continue
+    return "latin-1"
+
+
+def iter_csv(path: str) -> Iterator[dict]:
+    """صفوف CSV كقواميس بعناوين موحدة، صفاً صفاً دون تحميل الملف في الذاكرة"""
+    with open(path, "r", encoding=_sniff_encoding(path), errors="replace", newline="") as f:
+        reader = csv.reader(f)
+        header = next(reader, None)
+        if not header:
+            return
+        keys = [normalize_header(h) for h in header]
+        for row in reader:
+            if any(v.strip() for v in row):
+                yield dict(zip(keys, row))
+
+
+def iter_xlsx(path: str) -> Iterator[dict]:
+    """صفوف XLSX عبر openpyxl بوضع read_only (الورقة لا تُحمّل كاملة)"""
+    openpyxl = load_openpyxl()
+    if not openpyxl:
+        raise RuntimeError("XLSX غير مدعوم: الرجاء تثبيت openpyxl أو ارفع CSV.")
+    wb = openpyxl.load_workbook(path, data_only=True, read_only=True)
+    try:
+        rows = wb.active.iter_rows(values_only=True)
+        header = next(rows, None)
+        if not header:
+            return
+        keys = [normalize_header(x if x is not None else "") for x in header]
+        for row in rows:
+            if row is None or all(v is None or (isinstance(v, str) and not v.strip()) for v in row):
+                continue
+            yield {(keys[j] if j < len(keys) else f"col_{j}"): v for j, v in enumerate(row)}
+    finally:
+        wb.close()
+
+
+def iter_file(path: str) -> Iterator[dict]:
+    ext = os.path.splitext(path)[1].lower()
+    if ext == ".xlsx":
+        return iter_xlsx(path)
+    if ext == ".xls":
+        raise RuntimeError("صيغة .xls غير مدعومة. الرجاء رفع .xlsx أو .csv.")
+    return iter_csv(path)
+
+
+# ------------------------------------------------------------ التحقق بالأعمدة
+
+def _text(v) -> Optional[str]:
+    if v is None:
+        return None
+    if isinstance(v, float) and v.is_integer():
+        v = int(v)
+    v = str(v).strip()
+    return v or None
+
+
+def _text_limits() -> Dict[str, int]:
+    from models import Product
+    return {f: Product.__table__.c[f].type.length for f in TEXT_FIELDS if f != "condition"}
+
+
+def validate_batch(rows: Sequence[dict], first_rownum: int, run_id: int, require_name: bool = True) -> List[dict]:
+    """تنظيف دفعة صفوف عموداً عموداً ثم بناء صفوف الـ staging بنفس قواعد Product validators
+
+    الأخطاء لا توقف الاستيراد: الصف يُعلَّم action=skip/error مع note ويظهر في التقرير.
+    """
+    from barcodes import normalize_barcode
+
+    cols: Dict[str, list] = {f: [_text(r.get(f)) for r in rows] for f in TEXT_FIELDS}
+    for f in MONEY_FIELDS:
+        cols[f] = [clean_numeric(r.get(f)) for r in rows]
+    for f in INT_FIELDS + ("quantity",):
+        cols[f] = [clean_int(r.get(f)) for r in rows]
+
+    # المعرفات: SKU من رقم القطعة عند غيابه، وتوحيد الحالة كما في Product
+    cols["sku"] = [(s or p).upper() if (s or p) else None for s, p in zip(cols["sku"], cols["part_number"])]
+    cols["serial_no"] = [s.upper() if s else None for s in cols["serial_no"]]
+    cols["barcode"] = [normalize_barcode(b) if b else None for b in cols["barcode"]]
+    cols["condition"] = [(c or "NEW").upper() for c in cols["condition"]]
+    cols["price"] = [p if p is not None else s for p, s in zip(cols["price"], cols["selling_price"])]
+    cols["selling_price"] = [s if s is not None else p for s, p in zip(cols["selling_price"], cols["price"])]
+
+    limits = _text_limits()
+    out = []
+    for i in range(len(rows)):
+        row = {f: cols[f][i] for f in PRODUCT_FIELDS}
+        row.update(
+            run_id=run_id,
+            rownum=first_rownum + i,
+            action=None,
+            note=None,
+            product_id=None,
+            quantity=max(cols["quantity"][i] or 0, 0),
+            stock_before=None,
+            sku_key=row["sku"].lower() if row["sku"] else None,
+            part_key=row["part_number"].upper() if row["part_number"] else None,
+            serial_key=row["serial_no"].lower() if row["serial_no"] else None,
+        )
+        note = None
+        if not row["name"] and require_name:
+            row["action"], note = "skip", "missing_name"
+        elif row["condition"] not in CONDITIONS:
+            note = "invalid_condition"
+        else:
+            for f in MONEY_FIELDS:
+                v = row[f]
+                if v is not None and (not v.is_finite() or v < 0 or (f == "tax_rate" and v > 100)):
+                    note = f"invalid_{f}"
+                    break
+            for f in INT_FIELDS:
+                if note is None and row[f] is not None and row[f] < 0:
+                    note = f"invalid_{f}"
+            for f, limit in limits.items():
+                if note is None and limit and row[f] and len(row[f]) > limit:
+                    note = f"too_long_{f}"
+        if note and not row["action"]:
+            row["action"] = "error"
+        row["note"] = note
+        out.append(row)
+    return out
+
+
+def _insert_values(row, default_image: Optional[str], now: datetime) -> dict:
+    """قيم صف products الجديد مع منطق _product_before_save (الأسعار وحدود السعر والصورة)"""
+    v = {f: row[f] for f in PRODUCT_FIELDS}
+    for f in ZERO_DEFAULTS:
+        if v[f] is None:
+            v[f] = Decimal("0") if f != "min_qty" else 0
+    if v["selling_price"] == 0 and v["price"] > 0:
+        v["selling_price"] = v["price"]
+    if v["price"] == 0 and v["selling_price"] > 0:
+        v["price"] = v["selling_price"]
+    if v["min_price"] is not None and v["max_price"] is not None:
+        if v["min_price"] > v["max_price"]:
+            v["min_price"], v["max_price"] = v["max_price"], v["min_price"]
+        v["price"] = min(max(v["price"], v["min_price"]), v["max_price"])
+    v["image"] = v["image"] or default_image
+    v.update(is_active=True, is_digital=False, is_exchange=False, is_published=True, currency="ILS",
+             created_at=now, updated_at=now)
+    return v
+
+
+# ------------------------------------------------------------ المحرك
+
+class ProductImporter:
+    """استيراد منتجات بالدفعات: قراءة متدفقة ← تحقق بالأعمدة ← staging ← upsert مجمّع
+
+    كل دفعة تُكتب في product_import_staging وتُثبّت مع تقدم ImportRun، ثم
+    تتم المطابقة والتصنيف بعبارات UPDATE على الجدول كله، والترحيل إلى
+    products/stock_levels في معاملة واحدة دون مستمعي ORM لكل صف.
+    """
+
+    def __init__(self, session, run, warehouse_id: int, strategy: str = "skip", stock_mode: str = "add",
+                 match_on: Sequence[str] = ("sku", "part_number"), update_fields: Sequence[str] = DEFAULT_UPDATE_FIELDS,
+                 require_name: bool = True, stock_all_rows: bool = False, activate: bool = False,
+                 dry_run: bool = False, batch_rows: Optional[int] = None):
+        if strategy not in STRATEGIES:
+            raise ValueError(f"استراتيجية غير معروفة: {strategy}")
+        if stock_mode not in STOCK_MODES:
+            raise ValueError(f"وضع مخزون غير معروف: {stock_mode}")
+        self.session = session
+        self.run = run
+        self.warehouse_id = warehouse_id
+        self.strategy = strategy
+        self.stock_mode = stock_mode
+        self.match_on = tuple(match_on)
+        self.update_fields = tuple(update_fields)
+        self.require_name = require_name
+        self.stock_all_rows = stock_all_rows
+        self.activate = activate
+        self.dry_run = dry_run
+        self.problems: List[dict] = []
+        self.batch_rows = max(int(batch_rows or self._config("IMPORT_BATCH_ROWS", DEFAULT_BATCH_ROWS)), 1)
+
+        from models import Product, ProductCategory, ProductImportStaging
+        self.S = ProductImportStaging.__table__
+        self.P = Product.__table__
+        self.C = ProductCategory.__table__
+
+    @staticmethod
+    def _config(key, default=None):
+        try:
+            from flask import current_app
+            return current_app.config.get(key, default)
+        except Exception:
+            return default
+
+    # -------------------------------------------------------- التقدم
+
+    def _progress(self, stage: str, status: str = "RUNNING") -> None:
+        self.run.stage = stage
+        self.run.status = status
+        self.session.commit()
+
+    @property
+    def _rows(self):
+        return self.S.c.run_id == self.run.id
+
+    # -------------------------------------------------------- المراحل
+
+    def load(self, rows: Iterable[dict]) -> int:
+        """قراءة المصدر بدفعات batch_rows: تحقق ثم إدراج في staging وتثبيت التقدم"""
+        total = 0
+        batch: List[dict] = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= self.batch_rows:
+                total = self._stage_batch(batch, total)
+                batch = []
+        if batch:
+            total = self._stage_batch(batch, total)
+        return total
+
+    def _stage_batch(self, batch: List[dict], done: int) -> int:
+        staged = validate_batch(batch, done + 1, self.run.id, self.require_name)
+        self.session.execute(insert(self.S), staged)
+        self.run.processed = done + len(batch)
+        self.session.commit()
+        return self.run.processed
+
+    def _match_keys(self):
+        """(عمود staging، التعبير المقابل في products) - lower() يطابق فهارس uq_products_*_ci"""
+        S, P = self.S, self.P
+        return {
+            "sku": (S.c.sku_key, func.lower(P.c.sku)),
+            "part_number": (S.c.part_key, func.upper(P.c.part_number)),
+            "barcode": (S.c.barcode, P.c.barcode),
+            "serial_no": (S.c.serial_key, func.lower(P.c.serial_no)),
+        }
+
+    def match(self) -> None:
+        """ربط الصفوف بالمنتجات الموجودة وتصنيفها insert/update/skip/error بعبارات مجمّعة"""
+        S, P = self.S, self.P
+        keys = self._match_keys()
+        pending = and_(self._rows, S.c.action.is_(None))
+
+        for field in self.match_on:
+            key, prod_key = keys[field]
+            found = (
+                select(prod_key.label("k"), func.min(P.c.id).label("pid"))
+                .where(prod_key.isnot(None))
+                .group_by(prod_key)
+                .subquery()
+            )
+            self.session.execute(
+                update(S)
+                .where(pending, S.c.product_id.is_(None), key == found.c.k)
+                .values(product_id=found.c.pid)
+            )
+
+        matched = and_(pending, S.c.product_id.isnot(None))
+        unmatched = and_(pending, S.c.product_id.is_(None))
+        unique_keys = ("sku", "barcode", "serial_no")
+
+        if self.strategy == "skip":
+            self.session.execute(update(S).where(matched).values(action="skip"))
+        else:
+            if self.strategy == "update_product":
+                for field in unique_keys:
+                    key, prod_key = keys[field]
+                    taken = exists().where(prod_key == key, P.c.id != S.c.product_id)
+                    self.session.execute(
+                        update(S).where(matched, key.isnot(None), taken)
+                        .values(action="error", note=f"duplicate_{field}_update")
+                    )
+            self.session.execute(update(S).where(matched).values(action="update"))
+
+        self.session.execute(
+            update(S).where(unmatched, S.c.name.is_(None)).values(action="skip", note="missing_name")
+        )
+        for field in unique_keys:
+            key, prod_key = keys[field]
+            self.session.execute(
+                update(S).where(unmatched, key.isnot(None), exists().where(prod_key == key))
+                .values(action="error", note=f"duplicate_{field}")
+            )
+        # التكرار داخل الملف نفسه: أول صف فقط يُدرج
+        S2 = S.alias("s2")
+        for field in unique_keys:
+            key = keys[field][0]
+            key2 = S2.c[key.name]
+            first = (
+                select(func.min(S2.c.id))
+                .where(S2.c.run_id == self.run.id, S2.c.product_id.is_(None), key2.isnot(None))
+                .group_by(key2)
+            )
+            self.session.execute(
+                update(S).where(unmatched, key.isnot(None), S.c.id.notin_(first))
+                .values(action="error", note=f"duplicate_{field}_in_file")
+            )
+        self.session.execute(update(S).where(unmatched).values(action="insert"))
+
+    def _insert_products(self) -> None:
+        S, P = self.S, self.P
+        default_image = self._config("DEFAULT_PRODUCT_IMAGE")
+        link = update(S).where(S.c.id == bindparam("sid")).values(product_id=bindparam("pid"))
+        last = 0
+        while True:
+            rows = self.session.execute(
+                select(S.c.id, *[S.c[f] for f in PRODUCT_FIELDS])
+                .where(self._rows, S.c.action == "insert", S.c.id > last)
+                .order_by(S.c.id)
+                .limit(self.batch_rows)
+            ).mappings().all()
+            if not rows:
+                return
+            last = rows[-1]["id"]
+            now = _utcnow()
+            ids = self.session.execute(
+                insert(P).returning(P.c.id, sort_by_parameter_order=True),
+                [_insert_values(r, default_image, now) for r in rows],
+            ).scalars().all()
+            self.session.execute(link, [{"sid": r["id"], "pid": pid} for r, pid in zip(rows, ids)])
+
+    def _update_products(self) -> None:
+        S, P = self.S, self.P
+        latest = select(func.max(S.c.id)).where(self._rows, S.c.action == "update").group_by(S.c.product_id)
+        src = select(S).where(S.c.id.in_(latest)).subquery()
+        values = {f: func.coalesce(src.c[f], P.c[f]) for f in self.update_fields}
+        if self.activate:
+            values["is_active"] = True
+        if not values:
+            return
+        values["updated_at"] = _utcnow()
+        self.session.execute(update(P).where(P.c.id == src.c.product_id).values(**values))
+
+    def _touched(self, actions=("insert", "update")):
+        return select(self.S.c.product_id).where(self._rows, self.S.c.action.in_(actions))
+
+    def _fix_prices(self) -> None:
+        """نفس قواعد _product_before_save للمنتجات المحدثة، كعبارات على المجموعة"""
+        P = self.P
+        touched = P.c.id.in_(self._touched(("update",)))
+        s = self.session
+        if s.get_bind().dialect.name == "sqlite":
+            clamped = func.min(func.max(P.c.price, P.c.min_price), P.c.max_price)
+        else:
+            clamped = func.least(func.greatest(P.c.price, P.c.min_price), P.c.max_price)
+        s.execute(update(P).where(touched, P.c.selling_price == 0, P.c.price > 0).values(selling_price=P.c.price))
+        s.execute(update(P).where(touched, P.c.price == 0, P.c.selling_price > 0).values(price=P.c.selling_price))
+        s.execute(
+            update(P).where(touched, P.c.min_price > P.c.max_price)
+            .values(min_price=P.c.max_price, max_price=P.c.min_price)
+        )
+        s.execute(
+            update(P).where(touched, P.c.min_price.isnot(None), P.c.max_price.isnot(None),
+                            or_(P.c.price < P.c.min_price, P.c.price > P.c.max_price))
+            .values(price=clamped)
+        )
+
+    def _assign_categories(self) -> None:
+        S, P, C = self.S, self.P, self.C
+        actions = ("insert", "update") if self.strategy == "update_product" and "category_name" in self.update_fields else ("insert",)
+        names = self.session.execute(
+            select(func.min(S.c.category_name))
+            .where(self._rows, S.c.action.in_(actions), S.c.category_name.isnot(None))
+            .group_by(func.lower(S.c.category_name))
+        ).scalars().all()
+        if not names:
+            return
+        existing = set(self.session.execute(select(func.lower(C.c.name)).where(C.c.name.isnot(None))).scalars())
+        missing = [n for n in names if n.lower() not in existing]
+        if missing:
+            now = _utcnow()
+            self.session.execute(insert(C), [{"name": n, "created_at": now, "updated_at": now} for n in missing])
+        category_id = select(func.min(C.c.id)).where(func.lower(C.c.name) == func.lower(P.c.category_name)).scalar_subquery()
+        self.session.execute(
+            update(P)
+            .where(P.c.category_id.is_(None), P.c.category_name.isnot(None), P.c.id.in_(self._touched(actions)))
+            .values(category_id=category_id)
+        )
+
+    def _upsert_stock(self) -> None:
+        params = {"r": self.run.id, "w": self.warehouse_id, "now": _utcnow()}
+        qty_filter = "" if self.stock_all_rows else " AND quantity > 0"
+        self.session.execute(sa_text(
+            "UPDATE product_import_staging SET stock_before = COALESCE(("
+            "SELECT quantity FROM stock_levels WHERE stock_levels.product_id = product_import_staging.product_id "
+            "AND stock_levels.warehouse_id = :w), 0) "
+            "WHERE run_id = :r AND action IN ('insert', 'update')"
+        ), params)
+        self.session.execute(sa_text(
+            "INSERT INTO stock_levels (product_id, warehouse_id, quantity, reserved_quantity, created_at, updated_at) "
+            "SELECT product_id, :w, SUM(quantity), 0, :now, :now FROM product_import_staging "
+            f"WHERE run_id = :r AND action IN ('insert', 'update') AND product_id IS NOT NULL{qty_filter} "
+            "GROUP BY product_id "
+            "ON CONFLICT (product_id, warehouse_id) DO UPDATE SET "
+            f"quantity = {STOCK_MODES[self.stock_mode]}, updated_at = excluded.updated_at"
+        ), params)
+        from services.stock_totals import refresh_selected
+        S = self.S
+        refresh_selected(self.session.connection(), select(S.c.product_id).where(
+            self._rows, S.c.action.in_(("insert", "update")), S.c.product_id.isnot(None)
+        ))
+
+    def apply(self) -> None:
+        """ترحيل الصفوف المصنفة إلى products وstock_levels (تُثبّت مع آخر مرحلة)"""
+        self._insert_products()
+        if self.strategy == "update_product" or self.activate:
+            self._update_products()
+            self._fix_prices()
+        self._assign_categories()
+        self._upsert_stock()
+
+    def collect_problems(self, limit: int = 50) -> List[dict]:
+        """أول الصفوف المتخطاة/الخاطئة (قبل حذف staging) لعرضها في الاستجابة"""
+        S = self.S
+        self.problems = [dict(r) for r in self.session.execute(
+            select(S.c.rownum, S.c.sku, S.c.barcode, S.c.name, S.c.action, S.c.note)
+            .where(self._rows, S.c.action.in_(("skip", "error")))
+            .order_by(S.c.rownum)
+            .limit(limit)
+        ).mappings()]
+        return self.problems
+
+    def counts(self) -> Dict[str, int]:
+        S = self.S
+        by_action = dict(self.session.execute(
+            select(S.c.action, func.count()).where(self._rows).group_by(S.c.action)
+        ).all())
+        return {
+            "inserted": by_action.get("insert", 0),
+            "updated": by_action.get("update", 0),
+            "skipped": by_action.get("skip", 0),
+            "errors": by_action.get("error", 0),
+        }
+
+    def write_report(self, path: str) -> str:
+        """تقرير CSV لكل صف (نفس أعمدة التقرير السابق) يُكتب بدفعات من staging"""
+        S = self.S
+        stock = sa_text("SELECT product_id, quantity FROM stock_levels WHERE warehouse_id = :w AND product_id IN :ids").bindparams(
+            bindparam("ids", expanding=True)
+        )
+        tmp = f"{path}.tmp"
+        with open(tmp, "w", encoding="utf-8-sig", newline="") as f:
+            w = csv.DictWriter(f, fieldnames=REPORT_COLUMNS)
+            w.writeheader()
+            last = 0
+            while True:
+                rows = self.session.execute(
+                    select(S).where(self._rows, S.c.id > last).order_by(S.c.id).limit(self.batch_rows)
+                ).mappings().all()
+                if not rows:
+                    break
+                last = rows[-1]["id"]
+                ids = sorted({r["product_id"] for r in rows if r["product_id"]})
+                after = dict(self.session.execute(stock, {"w": self.warehouse_id, "ids": ids}).all()) if ids else {}
+                for r in rows:
+                    applied = r["action"] in ("insert", "update")
+                    added = r["quantity"] if applied and (self.stock_all_rows or r["quantity"] > 0) else 0
+                    w.writerow({
+                        "action": r["action"],
+                        "strategy": self.strategy,
+                        "sku": r["sku"] or "",
+                        "name": r["name"] or "",
+                        "product_id": r["product_id"] or "",
+                        "qty_added": added,
+                        "stock_before": r["stock_before"] or 0,
+                        "stock_after": after.get(r["product_id"], r["stock_before"] or 0) if applied else 0,
+                        "purchase_price": float(r["purchase_price"] or 0),
+                        "selling_price": float(r["selling_price"] or 0),
+                        "min_price": float(r["min_price"] or 0),
+                        "max_price": float(r["max_price"] or 0),
+                        "tax_rate": float(r["tax_rate"] or 0),
+                        "note": r["note"] or "",
+                    })
+        os.replace(tmp, path)
+        return path
+
+    def cleanup(self) -> None:
+        self.session.execute(self.S.delete().where(self._rows))
+
+    def execute(self, rows: Iterable[dict], report_path: Optional[str] = None) -> Dict[str, int]:
+        """تشغيل كل المراحل وتسجيل التقدم والنتيجة في ImportRun"""
+        t0 = time.perf_counter()
+        run = self.run
+        try:
+            self._progress("read")
+            self.load(rows)
+            self._progress("match")
+            self.match()
+            counts = self.counts()
+            self.collect_problems()
+            if not self.dry_run:
+                self._progress("apply")
+                self.apply()
+                self._progress("report")
+                if report_path:
+                    run.report_path = self.write_report(report_path)
+            self.cleanup()
+            for key, value in counts.items():
+                setattr(run, key, value)
+            run.duration_ms = int((time.perf_counter() - t0) * 1000)
+            run.finished_at = _utcnow()
+            self._progress("done", status="DONE")
+            return counts
+        except Exception as e:
+            self.session.rollback()
+            run.status = "FAILED"
+            run.notes = str(e)[:255]
+            run.finished_at = _utcnow()
+            run.duration_ms = int((time.perf_counter() - t0) * 1000)
+            try:
+                self.cleanup()
+                self.session.commit()
+            except Exception:
+                self.session.rollback()
+            raise
+
+
+def fail_stale_runs(session, stale_minutes: int = DEFAULT_STALE_MINUTES, run_ids: Optional[Sequence[int]] = None) -> int:
+    """تعليم العمليات المنقطعة FAILED
+
+    الخيط الخلفي لا ينجو من إعادة تشغيل العملية، فيبقى ImportRun على QUEUED/RUNNING للأبد.
+    كل دفعة وكل مرحلة تُثبّت فتحرّك updated_at، فالعملية التي لم يتحرك updated_at لها
+    منذ stale_minutes لم يعد أحد يعمل عليها (حتى مع عدة عمليات خادم تتشارك القاعدة).
+    """
+    from models import ImportRun
+
+    now = _utcnow()
+    stmt = (
+        update(ImportRun.__table__)
+        .where(
+            ImportRun.__table__.c.status.in_(ACTIVE_STATUSES),
+            ImportRun.__table__.c.updated_at < now - timedelta(minutes=stale_minutes),
+        )
+        .values(status="FAILED", notes="انقطع الاستيراد قبل اكتماله (أُعيد تشغيل الخادم؟)", finished_at=now, updated_at=now)
+    )
+    if run_ids is not None:
+        stmt = stmt.where(ImportRun.__table__.c.id.in_(list(run_ids)))
+    n = session.execute(stmt).rowcount or 0
+    session.commit()
+    if n:
+        logger.warning("product_import.stale_runs_failed count=%s", n)
+    return n
+
+
+def start_import(app, run_id: int, path: str, *, delete_file: bool = True, report_path: Optional[str] = None,
+                 **options) -> Optional[threading.Thread]:
+    """تشغيل استيراد ملف في خيط خلفي (أو مباشرة مع TESTING / IMPORT_BACKGROUND=False)"""
+
+    def _work(own_session: bool):
+        from extensions import db
+        from models import ImportRun
+        run = None
+        try:
+            run = db.session.get(ImportRun, run_id)
+            if run is None:
+                return
+            ProductImporter(db.session, run, **options).execute(iter_file(path), report_path=report_path)
+        except Exception as e:
+            logger.exception("product_import.failed run=%s", run_id)
+            if run is not None and run.status not in ("DONE", "FAILED"):
+                try:
+                    run.status, run.notes, run.finished_at = "FAILED", str(e)[:255], _utcnow()
+                    db.session.commit()
+                except Exception:
+                    db.session.rollback()
+        finally:
+            if delete_file:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            if own_session:
+                db.session.remove()
+
+    if app.config.get("TESTING") or not app.config.get("IMPORT_BACKGROUND", True):
+        _work(False)
+        return None
+
+    def _thread():
+        with app.app_context():
+            _work(True)
+
+    t = threading.Thread(target=_thread, name=f"product-import-{run_id}", daemon=True)
+    t.start()
+    return t
+
+
+__all__ = [
+    "ProductImporter", "iter_file", "iter_csv", "iter_xlsx", "validate_batch", "start_import", "fail_stale_runs",
+    "normalize_header", "clean_numeric", "clean_int", "load_openpyxl",
+]
@@ -0,0 +1,282 @@
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional
+
+from sqlalchemy import inspect as sa_inspect, text as sa_text
+
+from extensions import db
+
+
+logger = logging.getLogger(__name__)
+
+LEASE_NAME = "scheduler"
+DEFAULT_LEASE_TTL = 90
+DEFAULT_LEASE_RENEW = 30
+DEFAULT_JOB_STALE_SECONDS = 6 * 3600
+DEFAULT_HISTORY_DAYS = 30
+
+
+class LeaderLease:
+    """انتخاب قائد عبر صف في جدول scheduler_leases
+
+    كل عملية تجدد العقد دورياً، والعقد ينتقل لعملية أخرى فقط بعد انتهاء
+    صلاحيته (SCHEDULER_LEASE_TTL). إذا لم يكن الجدول موجوداً بعد (قبل
+    تشغيل الترحيل) يُستخدم قفل ملف في مجلد instance كبديل على نفس الخادم؛
+    أي خطأ آخر أثناء التجديد يعني التنحي حتى التجديد التالي.
+    """
+
+    def __init__(self, app, name: str = LEASE_NAME, ttl: Optional[int] = None):
+        self.app = app
+        self.name = name
+        self.ttl = int(ttl or app.config.get("SCHEDULER_LEASE_TTL", DEFAULT_LEASE_TTL))
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._is_leader = False
+        self._file_lock = None
+        self._lock = threading.Lock()
+
+    @property
+    def is_leader(self) -> bool:
+        return self._is_leader
+
+    def renew(self) -> bool:
+        with self._lock:
+            was_leader = self._is_leader
+            try:
+                self._is_leader = self._renew_db()
+                self._drop_file_lock()
+            except Exception as exc:
+                if self._lease_table_missing():
+                    self._is_leader = self._renew_file(exc)
+                else:
+                    # خطأ عابر (قاعدة مقفلة/انقطاع اتصال): التنحي أسلم من قائدين معاً
+                    logger.warning("Scheduler lease renewal failed (%s); stepping down", exc)
+                    self._is_leader = False
+            if self._is_leader and not was_leader:
+                logger.info("Scheduler leadership acquired by %s", self.owner)
+            elif was_leader and not self._is_leader:
+                logger.warning("Scheduler leadership lost by %s", self.owner)
+            return self._is_leader
+
+    def _renew_db(self) -> bool:
+        now = datetime.utcnow()
+        params = {"n": self.name, "o": self.owner, "now": now, "exp": now + timedelta(seconds=self.ttl)}
+        with self.app.app_context():
+            with db.engine.begin() as conn:
+                result = conn.execute(
+                    sa_text(
+                        "UPDATE scheduler_leases SET "
+                        "acquired_at = CASE WHEN owner = :o THEN acquired_at ELSE :now END, "
+                        "owner = :o, renewed_at = :now, expires_at = :exp "
+                        "WHERE name = :n AND (owner = :o OR expires_at < :now)"
+                    ),
+                    params,
+                )
+                if not result.rowcount:
+                    conn.execute(
+                        sa_text(
+                            "INSERT INTO scheduler_leases (name, owner, acquired_at, renewed_at, expires_at) "
+                            "SELECT :n, :o, :now, :now, :exp WHERE NOT EXISTS "
+                            "(SELECT 1 FROM scheduler_leases WHERE name = :n)"
+                        ),
+                        params,
+                    )
+                owner = conn.execute(
+                    sa_text("SELECT owner FROM scheduler_leases WHERE name = :n"), {"n": self.name}
+                ).scalar()
+        return owner == self.owner
+
+    def _lease_table_missing(self) -> bool:
+        try:
+            with self.app.app_context():
+                return not sa_inspect(db.engine).has_table("scheduler_leases")
+        except Exception:
+            return False
+
+    def _drop_file_lock(self) -> None:
+        if self._file_lock is not None:
+            try:
+                self._file_lock.close()
+            except Exception:
+                pass
+            self._file_lock = None
+
+    def _renew_file(self, exc: Exception) -> bool:
+        if self._file_lock is not None:
+            return True
+        path = os.path.join(self.app.instance_path, f"{self.name}.lock")
+        try:
+            os.makedirs(self.app.instance_path, exist_ok=True)
+            fh = open(path, "a+")
+        except OSError:
+            logger.warning("Scheduler lease unavailable (%s); running jobs in this process", exc)
+            return True
+        try:
+            try:
+                import fcntl
+                fcntl.flock(fh, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except ImportError:
+                import msvcrt
+                msvcrt.locking(fh.fileno(), msvcrt.LK_NBLCK, 1)
+        except OSError:
+            fh.close()
+            return False
+        self._file_lock = fh
+        logger.warning("Scheduler lease table unavailable (%s); using file lock %s", exc, path)
+        return True
+
+    def release(self) -> None:
+        with self._lock:
+            if self._is_leader:
+                try:
+                    with self.app.app_context():
+                        with db.engine.begin() as conn:
+                            conn.execute(
+                                sa_text(
+                                    "UPDATE scheduler_leases SET expires_at = :past "
+                                    "WHERE name = :n AND owner = :o"
+                                ),
+                                {"n": self.name, "o": self.owner, "past": datetime.utcnow() - timedelta(seconds=1)},
+                            )
+                except Exception:
+                    pass
+            self._drop_file_lock()
+            self._is_leader = False
+
+
+def _start_run(app, job_id: str, owner: str) -> Optional[int]:
+    """تسجيل بدء التشغيل، أو None إذا كان تشغيل سابق لنفس المهمة ما زال قائماً"""
+    from models import SchedulerJobRun
+
+    now = datetime.utcnow()
+    stale_after = int(app.config.get("SCHEDULER_JOB_STALE_SECONDS", DEFAULT_JOB_STALE_SECONDS))
+    table = SchedulerJobRun.__table__
+    with app.app_context():
+        with db.engine.begin() as conn:
+            running = conn.execute(
+                sa_text(
+                    "SELECT id FROM scheduler_job_runs "
+                    "WHERE job_id = :j AND status = 'RUNNING' AND started_at > :cutoff LIMIT 1"
+                ),
+                {"j": job_id, "cutoff": now - timedelta(seconds=stale_after)},
+            ).scalar()
+            if running:
+                conn.execute(table.insert().values(
+                    job_id=job_id, owner=owner, status="SKIPPED", started_at=now,
+                    finished_at=now, duration_ms=0, error=f"overlaps run #{running}",
+                ))
+                return None
+            result = conn.execute(table.insert().values(
+                job_id=job_id, owner=owner, status="RUNNING", started_at=now,
+            ))
+            return result.inserted_primary_key[0]
+
+
+def _finish_run(app, run_id: int, status: str, duration_ms: int, error: Optional[str]) -> None:
+    with app.app_context():
+        with db.engine.begin() as conn:
+            conn.execute(
+                sa_text(
+                    "UPDATE scheduler_job_runs SET status = :s, finished_at = :f, "
+                    "duration_ms = :d, error = :e WHERE id = :id"
+                ),
+                {"s": status, "f": datetime.utcnow(), "d": duration_ms, "e": error, "id": run_id},
+            )
+
+
+def run_job(app, lease: LeaderLease, job_id: str, func: Callable[[], Any]) -> Optional[str]:
+    """تنفيذ مهمة مجدولة على القائد فقط مع تسجيلها في scheduler_job_runs"""
+    if not lease.is_leader:
+        return None
+    run_id = None
+    history = True
+    try:
+        run_id = _start_run(app, job_id, lease.owner)
+        if run_id is None:
+            logger.warning("Scheduled job %s skipped: previous run still active", job_id)
+            return "SKIPPED"
+    except Exception as exc:
+        history = False
+        logger.debug("Job history unavailable for %s: %s", job_id, exc)
+
+    start = time.perf_counter()
+    status, error = "SUCCESS", None
+    try:
+        func()
+    except Exception as exc:
+        status, error = "FAILED", str(exc)[:2000]
+        logger.exception("Scheduled job %s failed", job_id)
+    finally:
+        if history:
+            try:
+                _finish_run(app, run_id, status, int((time.perf_counter() - start) * 1000), error)
+            except Exception as exc:
+                logger.debug("Could not record end of job %s: %s", job_id, exc)
+    return status
+
+
+def prune_job_history(app, days: Optional[int] = None) -> int:
+    days = int(days or app.config.get("SCHEDULER_HISTORY_DAYS", DEFAULT_HISTORY_DAYS))
+    with app.app_context():
+        with db.engine.begin() as conn:
+            result = conn.execute(
+                sa_text("DELETE FROM scheduler_job_runs WHERE started_at < :cutoff AND status <> 'RUNNING'"),
+                {"cutoff": datetime.utcnow() - timedelta(days=days)},
+            )
+    return result.rowcount or 0
+
+
+class JobRegistry:
+    """واجهة add_job متوافقة مع APScheduler تلف كل مهمة بـ run_job
+
+    تُمرَّر بدل الـ scheduler إلى من يسجل المهام (مثل schedule_automated_backups)
+    فتصبح كل المهام خاضعة لانتخاب القائد وسجل التشغيل ومنع التداخل.
+    """
+
+    def __init__(self, app, scheduler, lease: Optional[LeaderLease] = None):
+        self.app = app
+        self.scheduler = scheduler
+        self.lease = lease or LeaderLease(app)
+        self.job_ids: List[str] = []
+
+    def add_job(self, func: Callable[[], Any], trigger=None, id: Optional[str] = None, **kwargs):
+        job_id = id or getattr(func, "__name__", "job")
+        kwargs.setdefault("replace_existing", True)
+        kwargs.setdefault("max_instances", 1)
+        kwargs.setdefault("coalesce", True)
+        kwargs.setdefault("name", job_id)
+        app, lease = self.app, self.lease
+        if job_id not in self.job_ids:
+            self.job_ids.append(job_id)
+        return self.scheduler.add_job(
+            lambda: run_job(app, lease, job_id, func),
+            trigger,
+            id=job_id,
+            **kwargs,
+        )
+
+    def add_maintenance_jobs(self) -> None:
+        """مهام النظام نفسه: تجديد العقد (في كل عملية) وتنظيف السجل"""
+        renew = int(self.app.config.get("SCHEDULER_LEASE_RENEW", DEFAULT_LEASE_RENEW))
+        self.scheduler.add_job(
+            self.lease.renew,
+            "interval",
+            seconds=renew,
+            id="scheduler_lease_heartbeat",
+            replace_existing=True,
+            max_instances=1,
+            coalesce=True,
+        )
+        self.add_job(lambda: prune_job_history(self.app), "cron", hour=4, minute=15, id="scheduler_history_prune")
+
+    def status(self) -> Dict[str, Any]:
+        jobs = []
+        for job_id in self.job_ids:
+            job = self.scheduler.get_job(job_id)
+            next_run = getattr(job, "next_run_time", None) if job else None
+            jobs.append({"id": job_id, "next_run": next_run.isoformat() if next_run else None})
+        return {"owner": self.lease.owner, "is_leader": self.lease.is_leader, "jobs": jobs}
@@ -0,0 +1,184 @@
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from typing import Any, Dict, List, Optional
+
+
+PROFILE_ENV = "STARTUP_PROFILE"
+REPORT_NAME = "startup_profile.json"
+
+_profiler: Optional["StartupProfiler"] = None
+
+
+def profile_requested() -> bool:
+    return os.environ.get(PROFILE_ENV, "").strip().lower() in ("1", "true", "yes", "on")
+
+
+class _TimedLoader:
+    """غلاف loader لمواصفة وحدة واحدة؛ لا يعدّل الـ loader الأصلي المشترك بين الوحدات"""
+
+    def __init__(self, loader, fullname: str, profiler: "StartupProfiler"):
+        self._loader = loader
+        self._fullname = fullname
+        self._profiler = profiler
+
+    def create_module(self, spec):
+        return self._loader.create_module(spec)
+
+    def exec_module(self, module):
+        # الوحدة ترى الـ loader الأصلي (importlib.resources، pkgutil، فحوص isinstance)
+        module.__loader__ = self._loader
+        if getattr(module, "__spec__", None) is not None:
+            module.__spec__.loader = self._loader
+        with self._profiler.measure_import(self._fullname):
+            self._loader.exec_module(module)
+
+    def __getattr__(self, name):
+        return getattr(self._loader, name)
+
+
+class _TimingFinder:
+    """finder يمرر البحث للـ finders الحقيقية ويلف loader كل مواصفة لقياس زمن التنفيذ"""
+
+    def __init__(self, profiler: "StartupProfiler"):
+        self.profiler = profiler
+
+    def find_spec(self, fullname, path=None, target=None):
+        spec = None
+        for finder in sys.meta_path:
+            if finder is self:
+                continue
+            find_spec = getattr(finder, "find_spec", None)
+            if find_spec is None:
+                continue
+            spec = find_spec(fullname, path, target)
+            if spec is not None:
+                break
+        if spec is None:
+            return None
+        loader = spec.loader
+        # loaders المدمجة (BuiltinImporter/FrozenImporter) أصناف وليست كائنات، تُترك كما هي
+        if loader is None or isinstance(loader, type) or not hasattr(loader, "exec_module"):
+            return spec
+        spec.loader = _TimedLoader(loader, fullname, self.profiler)
+        return spec
+
+
+class StartupProfiler:
+    """زمن استيراد كل وحدة (ذاتي وتراكمي) وزمن كل مرحلة في create_app"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.modules: Dict[str, List[float]] = {}
+        self.phases: List[Dict[str, Any]] = []
+        self._stack: List[List[Any]] = []
+        self._lock = threading.RLock()
+        self._finder: Optional[_TimingFinder] = None
+        self.finished = False
+
+    def install(self) -> None:
+        if self._finder is None:
+            self._finder = _TimingFinder(self)
+            sys.meta_path.insert(0, self._finder)
+
+    def uninstall(self) -> None:
+        if self._finder is not None and self._finder in sys.meta_path:
+            sys.meta_path.remove(self._finder)
+        self._finder = None
+
+    @contextmanager
+    def measure_import(self, name: str):
+        # الاستيراد من خيوط أخرى (مثل scheduler) لا يدخل في شجرة الإقلاع
+        if threading.current_thread() is not threading.main_thread():
+            yield
+            return
+        frame = [name, time.perf_counter(), 0.0]
+        self._stack.append(frame)
+        try:
+            yield
+        finally:
+            self._stack.pop()
+            total = time.perf_counter() - frame[1]
+            self.modules[name] = [total, total - frame[2]]
+            if self._stack:
+                self._stack[-1][2] += total
+
+    @contextmanager
+    def phase(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.phases.append({"phase": name, "ms": round((time.perf_counter() - start) * 1000, 1)})
+
+    def report(self, top: int = 30) -> Dict[str, Any]:
+        def _rows(index: int) -> List[Dict[str, Any]]:
+            ranked = sorted(self.modules.items(), key=lambda kv: kv[1][index], reverse=True)[:top]
+            return [
+                {"module": name, "cumulative_ms": round(cum * 1000, 1), "self_ms": round(own * 1000, 1)}
+                for name, (cum, own) in ranked
+            ]
+
+        packages: Dict[str, float] = {}
+        for name, (_cum, own) in self.modules.items():
+            root = name.split(".", 1)[0]
+            packages[root] = packages.get(root, 0.0) + own
+        return {
+            "total_ms": round((time.perf_counter() - self.started) * 1000, 1),
+            "modules_imported": len(self.modules),
+            "phases": list(self.phases),
+            "by_cumulative": _rows(0),
+            "by_self": _rows(1),
+            "by_package": [
+                {"package": pkg, "self_ms": round(sec * 1000, 1)}
+                for pkg, sec in sorted(packages.items(), key=lambda kv: kv[1], reverse=True)[:top]
+            ],
+        }
+
+    def finish(self, app, top: int = 30) -> Dict[str, Any]:
+        """إيقاف القياس، تسجيل الملخص وحفظ التقرير في instance/startup_profile.json"""
+        self.uninstall()
+        self.finished = True
+        data = self.report(top)
+        app.extensions["startup_profile"] = data
+        app.logger.info(
+            "Startup profile: %.0f ms total, %s modules imported",
+            data["total_ms"], data["modules_imported"],
+        )
+        for row in data["phases"]:
+            app.logger.info("  phase %-24s %8.1f ms", row["phase"], row["ms"])
+        for row in data["by_self"][:15]:
+            app.logger.info(
+                "  import %-40s self %7.1f ms  cumulative %7.1f ms",
+                row["module"], row["self_ms"], row["cumulative_ms"],
+            )
+        try:
+            os.makedirs(app.instance_path, exist_ok=True)
+            with open(os.path.join(app.instance_path, REPORT_NAME), "w", encoding="utf-8") as f:
+                json.dump(data, f, ensure_ascii=False, indent=2)
+        except Exception as exc:
+            app.logger.warning("Could not write startup profile: %s", exc)
+        return data
+
+
+def install_import_profiler() -> StartupProfiler:
+    global _profiler
+    if _profiler is None:
+        _profiler = StartupProfiler()
+        _profiler.install()
+    return _profiler
+
+
+def current_profiler() -> Optional[StartupProfiler]:
+    return _profiler
+
+
+def phase(name: str):
+    """مرحلة مقاسة في create_app، ولا تكلف شيئاً إذا لم يكن وضع القياس مفعلاً"""
+    if _profiler is None or _profiler.finished:
+        return nullcontext()
+    return _profiler.phase(name)
@@ -0,0 +1,243 @@
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import threading
+import time
+from typing import Any, Dict, Optional
+
+from flask import request, send_from_directory
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+MANIFEST_NAME = "asset-manifest.json"
+PRECOMPRESSED_SUFFIXES = {"br": ".br", "gzip": ".gz"}
+COMPRESSIBLE_EXTENSIONS = {
+    ".css", ".js", ".mjs", ".map", ".json", ".svg", ".txt", ".html", ".xml",
+    ".ttf", ".otf", ".eot", ".ico",
+}
+HASH_LENGTH = 12
+# أقل فاصل بين فحصين لتاريخ تعديل المانيفست (إعادة التحميل بعد assets-build دون إعادة تشغيل)
+RELOAD_CHECK_INTERVAL = 2.0
+
+
+def _file_digest(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(chunk)
+    return h.hexdigest()[:HASH_LENGTH]
+
+
+def _write_atomic(path: str, payload: bytes) -> None:
+    tmp = f"{path}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(payload)
+    os.replace(tmp, path)
+
+
+def _is_build_artifact(rel_path: str) -> bool:
+    return (
+        rel_path == MANIFEST_NAME
+        or rel_path.endswith(".tmp")
+        or any(rel_path.endswith(s) for s in PRECOMPRESSED_SUFFIXES.values())
+    )
+
+
+def build_asset_manifest(
+    static_folder: str,
+    *,
+    compress: bool = True,
+    min_size: int = 1024,
+    gzip_level: int = 9,
+    brotli_quality: int = 11,
+) -> Dict[str, Any]:
+    """بناء بصمة المحتوى لملفات static/ وتوليد نسخ .br و .gz مسبقة الضغط
+
+    يتم إعادة استخدام النسخ المضغوطة من البناء السابق إذا لم تتغير بصمة الملف،
+    فلا يُعاد ضغط إلا ما تغيّر فعلاً.
+    """
+    manifest_path = os.path.join(static_folder, MANIFEST_NAME)
+    previous: Dict[str, Any] = {}
+    if os.path.exists(manifest_path):
+        try:
+            with open(manifest_path, "r", encoding="utf-8") as f:
+                previous = json.load(f).get("files", {})
+        except Exception:
+            previous = {}
+
+    files: Dict[str, Any] = {}
+    stats = {"files": 0, "compressed": 0, "reused": 0, "bytes": 0, "compressed_bytes": 0}
+
+    for root, _dirs, names in os.walk(static_folder):
+        for name in sorted(names):
+            path = os.path.join(root, name)
+            rel = os.path.relpath(path, static_folder).replace(os.sep, "/")
+            if _is_build_artifact(rel):
+                continue
+            st = os.stat(path)
+            digest = _file_digest(path)
+            entry = {"hash": digest, "size": st.st_size, "mtime_ns": st.st_mtime_ns}
+            stats["files"] += 1
+            stats["bytes"] += st.st_size
+
+            ext = os.path.splitext(name)[1].lower()
+            if compress and ext in COMPRESSIBLE_EXTENSIONS and st.st_size >= min_size:
+                old = previous.get(rel) or {}
+                reusable = old.get("hash") == digest
+                raw = None
+                for encoding, suffix in PRECOMPRESSED_SUFFIXES.items():
+                    if encoding == "br" and brotli is None:
+                        continue
+                    target = path + suffix
+                    if reusable and old.get(encoding) and os.path.exists(target):
+                        entry[encoding] = old[encoding]
+                        stats["reused"] += 1
+                        continue
+                    if raw is None:
+                        with open(path, "rb") as f:
+                            raw = f.read()
+                    if encoding == "br":
+                        packed = brotli.compress(raw, quality=brotli_quality)
+                    else:
+                        packed = gzip.compress(raw, compresslevel=gzip_level, mtime=0)
+                    # لا فائدة من نسخة مضغوطة لا توفّر 5% على الأقل
+                    if len(packed) >= st.st_size * 0.95:
+                        if os.path.exists(target):
+                            os.remove(target)
+                        continue
+                    _write_atomic(target, packed)
+                    entry[encoding] = len(packed)
+                    stats["compressed"] += 1
+                    stats["compressed_bytes"] += len(packed)
+
+            for encoding, suffix in PRECOMPRESSED_SUFFIXES.items():
+                if encoding not in entry and os.path.exists(path + suffix):
+                    os.remove(path + suffix)
+            files[rel] = entry
+
+    payload = json.dumps({"version": 1, "files": files}, ensure_ascii=False, separators=(",", ":"))
+    _write_atomic(manifest_path, payload.encode("utf-8"))
+    return stats
+
+
+def clean_asset_build(static_folder: str) -> int:
+    """حذف ملف البصمات وجميع النسخ المسبقة الضغط"""
+    removed = 0
+    for root, _dirs, names in os.walk(static_folder):
+        for name in names:
+            rel = os.path.relpath(os.path.join(root, name), static_folder).replace(os.sep, "/")
+            if _is_build_artifact(rel):
+                os.remove(os.path.join(root, name))
+                removed += 1
+    return removed
+
+
+class AssetManifest:
+    """قراءة asset-manifest.json وتقديم الروابط ذات البصمة والنسخ المضغوطة"""
+
+    def __init__(self, static_folder: str):
+        self.static_folder = static_folder
+        self.path = os.path.join(static_folder, MANIFEST_NAME)
+        self._files: Dict[str, Any] = {}
+        self._mtime: Optional[float] = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+        self.reload()
+
+    def _maybe_reload(self) -> None:
+        now = time.monotonic()
+        if now - self._checked_at >= RELOAD_CHECK_INTERVAL:
+            self.reload()
+
+    def reload(self) -> None:
+        with self._lock:
+            self._checked_at = time.monotonic()
+            try:
+                mtime = os.path.getmtime(self.path)
+            except OSError:
+                self._files, self._mtime = {}, None
+                return
+            if mtime == self._mtime:
+                return
+            try:
+                with open(self.path, "r", encoding="utf-8") as f:
+                    self._files = json.load(f).get("files", {})
+                self._mtime = mtime
+            except Exception:
+                self._files, self._mtime = {}, None
+
+    def __bool__(self) -> bool:
+        self._maybe_reload()
+        return bool(self._files)
+
+    def version_of(self, filename: str) -> Optional[str]:
+        self._maybe_reload()
+        entry = self._files.get(filename.lstrip("/"))
+        return entry.get("hash") if entry else None
+
+    def _is_fresh(self, filename: str, entry: Dict[str, Any]) -> bool:
+        # نسخة .br/.gz لملف عُدّل بعد البناء لا تُقدَّم أبداً
+        try:
+            st = os.stat(os.path.join(self.static_folder, filename))
+        except OSError:
+            return False
+        return st.st_size == entry.get("size") and st.st_mtime_ns == entry.get("mtime_ns")
+
+    def precompressed_variant(self, filename: str, accept_encodings) -> Optional[str]:
+        self._maybe_reload()
+        entry = self._files.get(filename)
+        if not entry:
+            return None
+        for encoding in ("br", "gzip"):
+            if entry.get(encoding) and accept_encodings[encoding] and self._is_fresh(filename, entry):
+                return encoding
+        return None
+
+
+def init_static_assets(app) -> Optional[AssetManifest]:
+    """تسجيل المانيفست واستبدال عرض static لتقديم النسخ المسبقة الضغط مباشرة
+
+    كل url_for('static', ...) في القوالب يحصل على ?v=<بصمة المحتوى> عبر
+    url_defaults، فلا حاجة لتعديل القوالب لتستفيد من التخزين الطويل.
+    """
+    static_folder = app.static_folder
+    if not static_folder:
+        return None
+    manifest = AssetManifest(static_folder)
+    app.extensions["asset_manifest"] = manifest
+
+    @app.url_defaults
+    def _static_fingerprint(endpoint, values):
+        if endpoint != "static" or "v" in values or app.debug:
+            return
+        version = manifest.version_of(values.get("filename") or "")
+        if version:
+            values["v"] = version
+
+    original_static = app.view_functions.get("static")
+    if original_static is None:
+        return manifest
+
+    def _serve_static(filename):
+        encoding = manifest.precompressed_variant(filename, request.accept_encodings)
+        if not encoding:
+            return original_static(filename=filename)
+        mimetype, _ = mimetypes.guess_type(filename)
+        response = send_from_directory(
+            static_folder,
+            filename + PRECOMPRESSED_SUFFIXES[encoding],
+            mimetype=mimetype or "application/octet-stream",
+            max_age=app.get_send_file_max_age(filename),
+        )
+        response.headers["Content-Encoding"] = encoding
+        response.vary.add("Accept-Encoding")
+        return response
+
+    app.view_functions["static"] = _serve_static
+    return manifest
@@ -0,0 +1,231 @@
+from datetime import datetime, timezone
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence
+
+from sqlalchemy import and_, case, exists, func, insert, literal, or_, select
+
+# عمود التفصيل في product_stock_totals لكل نوع مستودع (WarehouseType)
+TYPE_COLUMNS = {
+    "MAIN": "main_qty",
+    "PARTNER": "partner_qty",
+    "EXCHANGE": "exchange_qty",
+    "ONLINE": "online_qty",
+    "INVENTORY": "inventory_qty",
+}
+_CHUNK = 500
+
+
+def _utcnow() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def _tables():
+    from models import ProductStockTotal, StockLevel, Warehouse
+    return ProductStockTotal.__table__, StockLevel.__table__, Warehouse.__table__
+
+
+# ------------------------------------------------------------ الصيانة
+
+def _totals_select(where=None):
+    """صفوف product_stock_totals محسوبة من stock_levels بـ GROUP BY product_id"""
+    T, S, W = _tables()
+    qty = func.coalesce(S.c.quantity, 0)
+    reserved = func.coalesce(S.c.reserved_quantity, 0)
+    columns = [
+        S.c.product_id,
+        func.sum(qty).label("on_hand"),
+        func.sum(reserved).label("reserved"),
+        func.sum(case((qty > reserved, qty - reserved), else_=0)).label("available"),
+    ]
+    for wtype, column in TYPE_COLUMNS.items():
+        columns.append(func.sum(case((W.c.warehouse_type == wtype, qty), else_=0)).label(column))
+    columns += [
+        func.sum(case((qty > 0, 1), else_=0)).label("warehouses_count"),
+        literal(_utcnow()).label("updated_at"),
+    ]
+    q = select(*columns).select_from(S.outerjoin(W, W.c.id == S.c.warehouse_id)).group_by(S.c.product_id)
+    if where is not None:
+        q = q.where(where)
+    return q
+
+
+def _replace(connection, product_filter) -> None:
+    """حذف صفوف المنتجات المطابقة ثم إدراجها من جديد من stock_levels (عبارتان)"""
+    T, S, _ = _tables()
+    q = _totals_select(product_filter(S.c.product_id))
+    connection.execute(T.delete().where(product_filter(T.c.product_id)))
+    connection.execute(insert(T).from_select([c.name for c in q.selected_columns], q))
+
+
+def refresh_products(connection, product_ids: Iterable[int]) -> None:
+    """إعادة حساب إجماليات منتجات محددة؛ يُستدعى من مسار تعديل المخزون داخل نفس المعاملة"""
+    ids = sorted({int(pid) for pid in product_ids if pid})
+    for i in range(0, len(ids), _CHUNK):
+        chunk = ids[i:i + _CHUNK]
+        _replace(connection, lambda col: col.in_(chunk))
+
+
+def refresh_selected(connection, product_ids_select) -> None:
+    """إعادة حساب المنتجات الناتجة عن SELECT product_id (مثل صفوف دفعة استيراد)"""
+    _replace(connection, lambda col: col.in_(product_ids_select))
+
+
+def refresh_warehouse(connection, warehouse_id: int) -> None:
+    """بعد تغيير نوع مستودع: إعادة حساب كل المنتجات الموجودة فيه"""
+    _, S, _ = _tables()
+    refresh_selected(connection, select(S.c.product_id).where(S.c.warehouse_id == warehouse_id))
+
+
+def rebuild(connection) -> int:
+    """إعادة بناء الجدول كاملاً (بعد استيراد/حذف جماعي خارج مسار التعديل)"""
+    T, _, _ = _tables()
+    q = _totals_select()
+    connection.execute(T.delete())
+    connection.execute(insert(T).from_select([c.name for c in q.selected_columns], q))
+    return int(connection.execute(select(func.count()).select_from(T)).scalar() or 0)
+
+
+# ------------------------------------------------------------ القراءة
+
+def inventory_totals(session, active_only: bool = True) -> Dict[str, int]:
+    """إجمالي المخزون وعدد المنتجات تحت الحد الأدنى من الجدول المجمّع (استعلام واحد)"""
+    from models import Product
+
+    T, _, _ = _tables()
+    on_hand = func.coalesce(T.c.on_hand, 0)
+    q = select(
+        func.coalesce(func.sum(on_hand), 0),
+        func.coalesce(func.sum(case((on_hand <= func.coalesce(Product.min_qty, 0), 1), else_=0)), 0),
+    ).select_from(Product.__table__.outerjoin(T, T.c.product_id == Product.id))
+    if active_only:
+        q = q.where(Product.is_active.is_(True))
+    total, low = session.execute(q).one()
+    return {"inventory_total": int(total or 0), "low_stock_count": int(low or 0)}
+
+
+def low_stock_query(session, limit: Optional[int] = None):
+    """(Product, on_hand) للمنتجات النشطة التي رصيدها ≤ min_qty"""
+    from models import Product
+
+    T, _, _ = _tables()
+    on_hand = func.coalesce(T.c.on_hand, 0)
+    q = (
+        session.query(Product, on_hand.label("on_hand_sum"))
+        .outerjoin(T, T.c.product_id == Product.id)
+        .filter(Product.is_active.is_(True), on_hand <= func.coalesce(Product.min_qty, 0))
+        .order_by(on_hand.asc(), Product.id.asc())
+    )
+    return q.limit(limit) if limit else q
+
+
+def _search_clause(search: str):
+    from models import Product
+
+    like = f"%{search}%"
+    return or_(Product.name.ilike(like), Product.sku.ilike(like), Product.part_number.ilike(like))
+
+
+class InventoryPivot:
+    """كشف المخزون منتج × مستودع محسوباً في SQL مع ترقيم على الخادم
+
+    الصفحة = استعلام منتجات مرتب بالاسم (LIMIT/OFFSET) + استعلام تجميع شرطي
+    واحد (SUM(CASE WHEN warehouse_id = …)) لمنتجات الصفحة فقط. عند اختيار كل
+    المستودعات تأتي الإجماليات من product_stock_totals مباشرة.
+    """
+
+    def __init__(self, session, warehouse_ids: Sequence[int], all_selected: bool, search: str = ""):
+        self.session = session
+        self.warehouse_ids = list(warehouse_ids)
+        self.all_selected = all_selected
+        self.search = (search or "").strip()
+
+    def _products(self):
+        from models import Product
+
+        T, S, _ = _tables()
+        q = select(Product.id).select_from(Product.__table__)
+        if self.all_selected:
+            q = q.join(T, T.c.product_id == Product.id)
+        else:
+            q = q.where(exists().where(S.c.product_id == Product.id, S.c.warehouse_id.in_(self.warehouse_ids)))
+        if self.search:
+            q = q.where(_search_clause(self.search))
+        return q
+
+    def summary(self) -> Dict[str, int]:
+        """عدد المنتجات وإجمالي الكمية للمستودعات المحددة (كل الصفحات)"""
+        T, S, _ = _tables()
+        if not self.warehouse_ids:
+            return {"products": 0, "quantity": 0}
+        products = self._products().subquery()
+        if self.all_selected:
+            quantity = select(func.coalesce(func.sum(T.c.on_hand), 0)).where(T.c.product_id.in_(select(products.c.id)))
+        else:
+            quantity = select(func.coalesce(func.sum(S.c.quantity), 0)).where(
+                S.c.warehouse_id.in_(self.warehouse_ids), S.c.product_id.in_(select(products.c.id))
+            )
+        count = self.session.execute(select(func.count()).select_from(products)).scalar() or 0
+        return {"products": int(count), "quantity": int(self.session.execute(quantity).scalar() or 0)}
+
+    def page(self, page: int, per_page: int) -> List[dict]:
+        from models import Product
+
+        if not self.warehouse_ids:
+            return []
+        q = self._products().order_by(Product.name.asc(), Product.id.asc())
+        ids = list(self.session.execute(q.limit(per_page).offset(max(page - 1, 0) * per_page)).scalars())
+        return self.rows(ids)
+
+    def rows(self, ids: List[int]) -> List[dict]:
+        from models import Product
+
+        if not ids:
+            return []
+        _, S, _ = _tables()
+        qty = func.coalesce(S.c.quantity, 0)
+        reserved = func.coalesce(S.c.reserved_quantity, 0)
+        columns = [S.c.product_id]
+        for wid in self.warehouse_ids:
+            columns.append(func.sum(case((S.c.warehouse_id == wid, qty), else_=0)))
+            columns.append(func.sum(case((S.c.warehouse_id == wid, reserved), else_=0)))
+        columns.append(func.sum(qty))
+        pivot = {
+            r[0]: r for r in self.session.execute(
+                select(*columns).where(S.c.product_id.in_(ids), S.c.warehouse_id.in_(self.warehouse_ids))
+                .group_by(S.c.product_id)
+            )
+        }
+        products = {p.id: p for p in self.session.query(Product).filter(Product.id.in_(ids))}
+        out = []
+        for pid in ids:
+            r = pivot.get(pid)
+            by = {}
+            for i, wid in enumerate(self.warehouse_ids):
+                by[wid] = {"on": int(r[1 + 2 * i] or 0), "res": int(r[2 + 2 * i] or 0)} if r else {"on": 0, "res": 0}
+            out.append({"product": products.get(pid), "by": by, "total": int(r[-1] or 0) if r else 0})
+        return [row for row in out if row["product"] is not None]
+
+    def iter_all(self, batch: int = 1000) -> Iterator[dict]:
+        """كل الصفوف على دفعات (للتصدير) دون تحميل الكشف كاملاً في الذاكرة"""
+        from models import Product
+
+        if not self.warehouse_ids:
+            return
+        last_name, last_id = None, 0
+        while True:
+            q = self._products().order_by(Product.name.asc(), Product.id.asc())
+            if last_name is not None:
+                q = q.where(or_(Product.name > last_name, and_(Product.name == last_name, Product.id > last_id)))
+            ids = list(self.session.execute(q.limit(batch)).scalars())
+            if not ids:
+                return
+            rows = self.rows(ids)
+            yield from rows
+            if len(ids) < batch or not rows:
+                return
+            last_name, last_id = rows[-1]["product"].name, rows[-1]["product"].id
+
+
+__all__ = [
+    "InventoryPivot", "TYPE_COLUMNS", "inventory_totals", "low_stock_query", "rebuild",
+    "refresh_products", "refresh_selected", "refresh_warehouse",
+]
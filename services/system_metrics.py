@@ -0,0 +1,233 @@
+import logging
+import os
+import threading
+import time
+from collections import deque
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, Optional
+
+try:
+    import psutil
+except Exception:  # pragma: no cover - تبعية اختيارية
+    psutil = None
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_INTERVAL = 15
+DEFAULT_COUNTS_INTERVAL = 120
+HISTORY_SIZE = 120
+
+_INIT_LOCK = threading.Lock()
+
+
+def _count_queries() -> Dict[str, Callable[[], int]]:
+    """عدادات الكيانات التي يقرأها المساعد الذكي وفحص الصحة"""
+    from sqlalchemy import func, select
+    from extensions import db
+    from models import (
+        AuditLog, Customer, Expense, ExchangeTransaction, Note, Payment, Product, Role, Sale,
+        ServiceRequest, ServiceStatus, Shipment, StockLevel, Supplier, User, Warehouse,
+    )
+
+    def count(model, *criteria):
+        return lambda: db.session.query(func.count(model.id)).filter(*criteria).scalar() or 0
+
+    return {
+        "users": count(User),
+        "active_users": count(User, User.is_active.is_(True)),
+        "services": count(ServiceRequest),
+        "pending_services": count(ServiceRequest, ServiceRequest.status == ServiceStatus.PENDING.value),
+        "completed_services": count(ServiceRequest, ServiceRequest.status == ServiceStatus.COMPLETED.value),
+        "customers": count(Customer),
+        "active_customers": count(Customer, Customer.is_active.is_(True)),
+        "suppliers": count(Supplier),
+        "products": count(Product),
+        "products_in_stock": count(Product, Product.id.in_(select(StockLevel.product_id).distinct())),
+        "sales": count(Sale),
+        "payments": count(Payment),
+        "expenses": count(Expense),
+        "warehouses": count(Warehouse),
+        "notes": count(Note),
+        "shipments": count(Shipment),
+        "roles": count(Role),
+        "audit_logs": count(AuditLog),
+        "exchange_transactions": count(ExchangeTransaction),
+    }
+
+
+class SystemMetricsSampler:
+    """خيط خلفي يحدّث لقطة مقاييس النظام دورياً
+
+    القراءة من snapshot() فورية: لا cpu_percent(interval=...) ولا استعلامات
+    عدّ داخل الطلب. المعالج يُقاس كفرق بين عينتين متتاليتين، وعدادات
+    الكيانات تُحدّث بفاصل أطول (SYSTEM_METRICS_COUNTS_INTERVAL).
+    """
+
+    def __init__(self, app, interval: int = DEFAULT_INTERVAL, counts_interval: int = DEFAULT_COUNTS_INTERVAL):
+        self.app = app
+        self.interval = max(int(interval or DEFAULT_INTERVAL), 1)
+        self.counts_interval = max(int(counts_interval or DEFAULT_COUNTS_INTERVAL), self.interval)
+        self.history = deque(maxlen=HISTORY_SIZE)
+        self._snapshot: Dict[str, Any] = {}
+        self._counts: Dict[str, int] = {}
+        self._counts_at = 0.0
+        self._sampled_at = 0.0
+        self._lock = threading.Lock()
+        self._sample_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._process = psutil.Process() if psutil else None
+        if psutil:
+            # أول قراءة بدون فاصل تُرجع 0، لذلك تُهيأ هنا حتى تكون العينة الأولى صحيحة
+            psutil.cpu_percent(interval=None)
+            self._process.cpu_percent(interval=None)
+
+    # ------------------------------------------------------------ التشغيل
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="system-metrics", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+
+    def _sample_once(self):
+        if not self._sample_lock.acquire(blocking=False):
+            return
+        try:
+            self.sample()
+        except Exception as e:
+            logger.warning(f"⚠️ system metrics sample failed: {e}")
+        finally:
+            self._sample_lock.release()
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._sample_once()
+            self._wake.wait(self.interval)
+            self._wake.clear()
+
+    # ------------------------------------------------------------ العينات
+
+    def _db_size_bytes(self) -> Optional[int]:
+        uri = self.app.config.get("SQLALCHEMY_DATABASE_URI", "")
+        if uri.startswith("sqlite:///"):
+            path = uri.replace("sqlite:///", "")
+            return sum(os.path.getsize(p) for p in (path, f"{path}-wal") if os.path.exists(p))
+        from sqlalchemy import text
+        from extensions import db
+        try:
+            return int(db.session.execute(text("SELECT pg_database_size(current_database())")).scalar() or 0)
+        finally:
+            db.session.remove()
+
+    def _refresh_counts(self):
+        from extensions import db
+        counts = {}
+        try:
+            for name, query in _count_queries().items():
+                try:
+                    counts[name] = int(query())
+                except Exception:
+                    db.session.rollback()
+        finally:
+            db.session.remove()
+        self._counts = counts
+        self._counts_at = time.time()
+
+    def sample(self) -> Dict[str, Any]:
+        snap: Dict[str, Any] = {"sampled_at": datetime.now(timezone.utc).isoformat()}
+        if psutil:
+            vm = psutil.virtual_memory()
+            snap.update({
+                "cpu_percent": psutil.cpu_percent(interval=None),
+                "cpu_count": os.cpu_count(),
+                "memory_percent": vm.percent,
+                "memory_total_gb": round(vm.total / (1024 ** 3), 2),
+                "memory_available_gb": round(vm.available / (1024 ** 3), 2),
+                "process_cpu_percent": round(self._process.cpu_percent(interval=None), 2),
+                "process_rss_mb": round(self._process.memory_info().rss / (1024 ** 2), 2),
+                "process_threads": self._process.num_threads(),
+            })
+            try:
+                snap["disk_percent"] = psutil.disk_usage(self.app.instance_path).percent
+            except Exception:
+                pass
+
+        with self.app.app_context():
+            try:
+                size = self._db_size_bytes()
+                snap["db_size_bytes"] = size
+                snap["db_size_mb"] = round(size / (1024 ** 2), 2) if size is not None else None
+                snap["db_health"] = "نشط"
+            except Exception as e:
+                snap["db_health"] = f"خطأ: {e}"
+            if time.time() - self._counts_at >= self.counts_interval:
+                self._refresh_counts()
+
+        snap["counts"] = dict(self._counts)
+        snap["counts_at"] = datetime.fromtimestamp(self._counts_at, timezone.utc).isoformat() if self._counts_at else None
+        with self._lock:
+            self._snapshot = snap
+            self._sampled_at = time.monotonic()
+            if "cpu_percent" in snap:
+                self.history.append((snap["sampled_at"], snap["cpu_percent"], snap["memory_percent"]))
+        return snap
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return dict(self._snapshot)
+
+    def is_stale(self) -> bool:
+        """اللقطة أقدم من فاصل العينة (ضعفه إذا كان الخيط يعمل، فهو من يحدّثها عادة)"""
+        running = self._thread is not None and self._thread.is_alive()
+        return time.monotonic() - self._sampled_at >= self.interval * (2 if running else 1)
+
+    def fresh_snapshot(self) -> Dict[str, Any]:
+        """آخر لقطة (أو لقطة فارغة) فوراً؛ عند القِدم يُطلب تحديثها خارج الطلب
+
+        الخيط الخلفي يُوقظ ليأخذ العينة الآن، وبدونه (SYSTEM_METRICS_SAMPLER=0 أو
+        TESTING) تؤخذ في خيط قصير واحد؛ الطلب نفسه لا ينفذ استعلامات العدّ.
+        """
+        if not self._snapshot or self.is_stale():
+            if self._thread is not None and self._thread.is_alive():
+                self._wake.set()
+            elif not self._sample_lock.locked():
+                threading.Thread(target=self._sample_once, name="system-metrics-once", daemon=True).start()
+        return self.snapshot()
+
+
+def get_sampler(app) -> SystemMetricsSampler:
+    """العينة الخاصة بهذه العملية؛ يبدأ الخيط عند أول استخدام وليس في أوامر CLI"""
+    sampler = app.extensions.get("system_metrics")
+    if sampler is None:
+        with _INIT_LOCK:
+            sampler = app.extensions.get("system_metrics")
+            if sampler is None:
+                sampler = SystemMetricsSampler(
+                    app,
+                    interval=app.config.get("SYSTEM_METRICS_INTERVAL", DEFAULT_INTERVAL),
+                    counts_interval=app.config.get("SYSTEM_METRICS_COUNTS_INTERVAL", DEFAULT_COUNTS_INTERVAL),
+                )
+                app.extensions["system_metrics"] = sampler
+                if app.config.get("SYSTEM_METRICS_SAMPLER", True) and not app.config.get("TESTING"):
+                    sampler.start()
+    return sampler
+
+
+def current_snapshot(app=None) -> Dict[str, Any]:
+    """آخر لقطة مقاييس دون انتظار عينة؛ القديمة أو الناقصة تُحدّث في الخلفية
+
+    بدون الخيط الخلفي (SYSTEM_METRICS_SAMPLER=0 أو TESTING) يبقى التحديث
+    بوتيرة الطلبات بدل تجميد قيم أول طلب.
+    """
+    if app is None:
+        from flask import current_app
+        app = current_app._get_current_object()
+    return get_sampler(app).fresh_snapshot()
@@ -0,0 +1,6 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DISABLE_SCHEDULER", "1")
+os.environ.setdefault("SKIP_SYSTEM_INTEGRITY", "1")
@@ -0,0 +1,85 @@
+"""اختبارات طبقات التكلفة: FIFO و AVERAGE تحافظان على قيمة المشتريات"""
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+import pytest
+from sqlalchemy import create_engine, func, select
+
+from extensions import db
+from models import CogsEntry, CostLayer, Product
+from services import cost_layers
+
+
+PURCHASES = [(100, Decimal("1.0000")), (200, Decimal("1.5000")), (50, Decimal("3.2500"))]
+SALES = [70, 130, 33, 90]
+
+
+@pytest.fixture
+def connection():
+    engine = create_engine("sqlite://")
+    with engine.begin() as conn:
+        db.metadata.create_all(conn)
+        conn.execute(Product.__table__.insert().values(id=1, name="p"))
+        yield conn
+
+
+def _receive_all(connection, product_id=1):
+    start = datetime(2025, 1, 1)
+    for n, (qty, unit_cost) in enumerate(PURCHASES):
+        cost_layers.receive(connection, product_id, qty, unit_cost, "SHIPMENT_ITEM", n + 1, start + timedelta(days=n))
+
+
+def _sell(connection, method, product_id=1):
+    desired = {n + 1: (product_id, qty) for n, qty in enumerate(SALES)}
+    cost_layers._sync_outgoing(connection, "SALE", 1, "SALE_LINE", desired, datetime(2025, 2, 1), method)
+
+
+def _remaining_value(connection):
+    rows = connection.execute(select(CostLayer.qty_remaining, CostLayer.unit_cost)).all()
+    return sum(Decimal(r.qty_remaining) * Decimal(str(r.unit_cost)) for r in rows)
+
+
+def _cogs(connection):
+    return Decimal(str(connection.execute(select(func.coalesce(func.sum(CogsEntry.total_cost), 0))).scalar()))
+
+
+@pytest.mark.parametrize("method", cost_layers.METHODS)
+def test_cogs_plus_remaining_equals_purchases(connection, method):
+    _receive_all(connection)
+    _sell(connection, method)
+    purchases = sum(qty * cost for qty, cost in PURCHASES)
+    assert _cogs(connection) + _remaining_value(connection) == purchases
+
+
+def test_fifo_consumes_oldest_layer_first(connection):
+    _receive_all(connection)
+    unit_cost, total, source = cost_layers.consume(connection, 1, 120, "FIFO")
+    assert source == "layers"
+    assert total == Decimal("130.00")
+    remaining = connection.execute(select(CostLayer.qty_remaining).order_by(CostLayer.id)).scalars().all()
+    assert remaining == [0, 180, 50]
+
+
+def test_average_keeps_remaining_average(connection):
+    _receive_all(connection)
+    before = _remaining_value(connection) / 350
+    unit_cost, total, source = cost_layers.consume(connection, 1, 70, "AVERAGE")
+    remaining = connection.execute(select(CostLayer.qty_remaining).order_by(CostLayer.id)).scalars().all()
+    assert remaining == [80, 160, 40]
+    assert unit_cost == before.quantize(Decimal("0.0001"))
+    assert _remaining_value(connection) / 280 == before
+
+
+def test_average_apportions_whole_quantities(connection):
+    _receive_all(connection)
+    cost_layers.consume(connection, 1, 1, "AVERAGE")
+    remaining = connection.execute(select(CostLayer.qty_remaining).order_by(CostLayer.id)).scalars().all()
+    assert sum(remaining) == 349
+
+
+def test_shortfall_is_priced_from_product_card(connection):
+    connection.execute(Product.__table__.update().values(purchase_price=Decimal("2.00")))
+    cost_layers.receive(connection, 1, 10, Decimal("1.00"), "SHIPMENT_ITEM", 1, datetime(2025, 1, 1))
+    unit_cost, total, source = cost_layers.consume(connection, 1, 15, "FIFO")
+    assert source == "purchase_price"
+    assert total == Decimal("20.00")
@@ -0,0 +1,98 @@
+"""اختبارات جداول الاستهلاك: القسط الثابت والمتناقص والفترات المستقبلية"""
+from datetime import date
+from decimal import Decimal
+
+import pytest
+from sqlalchemy import create_engine, select
+from sqlalchemy.orm import Session
+
+from extensions import db
+from models import Account, AssetDepreciation, FixedAsset, FixedAssetCategory
+from services.depreciation import _Schedule, due_through, ensure_not_future, parse_period, run_depreciation
+
+
+def test_parse_period():
+    assert parse_period("2025-03") == (2025, 3)
+    with pytest.raises(ValueError):
+        parse_period("2025-13")
+    with pytest.raises(ValueError):
+        parse_period("march")
+
+
+def test_due_through_waits_for_depreciation_day():
+    assert due_through(date(2025, 3, 10), day_of_month=5) == (2025, 3)
+    assert due_through(date(2025, 3, 4), day_of_month=5) == (2025, 2)
+    assert due_through(date(2025, 1, 4), day_of_month=5) == (2024, 12)
+
+
+def test_future_period_is_rejected():
+    today = date(2025, 6, 15)
+    assert ensure_not_future((2025, 6), today) == (2025, 6)
+    assert ensure_not_future((2024, 12), today) == (2024, 12)
+    with pytest.raises(ValueError):
+        ensure_not_future((2025, 7), today)
+
+
+def test_straight_line_runs_for_useful_life():
+    sched = _Schedule(1, Decimal("1200"), date(2024, 1, 1), 1, "STRAIGHT_LINE", 0)
+    amounts = []
+    for month in range(2, 13):
+        amount = sched.amount_for(date(2024, month, 1))
+        sched.accumulated += amount
+        amounts.append(amount)
+    assert amounts == [Decimal("100.00")] * 11
+    assert sched.amount_for(date(2025, 1, 1)) is None
+
+
+def test_installment_never_exceeds_remaining_value():
+    sched = _Schedule(1, Decimal("1200"), date(2024, 1, 1), 2, "STRAIGHT_LINE", 0)
+    sched.accumulated = Decimal("1170")
+    assert sched.amount_for(date(2024, 6, 1)) == Decimal("30")
+    sched.accumulated = Decimal("1200")
+    assert sched.amount_for(date(2024, 7, 1)) is None
+
+
+def test_declining_balance_uses_book_value():
+    sched = _Schedule(1, Decimal("1000"), date(2024, 1, 1), 5, "DECLINING_BALANCE", 20)
+    first = sched.amount_for(date(2024, 2, 1))
+    sched.accumulated += first
+    second = sched.amount_for(date(2024, 3, 1))
+    assert first == Decimal("16.67")
+    assert second == ((Decimal("1000") - first) * Decimal("0.2") / 12).quantize(Decimal("0.01"))
+
+
+@pytest.fixture
+def session():
+    engine = create_engine("sqlite://")
+    with engine.connect() as conn:
+        db.metadata.create_all(conn)
+        conn.execute(Account.__table__.insert(), [
+            {"code": "1500", "name": "أصول", "type": "ASSET", "is_active": True},
+            {"code": "1590", "name": "مجمع الاستهلاك", "type": "ASSET", "is_active": True},
+        ])
+        conn.execute(FixedAssetCategory.__table__.insert().values(
+            id=1, code="EQ", name="معدات", account_code="1500", depreciation_account_code="1590",
+            useful_life_years=5, depreciation_method="STRAIGHT_LINE", depreciation_rate=0,
+        ))
+        conn.execute(FixedAsset.__table__.insert().values(
+            id=1, asset_number="FA-1", name="مكبس", category_id=1, purchase_date=date(2025, 1, 20),
+            purchase_price=Decimal("6000"), status="ACTIVE",
+        ))
+        with Session(bind=conn) as s:
+            yield s
+
+
+def test_run_depreciation_fills_missing_periods_once(session):
+    counts = run_depreciation(session, (2025, 4), post_gl=False)
+    assert (counts["rows"], counts["periods"]) == (3, 3)
+    rows = session.execute(
+        select(AssetDepreciation.fiscal_month, AssetDepreciation.depreciation_amount,
+               AssetDepreciation.book_value).order_by(AssetDepreciation.fiscal_month)
+    ).all()
+    assert [r.fiscal_month for r in rows] == [2, 3, 4]
+    assert all(Decimal(str(r.depreciation_amount)) == Decimal("100.00") for r in rows)
+    assert Decimal(str(rows[-1].book_value)) == Decimal("5700.00")
+
+    again = run_depreciation(session, (2025, 5), post_gl=False)
+    assert (again["rows"], again["periods"]) == (1, 1)
+    assert run_depreciation(session, (2025, 5), post_gl=False)["rows"] == 0
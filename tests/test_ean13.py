@@ -0,0 +1,79 @@
+"""اختبارات رقم التحقق EAN-13 وتهيئة عداد الباركود"""
+import pytest
+
+from barcodes import compute_ean13_check_digit, normalize_barcode
+from services.barcode_allocator import _sequence, ean13
+
+
+@pytest.mark.parametrize("code", ["4006381333931", "5901234123457", "9780306406157", "0012345678905"])
+def test_check_digit_of_known_codes(code):
+    assert compute_ean13_check_digit(code[:12]) == int(code[12])
+
+
+def test_check_digit_weights_even_positions_by_three():
+    # المواضع الزوجية (بالعد من 1) وزنها 3 والفردية وزنها 1
+    assert compute_ean13_check_digit("000000000010") == 9
+    assert compute_ean13_check_digit("000000000001") == 7
+    assert compute_ean13_check_digit("000000000000") == 0
+
+
+def test_check_digit_rejects_bad_base():
+    with pytest.raises(ValueError):
+        compute_ean13_check_digit("12345")
+    with pytest.raises(ValueError):
+        compute_ean13_check_digit("12345678901a")
+
+
+def test_normalize_completes_twelve_digits():
+    assert normalize_barcode("400638133393") == "4006381333931"
+    assert normalize_barcode("4006-3813-3393-1") == "4006381333931"
+
+
+def test_allocator_codes_are_valid_and_padded():
+    code = ean13("200", 42)
+    assert code == "200000000042" + str(compute_ean13_check_digit("200000000042"))
+    assert len(ean13("20", 1)) == 13
+    for item in (1, 7, 999_999_999):
+        c = ean13("200", item)
+        assert compute_ean13_check_digit(c[:12]) == int(c[12])
+
+
+def test_sequence_seed_ignores_invalid_codes():
+    parse = _sequence("200").parse
+    assert parse(ean13("200", 15)) == 15
+    bad = ean13("200", 900)[:12] + str((int(ean13("200", 900)[12]) + 1) % 10)
+    assert parse(bad) is None
+    assert parse(ean13("201", 5)) is None
+    assert parse("20000000001") is None
+    assert parse("200000000001x") is None
+
+
+# جدول المواصفة GS1: نمط التماثل (L فردي / G زوجي) للنصف الأيسر حسب الرقم الأول
+GS1_PARITY = {
+    0: "LLLLLL", 1: "LLGLGG", 2: "LLGGLG", 3: "LLGGGL", 4: "LGLLGG",
+    5: "LGGLLG", 6: "LGGGLL", 7: "LGLGLG", 8: "LGLGGL", 9: "LGGLGL",
+}
+
+
+@pytest.mark.parametrize("first", range(10))
+def test_left_half_parity_encodes_first_digit(first):
+    from services.label_render import _ean13_modules
+
+    base = f"{first}12345678901"
+    bits = _ean13_modules(base + str(compute_ean13_check_digit(base)))
+    assert len(bits) == 95
+    assert (bits[:3], bits[45:50], bits[-3:]) == ("101", "01010", "101")
+    groups = [bits[3 + 7 * i:10 + 7 * i] for i in range(6)]
+    parity = "".join("L" if g.count("1") % 2 else "G" for g in groups)
+    assert parity == GS1_PARITY[first]
+    # النصف الأيمن دائماً R (زوجي ويبدأ بـ 1)
+    right = [bits[50 + 7 * i:57 + 7 * i] for i in range(6)]
+    assert all(g[0] == "1" and g.count("1") % 2 == 0 for g in right)
+
+
+def test_symbology_uses_ean13_only_for_valid_codes():
+    from services.label_render import symbology
+
+    assert symbology("4006381333931") == "ean13"
+    assert symbology("4006381333932") == "qr"
+    assert symbology("4006381333931", kind="qr") == "qr"
@@ -0,0 +1,119 @@
+"""اختبارات استراتيجيات استيراد المنتجات وأوضاع المخزون"""
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+import pytest
+from sqlalchemy import create_engine, select, update
+from sqlalchemy.orm import Session
+
+from extensions import db
+from models import ImportRun, Product, StockLevel, Warehouse
+from services.product_import import (
+    ProductImporter, clean_int, clean_numeric, fail_stale_runs, normalize_header,
+)
+
+
+@pytest.fixture
+def session():
+    engine = create_engine("sqlite://")
+    with engine.connect() as conn:
+        db.metadata.create_all(conn)
+        conn.execute(Warehouse.__table__.insert().values(id=1, name="رئيسي", warehouse_type="MAIN"))
+        conn.execute(Product.__table__.insert().values(
+            id=1, name="فلتر زيت", sku="F-1", price=10, selling_price=10, purchase_price=6,
+        ))
+        conn.execute(StockLevel.__table__.insert().values(product_id=1, warehouse_id=1, quantity=5, reserved_quantity=0))
+        conn.commit()
+        with Session(bind=conn) as s:
+            yield s
+
+
+def _import(session, rows, **options):
+    run = ImportRun(warehouse_id=1, status="QUEUED")
+    session.add(run)
+    session.commit()
+    importer = ProductImporter(session, run, warehouse_id=1, **options)
+    return importer, importer.execute(rows)
+
+
+def _product(session, sku):
+    return session.execute(select(Product.__table__).where(Product.__table__.c.sku == sku)).mappings().one()
+
+
+def _qty(session, product_id):
+    return session.execute(
+        select(StockLevel.quantity).where(StockLevel.product_id == product_id, StockLevel.warehouse_id == 1)
+    ).scalar()
+
+
+ROWS = [
+    {"name": "فلتر زيت جديد", "sku": "F-1", "price": "12", "quantity": "3"},
+    {"name": "بوجيه", "sku": "S-9", "price": "٤٫٥", "quantity": "7"},
+]
+
+
+def test_header_and_value_cleaning():
+    assert normalize_header("الاسم") == "name"
+    assert normalize_header(" QTY ") == "quantity"
+    assert normalize_header("Part-Number") == "part_number"
+    assert clean_numeric("₪ 1,250.50") == Decimal("1250.50")
+    assert clean_numeric("٤٫٥") == Decimal("4.5")
+    assert clean_numeric("abc") is None
+    assert clean_int("٧") == 7
+    assert clean_int("") is None
+
+
+def test_skip_keeps_existing_products(session):
+    importer, counts = _import(session, [dict(r) for r in ROWS], strategy="skip")
+    assert importer.run.status == "DONE"
+    assert (counts["inserted"], counts["skipped"]) == (1, 1)
+    assert _product(session, "F-1")["name"] == "فلتر زيت"
+    assert _qty(session, 1) == 5
+    assert _qty(session, _product(session, "S-9")["id"]) == 7
+
+
+def test_update_product_updates_fields_and_adds_stock(session):
+    _, counts = _import(session, [dict(r) for r in ROWS], strategy="update_product")
+    assert (counts["inserted"], counts["updated"]) == (1, 1)
+    existing = _product(session, "F-1")
+    assert existing["name"] == "فلتر زيت جديد"
+    assert existing["price"] == Decimal("12")
+    assert _qty(session, 1) == 8
+
+
+def test_stock_only_leaves_product_fields(session):
+    _, counts = _import(session, [dict(ROWS[0])], strategy="stock_only", stock_mode="replace")
+    assert counts["updated"] == 1
+    assert _product(session, "F-1")["name"] == "فلتر زيت"
+    assert _qty(session, 1) == 3
+
+
+def test_stock_mode_none_only_creates_missing_rows(session):
+    _import(session, [dict(r) for r in ROWS], strategy="stock_only", stock_mode="none")
+    assert _qty(session, 1) == 5
+    assert _qty(session, _product(session, "S-9")["id"]) == 7
+
+
+def test_duplicates_in_file_are_reported(session):
+    rows = [{"name": "أ", "sku": "D-1"}, {"name": "ب", "sku": "D-1"}, {"sku": "X-1"}]
+    importer, counts = _import(session, rows, strategy="skip")
+    assert (counts["inserted"], counts["errors"], counts["skipped"]) == (1, 1, 1)
+    assert {p["note"] for p in importer.problems} == {"duplicate_sku_in_file", "missing_name"}
+
+
+def test_dry_run_writes_nothing(session):
+    _, counts = _import(session, [dict(r) for r in ROWS], strategy="update_product", dry_run=True)
+    assert counts["inserted"] == 1
+    assert session.execute(select(Product.__table__.c.id).where(Product.__table__.c.sku == "S-9")).first() is None
+    assert _product(session, "F-1")["name"] == "فلتر زيت"
+
+
+def test_stale_runs_are_failed(session):
+    old = datetime.utcnow() - timedelta(hours=2)
+    session.add_all([ImportRun(id=10, warehouse_id=1, status="RUNNING"), ImportRun(id=11, warehouse_id=1, status="QUEUED")])
+    session.commit()
+    session.execute(update(ImportRun.__table__).where(ImportRun.__table__.c.id == 10).values(updated_at=old))
+    session.commit()
+    assert fail_stale_runs(session, 30) == 1
+    statuses = dict(session.execute(select(ImportRun.id, ImportRun.status)).all())
+    assert statuses == {10: "FAILED", 11: "QUEUED"}